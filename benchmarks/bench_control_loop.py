@@ -0,0 +1,105 @@
+"""
+Benchmark the jitter of the control loop with and without RPC load, with the control loop in the RPC server's process
+or in its own (the ``ISOLATE_CONTROL_LOOP`` pref, see :mod:`~vent.coordinator.control_process` ).
+
+A simulated controller is run by a :class:`.CoordinatorRemote` , like the GUI does. For each mode, the durations of
+the control loop's cycles are collected for a few seconds (see :meth:`.ControlModuleBase.get_loop_stats` ), either
+
+* ``idle`` : with no other requests
+* ``rpc load`` : while several threads call ``get_sensors`` , ``get_control`` and ``set_control`` , each on its own
+  connection, as fast as the server answers
+
+Run from the repository root::
+
+    python benchmarks/bench_control_loop.py
+    python benchmarks/bench_control_loop.py --seconds 10 --threads 8 --cpus 0
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vent.common import prefs
+from vent.common.message import ControlSetting
+from vent.common.values import ValueName
+from vent.coordinator import rpc
+from vent.coordinator.coordinator import get_coordinator
+
+
+def load(stop: threading.Event, calls: list):
+    """ Call the controller until ``stop`` is set, counting the calls in ``calls`` """
+    client = rpc.RPCClient()
+    setting = pickle.dumps(ControlSetting(ValueName.PIP, 25, 20, 30, time.time()))
+    name = pickle.dumps(ValueName.PIP)
+    n = 0
+    while not stop.is_set():
+        pickle.loads(client.get_sensors().data)
+        pickle.loads(client.get_control(name).data)
+        client.set_control(setting)
+        n += 3
+    client.close()
+    calls.append(n)
+
+
+def run(isolate: bool, threads: int, seconds: float, cpus=None) -> dict:
+    prefs.set_pref('ISOLATE_CONTROL_LOOP', isolate)
+    prefs.set_pref('CONTROL_LOOP_CPUS', cpus)
+    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    try:
+        coordinator.start()
+        time.sleep(0.5)
+        # skip the cycles so far
+        since = coordinator.get_state()['loop_stats'].get('count')
+
+        stop = threading.Event()
+        calls = []
+        workers = [threading.Thread(target=load, args=(stop, calls)) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+        stats = coordinator.get_state(loop_since=since)['loop_stats']
+        coordinator.stop()
+    finally:
+        coordinator.process_manager.try_stop_process()
+        prefs.set_pref('ISOLATE_CONTROL_LOOP', False)
+        prefs.set_pref('CONTROL_LOOP_CPUS', None)
+    stats['calls/s'] = sum(calls) / seconds
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=5, help='seconds to collect cycles for, in each mode')
+    parser.add_argument('--threads', type=int, default=4, help='threads calling the controller for the rpc load')
+    parser.add_argument('--cpus', type=int, nargs='*', default=None,
+                        help='CPUs to pin the isolated control loop to, see the CONTROL_LOOP_CPUS pref')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for isolate in (False, True):
+        for threads in (0, args.threads):
+            mode = 'own process' if isolate else 'rpc process'
+            name = (mode, 'rpc load' if threads else 'idle')
+            results[name] = run(isolate, threads, args.seconds, args.cpus if isolate else None)
+
+    print()
+    print('{:>12} {:>9} {:>8} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'control loop', 'load', 'cycles', 'mean(us)', 'std(us)', 'p99(us)', 'max(us)', 'calls/s'))
+    for (mode, load_name), stats in results.items():
+        print('{:>12} {:>9} {:>8} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>9.0f}'.format(
+            mode, load_name, stats['n'], stats['mean'] * 1e6, stats['std'] * 1e6, stats['p99'] * 1e6,
+            stats['max'] * 1e6, stats['calls/s']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
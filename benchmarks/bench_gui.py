@@ -0,0 +1,326 @@
+"""
+Benchmark the cost of running :class:`~vent.gui.main.Vent_Gui` .
+
+The GUI is constructed offscreen (``QT_QPA_PLATFORM=offscreen`` , unless another platform is set) and fed either by a
+simulated controller through :class:`~vent.coordinator.coordinator.CoordinatorLocal` , or by a synthetic breath
+waveform that costs nothing to produce, so only the GUI is measured. With ``--stall`` , the synthetic feed takes that
+many seconds to reply to every request, like a stalled controller, which shouldn't slow the GUI down. It is run for a fixed number of frames of its
+:class:`~vent.gui.render.RenderClock` , and reports:
+
+* the time of each :meth:`~vent.gui.main.Vent_Gui.receive_sensors` (handing fetched values to the widgets, values are
+  fetched in the background by :class:`~vent.coordinator.async_coordinator.AsyncCoordinator` )
+* the time of each :meth:`.Plot.update_value` and :meth:`.Plot.render`
+* the time of each frame, and the fraction of time spent rendering and fetching
+* event loop latency: how late a timer scheduled every few milliseconds fires
+* resident memory before the GUI is built, after, and at the end
+
+Results can be saved as json, and compared against a saved baseline, exiting with status 1 if any time or memory
+regressed by more than ``--tolerance`` . Run from the repository root::
+
+    python benchmarks/bench_gui.py
+    python benchmarks/bench_gui.py --feed sim --frames 1200 --fps 30
+    python benchmarks/bench_gui.py --stall 2
+    python benchmarks/bench_gui.py --save baseline.json
+    python benchmarks/bench_gui.py --baseline baseline.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import typing
+
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PySide2 import QtCore
+
+from vent.common import values
+from vent.common.message import SensorValues
+from vent.coordinator.coordinator import CoordinatorBase, get_coordinator
+
+BREATH = 3  # seconds per breath of the synthetic feed
+
+REGRESSION_KEYS = (
+    'update_gui_mean_ms', 'update_gui_p99_ms',
+    'plot_update_us', 'plot_render_mean_ms',
+    'frame_mean_ms', 'frame_p99_ms', 'load',
+    'latency_p99_ms', 'rss_growth_mb'
+)
+"""
+Results where lower is better, compared against a baseline
+"""
+
+
+class SyntheticCoordinator(CoordinatorBase):
+    """
+    Coordinator that returns a noiseless synthetic breath for each sensor, without a controller
+    """
+
+    def __init__(self, stall: float = 0):
+        """
+        Args:
+            stall (float): seconds to wait before returning sensor values
+        """
+        super(SyntheticCoordinator, self).__init__()
+        self.stall = stall
+        self.controls = {}
+        self.loop_counter = 0
+        self.start_time = time.time()
+
+    def get_sensors(self) -> SensorValues:
+        if self.stall:
+            time.sleep(self.stall)
+        now = time.time()
+        phase = ((now - self.start_time) % BREATH) / BREATH
+        vals = {}
+        for name, value in values.SENSOR.items():
+            low, high = value.safe_range
+            vals[name] = low + (high - low) * (0.5 + 0.4 * np.sin(2 * np.pi * phase))
+        self.loop_counter += 1
+        return SensorValues(timestamp=now,
+                            loop_counter=self.loop_counter,
+                            breath_count=int((now - self.start_time) // BREATH),
+                            vals=vals)
+
+    def set_control(self, control_setting):
+        self.controls[control_setting.name] = control_setting
+
+    def set_controls(self, control_settings):
+        for control_setting in control_settings:
+            self.set_control(control_setting)
+
+    def get_control(self, control_setting_name):
+        return self.controls[control_setting_name]
+
+
+class Timed(object):
+    """ Wraps a method, keeping the duration of each call """
+
+    def __init__(self, method: typing.Callable):
+        self.method = method
+        self.durations = []
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.method(*args, **kwargs)
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+
+class LatencyProbe(QtCore.QObject):
+    """ A timer that fires every ``interval`` s, keeping how late each firing is """
+
+    def __init__(self, interval: float = 0.005):
+        super(LatencyProbe, self).__init__()
+        self.interval = interval
+        self.lateness = []
+        self._last = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(round(interval * 1000))
+        self.timer.timeout.connect(self._fired)
+
+    def _fired(self):
+        now = time.perf_counter()
+        if self._last is not None:
+            self.lateness.append(max(now - self._last - self.interval, 0))
+        self._last = now
+
+    def start(self):
+        self._last = None
+        self.lateness = []
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+
+def rss_mb() -> float:
+    """ Resident memory of this process (MB) """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        # not linux, use the peak instead
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def run(feed: str = 'synthetic',
+        frames: int = 600,
+        warmup: int = 40,
+        fps: float = 20,
+        update_period: float = 0.1,
+        stall: float = 0) -> dict:
+    """
+    Build the GUI and run it for ``warmup + frames`` frames, measuring the last ``frames``
+
+    Args:
+        feed (str): ``'synthetic'`` for :class:`.SyntheticCoordinator` , ``'sim'`` for a simulated controller
+        frames (int): frames to measure
+        warmup (int): frames to run before measuring
+        fps (float): frames per second of the render clock
+        update_period (float): seconds between fetching values from the coordinator
+        stall (float): seconds the synthetic feed takes to reply
+
+    Returns:
+        dict: results, times in ms unless their name says otherwise
+    """
+    from vent import gui
+    from vent.gui import render
+    from vent.gui.main import launch_gui
+
+    rss_start = rss_mb()
+    build_start = time.perf_counter()
+    if feed == 'sim':
+        coordinator = get_coordinator(single_process=True, sim_mode=True)
+    else:
+        coordinator = SyntheticCoordinator(stall)
+
+    gui.limit_gui(False)
+    app, vent_gui = launch_gui(coordinator)
+    vent_gui.render_clock.fps = fps
+    vent_gui.update_period = update_period
+    vent_gui.show()
+    app.processEvents()
+    build_ms = (time.perf_counter() - build_start) * 1000
+    rss_built = rss_mb()
+
+    if feed == 'sim':
+        vent_gui.start()
+
+    plot_updates, plot_renders = [], []
+    for plot in vent_gui.plots.values():
+        plot.update_value = Timed(plot.update_value)
+        plot.render = Timed(plot.render)
+        plot_updates.append(plot.update_value)
+        plot_renders.append(plot.render)
+
+    probe = LatencyProbe()
+    n_frames = [0]
+
+    def on_frame(this_time):
+        n_frames[0] += 1
+        if n_frames[0] == warmup:
+            # start measuring
+            vent_gui.render_clock.frames = render.FrameStats(frames)
+            vent_gui.ingest_stats = render.FrameStats(frames)
+            for timed in plot_updates + plot_renders:
+                timed.durations = []
+            probe.start()
+        elif n_frames[0] == warmup + frames:
+            app.quit()
+
+    vent_gui.render_clock.frame.connect(on_frame)
+    wall_start = time.perf_counter()
+    app.exec_()
+    wall = time.perf_counter() - wall_start
+    probe.stop()
+    vent_gui.render_clock.frame.disconnect(on_frame)
+
+    stats = vent_gui.render_stats()
+    frame_stats, ingest_stats = stats['render'], stats['ingest']
+    update_durations = np.concatenate([timed.durations for timed in plot_updates]) \
+        if plot_updates else np.zeros(1)
+    render_durations = np.concatenate([timed.durations for timed in plot_renders]) \
+        if plot_renders else np.zeros(1)
+    lateness = np.array(probe.lateness) if probe.lateness else np.zeros(1)
+
+    results = {
+        'feed':                feed,
+        'frames':              frame_stats['n'],
+        'fps':                 frame_stats['fps'],
+        'seconds':             wall,
+        'build_ms':            build_ms,
+        'update_gui_mean_ms':  ingest_stats.get('mean', 0.) * 1000,
+        'update_gui_p99_ms':   ingest_stats.get('p99', 0.) * 1000,
+        'update_gui_late':     ingest_stats.get('late', 0),
+        'plot_update_us':      float(update_durations.mean()) * 1e6,
+        'plot_render_mean_ms': float(render_durations.mean()) * 1000,
+        'frame_mean_ms':       frame_stats['mean'] * 1000,
+        'frame_p99_ms':        frame_stats['p99'] * 1000,
+        'frame_max_ms':        frame_stats['max'] * 1000,
+        'frames_late':         frame_stats.get('late', 0),
+        'load':                stats['load'],
+        'latency_mean_ms':     float(lateness.mean()) * 1000,
+        'latency_p99_ms':      float(np.percentile(lateness, 99)) * 1000,
+        'latency_max_ms':      float(lateness.max()) * 1000,
+        'rss_start_mb':        rss_start,
+        'rss_built_mb':        rss_built,
+        'rss_end_mb':          rss_mb(),
+    }
+    results['rss_growth_mb'] = results['rss_end_mb'] - results['rss_built_mb']
+
+    vent_gui.close()
+    app.processEvents()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> typing.List[str]:
+    """
+    Regressions of ``results`` relative to ``baseline`` , for the :data:`.REGRESSION_KEYS`
+
+    Small absolute differences (under 0.05 ms, 50 us per plot update, 0.05 of load, or 1 MB) are ignored, as they are
+    mostly noise.
+
+    Returns:
+        list: descriptions of the regressions, empty if there are none
+    """
+    floors = {'load': 0.05, 'rss_growth_mb': 1, 'plot_update_us': 50}
+    regressions = []
+    for key in REGRESSION_KEYS:
+        if key not in baseline or key not in results:
+            continue
+        old, new = baseline[key], results[key]
+        if new - old > max(abs(old) * tolerance, floors.get(key, 0.05)):
+            regressions.append('{}: {:.3f} -> {:.3f} ({:+.0f}%)'.format(
+                key, old, new, (new - old) / old * 100 if old else float('inf')))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--feed', choices=('synthetic', 'sim'), default='synthetic',
+                        help='synthetic waveforms, or a simulated controller')
+    parser.add_argument('--frames', type=int, default=600, help='frames to measure')
+    parser.add_argument('--warmup', type=int, default=40, help='frames to run before measuring')
+    parser.add_argument('--fps', type=float, default=20, help='frames per second of the render clock')
+    parser.add_argument('--update-period', type=float, default=0.1, help='seconds between fetching values')
+    parser.add_argument('--stall', type=float, default=0, help='seconds the synthetic feed takes to reply')
+    parser.add_argument('--save', type=str, default=None, help='save the results to this json file')
+    parser.add_argument('--baseline', type=str, default=None, help='json file of results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a result may be worse than the baseline before it is a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.feed, args.frames, args.warmup, args.fps, args.update_period, args.stall)
+
+    print()
+    for key, value in results.items():
+        print('{:>20} {}'.format(key, '{:.3f}'.format(value) if isinstance(value, float) else value))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        print()
+        if regressions:
+            print('Regressed from {}:'.format(args.baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('No regressions from {}'.format(args.baseline))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark the control loop of :class:`~vent.controller.control_module.ControlModuleDevice` as I2C latency varies.
+
+The controller runs on the devices in ``vent/io/config/devices.ini`` , but talks to a
+:class:`~vent.io.devices.sim_pigpio.SimPigpio` instead of the pigpio daemon, with a simulated ADS1015 on the I2C bus.
+For each I2C latency, the loop rate and the jitter (standard deviation, 99th percentile and max) of the loop
+durations are reported, along with the number of bus transactions per loop.
+
+With ``--config vent/io/config/sim-lung-devices.ini`` the sensors instead read a simulated lung that responds to the
+valves (see :mod:`vent.io.devices.lung` ), so the controller runs full breath cycles. The lung devices don't use the
+bus, so this measures the cost of the controller and HAL code itself, independent of the latency settings.
+
+Run from the repository root::
+
+    python benchmarks/bench_hal_latency.py
+    python benchmarks/bench_hal_latency.py --latency 0 0.0005 0.001 --jitter 0.5 --duration 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vent.controller.control_module import ControlModuleDevice
+from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115, TransactionModel
+
+CONFIG_FILE = 'vent/io/config/devices.ini'
+ADC_ADDRESS = 0x48
+
+# voltages on the ADC channels, see MUX in devices.ini
+CHANNEL_VOLTAGES = {
+    0: 2.4,     # pressure_sensor
+    1: 2.25,    # flow_sensor_ex
+    3: 2.5      # oxygen_sensor
+}
+
+
+def make_pig(latency: float, jitter: float, error_rate: float, gpio_latency: float, seed=None) -> SimPigpio:
+    """
+    Make a simulated pigpio connection with an ADC, where I2C transactions take ``latency`` seconds on average.
+
+    Args:
+        latency (float): mean I2C transaction time (s)
+        jitter (float): standard deviation of I2C transaction time, as a fraction of ``latency``
+        error_rate (float): probability that an I2C transaction fails
+        gpio_latency (float): mean time of GPIO and PWM transactions (s)
+        seed: seed for the random latencies
+    """
+    rng = np.random.default_rng(seed)
+
+    def noisy(voltage):
+        return lambda: voltage + rng.normal(0, 0.005)
+
+    i2c = TransactionModel(latency=latency, jitter=latency * jitter, error_rate=error_rate)
+    gpio = TransactionModel(latency=gpio_latency, jitter=gpio_latency * jitter)
+    pig = SimPigpio(models={'i2c_read': i2c, 'i2c_write': i2c, 'pwm': gpio, 'gpio': gpio}, seed=seed)
+    pig.add_i2c_device(
+        SimADS1115(channels={mux: noisy(voltage) for mux, voltage in CHANNEL_VOLTAGES.items()}),
+        ADC_ADDRESS
+    )
+    return pig
+
+
+def run(latency: float, jitter: float, error_rate: float, gpio_latency: float,
+        duration: float, warmup: float, seed=None, config_file: str = CONFIG_FILE) -> dict:
+    """
+    Run the controller for ``duration`` seconds after ``warmup`` seconds, and return its loop statistics along with
+    the transactions per loop.
+    """
+    pig = make_pig(latency, jitter, error_rate, gpio_latency, seed)
+    controller = ControlModuleDevice(save_logs=False, config_file=config_file, pig=pig)
+    try:
+        controller.start()
+        time.sleep(warmup)
+        since = controller.get_loop_stats().get('count')
+        pig.reset_stats()
+        start_count = controller.get_heartbeat()
+
+        time.sleep(duration)
+        stats = controller.get_loop_stats(since)
+        loops = controller.get_heartbeat() - start_count
+    finally:
+        controller.stop()
+        time.sleep(0.1)
+
+    # the loop stats only keep the most recent loops, count transactions over all of them
+    loops = max(loops, 1)
+    stats['i2c_per_loop'] = (pig.stats['i2c_read']['count'] + pig.stats['i2c_write']['count']) / loops
+    stats['gpio_per_loop'] = (pig.stats['gpio']['count'] + pig.stats['pwm']['count']) / loops
+    stats['errors'] = sum(s['errors'] for s in pig.stats.values())
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--latency', type=float, nargs='+', default=[0, 0.0001, 0.00025, 0.0005, 0.001, 0.002],
+                        help='mean I2C transaction times to test, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help='standard deviation of transaction times, as a fraction of the mean')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='probability that an I2C transaction fails')
+    parser.add_argument('--gpio-latency', type=float, default=0.0001,
+                        help='mean GPIO/PWM transaction time, in seconds')
+    parser.add_argument('--duration', type=float, default=5, help='seconds to measure each latency for')
+    parser.add_argument('--warmup', type=float, default=1, help='seconds to run before measuring')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--config', type=str, default=CONFIG_FILE, help='device config file for the Hal')
+    args = parser.parse_args(argv)
+
+    header = '{:>12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8} {:>7}'.format(
+        'latency(ms)', 'rate(Hz)', 'mean(ms)', 'std(ms)', 'p99(ms)', 'max(ms)', 'i2c/loop', 'gpio/loop', 'errors')
+    results = []
+    for latency in args.latency:
+        stats = run(latency, args.jitter, args.error_rate, args.gpio_latency,
+                    args.duration, args.warmup, args.seed, args.config)
+        results.append((latency, stats))
+
+    print()
+    print(header)
+    for latency, stats in results:
+        if stats.get('n', 0) == 0:
+            print('{:>12.3f}  control loop did not run'.format(latency * 1000))
+            continue
+        print('{:>12.3f} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>8.2f} {:>9.2f} {:>7d}'.format(
+            latency * 1000,
+            stats['rate'],
+            stats['mean'] * 1000,
+            stats['std'] * 1000,
+            stats['p99'] * 1000,
+            stats['max'] * 1000,
+            stats['i2c_per_loop'],
+            stats['gpio_per_loop'],
+            stats['errors']
+        ))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark exporting a :class:`~vent.common.loggers.DataLogger` file to csv and MATLAB files.
+
+Writes a log file of about ``--size`` MB of noisy waveforms (so it compresses like real data), then exports it with
+the chunked exporters :func:`~vent.common.loggers.export_csv` and :func:`~vent.common.loggers.export_mat` , and with
+the previous exporters that loaded every table into memory with ``load_file`` and wrote them with ``np.savetxt`` and
+``scipy.io.savemat`` . Each export runs in its own process, and its wall time, throughput (MB of log per second) and
+peak resident memory are reported.
+
+Run from the repository root::
+
+    python benchmarks/bench_log_export.py
+    python benchmarks/bench_log_export.py --size 100 --exporters csv mat
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy.io as sio
+import tables as pytb
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vent.common.loggers import LOG_TABLES, EXPORT_TABLES, index_logfile, export_csv, export_mat
+
+RATE = 500          # waveform samples per second
+BREATH = 3          # seconds per breath
+CHUNK = 1000000     # rows generated at once
+
+
+def make_log(filename: str, size_mb: float, seed=None):
+    """
+    Write a log file of about ``size_mb`` MB, with waveforms, one derived row per breath, and a few control commands
+    """
+    rng = np.random.default_rng(seed)
+    filters = pytb.Filters(complevel=9, complib='zlib')
+    with pytb.open_file(filename, mode='w') as h5file:
+        for group, description in LOG_TABLES.items():
+            h5file.create_group('/', group)
+            h5file.create_table('/' + group, 'readout', description, filters=filters)
+        waveforms = h5file.root.waveforms.readout
+        derived = h5file.root.derived_quantities.readout
+
+        n = 0
+        while os.path.getsize(filename) < size_mb * 1e6:
+            rows = np.zeros(CHUNK, dtype=waveforms.dtype)
+            t = (n + np.arange(CHUNK)) / RATE
+            rows['timestamp'] = t
+            rows['cycle_number'] = t // BREATH
+            rows['pressure'] = 20 * (t % BREATH < 1) + 5 + rng.normal(0, 0.5, CHUNK)
+            rows['flow_out'] = rng.normal(0, 1, CHUNK)
+            rows['control_in'] = rng.uniform(0, 100, CHUNK)
+            rows['control_out'] = t % BREATH >= 1
+            rows['oxygen'] = 21 + rng.normal(0, 0.1, CHUNK)
+            waveforms.append(rows)
+
+            breaths = np.zeros(CHUNK // (RATE * BREATH), dtype=derived.dtype)
+            breaths['cycle_number'] = np.unique(rows['cycle_number'])[:len(breaths)]
+            breaths['timestamp'] = breaths['cycle_number'] * BREATH
+            breaths['pip'] = 25 + rng.normal(0, 0.5, len(breaths))
+            derived.append(breaths)
+            h5file.flush()
+            n += CHUNK
+
+        h5file.root.controls.readout.append([(100, 0, b'PIP', 0, 25), (20, 0, b'PEEP', 0, 5)])
+        index_logfile(h5file)
+
+
+def load_all(filename: str) -> dict:
+    """ What ``DataLogger.load_file`` did: read every table into memory """
+    with pytb.open_file(filename, mode='r') as h5file:
+        return {table: h5file.get_node('/' + table, 'readout').read() for table in EXPORT_TABLES}
+
+
+def legacy_csv(filename: str):
+    new_file = filename.split('h5')
+    for table, data in load_all(filename).items():
+        np.savetxt(new_file[0] + EXPORT_TABLES[table] + '.csv', data, delimiter=',',
+                   header=str(data.dtype.names)[1:-1], comments='',
+                   fmt=['%s' if data.dtype[field].kind == 'S' else '%.18e' for field in data.dtype.names])
+
+
+def legacy_mat(filename: str):
+    sio.savemat(filename.split('h5')[0] + '.mat',
+                {EXPORT_TABLES[table]: data for table, data in load_all(filename).items()})
+
+
+EXPORTERS = {
+    'csv':        export_csv,
+    'mat':        export_mat,
+    'legacy_csv': legacy_csv,
+    'legacy_mat': legacy_mat
+}
+
+
+def _run(exporter: str, filename: str, queue: mp.Queue):
+    start = time.perf_counter()
+    EXPORTERS[exporter](filename)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on linux
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3))
+
+
+def run(exporter: str, filename: str) -> tuple:
+    """ Export ``filename`` in a new process, returning the time taken (s) and the peak memory of the process (MB) """
+    queue = mp.Queue()
+    process = mp.Process(target=_run, args=(exporter, filename, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return None, None
+    return queue.get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--size', type=float, default=1000, help='size of the log file to export, in MB')
+    parser.add_argument('--exporters', type=str, nargs='+', default=list(EXPORTERS.keys()),
+                        choices=list(EXPORTERS.keys()))
+    parser.add_argument('--dir', type=str, default=None, help='directory to write the log and exports in')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as log_dir:
+        filename = os.path.join(log_dir, 'bench_controller_log.0.h5')
+        print('Writing {:.0f} MB log...'.format(args.size))
+        make_log(filename, args.size, args.seed)
+        size_mb = os.path.getsize(filename) / 1e6
+
+        for exporter in args.exporters:
+            elapsed, peak = run(exporter, filename)
+            results.append((exporter, elapsed, peak))
+
+    print()
+    print('{:>12} {:>10} {:>10} {:>14}'.format('exporter', 'time(s)', 'MB/s', 'peak mem(MB)'))
+    for exporter, elapsed, peak in results:
+        if elapsed is None:
+            print('{:>12}  failed (out of memory?)'.format(exporter))
+            continue
+        print('{:>12} {:>10.1f} {:>10.1f} {:>14.0f}'.format(exporter, elapsed, size_mb / elapsed, peak))
+    return results
+
+
+if __name__ == '__main__':
+    main()
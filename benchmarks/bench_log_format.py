@@ -0,0 +1,140 @@
+"""
+Benchmark the compact (16 bit quantized) waveform layout of :class:`~vent.common.loggers.DataLogger` against the
+float64 layout.
+
+Simulated breaths, with the noise and resolution of a 16 bit ADC, are stored through
+:meth:`~vent.common.loggers.DataLogger.store_waveform_data` in each layout, flushing once per breath like the
+controller. For each layout the file size per hour of ventilation, the time to store a sample, and the time to read
+the whole file and a 10 s window back with :class:`~vent.common.loggers.LogReader` are reported, along with the largest
+error of the compact waveforms.
+
+Log files are written to ``DATA_DIR`` like the controller's, and removed afterwards. Run from the repository root::
+
+    python benchmarks/bench_log_format.py
+    python benchmarks/bench_log_format.py --rate 1000 --duration 1800
+"""
+
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vent.common.loggers import DataLogger, LogReader, COMPACT_FIELDS
+from vent.common.message import ControlValues
+
+BREATH = 3          # seconds per breath
+ADC_STEP = {        # resolution of each waveform, in its units
+    'pressure': 0.0078,
+    'flow_out': 0.0153,
+    'oxygen':   0.0061
+}
+
+
+def make_waveforms(rate: float, duration: float, seed=None) -> dict:
+    """ Simulated waveforms at ``rate`` Hz for ``duration`` seconds, {field: array} """
+    rng = np.random.default_rng(seed)
+    t = 1e9 + np.arange(int(rate * duration)) / rate
+    phase = t % BREATH
+    inspiration = phase < 1
+    waveforms = {
+        'timestamp':    t,
+        'cycle_number': ((t - t[0]) // BREATH).astype(np.uint32),
+        'pressure':     np.where(inspiration, 25 - 20 * np.exp(-10 * phase), 5 + 20 * np.exp(-10 * (phase - 1))),
+        'flow_out':     np.where(inspiration, 0, 30 * np.exp(-3 * (phase - 1))),
+        'oxygen':       np.full(len(t), 21.),
+        'control_in':   np.where(inspiration, 5 * (1 - np.exp(-5 * phase)), 0),
+        'control_out':  (~inspiration).astype(float)
+    }
+    for field, step in ADC_STEP.items():
+        noisy = waveforms[field] + rng.normal(0, 4 * step, len(t))
+        waveforms[field] = np.round(noisy / step) * step
+    return waveforms
+
+
+def write(waveforms: dict, compact: bool) -> tuple:
+    """ Store the waveforms with a DataLogger, returning its file and the seconds spent storing each sample """
+    dl = DataLogger(compact=compact)
+    n = len(waveforms['timestamp'])
+    breath = waveforms['cycle_number']
+    start = time.perf_counter()
+    for i in range(n):
+        sensor_values = SimpleNamespace(timestamp=waveforms['timestamp'][i],
+                                        PRESSURE=waveforms['pressure'][i],
+                                        FLOWOUT=waveforms['flow_out'][i],
+                                        FIO2=waveforms['oxygen'][i],
+                                        breath_count=breath[i])
+        dl.store_waveform_data(sensor_values, ControlValues(waveforms['control_in'][i], waveforms['control_out'][i]))
+        if i + 1 < n and breath[i + 1] != breath[i]:
+            dl.flush_logfile()
+    dl.flush_logfile()
+    elapsed = time.perf_counter() - start
+    dl.close_logfile()
+    return dl, elapsed / n
+
+
+def read(filename: str, t_mid: float) -> tuple:
+    """ Seconds to read the whole file, and a 10 s window, and the waveforms read """
+    with LogReader(filename) as reader:
+        start = time.perf_counter()
+        rows = reader.read()
+        whole = time.perf_counter() - start
+
+        windows = []
+        for _ in range(20):
+            start = time.perf_counter()
+            reader.read(start=t_mid, stop=t_mid + 10)
+            windows.append(time.perf_counter() - start)
+    return whole, np.median(windows), rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rate', type=float, default=500, help='control loop samples per second')
+    parser.add_argument('--duration', type=float, default=600, help='seconds of ventilation to log')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    waveforms = make_waveforms(args.rate, args.duration, args.seed)
+    t_mid = waveforms['timestamp'][len(waveforms['timestamp']) // 2]
+
+    results = {}
+    for layout, compact in (('float64', False), ('compact', True)):
+        dl, per_sample = write(waveforms, compact)
+        try:
+            size = os.path.getsize(dl.file)
+            whole, window, rows = read(dl.file, t_mid)
+        finally:
+            os.remove(dl.file)
+            if dl.catalog is not None:
+                dl.catalog.remove(dl.file)
+        results[layout] = {
+            'mb_per_hour': size / 1e6 * 3600 / args.duration,
+            'write_us':    per_sample * 1e6,
+            'read_s':      whole,
+            'mrows_per_s': len(rows) / whole / 1e6,
+            'window_ms':   window * 1e3,
+            'rows':        rows
+        }
+
+    print()
+    print('{:>8} {:>10} {:>15} {:>9} {:>13} {:>15}'.format(
+        'layout', 'MB/hour', 'write(us/row)', 'read(s)', 'read(Mrow/s)', '10s window(ms)'))
+    for layout, result in results.items():
+        print('{:>8} {:>10.1f} {:>15.1f} {:>9.3f} {:>13.2f} {:>15.2f}'.format(
+            layout, result['mb_per_hour'], result['write_us'], result['read_s'], result['mrows_per_s'],
+            result['window_ms']))
+
+    exact, compact = results['float64']['rows'], results['compact']['rows']
+    print()
+    print('max error of compact waveforms: ' + ', '.join(
+        '{} {:.2g}'.format(field, np.abs(compact[field] - exact[field]).max()) for field in COMPACT_FIELDS))
+    return results
+
+
+if __name__ == '__main__':
+    main()
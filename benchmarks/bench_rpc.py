@@ -0,0 +1,133 @@
+"""
+Benchmark the round trip of :meth:`.CoordinatorRemote.get_sensors` through the controller's RPC server.
+
+A simulated controller is served from a separate process, like :class:`.ProcessManager` does, by either
+
+* ``http/1.0`` : a plain :class:`xmlrpc.server.SimpleXMLRPCServer` , which closes the connection after each request,
+  called through a plain :class:`xmlrpc.client.ServerProxy` , so every call opens a new TCP connection
+* ``keep-alive`` : :class:`~vent.coordinator.rpc.RPCServer` called through :class:`~vent.coordinator.rpc.RPCClient` ,
+  which keep the connection open between calls
+
+For each, the latency of ``get_sensors`` calls (including unpickling the result) is reported from one thread, and the
+total rate of calls from several threads at once. Run from the repository root::
+
+    python benchmarks/bench_rpc.py
+    python benchmarks/bench_rpc.py --calls 5000 --threads 4 --running
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import threading
+import time
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vent.coordinator import rpc
+
+PORT = rpc.default_port + 10
+
+
+def serve(kind: str, port: int, running: bool, ready):
+    """ Serve a simulated controller in this process """
+    import vent.controller.control_module
+    rpc.remote_controller = vent.controller.control_module.get_control_module(sim_mode=True)
+    if running:
+        rpc.remote_controller.start()
+
+    if kind == 'keep-alive':
+        server = rpc.make_server(port=port)
+    else:
+        server = SimpleXMLRPCServer((rpc.default_addr, port), allow_none=True, logRequests=False)
+        server.register_function(rpc.get_sensors, 'get_sensors')
+    ready.set()
+    server.serve_forever()
+
+
+def make_client(kind: str, port: int):
+    if kind == 'keep-alive':
+        return rpc.RPCClient(port=port)
+    else:
+        return xmlrpc.client.ServerProxy(f'http://{rpc.default_addr}:{port}/')
+
+
+def latency(client, calls: int) -> np.ndarray:
+    """ Seconds for each of ``calls`` calls """
+    durations = np.zeros(calls)
+    for i in range(calls):
+        start = time.perf_counter()
+        pickle.loads(client.get_sensors().data)
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def throughput(kind: str, port: int, threads: int, calls: int) -> float:
+    """ Calls per second from ``threads`` threads making ``calls`` calls each """
+    shared = make_client(kind, port) if kind == 'keep-alive' else None
+
+    def work():
+        # a ServerProxy isn't thread-safe, each thread needs its own
+        client = shared if shared is not None else make_client(kind, port)
+        for _ in range(calls):
+            pickle.loads(client.get_sensors().data)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * calls / (time.perf_counter() - start)
+
+
+def run(kind: str, calls: int, threads: int, running: bool) -> dict:
+    ready = mp.Event()
+    server = mp.Process(target=serve, args=(kind, PORT, running, ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError('server did not start')
+        client = make_client(kind, PORT)
+        latency(client, 100)  # warm up
+        durations = latency(client, calls)
+        rate = throughput(kind, PORT, threads, calls // threads)
+    finally:
+        server.kill()
+        server.join()
+    return {
+        'mean_us': durations.mean() * 1e6,
+        'p50_us':  np.percentile(durations, 50) * 1e6,
+        'p99_us':  np.percentile(durations, 99) * 1e6,
+        'max_us':  durations.max() * 1e6,
+        'rate':    rate
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=2000, help='calls to time')
+    parser.add_argument('--threads', type=int, default=4, help='threads calling at once for the throughput')
+    parser.add_argument('--running', action='store_true', help='run the simulated control loop while serving')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for kind in ('http/1.0', 'keep-alive'):
+        results[kind] = run(kind, args.calls, args.threads, args.running)
+
+    print()
+    print('{:>11} {:>10} {:>10} {:>10} {:>10} {:>18}'.format(
+        'server', 'mean(us)', 'p50(us)', 'p99(us)', 'max(us)', f'calls/s ({args.threads} thr)'))
+    for kind, result in results.items():
+        print('{:>11} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>18.0f}'.format(
+            kind, result['mean_us'], result['p50_us'], result['p99_us'], result['max_us'], result['rate']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from vent.io.devices.pins import Pin
-from collections import deque
+from vent.io.devices.sim_pigpio import MockHardwareDevice, soft_frequencies
 from functools import wraps
 from random import getrandbits, choice
 from secrets import token_bytes
@@ -427,7 +427,7 @@ def mock_i2c_hardware():
         i2c_bus = getrandbits(1) if i2c_bus is None else i2c_bus
         i2c_address = getrandbits(7) if i2c_address is None else i2c_address
         if reg_values is None:
-            n_registers = getrandbits(5) if n_registers is None else n_registers
+            n_registers = (getrandbits(5) or 1) if n_registers is None else n_registers    # at least one register
             reg_values = [token_bytes(2) for _ in range(n_registers)]
         else:
             if n_registers is None:
@@ -476,79 +476,3 @@ def mock_pigpio_bad_user_gpio_arg(func):
         return result
 
     return check_args
-
-
-class MockHardwareDevice:
-    def __init__(self, *args):
-        """ A simple mock device with registers defined by kwargs. If only one register value is passed, device emulates
-        a single register device that responds to read_device commands (such as the SFM3200). Retains past register
-        values upon writing to a register for logging/assertion convenience.
-
-        Register values are stored as raw bytes. Reading and writing to/from the registers simulates network-endian
-            transactions by byteswapping.
-
-        Args:
-            *args: register_values of type bytes; one, per, register
-        """
-        self.last_register = None
-        self.registers = []
-        if args:
-            for arg in args:
-                if not isinstance(arg, bytes):
-                    raise TypeError("Unknown register value of type {}".format(type(arg)))
-                self.registers.append(deque())
-                self.registers[-1].append(arg)
-            if len(self.registers) == 1:
-                self.last_register = 0
-        else:
-            TypeError("MockHardwareDevice needs at least one register to initialize")
-
-    def read_mock_hardware_device(self, count=None):
-        """Alias for read_mock_hardware_register(reg_num=None, count)"""
-        return self.read_mock_hardware_register(reg_num=None, count=count)
-
-    def write_mock_hardware_device(self, value):
-        """ Alias for write_mock_hardware_register(reg_num=None, value)"""
-        self.write_mock_hardware_register(reg_num=None, value=value)
-
-    def read_mock_hardware_register(self, reg_num=None, count=None):
-        """ Reads count bytes from a specific register
-
-        Args:
-            reg_num: The index of the register to read
-            count (int): The number of bytes to read
-
-        Returns:
-            bytes: the register contents
-        """
-        if reg_num is None:
-            if self.last_register is not None:
-                reg_num = self.last_register
-            else:
-                raise RuntimeError("mock_i2c_device tried to access last register but none have been accessed yet")
-        else:
-            self.last_register = reg_num
-        result = self.registers[reg_num][-1]
-        return result if count is None else result[:count]
-
-    def write_mock_hardware_register(self, reg_num, value):
-        """ Writes value to register specified by reg_num
-
-        Args:
-            reg_num: The index of the register to write
-            value (bytes): The stuff to write to the register
-        """
-        if type(value) is not bytes:
-            raise TypeError("arg 'value' must be of type bytes")
-        if reg_num is None:
-            if self.last_register is not None:
-                reg_num = self.last_register
-            else:
-                raise RuntimeError("mock_i2c_device tried to access last register but none have been accessed yet")
-        else:
-            self.last_register = reg_num
-        self.last_register = reg_num
-        self.registers[reg_num].append(value)
-
-
-soft_frequencies = (8000, 4000, 2000, 1600, 1000, 800, 500, 400, 320, 250, 200, 160, 100, 80, 50, 40, 20, 10)
\ No newline at end of file
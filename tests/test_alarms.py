@@ -681,3 +681,106 @@ def test_alarm_manager_logged_alarms(fake_sensors, fake_rule):
 
 
 
+
+def test_alarm_manager_value_subset(fake_sensors, fake_rule):
+    """
+    Updating with ``value_names`` only checks the rules that depend on those values
+    """
+    manager = Alarm_Manager()
+    manager.reset()
+
+    # the default rules that depend on pressure
+    pressure_rules = manager.get_rules((ValueName.PRESSURE,))
+    assert all([ValueName.PRESSURE in rule.value_names for rule in pressure_rules])
+    assert AlarmType.HIGH_PRESSURE in [rule.name for rule in pressure_rules]
+    assert AlarmType.LOW_VTE not in [rule.name for rule in pressure_rules]
+
+    # replacing a rule invalidates the cache
+    rule = fake_rule(alarm_type=AlarmType.LOW_VTE)
+    manager.load_rule(rule)
+    assert rule in manager.get_rules((ValueName.PRESSURE,))
+
+    # a VTE-only update doesn't check the (now pressure) rule
+    sensors = fake_sensors({ValueName.PRESSURE: 3.5})
+    manager.update(sensors, (ValueName.VTE,))
+    assert AlarmType.LOW_VTE not in manager.active_alarms.keys()
+
+    manager.update(sensors, (ValueName.PRESSURE,))
+    assert manager.active_alarms[AlarmType.LOW_VTE].severity == AlarmSeverity.HIGH
+
+    # restore default rules
+    manager.reset()
+    manager.load_rule(copy.deepcopy(ALARM_RULES[AlarmType.LOW_VTE]))
+
+
+def test_alarm_log_query():
+    """
+    Alarm_Log is bounded and can be queried by time, type, and severity
+    """
+    from vent.alarm.alarm_log import Alarm_Log
+
+    log = Alarm_Log(capacity=50)
+
+    types = [AlarmType.HIGH_PRESSURE, AlarmType.LOW_VTE]
+    severities = [AlarmSeverity.LOW, AlarmSeverity.MEDIUM, AlarmSeverity.HIGH]
+
+    for i in range(120):
+        alarm = Alarm(types[i % 2], severities[i % 3], start_time=float(i), value=i)
+        log.append(alarm)
+
+    # only the most recent events are kept
+    assert len(log) == 50
+    events = log.query()
+    assert len(events) == 50
+    assert events['timestamp'][0] == 70
+    assert np.all(np.diff(events['timestamp']) > 0)
+
+    # time ranges, [start, stop)
+    events = log.query(start=100, stop=110)
+    assert list(events['timestamp']) == list(range(100, 110))
+    assert len(log.query(stop=10)) == 0
+
+    # by type
+    events = log.query(start=100, alarm_type=AlarmType.LOW_VTE)
+    assert all(events['alarm_type'] == AlarmType.LOW_VTE.value)
+    assert list(events['timestamp']) == list(range(101, 120, 2))
+
+    # by severity
+    events = log.query(severity=AlarmSeverity.HIGH)
+    assert all(events['severity'] == AlarmSeverity.HIGH.value)
+    assert events['timestamp'][0] >= 70
+
+    # by both
+    events = log.query(alarm_type=AlarmType.HIGH_PRESSURE, severity=AlarmSeverity.LOW)
+    assert list(events['timestamp']) == [i for i in range(70, 120) if i % 6 == 0]
+
+    # timestamps going backwards are clamped to keep the log sorted
+    log.append(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, start_time=5.))
+    assert log.query()['timestamp'][-1] == 119
+
+    log.clear()
+    assert len(log.query()) == 0
+
+
+def test_alarm_manager_alarm_log(fake_sensors, fake_rule):
+    """
+    Emitted alarms, including clears, are stored in the manager's alarm_log
+    """
+    manager = Alarm_Manager()
+    manager.reset()
+    manager.alarm_log.clear()
+
+    rule = fake_rule(latch=False, persistent=False)
+    manager.load_rule(rule)
+
+    sensors = fake_sensors()
+    sensors.PRESSURE = 3.5
+    manager.update(sensors)
+    sensors.PRESSURE = 0.5
+    manager.update(sensors)
+
+    events = manager.alarm_log.query(alarm_type=rule.name)
+    assert list(events['severity']) == [AlarmSeverity.HIGH.value, AlarmSeverity.OFF.value]
+
+    manager.reset()
+    manager.load_rule(copy.deepcopy(ALARM_RULES[AlarmType.HIGH_PRESSURE]))
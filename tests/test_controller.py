@@ -1,10 +1,11 @@
+import os
 import time
 import numpy as np
 import pytest
 import random
 
 from vent.common.message import SensorValues, ControlSetting
-from vent.alarm import AlarmSeverity, Alarm
+from vent.alarm import AlarmSeverity, AlarmType, Alarm
 from vent.common.values import ValueName
 from vent.coordinator.coordinator import get_coordinator
 from vent.controller.control_module import get_control_module
@@ -199,3 +200,399 @@ def test_erratic_dt():
     assert np.mean(peeps) < 8
     assert np.mean(pips) < 8
 
+
+
+######################################################################
+#########################   TEST 5  ##################################
+######################################################################
+#
+#   Alarm rules checked in the control loop are returned as events
+#
+
+def test_controller_alarm_events():
+    '''
+    With CONTROLLER_ALARMS, alarm manager transitions are queued for the coordinator
+    '''
+    from vent.alarm import Alarm_Manager, AlarmType, ALARM_RULES
+
+    manager = Alarm_Manager()
+    manager.reset()
+    prefs.set_pref('CONTROLLER_ALARMS', True)
+    try:
+        Controller = get_control_module(sim_mode=True)
+    finally:
+        prefs.set_pref('CONTROLLER_ALARMS', False)
+
+    assert Controller.get_alarm_events() == []
+
+    Controller.COPY_DATA_OXYGEN = 50
+    Controller._DATA_PRESSURE = ALARM_RULES[AlarmType.HIGH_PRESSURE].conditions[0][1].limit + 1
+    Controller._update_alarms()
+
+    events = Controller.get_alarm_events()
+    assert AlarmType.HIGH_PRESSURE in [e.alarm_type for e in events]
+    assert all([isinstance(e, Alarm) for e in events])
+    # events are cleared once collected
+    assert Controller.get_alarm_events() == []
+
+    # and the loop keeps checking while running
+    Controller.start()
+    time.sleep(0.5)
+    Controller.stop()
+    assert Controller._alarm_values.loop_counter > 0
+
+    # a stopped controller is no longer called by the shared manager
+    assert Controller._emit_alarm_event not in manager.callbacks
+
+    manager.reset()
+
+
+def test_controller_alarm_log_detached():
+    '''
+    Alarm events are stored in a controller's logfile only until it stops, and stopping an older controller leaves
+    a newer one's logfile attached
+    '''
+    from vent.alarm import Alarm_Manager
+    from vent.controller.control_module import ControlModuleBase
+
+    manager = Alarm_Manager()
+    old, new = None, None
+    prefs.set_pref('CONTROLLER_ALARMS', True)
+    try:
+        old = ControlModuleBase(save_logs=True)
+        assert old.dl is not None
+        assert manager.alarm_log.data_logger is old.dl
+        new = ControlModuleBase(save_logs=True)
+        assert manager.alarm_log.data_logger is new.dl
+        old.stop()
+        assert manager.alarm_log.data_logger is new.dl
+        new.stop()
+        assert manager.alarm_log.data_logger is None
+    finally:
+        prefs.set_pref('CONTROLLER_ALARMS', False)
+        for controller in (old, new):
+            if controller is not None:
+                controller.dl.close_logfile()
+                controller.dl.wait_indexed(timeout=60)
+                os.remove(controller.dl.file)
+                controller.dl.catalog.remove(controller.dl.file)
+
+
+def test_controller_alarm_events_cleared():
+    '''
+    Alarms the controller raises itself are followed by an OFF event when they clear
+    '''
+    from vent.alarm import AlarmType, AlarmSeverity, ALARM_RULES
+
+    Controller = get_control_module(sim_mode=True)
+    test_for_alarms = Controller._ControlModuleBase__test_for_alarms
+    limit = ALARM_RULES[AlarmType.HIGH_PRESSURE].conditions[0][1].limit
+
+    # high pressure, and an implausible oxygen reading
+    Controller.COPY_DATA_OXYGEN = 150
+    Controller._DATA_Qout = 1
+    Controller._DATA_PRESSURE = limit + 1
+    test_for_alarms()
+    raised = Controller.get_alarm_events()
+    assert {(e.alarm_type, e.severity) for e in raised} == {(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH),
+                                                           (AlarmType.BAD_SENSOR_READINGS, AlarmSeverity.TECHNICAL)}
+
+    # both back in range
+    Controller.COPY_DATA_OXYGEN = 50
+    Controller._DATA_Qout = 2
+    Controller._DATA_PRESSURE = limit - 1
+    test_for_alarms()
+    cleared = Controller.get_alarm_events()
+    assert {(e.alarm_type, e.severity) for e in cleared} == {(AlarmType.HIGH_PRESSURE, AlarmSeverity.OFF),
+                                                            (AlarmType.BAD_SENSOR_READINGS, AlarmSeverity.OFF)}
+    assert Controller.HAPA is None
+    assert Controller.TECHA == []
+
+    # and only once
+    Controller._DATA_Qout = 3
+    Controller._DATA_PRESSURE = limit - 2
+    test_for_alarms()
+    assert Controller.get_alarm_events() == []
+
+
+######################################################################
+#########################   TEST 6  ##################################
+######################################################################
+#
+#   Timing of the main loop is reported
+#
+
+def test_loop_stats():
+    '''
+    get_loop_stats summarizes the recent loop durations, or those since the count of earlier stats,
+    without clearing them for other callers
+    '''
+    Controller = get_control_module(sim_mode=True)
+    assert Controller.get_loop_stats() == {}
+
+    Controller.start()
+    time.sleep(0.3)
+    stats = Controller.get_loop_stats()
+    # another caller gets the same cycles
+    assert Controller.get_state()['loop_stats']['n'] >= stats['n']
+    time.sleep(0.1)
+    later = Controller.get_loop_stats(since=stats['count'])
+    Controller.stop()
+
+    assert stats['n'] > 0 and later['n'] > 0
+    assert stats['min'] <= stats['mean'] <= stats['p99'] <= stats['max']
+    assert stats['rate'] == 1 / stats['mean']
+    assert later['count'] == stats['count'] + later['n']
+    # nothing was cleared
+    final = Controller.get_loop_stats()
+    assert final['count'] == final['n'] >= later['count']
+    assert Controller.get_loop_stats(since=final['count']) == {}
+
+
+def test_checkpoint():
+    '''
+    A new controller restored from the checkpoint of another has its settings and HAPA limit, and runs if it was running
+    '''
+    Controller = get_control_module(sim_mode=True)
+    Controller.set_control(ControlSetting(name=ValueName.PIP, value=27, max_value=32))
+    Controller.set_control(ControlSetting(name=ValueName.PEEP, value=7))
+    Controller.start()
+    checkpoint = Controller.get_checkpoint()
+    Controller.stop()
+    assert checkpoint['running']
+
+    Restored = get_control_module(sim_mode=True)
+    Restored.restore_checkpoint(checkpoint)
+    assert Restored.get_control(ValueName.PIP).value == 27
+    assert Restored.get_control(ValueName.PEEP).value == 7
+    assert Restored.limit_hapa == 32
+    assert Restored.is_running()
+    Restored.stop()
+    assert not Restored.get_checkpoint()['running']
+
+
+######################################################################
+#########################   TEST 7  ##################################
+######################################################################
+#
+#   Sensors are read at their own rates by the scheduler
+#
+
+def test_sensor_scheduler():
+    '''
+    Periodic sensors are spread across their period, respect phase constraints and the per tick budget,
+    and failed reads keep the last value
+    '''
+    from vent.controller.scheduler import SensorScheduler, ScheduledSensor
+
+    reads = {'fast': 0, 'slow_a': 0, 'slow_b': 0, 'exp': 0, 'bad': 0}
+    def reader(name):
+        def read():
+            reads[name] += 1
+            if name == 'bad' and reads[name] > 1:
+                raise IOError('bus error')
+            return reads[name]
+        return read
+
+    scheduler = SensorScheduler([
+        ScheduledSensor('fast', reader('fast')),
+        ScheduledSensor('slow_a', reader('slow_a'), period=1),
+        ScheduledSensor('slow_b', reader('slow_b'), period=1),
+        ScheduledSensor('exp', reader('exp'), period=1, phase='expiration'),
+        ScheduledSensor('bad', reader('bad'), period=0.5, offset=0.25),
+    ], max_reads_per_tick=1, start=0)
+
+    # tick every 10ms for 10 seconds, alternating 1 sec phases
+    per_tick = []
+    for now in np.arange(0, 10, 0.01):
+        phase = 'inspiration' if int(now) % 2 == 0 else 'expiration'
+        values = scheduler.update(phase, now=now)
+        per_tick.append(len(values) - ('fast' in values))
+        if 'exp' in values:
+            assert phase == 'expiration'
+
+    assert reads['fast'] == 1000
+    # never more than one periodic read per tick
+    assert max(per_tick) == 1
+    assert 9 <= reads['slow_a'] <= 11
+    assert 9 <= reads['slow_b'] <= 11
+    # only read during the 5 sec of expiration, at most once per period slot
+    assert 5 <= reads['exp'] <= 10
+    # sensors with the same period were offset from each other
+    assert scheduler.sensors['slow_b'].next_due - scheduler.sensors['slow_a'].next_due == pytest.approx(1/3, abs=0.05)
+
+    # failed sensor keeps its first value and goes stale
+    assert scheduler.value('bad') == 1
+    assert scheduler.stale(now=10) == ['bad']
+    assert scheduler.age('bad', now=10) == pytest.approx(9.75, abs=0.05)
+    assert scheduler.age('fast', now=10) == pytest.approx(0.01)
+
+
+def test_sensor_scheduler_failure_logs():
+    '''
+    A sensor that keeps failing is logged with a traceback once, then only every log_interval
+    '''
+    from unittest.mock import Mock
+    from vent.controller.scheduler import SensorScheduler, ScheduledSensor
+
+    broken = {'broken': True}
+    def read():
+        if broken['broken']:
+            raise IOError('bus error')
+        return 1
+
+    scheduler = SensorScheduler([ScheduledSensor('pressure', read)], start=0, log_interval=4)
+    scheduler.logger = Mock()
+
+    # fails every tick for 10 seconds
+    for now in np.arange(0, 10, 0.01):
+        scheduler.update(now=now)
+    assert scheduler.sensors['pressure'].failures == 1000
+    assert scheduler.logger.exception.call_count == 1
+    assert scheduler.logger.error.call_count == 2
+
+    broken['broken'] = False
+    scheduler.update(now=10)
+    assert scheduler.sensors['pressure'].failures == 0
+    assert scheduler.logger.info.call_count == 1
+
+
+def test_device_sensor_schedule():
+    '''
+    ControlModuleDevice reads pressure every loop and the oxygen sensor rarely, only during expiration
+    '''
+    from vent.controller.control_module import ControlModuleDevice
+    from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115
+
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 2.4, 1: 2.25, 3: 2.5}), 0x48)
+    Controller = ControlModuleDevice(save_logs=False, config_file='vent/io/config/devices.ini', pig=pig)
+
+    oxygen = Controller._scheduler.sensors['oxygen']
+    reads = []
+    read_oxygen = oxygen.read
+    oxygen.read = lambda: reads.append(time.time()) or read_oxygen()
+
+    Controller.start()
+    time.sleep(3)
+    Controller.stop()
+
+    assert Controller.get_loop_stats()['n'] > 100
+    assert 1 <= len(reads) <= 2
+    ages = Controller.get_sensor_ages()
+    assert ages['pressure'] < 0.5
+    assert Controller.COPY_DATA_OXYGEN != 0 or Controller._DATA_OXYGEN != 0
+
+
+def test_device_sensor_budget():
+    '''
+    ControlModuleDevice defers the oxygen sensor to a later loop, rather than reading it on a loop that has already
+    spent its sensor budget
+    '''
+    from vent.controller.control_module import ControlModuleDevice
+    from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115
+
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 2.4, 1: 2.25, 3: 2.5}), 0x48)
+    Controller = ControlModuleDevice(save_logs=False, config_file='vent/io/config/devices.ini', pig=pig)
+    scheduler = Controller._scheduler
+    assert scheduler.tick_budget == Controller._SENSOR_TICK_BUDGET
+
+    pressure, oxygen = scheduler.sensors['pressure'], scheduler.sensors['oxygen']
+    read_pressure = pressure.read
+    def slow_pressure():
+        time.sleep(Controller._SENSOR_TICK_BUDGET * 2)
+        return read_pressure()
+
+    # the oxygen sensor is due, but reading pressure took the whole budget
+    now = oxygen.next_due
+    pressure.read = slow_pressure
+    values = scheduler.update('expiration', now=now)
+    assert 'pressure' in values and 'oxygen' not in values
+    assert scheduler.deferred == 1
+
+    # so it's read on the next loop
+    pressure.read = read_pressure
+    values = scheduler.update('expiration', now=now + 0.01)
+    assert 'oxygen' in values
+
+
+def test_device_stale_pressure():
+    '''
+    If pressure can't be read, the controller raises a technical alert and puts the valves in stand-by
+    '''
+    from vent.controller.control_module import ControlModuleDevice
+    from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115
+
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 2.4, 1: 2.25, 3: 2.5}), 0x48)
+    Controller = ControlModuleDevice(save_logs=False, config_file='vent/io/config/devices.ini', pig=pig)
+
+    pressure = Controller._scheduler.sensors['pressure']
+    read_pressure = pressure.read
+    def broken():
+        raise IOError('bus error')
+
+    Controller.start()
+    time.sleep(0.2)
+    pressure.read = broken
+    time.sleep(0.3)
+
+    assert Controller._pressure_stale
+    assert Controller.HAL.setpoint_in == 0
+    assert Controller.HAL.setpoint_ex == 1
+    raised = [e for e in Controller.get_alarm_events() if e.alarm_type == AlarmType.STALE_SENSOR]
+    assert [e.severity for e in raised] == [AlarmSeverity.TECHNICAL]
+
+    # and controls again once it can
+    pressure.read = read_pressure
+    time.sleep(0.2)
+    Controller.stop()
+
+    assert not Controller._pressure_stale
+    cleared = [e for e in Controller.get_alarm_events() if e.alarm_type == AlarmType.STALE_SENSOR]
+    assert [e.severity for e in cleared] == [AlarmSeverity.OFF]
+
+
+######################################################################
+#########################   TEST 8  ##################################
+######################################################################
+#
+#   A controller saving logs also records to the flight recorder
+#
+
+def test_flight_recorder(tmp_path, monkeypatch):
+    '''
+    Samples, settings and alarm events are in the flight recorder file without syncing it
+    '''
+    import functools
+    import os
+    from vent.controller import control_module
+    from vent.common.flight_recorder import FlightRecorder, read_flight_recorder
+    from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115
+
+    ring = str(tmp_path / 'flight_recorder.ring')
+    monkeypatch.setattr(control_module, 'FlightRecorder', functools.partial(FlightRecorder, filename=ring, minutes=1))
+
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 2.4, 1: 2.25, 3: 2.5}), 0x48)
+    Controller = control_module.ControlModuleDevice(save_logs=True, config_file='vent/io/config/devices.ini', pig=pig)
+    try:
+        Controller.set_control(ControlSetting(name=ValueName.PIP, value=25, min_value=0, max_value=50,
+                                              timestamp=time.time()))
+        Controller._emit_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=60))
+        Controller.start()
+        time.sleep(1)
+        Controller.stop()
+
+        data = read_flight_recorder(ring)
+        assert len(data['samples']) > 10
+        assert np.all(np.diff(data['samples']['timestamp']) > 0)
+        assert data['settings']['name'][0] == b'PIP'
+        assert data['settings']['value'][0] == 25
+        assert data['alarms']['alarm_type'][0] == b'HIGH_PRESSURE'
+    finally:
+        Controller.stop()
+        Controller.dl.close_logfile()
+        Controller.dl.wait_indexed(timeout=60)
+        os.remove(Controller.dl.file)
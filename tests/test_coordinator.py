@@ -1,5 +1,9 @@
 # TODO: this is a unit test, need to add integration test
+import asyncio
+import multiprocessing
+import os
 import random
+import signal
 import socket
 import threading
 import time
@@ -7,13 +11,16 @@ from unittest.mock import patch, Mock
 
 import pytest
 
-from vent.common import values
+from vent.common import prefs, values
 from vent.common.message import ControlSetting, SensorValues
 from vent.alarm import AlarmSeverity, Alarm
 from vent.common.values import ValueName
 from vent.controller.control_module import ControlModuleBase
 from vent.coordinator import rpc
-from vent.coordinator.coordinator import get_coordinator
+from vent.coordinator.async_coordinator import AsyncCoordinator
+from vent.coordinator.control_process import start_control_loop
+from vent.coordinator.coordinator import get_coordinator, CoordinatorBase
+from vent.coordinator.process_manager import Checkpoint
 
 
 def is_port_in_use(port):
@@ -153,6 +160,354 @@ def test_process_manager():
     assert coordinator.is_running() == False
 
 
+@pytest.mark.timeout(10)
+def test_process_manager_nowait():
+    # the controller process starts in the background
+    coordinator = get_coordinator(single_process=False, sim_mode=True, wait=False)
+    assert coordinator.process_manager.child_pid is not None
+
+    # the first call waits for it to be serving
+    coordinator.start()
+    assert coordinator.is_ready()
+    assert coordinator.is_running() == True
+
+    coordinator.process_manager.restart_process()
+    assert coordinator.process_manager.is_ready()
+    coordinator.stop()
+
+
+def test_checkpoint():
+    checkpoint = Checkpoint(size=1024)
+    assert checkpoint.load() is None
+
+    for i in range(3):
+        checkpoint.save({'controls': {ValueName.PIP: i}, 'running': True})
+        assert checkpoint.load() == {'controls': {ValueName.PIP: i}, 'running': True}
+
+    checkpoint.clear()
+    assert checkpoint.load() is None
+
+    with pytest.raises(ValueError):
+        checkpoint.save({'too big': bytes(2048)})
+
+
+@pytest.mark.timeout(20)
+@pytest.mark.parametrize("stall", [signal.SIGKILL, signal.SIGSTOP])
+def test_process_manager_watchdog(stall):
+    coordinator = get_coordinator(single_process=False, sim_mode=True, watchdog=True)
+    process_manager = coordinator.process_manager
+    coordinator.start()
+    coordinator.set_control(ControlSetting(name=ValueName.PIP, value=27, min_value=20, max_value=30,
+                                           timestamp=time.time()))
+
+    # killed or frozen, the controller is restarted with the same settings
+    pid = process_manager.child_pid
+    os.kill(pid, stall)
+    start = time.time()
+    while not process_manager.restarts:
+        assert time.time() - start < process_manager.max_heartbeat_interval + 2
+        time.sleep(0.01)
+
+    assert len(process_manager.restarts) == 1
+    assert process_manager.child_pid != pid
+    assert process_manager.is_ready()
+    assert coordinator.get_control(ValueName.PIP).value == 27
+    assert coordinator.is_running()
+
+    # and a cold restart goes back to the defaults
+    process_manager.restart_process(warm=False)
+    assert coordinator.get_control(ValueName.PIP).value != 27
+    assert not coordinator.is_running()
+
+    coordinator.stop()
+    assert process_manager.child_pid is None
+
+
+def stalled_rotation_control_module(sim_mode, rotations):
+    """
+    A simulated controller that logs, and stalls for longer than the watchdog allows whenever it rotates its log file
+    """
+    from vent.controller.control_module import ControlModuleSimulator
+
+    def rotation_newfile():
+        time.sleep(1.5)
+        rotations.value += 1
+
+    controller = ControlModuleSimulator()
+    controller.dl = Mock(rotation_newfile=rotation_newfile)
+    controller._save_logs = True
+    controller._FLUSH_EVERY = 1
+    return controller
+
+
+@pytest.mark.timeout(40)
+def test_process_manager_watchdog_busy():
+    """
+    The watchdog doesn't restart a controller that stalls in a known long operation, like rotating its log file
+    """
+    rotations = multiprocessing.Value('i', 0)
+    with patch('vent.controller.control_module.get_control_module',
+               lambda sim_mode: stalled_rotation_control_module(sim_mode, rotations)):
+        coordinator = get_coordinator(single_process=False, sim_mode=True, watchdog=True)
+    process_manager = coordinator.process_manager
+    try:
+        assert process_manager.max_heartbeat_interval < 1.5
+        coordinator.set_control(ControlSetting(name=ValueName.BREATHS_PER_MINUTE, value=30))
+        coordinator.start()
+        start = time.time()
+        while rotations.value < 2:
+            assert time.time() - start < 30
+            time.sleep(0.05)
+
+        assert process_manager.restarts == []
+        assert coordinator.is_running()
+        coordinator.stop()
+    finally:
+        process_manager.try_stop_process()
+
+
+@pytest.mark.timeout(20)
+def test_process_manager_standby():
+    coordinator = get_coordinator(single_process=False, sim_mode=True, standby=True)
+    process_manager = coordinator.process_manager
+    coordinator.start()
+    coordinator.set_control(ControlSetting(name=ValueName.PIP, value=27, min_value=20, max_value=30,
+                                           timestamp=time.time()))
+
+    for _ in range(3):
+        # the standby is forked in the background, by the controller process rather than ours
+        start = time.time()
+        while process_manager.standby_process is None:
+            assert time.time() - start < 5
+            time.sleep(0.01)
+        standby_pid = process_manager.standby_process.pid
+        with open(f'/proc/{standby_pid}/stat') as stat:
+            assert int(stat.read().rsplit(')', 1)[1].split()[1]) == process_manager.child_pid
+
+        # and takes over, with the same settings
+        latency = process_manager.restart_process()
+        assert process_manager.child_pid == standby_pid
+        assert latency < 0.1
+        assert coordinator.get_control(ValueName.PIP).value == 27
+        assert coordinator.is_running()
+
+    standby_process = process_manager.standby_process
+    coordinator.stop()
+    assert process_manager.standby_process is None
+    assert standby_process is None or not standby_process.is_alive()
+
+
+@pytest.mark.timeout(20)
+def test_isolated_control_loop():
+    prefs.set_pref('ISOLATE_CONTROL_LOOP', True)
+    try:
+        coordinator = get_coordinator(single_process=False, sim_mode=True)
+        coordinator.start()
+        assert coordinator.is_running()
+
+        # settings reach the control loop through shared memory
+        t = time.time()
+        coordinator.set_controls([ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=t),
+                                  ControlSetting(name=ValueName.PEEP, value=6, min_value=4, max_value=8, timestamp=t)])
+        assert coordinator.get_control(ValueName.PIP).value == 25
+        assert coordinator.get_control(ValueName.PEEP).value == 6
+
+        # and sensor values, the heartbeat and loop timing come back
+        sensors = coordinator.get_sensors()
+        time.sleep(0.2)
+        state = coordinator.get_state()
+        assert isinstance(state['sensors'], SensorValues)
+        assert state['sensors'].loop_counter > sensors.loop_counter
+        assert state['loop_stats']['n'] > 0
+        assert state['loop_stats']['p99'] >= state['loop_stats']['mean']
+        # another caller still gets those cycles, or only the ones after them
+        assert coordinator.get_state()['loop_stats']['n'] >= state['loop_stats']['n']
+        time.sleep(0.1)
+        later = coordinator.get_state(loop_since=state['loop_stats']['count'])['loop_stats']
+        assert later['count'] == state['loop_stats']['count'] + later['n']
+
+        coordinator.stop()
+        assert coordinator.process_manager.child_pid is None
+    finally:
+        prefs.set_pref('ISOLATE_CONTROL_LOOP', False)
+
+
+@pytest.mark.timeout(10)
+def test_control_loop_process():
+    controller = start_control_loop(sim_mode=True)
+    try:
+        controller.set_control(ControlSetting(name=ValueName.PIP, value=27, min_value=20, max_value=30,
+                                              timestamp=time.time()))
+        controller.start()
+        heartbeat = controller.get_heartbeat()
+        time.sleep(0.1)
+        assert controller.get_heartbeat() > heartbeat
+        assert controller.get_checkpoint()['running']
+        assert controller.get_control(ValueName.PIP).value == 27
+
+        controller.stop()
+        heartbeat = controller.get_heartbeat()
+        time.sleep(0.05)
+        assert controller.get_heartbeat() == heartbeat
+    finally:
+        controller.close()
+    assert not controller.process.is_alive()
+
+
+@pytest.mark.timeout(10)
+def test_remote_coordinator_threads():
+    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    coordinator.start()
+
+    errors = []
+    def get_sensors():
+        try:
+            for _ in range(50):
+                assert isinstance(coordinator.get_sensors(), SensorValues)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=get_sensors) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    coordinator.stop()
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize("single_process", [True, False])
+def test_get_state(single_process):
+    coordinator = get_coordinator(single_process=single_process, sim_mode=True)
+    coordinator.start()
+
+    t = time.time()
+    settings = [ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30, timestamp=t),
+                ControlSetting(name=ValueName.PEEP, value=6, min_value=4, max_value=8, timestamp=t)]
+
+    # set together, and read back in the same request
+    state = coordinator.get_state(settings)
+    assert isinstance(state['sensors'], SensorValues)
+    assert state['controls'][ValueName.PIP].value == 25
+    assert state['controls'][ValueName.PEEP].value == 6
+    assert set(state['controls'].keys()) == set(values.CONTROL.keys())
+    assert isinstance(state['active_alarms'], dict)
+    assert isinstance(state['loop_stats'], dict)
+
+    coordinator.set_controls([ControlSetting(name=ValueName.PIP, value=28, min_value=20, max_value=30, timestamp=t),
+                              ControlSetting(name=ValueName.PEEP, value=7, min_value=4, max_value=8, timestamp=t)])
+    assert coordinator.get_control(ValueName.PIP).value == 28
+    assert coordinator.get_control(ValueName.PEEP).value == 7
+
+    coordinator.stop()
+
+
+@pytest.mark.timeout(10)
+def test_async_coordinator():
+    coordinator = get_coordinator(single_process=False, sim_mode=True)
+    client = AsyncCoordinator(coordinator, timeout=2)
+    client.submit('start').result()
+
+    # several requests in flight at once
+    requests = [client.submit('get_sensors') for _ in range(8)]
+    for request in requests:
+        assert isinstance(request.result(), SensorValues)
+    assert client.in_flight == 0
+
+    t = time.time()
+    client.submit('set_control', ControlSetting(name=ValueName.PIP, value=25, min_value=20, max_value=30,
+                                                timestamp=t)).result()
+    assert client.submit('get_control', ValueName.PIP).result().value == 25
+
+    client.close()
+    coordinator.stop()
+
+
+@pytest.mark.timeout(10)
+def test_async_coordinator_ordered():
+    class RecordingCoordinator(CoordinatorBase):
+        def __init__(self):
+            super(RecordingCoordinator, self).__init__()
+            self.calls = []
+            self.running = 0
+            self.max_running = 0
+            self.lock = threading.Lock()
+
+        def set_control(self, control_setting):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.01)
+            self.calls.append(control_setting.value)
+            with self.lock:
+                self.running -= 1
+
+        def stop(self):
+            time.sleep(0.1)
+            self.calls.append('stop')
+
+    coordinator = RecordingCoordinator()
+    client = AsyncCoordinator(coordinator, timeout=2)
+
+    # ordered calls run one at a time, in the order they were submitted
+    requests = [client.submit('set_control', ControlSetting(name=ValueName.PIP, value=value), ordered=True)
+                for value in range(10)]
+    for request in requests:
+        request.result(2)
+    assert coordinator.calls == list(range(10))
+    assert coordinator.max_running == 1
+
+    # and closing lets those already submitted finish, without waiting if asked not to
+    stopping = client.submit('stop', ordered=True)
+    start = time.time()
+    client.close(wait=False)
+    assert time.time() - start < 0.05
+    stopping.result(2)
+    assert coordinator.calls[-1] == 'stop'
+    client._thread.join(1)
+    assert client.loop.is_closed()
+
+
+@pytest.mark.timeout(10)
+def test_async_coordinator_stalled():
+    class StalledCoordinator(CoordinatorBase):
+        def __init__(self):
+            super(StalledCoordinator, self).__init__()
+            self.stall = threading.Event()
+
+        def get_sensors(self):
+            self.stall.wait(5)
+            return 'sensors'
+
+    coordinator = StalledCoordinator()
+    client = AsyncCoordinator(coordinator, timeout=0.2, max_in_flight=2)
+
+    # submitting doesn't wait for the controller
+    start = time.time()
+    requests = [client.submit('get_sensors') for _ in range(4)]
+    assert time.time() - start < 0.1
+
+    # every request is abandoned at its deadline, even those waiting for a free worker
+    for request in requests:
+        with pytest.raises(asyncio.TimeoutError):
+            request.result(1)
+    assert time.time() - start < 1
+    assert client.in_flight == 0
+
+    # cancelled requests are dropped, others finish once the controller recovers
+    cancelled = client.submit('get_sensors', timeout=2)
+    time.sleep(0.05)
+    assert cancelled.cancel()
+    request = client.submit('get_sensors', timeout=2)
+    coordinator.stall.set()
+    assert request.result(2) == 'sensors'
+    assert cancelled.cancelled()
+
+    client.close()
+
+
 def test_local_sensors():
     coordinator = get_coordinator(single_process=True, sim_mode=True)
     coordinator.start()
@@ -15,6 +15,7 @@ test types
 """
 
 from copy import copy
+from unittest.mock import patch
 import pdb
 
 import pytest
@@ -30,6 +31,7 @@ from pytestqt.qt_compat import qt_api
 from vent import gui
 from vent.gui import styles
 from vent.gui import widgets
+from vent.gui import render
 from vent.common import message, values
 from vent.coordinator.coordinator import get_coordinator
 
@@ -137,6 +139,13 @@ def test_gui_launch_mp(qtbot):
 ################################
 # test user interaction
 
+def wait_for_control(qtbot, vent_gui, value_name, value):
+    """
+    Wait for a setting the GUI sent in the background to reach the controller
+    """
+    qtbot.waitUntil(lambda: vent_gui.coordinator.get_control(value_name).value == value, timeout=2000)
+
+
 @pytest.mark.parametrize("test_value", [(k, v) for k, v in values.CONTROL.items()])
 def test_gui_controls(qtbot, spawn_gui, test_value):
     """
@@ -186,9 +195,7 @@ def test_gui_controls(qtbot, spawn_gui, test_value):
         control_widget.value_label.returnPressedAction()
         # should call labelUpdatedAction and send to controller
 
-        control_value = vent_gui.coordinator.get_control(value_name)
-
-        assert(control_value.value == test_value)
+        wait_for_control(qtbot, vent_gui, value_name, test_value)
 
     # from slider
     # toggle it open
@@ -200,16 +207,35 @@ def test_gui_controls(qtbot, spawn_gui, test_value):
         test_value = gen_test_value()
         control_widget.slider.setValue(test_value)
 
-        control_value = vent_gui.coordinator.get_control(value_name)
-        assert(control_value.value == test_value)
+        wait_for_control(qtbot, vent_gui, value_name, test_value)
 
     # from set_value
     for i in range(n_samples):
         test_value = gen_test_value()
         vent_gui.set_value(test_value, value_name = value_name)
 
-        control_value = vent_gui.coordinator.get_control(value_name)
-        assert(control_value.value == test_value)
+        wait_for_control(qtbot, vent_gui, value_name, test_value)
+
+
+def test_gui_control_failure(qtbot, spawn_gui):
+    """
+    Settings are sent without blocking the GUI, in order, and one that fails is shown in the status bar
+    """
+    app, vent_gui = spawn_gui
+    vent_gui.timer.stop()
+
+    for value in (21, 22, 23):
+        vent_gui.set_value(value, value_name=values.ValueName.PIP)
+    wait_for_control(qtbot, vent_gui, values.ValueName.PIP, 23)
+
+    with patch.object(vent_gui.coordinator, 'set_control', side_effect=RuntimeError('controller gone')):
+        with qtbot.waitSignal(vent_gui.control_failed, timeout=2000) as blocker:
+            vent_gui.set_value(25, value_name=values.ValueName.PIP)
+    assert 'controller gone' in blocker.args[0]
+    assert 'controller gone' in vent_gui.status_bar.status_message.message.text()
+
+    vent_gui.status_bar.status_message.clear_message()
+    assert vent_gui.status_bar.status_message.message.text() == ''
 
 
 @pytest.mark.parametrize("test_value", [(k, v) for k, v in values.SENSOR.items()])
@@ -282,6 +308,59 @@ def test_gui_monitor(qtbot, spawn_gui, test_value):
 
 
 
+def test_monitor_change_detection(qtbot):
+    """
+    Monitors only mark themselves dirty and set their label when the value changes at the displayed precision,
+    and all monitors update on the same frame
+    """
+    value = values.SENSOR[values.ValueName.PRESSURE]
+    monitors = [widgets.Monitor(value, update_period=0.5) for _ in range(3)]
+    for monitor in monitors:
+        qtbot.addWidget(monitor)
+
+    step = 10 ** -value.decimals
+    mid = np.round(np.mean(value.safe_range), value.decimals)
+    monitors[0].update_value(mid)
+    monitors[0].render(10.)
+    assert not monitors[0].dirty
+    label = monitors[0].value_label.text()
+
+    # changes smaller than the displayed precision are ignored
+    monitors[0].update_value(mid + step / 4)
+    assert not monitors[0].dirty
+
+    # changes back to the displayed value don't set the label
+    monitors[0].update_value(mid + step)
+    monitors[0].update_value(mid)
+    assert monitors[0].dirty
+    monitors[0].value_label.setText('sentinel')
+    monitors[0].render(10.5)
+    assert monitors[0].value_label.text() == 'sentinel'
+    monitors[0].value_label.setText(label)
+
+    # monitors that change at different times update together, once per update_period
+    for monitor in monitors[1:]:
+        monitor.update_value(mid)
+        monitor.render(11.2)
+    monitors[1].update_value(mid + step)
+    monitors[2].update_value(mid + 2 * step)
+    for monitor in monitors[1:]:
+        monitor.render(11.4)
+        assert monitor.dirty
+    for monitor in monitors[1:]:
+        monitor.render(11.5)
+        assert not monitor.dirty
+        assert float(monitor.value_label.text()) == monitor.value
+
+    # alarm styles are only set when the state changes
+    monitors[0].alarm_state = True
+    monitors[0].value_label.setStyleSheet('')
+    monitors[0].alarm_state = True
+    assert monitors[0].value_label.styleSheet() == ''
+    monitors[0].alarm_state = False
+    assert monitors[0].value_label.styleSheet() == styles.DISPLAY_VALUE
+
+
 ###################################
 # Test base components
 
@@ -431,3 +510,170 @@ def test_rangeslider_minmax(qtbot, generic_minmax, generic_saferange):
         assert(rangeslider.low == lowpoint)
         assert(rangeslider.high == highpoint)
 
+
+
+#################
+# Plot
+
+def test_plot_buffer():
+    """
+    Any run of the last buffer_size samples is one contiguous slice, oldest first
+    """
+    buffer = widgets.plot.PlotBuffer(5)
+    for i in range(13):
+        buffer.append(i, i % 3, i * 10)
+
+    assert buffer.first == 8
+    assert list(buffer.values[buffer.span(0)]) == [80, 90, 100, 110, 120]
+    assert list(buffer.times[buffer.span(10, 12)]) == [10, 11]
+    assert buffer.span(12, 12).stop == buffer.span(12, 12).start
+
+
+def test_plot_sweeps(qtbot):
+    """
+    The plot draws the current sweep from the left, and the rest of the previous sweep to the right of the time marker,
+    and only gives curves new data when they change
+    """
+    plot = widgets.Plot('test', buffer_size=100, plot_duration=5)
+    qtbot.addWidget(plot)
+    plot.reset(start_time=0)
+
+    for i in range(120):
+        plot.update_value((i / 10, i))
+        plot.redraw(i / 10)
+
+    # 11.9 s: current sweep from 10 s, the previous sweep after 6.9 s
+    late_x, late_y = plot.late_curve.getData()
+    early_x, early_y = plot.early_curve.getData()
+    assert list(late_y) == list(range(100, 120))
+    assert late_x[0] == pytest.approx(0)
+    assert list(early_y) == list(range(70, 100))
+    assert early_x[0] == pytest.approx(2)
+
+    plot.set_duration(3)
+    plot.redraw(11.9)
+    assert list(plot.late_curve.getData()[1]) == list(range(90, 120))
+    assert plot.early_curve.getData()[1] is None or len(plot.early_curve.getData()[1]) == 0
+
+
+def test_minmax_trace():
+    """
+    Each bin is decimated to its min and max, in the order they occurred
+    """
+    trace = widgets.plot.MinMaxTrace(n_bins=10, duration=1, start_time=0)
+    values = [0, 5, -3, 1, 2, 2, 9, 1, 1, 1]
+    for i, value in enumerate(values):
+        # bins are 0.1 s wide, 5 samples each
+        trace.append(i * 0.02, value)
+
+    span = trace.buffer.span(0)
+    assert list(trace.buffer.values[span]) == [5, -3, 9, 1]
+    assert list(trace.buffer.times[span]) == pytest.approx([0.02, 0.04, 0.12, 0.14])
+
+    # the next sweep starts a new bin
+    trace.append(1.01, 4)
+    assert trace.sweep == 1
+    assert trace.sweep_start == 4
+    assert trace.prev_sweep_start == 0
+
+
+def test_plot_decimation(qtbot):
+    """
+    With more than two samples per pixel in view, the plot draws the min/max decimated trace, keeping the peaks
+    """
+    plot = widgets.Plot('test', buffer_size=4092, plot_duration=5)
+    qtbot.addWidget(plot)
+    plot.reset(start_time=0)
+
+    n = 12000
+    values = np.sin(np.arange(n) / 1000 * 2 * np.pi) + (np.arange(n) % 997 == 0) * 5
+    for i in range(n):
+        plot.update_value((i / 1000, values[i]))
+    plot.redraw((n - 1) / 1000)
+
+    early_y, late_y = plot.early_curve.getData()[1], plot.late_curve.getData()[1]
+    assert len(early_y) + len(late_y) <= 2 * (plot.decimated.n_bins + 1)
+    # every spike in the last 5 s is drawn
+    n_spikes = np.sum((np.arange(n) % 997 == 0) & (np.arange(n) > n - 5000))
+    assert np.sum(np.concatenate([early_y, late_y]) > 4) == n_spikes
+
+
+#####
+# Render clock
+
+def test_frame_stats():
+    stats = render.FrameStats(n_frames=10)
+    assert stats.stats() == {}
+
+    # 20 frames of 10 ms every 50 ms, one of them starting late
+    starts = np.arange(20) * 0.05
+    starts[15:] += 0.05
+    for start in starts:
+        stats.add(start, start + 0.01)
+
+    result = stats.stats(period=0.05)
+    assert result['n'] == 10
+    assert result['mean'] == pytest.approx(0.01)
+    assert result['load'] == pytest.approx(0.1 / (starts[-1] + 0.01 - starts[10]))
+    assert result['late'] == 1
+
+
+def test_render_clock(qtbot):
+    """
+    The render clock renders animated items every frame, and other items only when they are dirty
+    """
+    class Item(object):
+        def __init__(self, animated=False):
+            self.animated = animated
+            self.dirty = False
+            self.n_renders = 0
+
+        def render(self, this_time):
+            self.n_renders += 1
+            self.dirty = False
+
+    clock = render.RenderClock(fps=50)
+    animated, idle, dirty = Item(animated=True), Item(), Item()
+    for item in (animated, idle, dirty):
+        clock.add(item)
+
+    dirty.dirty = True
+    with qtbot.waitSignal(clock.frame, timeout=1000):
+        clock.start()
+    qtbot.wait(500)
+    clock.stop()
+
+    assert animated.n_renders > 5
+    assert idle.n_renders == 0
+    assert dirty.n_renders == 1
+
+    stats = clock.stats()
+    assert stats['n'] == animated.n_renders
+    assert 0 <= stats['load'] <= 1
+
+
+def test_render_clock_autostart(qtbot):
+    """
+    The render clock starts when the first item is added, so widgets used on their own are rendered, but isn't
+    restarted by adding items once it was stopped
+    """
+    class Item(object):
+        dirty = True
+
+        def __init__(self):
+            self.n_renders = 0
+
+        def render(self, this_time):
+            self.n_renders += 1
+            self.dirty = False
+
+    clock = render.RenderClock(fps=50)
+    assert not clock.timer.isActive()
+    item = Item()
+    with qtbot.waitSignal(clock.frame, timeout=1000):
+        clock.add(item)
+    assert item.n_renders == 1
+
+    clock.stop()
+    clock.add(Item())
+    assert not clock.timer.isActive()
@@ -0,0 +1,79 @@
+import time
+
+import numpy as np
+import pytest
+
+from vent.io import Hal
+from vent.io.devices.lung import SimLung, LungSensor
+from vent.io.devices.sim_pigpio import SimPigpio
+
+
+@pytest.fixture()
+def lung_hal(tmp_path):
+    """ A Hal with sim-lung-devices.ini, with a lung that advances a fixed 10ms per read and noiseless sensors"""
+    with open('vent/io/config/sim-lung-devices.ini', 'r') as config_f:
+        config_text = config_f.read()
+    config_text = config_text.replace('peep_valve = 5', 'peep_valve = 5\ndt         = 0.01')
+    config_text = config_text.replace('noise  = 0.1', 'noise  = 0').replace('noise  = 0.5', 'noise  = 0')
+    config = tmp_path / 'sim-lung-devices.ini'
+    config.write_text(config_text)
+
+    SimLung._LUNGS.clear()
+    yield Hal(config_file=str(config), pig=SimPigpio())
+    SimLung._LUNGS.clear()
+
+
+def test_lung_responds_to_valves(lung_hal):
+    """ Pressure rises while inspiring with the expiratory valve closed, and falls to PEEP when it opens"""
+    hal = lung_hal
+    assert hal._lung is SimLung.get()
+    assert hal.pressure == pytest.approx(0)
+
+    hal.setpoint_ex = 0
+    hal.setpoint_in = 100
+    pressures = [hal.pressure for _ in range(50)]
+    assert np.all(np.diff(pressures) > 0)
+    assert hal.flow_in > 0
+    assert hal.flow_ex == 0
+
+    peak = pressures[-1]
+    hal.setpoint_in = 0
+    assert not hal._inlet_valve.is_open
+    # holds pressure with both sides closed
+    assert hal.pressure == pytest.approx(peak, rel=0.05)
+
+    hal.setpoint_ex = 1
+    pressures = [hal.pressure for _ in range(500)]
+    assert pressures[-1] < peak
+    # the PEEP valve closes once pressure is below PEEP
+    assert pressures[-1] < 5
+    assert hal.flow_ex == 0
+    assert hal.flow_in == 0
+
+    # a larger setpoint fills faster
+    SimLung.get().reset()
+    hal.setpoint_ex = 0
+    hal.setpoint_in = 30
+    slow = [hal.pressure for _ in range(20)][-1]
+    SimLung.get().reset()
+    hal.setpoint_in = 90
+    fast = [hal.pressure for _ in range(20)][-1]
+    assert fast > slow
+
+
+def test_lung_realtime():
+    """ Without a fixed dt, the lung advances by wall time"""
+    SimLung._LUNGS.clear()
+    lung = SimLung('realtime')
+    sensor = LungSensor('volume', lung='realtime')
+    with pytest.raises(ValueError):
+        LungSensor('temperature', lung='realtime')
+    with pytest.raises(ValueError):
+        lung.attach('aux', None)
+
+    # no valves attached: no inflow, expiratory side open
+    start = sensor.get()
+    time.sleep(0.05)
+    assert sensor.get() == pytest.approx(start)
+    assert lung.balloon.Qin == 0
+    SimLung._LUNGS.clear()
@@ -0,0 +1,133 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import tables as pytb
+
+from .pigpio_mocks import patch_pigpio_base
+from vent.common.loggers import ContinuousData
+from vent.io import Hal
+from vent.io.devices.replay import LogReplay, ReplaySensor, ReplayOnOffValve, ReplayControlValve
+
+
+@pytest.fixture()
+def replay_log(tmp_path):
+    """ Factory fixture that writes a DataLogger-style waveform table where pressure is the row number."""
+    def make_log(n_rows=100, dt=0.01):
+        filename = str(tmp_path / 'replay_log_{}.h5'.format(n_rows))
+        with pytb.open_file(filename, mode='w') as h5file:
+            group = h5file.create_group('/', 'waveforms')
+            table = h5file.create_table(group, 'readout', ContinuousData)
+            rows = np.zeros(n_rows, dtype=table.dtype)
+            rows['timestamp'] = 1e9 + np.arange(n_rows) * dt
+            rows['pressure'] = np.arange(n_rows)
+            rows['flow_out'] = np.arange(n_rows) / 60
+            rows['oxygen'] = 21
+            table.append(rows)
+        LogReplay._REPLAYS.clear()
+        return filename
+    yield make_log
+    for replay in LogReplay._REPLAYS.values():
+        replay.close()
+    LogReplay._REPLAYS.clear()
+
+
+def test_replay_fast(replay_log):
+    """ Without realtime, each read of the clock sensor advances one row, across chunk boundaries"""
+    filename = replay_log(n_rows=50)
+    replay = LogReplay.get(filename, realtime=False)
+    replay.chunk_size = 7
+
+    pressure = ReplaySensor(filename, 'pressure', realtime=False)
+    flow = ReplaySensor(filename, 'flow_out', realtime=False, scale=60)
+    missing = ReplaySensor(filename, 'aux_pressure', realtime=False, default=3.0)
+    assert pressure.replay is flow.replay is replay
+
+    for i in range(1, 50):
+        assert pressure.get() == i
+        # non-clock sensors read the same row
+        assert flow.get() == pytest.approx(i)
+        assert missing.get() == 3.0
+
+    # at the end of the log, keep returning the last row
+    assert pressure.get() == 49
+    assert replay.finished
+
+    with pytest.raises(ValueError):
+        ReplaySensor(filename, 'aux_pressure', realtime=False)
+
+
+def test_replay_loop(replay_log):
+    filename = replay_log(n_rows=10)
+    pressure = ReplaySensor(filename, 'pressure', realtime=False, loop=True)
+    values = [pressure.get() for _ in range(20)]
+    assert values[:9] == list(range(1, 10))
+    assert values[9] == 0
+
+
+def test_replay_realtime(replay_log):
+    """ With realtime, the replay follows the log's timestamps"""
+    filename = replay_log(n_rows=1000, dt=0.01)
+    pressure = ReplaySensor(filename, 'pressure', realtime=True)
+    pressure.replay.chunk_size = 16
+
+    assert pressure.get() == 0
+    time.sleep(0.2)
+    value = pressure.get()
+    # about 20 rows later, leave plenty of slack for slow machines
+    assert 15 <= value <= 60
+
+
+def test_replay_valves_record(replay_log):
+    filename = replay_log(n_rows=10)
+    valve = ReplayOnOffValve(filename, realtime=False)
+    control = ReplayControlValve(filename, realtime=False)
+    pressure = ReplaySensor(filename, 'pressure', realtime=False)
+
+    valve.open()
+    pressure.get()
+    valve.close()
+    control.setpoint = 50
+    assert valve.is_open is False
+    assert control.setpoint == 50
+
+    commands = valve.commands
+    assert commands.shape == (2, 3)
+    assert list(commands[:, 2]) == [1, 0]
+    # log times of the replay when the command was given
+    assert commands[1, 1] - commands[0, 1] == pytest.approx(0.01)
+    assert list(control.commands[:, 2]) == [50]
+
+
+def test_replay_hal(replay_log, patch_pigpio_base, tmp_path):
+    """ The HAL can be configured with replay devices"""
+    filename = replay_log(n_rows=100)
+    config = tmp_path / 'replay-devices.ini'
+    with open('vent/io/config/replay-devices.ini', 'r') as config_f:
+        config_text = config_f.read()
+    config_text = config_text.replace('"../../../sandbox/example_logfile/2020-06-08-11-17_controller_log.0.h5"',
+                                      '"{}"'.format(filename))
+    config_text = config_text.replace('realtime = True', 'realtime = False')
+    config.write_text(config_text)
+
+    hal = Hal(config_file=str(config))
+    for i in range(1, 10):
+        assert hal.pressure == i
+        assert hal.flow_ex == pytest.approx(i)
+        assert hal.oxygen == 21
+        hal.setpoint_in = i
+        hal.setpoint_ex = i % 2
+
+    assert list(hal._control_valve.commands[:, 2]) == list(range(1, 10))
+    assert hal._expiratory_valve.commands[-1, 2] == 1
+
+
+def test_replay_config_paths(patch_pigpio_base, tmp_path, monkeypatch):
+    """ Log files in the replay config are found from any working directory"""
+    config = os.path.abspath('vent/io/config/replay-devices.ini')
+    monkeypatch.chdir(tmp_path)
+    hal = Hal(config_file=config)
+    assert os.path.isfile(hal._pressure_sensor.replay.file)
+    assert hal.pressure is not None
+    hal._pressure_sensor.replay.close()
@@ -0,0 +1,90 @@
+import time
+
+import pigpio
+import pytest
+
+from vent.io import Hal
+from vent.io.devices import ADS1015
+from vent.io.devices.sim_pigpio import SimPigpio, SimADS1115, TransactionModel, MockHardwareDevice
+
+
+def test_sim_adc():
+    """ The simulated ADC converts the voltage on the channel selected by the last config written """
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 1.0, 2: lambda: 3.0}), 0x48)
+    adc = ADS1015(address=0x48, i2c_bus=1, pig=pig)
+
+    assert adc.read_conversion(MUX=0) == pytest.approx(1.0, abs=1e-3)
+    assert adc.read_conversion(MUX=2) == pytest.approx(3.0, abs=1e-3)
+    assert adc.read_conversion(MUX=1) == 0
+    assert adc.read_conversion(MUX=0, PGA=2.048) == pytest.approx(1.0, abs=1e-3)
+
+
+def test_sim_latency():
+    """ Transactions take the modelled time and are counted"""
+    latency = 0.005
+    pig = SimPigpio(models={'gpio': TransactionModel(latency=latency)})
+
+    start = time.perf_counter()
+    for _ in range(10):
+        pig.write(27, 1)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed >= 10 * latency
+    assert pig.stats['gpio']['count'] == 10
+    assert pig.stats['gpio']['time'] == pytest.approx(elapsed, rel=0.2)
+    assert pig.read(27) == 1
+    assert pig.stats['i2c_read']['count'] == 0
+
+    pig.reset_stats()
+    assert pig.stats['gpio']['count'] == 0
+
+
+def test_sim_errors():
+    """ Transactions fail at the error rate by raising a pigpio.error"""
+    pig = SimPigpio(seed=0)
+    pig.add_i2c_device(SimADS1115(), 0x48)
+    handle = pig.i2c_open(1, 0x48)
+    pig.set_model('i2c_read', error_rate=0.5)
+
+    errors = 0
+    for _ in range(1000):
+        try:
+            pig.i2c_read_i2c_block_data(handle, 0, 2)
+        except pigpio.error:
+            errors += 1
+
+    assert 400 < errors < 600
+    assert pig.stats['i2c_read']['errors'] == errors
+
+    with pytest.raises(ValueError):
+        pig.set_model('spi', latency=1)
+    with pytest.raises(pigpio.error):
+        pig.i2c_open(1, 0x49)
+
+
+def test_sim_hal():
+    """ The Hal can be run on the simulated pigpio backend with hardware device configs"""
+    pig = SimPigpio()
+    pig.add_i2c_device(SimADS1115(channels={0: 2.2 + 0.2, 1: 2.25, 3: 2.2}), 0x48)
+    hal = Hal(config_file='vent/io/config/devices.ini', pig=pig)
+
+    assert hal.pressure == pytest.approx(0.2 / 2.0 * 70.3, rel=1e-2)
+    assert hal.oxygen == pytest.approx(0, abs=0.1)
+
+    hal.setpoint_in = 50
+    assert hal._inlet_valve.is_open
+    assert pig.pwm_duty[12] > 0
+    hal.setpoint_ex = 1
+    assert pig.levels[27] == 1
+    hal.setpoint_ex = 0
+    assert pig.levels[27] == 0
+
+
+def test_mock_hardware_device_registers():
+    """ A mock hardware device needs at least one register, of bytes """
+    assert len(MockHardwareDevice(b'\x00\x01').registers) == 1
+    with pytest.raises(TypeError):
+        MockHardwareDevice()
+    with pytest.raises(TypeError):
+        MockHardwareDevice(1)
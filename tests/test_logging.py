@@ -1 +1,612 @@
-# FIXME: stub to remind us to write these
\ No newline at end of file
+import mmap
+import multiprocessing as mp
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pytest
+import tables as pytb
+
+from vent.alarm import Alarm, AlarmType, AlarmSeverity
+from vent.common.loggers import DataLogger, LogReader, LOG_TABLES, index_logfile, WaveformPyramid, \
+    export_csv, export_mat, quantize_block, dequantize, COMPACT_BLOCK_ROWS
+from vent.common import log_batch, loggers
+from vent.common.log_catalog import LogCatalog, CATALOG_FILE
+from vent.common.flight_recorder import FlightRecorder, read_flight_recorder, previous_recordings, previous_filename
+from vent.common.message import ControlValues, ControlSetting
+from vent.common.values import ValueName
+
+
+def test_store_alarm_event():
+    """
+    Alarm events are stored in the /alarms table and returned by load_file
+    """
+    dl = DataLogger()
+    try:
+        alarm = Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50)
+        dl.store_alarm_event(alarm)
+        alarm.deactivate()
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.OFF))
+        dl.flush_logfile()
+
+        alarm_data = dl.load_file()['alarm_data']
+        assert len(alarm_data) == 2
+        assert alarm_data['alarm_type'][0] == b'HIGH_PRESSURE'
+        assert list(alarm_data['severity']) == [b'HIGH', b'OFF']
+        assert alarm_data['value'][0] == 50
+        assert np.isnan(alarm_data['end_time'][0])
+    finally:
+        dl.close_logfile()
+        os.remove(dl.file)
+
+
+def _write_log(filename, t0, first_cycle, n_cycles, rows_per_cycle=100, dt=0.01, index=True):
+    """ Write a log file like the DataLogger's, with waveforms and one derived row per cycle """
+    with pytb.open_file(filename, mode='w') as h5file:
+        for group, description in LOG_TABLES.items():
+            h5file.create_group('/', group)
+            h5file.create_table('/' + group, 'readout', description)
+
+        n = n_cycles * rows_per_cycle
+        waveforms = np.zeros(n, dtype=h5file.root.waveforms.readout.dtype)
+        waveforms['timestamp'] = t0 + np.arange(n) * dt
+        waveforms['cycle_number'] = first_cycle + np.arange(n) // rows_per_cycle
+        waveforms['pressure'] = np.arange(n)
+        h5file.root.waveforms.readout.append(waveforms)
+
+        derived = np.zeros(n_cycles, dtype=h5file.root.derived_quantities.readout.dtype)
+        derived['timestamp'] = waveforms['timestamp'][::rows_per_cycle]
+        derived['cycle_number'] = first_cycle + np.arange(n_cycles)
+        h5file.root.derived_quantities.readout.append(derived)
+
+        if index:
+            index_logfile(h5file)
+
+
+def test_index_logfile(tmp_path):
+    """
+    The timestamp and cycle_number columns are indexed, and indexes are updated on the next index_logfile
+    """
+    filename = str(tmp_path / 'log.0.h5')
+    _write_log(filename, 0, 0, 10)
+    with pytb.open_file(filename, mode='a') as h5file:
+        waveforms = h5file.root.waveforms.readout
+        assert waveforms.cols.timestamp.is_indexed
+        assert waveforms.cols.cycle_number.is_indexed
+        assert not waveforms.cols.pressure.is_indexed
+        assert h5file.root.controls.readout.cols.timestamp.is_indexed
+        assert not waveforms.autoindex
+
+        # appending marks the index dirty rather than updating it
+        waveforms.append(waveforms[-1:])
+        waveforms.flush()
+        assert waveforms.cols.timestamp.index.dirty
+        index_logfile(h5file)
+        assert not waveforms.cols.timestamp.index.dirty
+
+
+def test_log_reader(tmp_path):
+    """
+    LogReader returns the rows in a time window or breath range across rotated files, oldest first
+    """
+    # rotated files: higher index is older
+    _write_log(str(tmp_path / 'log.2.h5'), 0, 0, 10)
+    _write_log(str(tmp_path / 'log.1.h5'), 10, 10, 10, index=False)
+    _write_log(str(tmp_path / 'log.0.h5'), 20, 20, 10)
+    _write_log(str(tmp_path / 'other.0.h5'), 100, 0, 10)
+
+    with LogReader.session(str(tmp_path / 'log.0.h5')) as reader:
+        assert len(reader.files) == 3
+        assert reader.files[0].endswith('log.2.h5')
+
+        everything = reader.read()
+        assert len(everything) == 3000
+        assert np.all(np.diff(everything['timestamp']) > 0)
+
+        window = reader.read(start=5, stop=15)
+        assert len(window) == 1000
+        assert window['timestamp'][0] == 5
+        assert window['timestamp'][-1] < 15
+
+        breaths = reader.read('derived_quantities', first_cycle=8, last_cycle=12)
+        assert list(breaths['cycle_number']) == [8, 9, 10, 11, 12]
+
+        both = reader.read(start=9.5, first_cycle=10, last_cycle=10, fields=['timestamp', 'pressure'])
+        assert both.dtype.names == ('timestamp', 'pressure')
+        assert len(both) == 100
+        assert both['timestamp'][0] == 10
+
+        assert len(reader.read(start=1000)) == 0
+        assert len(reader.read('alarms', start=0)) == 0
+
+        chunks = list(reader.iter_read(start=5, stop=25, chunk_size=300))
+        assert max(len(chunk) for chunk in chunks) <= 300
+        assert np.array_equal(np.concatenate(chunks), reader.read(start=5, stop=25))
+        assert sum(len(chunk) for chunk in reader.iter_read(chunk_size=1000)) == 3000
+
+        with pytest.raises(ValueError):
+            reader.read('controls', first_cycle=1)
+        with pytest.raises(ValueError):
+            reader.read('breaths')
+
+    with LogReader(str(tmp_path)) as reader:
+        assert len(reader.files) == 4
+        assert reader.files[-1].endswith('other.0.h5')
+
+    with pytest.raises(FileNotFoundError):
+        LogReader(str(tmp_path / 'missing*.h5'))
+
+
+def test_datalogger_indexes_on_close(monkeypatch):
+    """
+    The DataLogger indexes its file when it closes it, and a file it rotates or closes in the background in a separate
+    process, rather than in the control loop that calls rotation_newfile
+    """
+    dl = DataLogger()
+    rotated = dl.file.replace('.0.', '.1.')
+    try:
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+        dl.flush_logfile()
+        dl.close_logfile()
+
+        with LogReader(dl.file) as reader:
+            assert reader._h5files[0].root.waveforms.readout.cols.cycle_number.is_indexed
+            assert len(reader.read('alarms', start=0)) == 1
+
+        # rotate a fresh file: nothing is indexed in this process
+        os.remove(dl.file)
+        dl.catalog.remove(dl.file)
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+        dl.flush_logfile()
+        index = mock.Mock()
+        monkeypatch.setattr(loggers, 'index_logfile', index)
+        dl._MAX_FILE_SIZE = 0
+        dl.rotation_newfile()
+        index.assert_not_called()
+        assert os.path.exists(rotated)
+
+        assert dl.wait_indexed(timeout=60)
+        with LogReader(rotated) as reader:
+            assert reader._h5files[0].root.waveforms.readout.cols.cycle_number.is_indexed
+            assert len(reader.read('alarms', start=0)) == 1
+        assert [entry['path'] for entry in dl.catalog.entries()
+                if entry['path'] == os.path.abspath(rotated) and entry['n_alarms'] == 1]
+
+        # and the file it closes in the background, like when the controller stops
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+        dl.close_logfile(background=True)
+        index.assert_not_called()
+        assert dl.wait_indexed(timeout=60)
+        with LogReader(dl.file) as reader:
+            assert reader._h5files[0].root.waveforms.readout.cols.cycle_number.is_indexed
+        assert [entry['path'] for entry in dl.catalog.entries()
+                if entry['path'] == os.path.abspath(dl.file) and entry['n_alarms'] == 1]
+    finally:
+        dl.close_logfile()
+        for filename in (dl.file, rotated):
+            if os.path.exists(filename):
+                os.remove(filename)
+            dl.catalog.remove(filename)
+
+
+def test_log_catalog(tmp_path):
+    """
+    The catalog records each file's span and size, finds files by time and breath, follows rotations,
+    and is rebuilt from the directory when it is missing
+    """
+    session = str(tmp_path / 'a_controller_log')
+    _write_log(session + '.1.h5', 0, 0, 10)
+    _write_log(session + '.0.h5', 10, 10, 10)
+
+    catalog = LogCatalog(str(tmp_path))
+    assert catalog.count() == 2
+    assert catalog.total_size() == sum(os.path.getsize(session + f'.{i}.h5') for i in range(2))
+    entry = catalog.entries()[0]
+    assert entry['path'] == session + '.1.h5'
+    assert entry['rotation'] == 1
+    assert (entry['start'], entry['first_cycle'], entry['last_cycle']) == (0, 0, 9)
+    assert entry['n_waveforms'] == 1000 and entry['n_derived'] == 10 and entry['n_alarms'] == 0
+
+    assert catalog.find(time=5) == [session + '.1.h5']
+    assert catalog.find(start=5, stop=15) == [session + '.1.h5', session + '.0.h5']
+    assert catalog.find(cycle=15, session=session) == [session + '.0.h5']
+    assert catalog.find(time=100) == []
+
+    # rotate like DataLogger.rotation_newfile with at most 2 files: .1 is overwritten by .0
+    os.replace(session + '.0.h5', session + '.1.h5')
+    catalog.rotate(session + '.0.h5', 1)
+    assert [(e['path'], e['first_cycle']) for e in catalog.entries()] == [(session + '.1.h5', 10)]
+
+    _write_log(session + '.0.h5', 20, 20, 10)
+    catalog.update(session + '.0.h5')
+    assert catalog.find(start=0) == [session + '.1.h5', session + '.0.h5']
+
+    # a new catalog is rebuilt from the files
+    os.remove(os.path.join(str(tmp_path), CATALOG_FILE))
+    assert LogCatalog(str(tmp_path)).entries() == [
+        dict(e, updated=pytest.approx(e['updated'], abs=60)) for e in catalog.entries()]
+
+
+def test_log_catalog_reconcile(tmp_path):
+    """
+    The catalog drops files that were deleted by hand and adds ones it's missing when it doesn't match the directory,
+    and counts a rotated file's size before it is indexed
+    """
+    session = str(tmp_path / 'a_controller_log')
+    _write_log(session + '.1.h5', 0, 0, 10)
+    _write_log(session + '.0.h5', 10, 10, 10)
+    catalog = LogCatalog(str(tmp_path))
+
+    os.remove(session + '.1.h5')
+    catalog = LogCatalog(str(tmp_path))
+    assert [e['path'] for e in catalog.entries()] == [session + '.0.h5']
+
+    with open(str(tmp_path / 'not_a_log.h5'), 'wb') as f:
+        f.write(b'0' * 100)
+    catalog.reconcile()
+    assert sorted(e['path'] for e in catalog.entries()) == [session + '.0.h5', str(tmp_path / 'not_a_log.h5')]
+    assert catalog.total_size() == os.path.getsize(session + '.0.h5') + 100
+    assert catalog.total_size(exclude=session + '.0.h5') == 100
+    assert catalog.count(exclude=session + '.0.h5') == 1
+
+    # the file being written has no entry until it is closed, it does as soon as it's rotated
+    catalog.remove(session + '.0.h5')
+    with open(session + '.0.h5', 'ab') as f:
+        f.write(b'0' * 100)
+    os.replace(session + '.0.h5', session + '.1.h5')
+    catalog.rotate(session + '.0.h5', 10)
+    entry = [e for e in catalog.entries() if e['path'] == session + '.1.h5'][0]
+    assert (entry['rotation'], entry['size']) == (1, os.path.getsize(session + '.1.h5'))
+
+
+def test_datalogger_quota():
+    """
+    Logging stops when the catalog is over the quota, and resumes once files are deleted and the catalog reconciled
+    """
+    dl = DataLogger()
+    gone = os.path.join(dl.log_dir, 'deleted_controller_log.0.h5')
+    try:
+        # a file that was deleted by hand and still counts
+        with dl.catalog._connect() as conn:
+            conn.execute('INSERT INTO files (path, size) VALUES (?, ?)', (gone, int(1e15)))
+        assert dl.catalog.total_size() >= 1e15
+        assert dl.check_files() < 1e15
+        assert dl._data_save_allowed
+        assert gone not in [e['path'] for e in dl.catalog.entries()]
+
+        # the file being written counts
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+        dl.flush_logfile()
+        assert dl.check_files() == dl.catalog.total_size(exclude=dl.file) + os.path.getsize(dl.file)
+
+        # logging that was turned off resumes once space is freed
+        dl._data_save_allowed = False
+        dl.rotation_newfile()
+        assert dl._data_save_allowed
+    finally:
+        dl.close_logfile()
+        os.remove(dl.file)
+        dl.catalog.remove(dl.file)
+        dl.catalog.remove(gone)
+
+
+def test_datalogger_catalog():
+    """
+    The DataLogger catalogs its file on close, and checks space from the catalog
+    """
+    dl = DataLogger()
+    try:
+        dl.store_alarm_event(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+        dl.close_logfile()
+        entry = [e for e in dl.catalog.entries() if e['path'] == os.path.abspath(dl.file)][0]
+        assert entry['size'] == os.path.getsize(dl.file)
+        assert entry['n_alarms'] == 1
+        assert dl.check_files() == dl.catalog.total_size()
+    finally:
+        dl.close_logfile()
+        os.remove(dl.file)
+        dl.catalog.remove(dl.file)
+
+
+def test_quantize_block():
+    """
+    Quantized waveforms are restored to within half a step of the block's range, non-finite values as NaN
+    """
+    rows = np.zeros(1000, dtype=pytb.description.dtype_from_descr(LOG_TABLES['waveforms']))
+    rows['timestamp'] = np.arange(1000) * 0.01
+    rows['pressure'] = 5 + 20 * np.sin(rows['timestamp'])
+    rows['flow_out'] = 3                     # constant
+    rows['oxygen'][:] = 21
+    rows['oxygen'][10] = np.nan
+    rows['control_in'] = np.linspace(-1, 1, 1000)
+    rows['control_in'][[0, 500, 999]] = [np.nan, np.inf, -np.inf]
+
+    compact, block = quantize_block(rows, 5000)
+    assert compact.dtype['pressure'] == np.uint16
+    assert block['start_row'][0] == 5000
+    restored = dequantize(compact, np.arange(5000, 6000), block)
+    step = (rows['pressure'].max() - rows['pressure'].min()) / 65534
+    assert np.abs(restored['pressure'] - rows['pressure']).max() <= step / 2 + 1e-12
+    assert np.all(restored['flow_out'] == 3)
+    assert np.isnan(restored['oxygen'][10])
+    assert np.all(np.delete(restored['oxygen'], 10) == 21)
+
+    # non-finite values don't stretch or clip the range of the finite ones
+    finite = np.isfinite(rows['control_in'])
+    assert np.all(np.isnan(restored['control_in'][~finite]))
+    step = (rows['control_in'][finite].max() - rows['control_in'][finite].min()) / 65534
+    assert np.abs(restored['control_in'][finite] - rows['control_in'][finite]).max() <= step / 2 + 1e-12
+    assert np.all(restored['timestamp'] == rows['timestamp'])
+
+
+def test_compact_log():
+    """
+    A compact DataLogger stores quantized waveforms in blocks, and LogReader and load_file restore them
+    """
+    dl = DataLogger(compact=True)
+    try:
+        n = COMPACT_BLOCK_ROWS * 2 + 500
+        for i in range(n):
+            t = 100 + i / 100
+            sensor_values = SimpleNamespace(timestamp=t, PRESSURE=10 * np.sin(t), FLOWOUT=i, FIO2=21, breath_count=i // 100)
+            dl.store_waveform_data(sensor_values, ControlValues(i % 2, 0))
+        assert dl.data_table.nrows == COMPACT_BLOCK_ROWS * 2
+        dl.flush_logfile()
+        assert dl.data_table.nrows == n
+        dl.close_logfile()
+
+        with LogReader(dl.file) as reader:
+            assert reader._h5files[0].root.waveforms.readout.dtype['pressure'] == np.uint16
+            assert len(reader._h5files[0].root.waveforms.quantization) == 3
+
+            waveforms = reader.read()
+            assert waveforms.dtype == pytb.description.dtype_from_descr(LOG_TABLES['waveforms'])
+            t = 100 + np.arange(n) / 100
+            assert waveforms['pressure'] == pytest.approx(10 * np.sin(t), abs=1e-3)
+            assert waveforms['flow_out'] == pytest.approx(np.arange(n), abs=0.1)
+            assert np.all(waveforms['control_in'] == np.arange(n) % 2)
+
+            # queries across a block boundary
+            window = reader.read(start=109.5, stop=110.5)
+            assert window['flow_out'] == pytest.approx(np.arange(950, 1050), abs=0.1)
+            chunks = list(reader.iter_read(first_cycle=9, last_cycle=10, chunk_size=30))
+            assert np.concatenate(chunks)['flow_out'] == pytest.approx(np.arange(900, 1100), abs=0.1)
+
+        assert dl.load_file()['waveform_data']['flow_out'] == pytest.approx(np.arange(n), abs=0.1)
+    finally:
+        dl.close_logfile()
+        os.remove(dl.file)
+        dl.catalog.remove(dl.file)
+
+
+def test_waveform_pyramid():
+    """
+    Completed bins have the min/max/mean of their samples, and are merged into the coarser levels
+    """
+    pyramid = WaveformPyramid()
+    rate = 100
+    completed = []
+    for i in range(125 * rate):
+        t = i / rate
+        completed.extend(pyramid.add(t, i // 300, (t, -t, 0, 0, i % 2)))
+    completed.extend(pyramid.flush())
+
+    levels = [[summary_bin for level, summary_bin in completed if level == n] for n in range(3)]
+    assert [len(level) for level in levels] == [1250, 125, 3]
+    assert [sum(summary_bin[1] for summary_bin in level) for level in levels] == [125 * rate] * 3
+
+    start, n_samples, cycle, mins, maxs, sums = levels[1][61]
+    assert start == 61
+    assert n_samples == rate
+    assert cycle == 61 * rate // 300
+    assert mins[0] == pytest.approx(61) and maxs[0] == pytest.approx(61.99)
+    assert mins[1] == pytest.approx(-61.99)
+    assert sums[0] / n_samples == pytest.approx(61.495)
+    assert sums[4] / n_samples == pytest.approx(0.5)
+    assert levels[2][2][0] == 120
+    assert levels[2][2][1] == 5 * rate
+
+
+def test_read_overview():
+    """
+    The DataLogger writes summaries as it stores waveforms, and read_overview picks a level for the span and width
+    """
+    dl = DataLogger()
+    try:
+        rate = 50
+        for i in range(180 * rate):
+            t = 1000 + i / rate
+            sensor_values = SimpleNamespace(timestamp=t, PRESSURE=np.sin(t), FLOWOUT=0, FIO2=21, breath_count=i // 200)
+            dl.store_waveform_data(sensor_values, ControlValues(i % 2, 0))
+        dl.flush_logfile()
+        dl.close_logfile()
+
+        with LogReader(dl.file) as reader:
+            assert len(reader._h5files[0].root.waveform_summary.level_100ms) == 1800
+            assert len(reader._h5files[0].root.waveform_summary.level_1min) == 4
+            assert reader.time_range() == (1000, pytest.approx(1000 + 180 - 1 / rate))
+
+            overview = reader.read_overview(width=100)
+            assert len(overview) == 180
+            assert np.all(overview['n_samples'] == rate)
+            assert np.all(overview['pressure_max'] >= overview['pressure_mean'])
+            assert np.all(overview['control_in_mean'] == pytest.approx(0.5))
+
+            # the bin straddling start is included
+            overview = reader.read_overview(start=1010.05, stop=1020, width=50)
+            assert len(overview) == 100
+            assert overview['timestamp'][0] == pytest.approx(1010)
+            # and one that ends at start isn't
+            overview = reader.read_overview(start=1010, stop=1020, width=50)
+            assert len(overview) == 100
+            assert overview['timestamp'][0] == pytest.approx(1010)
+
+            # too short for any level, raw samples
+            overview = reader.read_overview(start=1010, stop=1011, width=100)
+            assert len(overview) == rate
+            assert np.all(overview['pressure_min'] == overview['pressure_max'])
+            assert overview['pressure_mean'][0] == pytest.approx(np.sin(1010))
+    finally:
+        dl.close_logfile()
+        os.remove(dl.file)
+
+
+def test_export(tmp_path):
+    """
+    Logs are exported to csv and MATLAB v7.3 files in chunks, with the same rows as the log
+    """
+    filename = str(tmp_path / 'log.0.h5')
+    _write_log(filename, 0, 0, 10)
+    with pytb.open_file(filename, mode='a') as h5file:
+        h5file.root.controls.readout.append([(100, 0, b"PIP", 1.5, 20), (20, 0, b"PEEP", 2.5, 5)])
+
+    with LogReader(filename) as reader:
+        waveforms = reader.read()
+
+    csv_files = export_csv(filename, chunk_size=300)
+    assert csv_files[0] == str(tmp_path / 'log.0.waveforms.csv')
+    exported = np.loadtxt(csv_files[0], delimiter=',', skiprows=1)
+    assert exported.shape == (1000, len(waveforms.dtype.names))
+    assert np.array_equal(exported[:, waveforms.dtype.names.index('pressure')], waveforms['pressure'])
+    with open(csv_files[2]) as csv_file:
+        assert csv_file.readline().strip() == 'max_value,min_value,name,timestamp,value'
+        assert "PIP" in csv_file.readline()
+
+    mat_filename = export_mat(filename, chunk_size=300)
+    with open(mat_filename, 'rb') as mat_file:
+        header = mat_file.read(128)
+    assert header.startswith(b'MATLAB 7.3 MAT-file')
+    assert header[-4:] == b'\x00\x02IM'
+
+    with pytb.open_file(mat_filename, mode='r') as mat_file:
+        assert mat_file.root.waveforms._v_attrs.MATLAB_class == b'struct'
+        pressure = mat_file.root.waveforms.pressure
+        assert pressure._v_attrs.MATLAB_class == b'double'
+        assert pressure.shape == (1, 1000)
+        assert np.array_equal(pressure[0], waveforms['pressure'])
+        assert mat_file.root.waveforms.cycle_number._v_attrs.MATLAB_class == b'uint32'
+        name = mat_file.root.control_commands.name
+        assert name._v_attrs.MATLAB_class == b'char'
+        assert bytes(name[:, 0].astype(np.uint8)).rstrip(b'\x00') == b'PIP'
+        assert bytes(name[:, 1].astype(np.uint8)).rstrip(b'\x00') == b'PEEP'
+
+
+def test_log_batch(tmp_path):
+    """
+    The batch tool summarizes files and breaths in a process pool, merging breaths split across rotated files
+    """
+    _write_log(str(tmp_path / 'a_controller_log.1.h5'), 0, 0, 10)
+    _write_log(str(tmp_path / 'a_controller_log.0.h5'), 10, 9, 10)
+    _write_log(str(tmp_path / 'b_controller_log.0.h5'), 100, 0, 5)
+    (tmp_path / 'c_controller_log.0.h5').write_bytes(b'not a log')
+
+    files = log_batch.find_logs([str(tmp_path)])
+    assert len(files) == 4
+    assert log_batch.session_of(files[0]) == 'a_controller_log'
+
+    out_dir = str(tmp_path / 'report')
+    report = log_batch.run_batch(files, out_dir, export=['csv'], processes=2, chunk_size=300, verbose=False)
+
+    assert list(report['errors'].keys()) == [str(tmp_path / 'c_controller_log.0.h5')]
+    assert [summary['breaths'] for summary in report['files']] == [10, 10, 5]
+    assert [summary['start'] for summary in report['files']] == [0, 10, 100]
+    assert report['files'][1]['samples'] == 1000
+    assert os.path.exists(str(tmp_path / 'b_controller_log.0.waveforms.csv'))
+
+    breaths = [breath for breath in report['breaths'] if breath['session'] == 'a_controller_log']
+    assert [breath['cycle_number'] for breath in breaths] == list(range(19))
+    split = breaths[9]
+    assert split['n_samples'] == 200
+    assert split['start'] == pytest.approx(9) and split['stop'] == pytest.approx(10.99)
+    assert split['pressure_min'] == 0 and split['pressure_max'] == 999
+    assert breaths[3]['pressure_mean'] == pytest.approx(349.5)
+    assert breaths[3]['pip'] == 0
+
+    with open(os.path.join(out_dir, 'breaths.csv')) as csv_file:
+        assert len(csv_file.readlines()) == 19 + 5 + 1
+    with open(os.path.join(out_dir, 'files.csv')) as csv_file:
+        assert csv_file.readline().startswith('file,session,size_mb')
+
+
+def _record_and_die(filename):
+    recorder = FlightRecorder(filename, minutes=1, rate=10)
+    for i in range(1000):
+        recorder.record_sample(i, i, 0, 0, 0, 21, i // 10)
+    # die without syncing or closing
+    os._exit(1)
+
+
+def test_flight_recorder_sync(tmp_path):
+    """
+    Syncing only writes the pages recorded into since the last sync, in the background if asked to
+    """
+    recorder = FlightRecorder(str(tmp_path / 'flight_recorder.ring'), minutes=1, rate=100)
+    assert recorder._dirty_pages() == []
+    for i in range(10):
+        recorder.record_sample(i, i, 0, 0, 0, 21, 0)
+    recorder.record_setting(ControlSetting(ValueName.PIP, 25))
+    pages = recorder._dirty_pages()
+    assert [length <= mmap.PAGESIZE for offset, length in pages] == [True, True]
+    assert all(offset % mmap.PAGESIZE == 0 for offset, length in pages)
+    assert recorder._dirty_pages() == []
+
+    # wrapping around the sample ring writes it from the last synced sample, and then from its start
+    for i in range(6000):
+        recorder.record_sample(i, i, 0, 0, 0, 21, 0)
+    pages = recorder._dirty_pages()
+    assert len(pages) == 2 and sum(length for offset, length in pages) >= recorder._samples.nbytes
+
+    recorder.record_sample(0, 0, 0, 0, 0, 21, 0)
+    recorder.sync(wait=False)
+    recorder._syncing.join()
+    assert recorder._dirty_pages() == []
+    recorder.close()
+
+
+def test_flight_recorder(tmp_path):
+    """
+    The flight recorder keeps the most recent records in order, and they can be read after the process dies
+    """
+    filename = str(tmp_path / 'flight_recorder.ring')
+    process = mp.Process(target=_record_and_die, args=(filename,))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    data = read_flight_recorder(filename)
+    samples = data['samples']
+    assert len(samples) == 600
+    assert list(samples['seq']) == list(range(401, 1001))
+    assert list(samples['pressure']) == list(range(400, 1000))
+    assert samples.dtype.names == ('seq', 'timestamp', 'pressure', 'flow_out', 'control_in', 'control_out',
+                                   'oxygen', 'cycle_number')
+    assert len(data['alarms']) == 0
+
+    # restarting keeps the previous recording, and a record torn mid-write is skipped
+    recorder = FlightRecorder(filename, minutes=1, rate=10)
+    assert previous_recordings(filename) == [previous_filename(filename, data['created'])]
+    assert len(read_flight_recorder(previous_recordings(filename)[0])['samples']) == 600
+    recorder.record_alarm(Alarm(AlarmType.HIGH_PRESSURE, AlarmSeverity.HIGH, value=50))
+    recorder.record_sample(0, 1, 0, 0, 0, 21, 0)
+    recorder.record_sample(1, 2, 0, 0, 0, 21, 0)
+    recorder._samples['seq'][2] = 0
+    data = read_flight_recorder(filename)
+    assert list(data['samples']['pressure']) == [1]
+    assert data['alarms']['value'][0] == 50
+    assert np.isnan(data['alarms']['end_time'][0])
+    recorder.close()
+
+    # restarting again keeps both previous recordings, up to keep_previous
+    created = read_flight_recorder(filename)['created']
+    FlightRecorder(filename, minutes=1, rate=10).close()
+    previous = previous_recordings(filename)
+    assert len(previous) == 2 and previous[0] == previous_filename(filename, created)
+    assert list(read_flight_recorder(previous[0])['samples']['pressure']) == [1]
+    assert len(read_flight_recorder(previous[1])['samples']) == 600
+    FlightRecorder(filename, minutes=1, rate=10, keep_previous=2).close()
+    assert previous_recordings(filename)[1:] == previous[:1]
+
+    (tmp_path / 'not_a_ring').write_bytes(b'\0' * 8192)
+    with pytest.raises(ValueError):
+        read_flight_recorder(str(tmp_path / 'not_a_ring'))
@@ -1,3 +1,4 @@
+from vent.common import startup
 from vent.common import prefs
 from vent.common.prefs import get_pref, set_pref
 
@@ -14,6 +14,7 @@ class AlarmType(Enum):
     SENSORS_STUCK = auto()
     BAD_SENSOR_READINGS = auto()
     MISSED_HEARTBEAT = auto()
+    STALE_SENSOR = auto()  # the controller could not read a sensor it needs for too long
 
 
 class AlarmSeverity(Enum):
@@ -0,0 +1,218 @@
+"""
+Bounded history of alarm events.
+
+:class:`.Alarm_Log` keeps a fixed number of the most recent alarm events in preallocated numpy ring buffers,
+so memory use is constant no matter how long the ventilator runs. Events are appended in time order,
+so time ranges can be found with a binary search, and separate ring buffers of event sequence numbers
+index the events by :class:`.AlarmType` and :class:`.AlarmSeverity` .
+
+If a :class:`.DataLogger` is attached, every event is also appended to its hdf5 file.
+"""
+
+import threading
+import typing
+
+import numpy as np
+
+from vent import prefs
+from vent.alarm import AlarmType, AlarmSeverity
+from vent.alarm.alarm import Alarm
+
+if typing.TYPE_CHECKING:
+    from vent.common.loggers import DataLogger
+
+
+ALARM_EVENT_DTYPE = np.dtype([
+    ('seq',        np.int64),    # sequence number of the event, position in the ring is seq % capacity
+    ('timestamp',  np.float64),  # time the event was logged, never decreases
+    ('alarm_type', np.int16),    # AlarmType.value
+    ('severity',   np.int8),     # AlarmSeverity.value
+    ('alarm_id',   np.int64),    # Alarm.id
+    ('start_time', np.float64),
+    ('end_time',   np.float64),  # nan if the alarm has not ended
+    ('value',      np.float64)   # nan if the alarm has no value
+])
+"""
+:class:`numpy.dtype` of the records returned by :meth:`.Alarm_Log.query`
+"""
+
+_INDEX_DTYPE = np.dtype([
+    ('seq',       np.int64),
+    ('timestamp', np.float64)
+])
+
+
+class _Ring(object):
+    """
+    Fixed size ring buffer of numpy records that are appended with nondecreasing timestamps.
+    """
+
+    def __init__(self, capacity: int, dtype: np.dtype):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.head = 0   # next position to write
+        self.count = 0
+
+    def append(self, row: tuple):
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def segments(self) -> typing.List[np.ndarray]:
+        """
+        Views of the stored records in chronological order -- one segment until the buffer wraps, two after.
+        """
+        if self.count < self.capacity:
+            return [self.data[:self.count]]
+        else:
+            return [self.data[self.head:], self.data[:self.head]]
+
+    def range(self, start: float, stop: float) -> np.ndarray:
+        """
+        Records with ``start <= timestamp < stop`` , found by binary search in each segment.
+        """
+        found = []
+        for segment in self.segments():
+            times = segment['timestamp']
+            first = np.searchsorted(times, start, side='left')
+            last = np.searchsorted(times, stop, side='left')
+            if last > first:
+                found.append(segment[first:last])
+
+        if len(found) == 0:
+            return self.data[:0]
+        elif len(found) == 1:
+            return found[0]
+        else:
+            return np.concatenate(found)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class Alarm_Log(object):
+    """
+    Bounded, indexed store of alarm events (every :class:`.Alarm` emitted by the :class:`.Alarm_Manager` ,
+    including those emitted with :attr:`.AlarmSeverity.OFF` when an alarm is cleared).
+
+    Attributes:
+        capacity (int): number of events kept in memory, older events are overwritten
+        data_logger (:class:`.DataLogger`): if not ``None`` , events are also stored in its hdf5 file.
+    """
+
+    def __init__(self, capacity: int = None, data_logger: 'DataLogger' = None):
+        """
+        Args:
+            capacity (int): number of events to keep, if ``None`` use the ``ALARM_LOG_SIZE`` pref.
+            data_logger (:class:`.DataLogger`): optional, logger to persist events with
+        """
+        if capacity is None:
+            capacity = prefs.get_pref('ALARM_LOG_SIZE')
+        assert capacity > 0
+
+        self.capacity = capacity
+        self.data_logger = data_logger
+
+        self._events = _Ring(capacity, ALARM_EVENT_DTYPE)
+        self._type_index = {alarm_type: _Ring(capacity, _INDEX_DTYPE) for alarm_type in AlarmType}
+        self._severity_index = {severity: _Ring(capacity, _INDEX_DTYPE) for severity in AlarmSeverity}
+
+        self._seq = 0
+        self._last_timestamp = -np.inf
+        self._lock = threading.Lock()
+
+    def append(self, alarm: Alarm, timestamp: float = None):
+        """
+        Store an alarm event.
+
+        Args:
+            alarm (:class:`.Alarm`): the emitted alarm
+            timestamp (float): time of the event, if ``None`` use the alarm's start time.
+                Timestamps earlier than the last logged event (eg. if the system clock was changed)
+                are logged with the last event's timestamp to keep the log sorted.
+        """
+        if timestamp is None:
+            timestamp = alarm.start_time
+
+        with self._lock:
+            timestamp = max(timestamp, self._last_timestamp)
+            self._last_timestamp = timestamp
+
+            seq = self._seq
+            self._seq += 1
+
+            self._events.append((
+                seq,
+                timestamp,
+                alarm.alarm_type.value,
+                alarm.severity.value,
+                alarm.id,
+                alarm.start_time,
+                alarm.alarm_end_time if alarm.alarm_end_time is not None else np.nan,
+                alarm.value if isinstance(alarm.value, (int, float)) else np.nan
+            ))
+            self._type_index[alarm.alarm_type].append((seq, timestamp))
+            self._severity_index[alarm.severity].append((seq, timestamp))
+
+        if self.data_logger is not None:
+            self.data_logger.store_alarm_event(alarm, timestamp)
+
+    def query(self,
+              start: float = None,
+              stop: float = None,
+              alarm_type: AlarmType = None,
+              severity: AlarmSeverity = None) -> np.ndarray:
+        """
+        Get logged events, oldest first.
+
+        Time ranges are found by binary search, and filtering by ``alarm_type`` or ``severity`` uses their index,
+        so the cost is O(log n) plus the number of events returned.
+
+        Args:
+            start (float): optional, only events with ``timestamp >= start``
+            stop (float): optional, only events with ``timestamp < stop``
+            alarm_type (:class:`.AlarmType`): optional, only events of this type
+            severity (:class:`.AlarmSeverity`): optional, only events of this severity
+
+        Returns:
+            :class:`numpy.ndarray` : of :data:`.ALARM_EVENT_DTYPE` records
+        """
+        if start is None:
+            start = -np.inf
+        if stop is None:
+            stop = np.inf
+
+        with self._lock:
+            if alarm_type is None and severity is None:
+                return self._events.range(start, stop).copy()
+
+            if alarm_type is not None:
+                index = self._type_index[alarm_type]
+            else:
+                index = self._severity_index[severity]
+
+            seqs = index.range(start, stop)['seq']
+            # events older than the event buffer have been overwritten
+            seqs = seqs[seqs > self._seq - 1 - self.capacity]
+            events = self._events.data[seqs % self.capacity]
+
+        if alarm_type is not None and severity is not None:
+            events = events[events['severity'] == severity.value]
+
+        return events
+
+    def __len__(self):
+        return self._events.count
+
+    def clear(self):
+        """
+        Empty the log (doesn't affect events already stored by the :attr:`.data_logger` )
+        """
+        with self._lock:
+            self._seq = 0
+            self._events.clear()
+            for index in self._type_index.values():
+                index.clear()
+            for index in self._severity_index.values():
+                index.clear()
@@ -1,31 +1,55 @@
 import copy
+import functools
+import threading
 import time
+from collections import deque
 
 from vent.alarm import AlarmSeverity, AlarmType
 from vent.alarm.condition import Condition
 from vent.common.message import SensorValues, ControlSetting
+from vent.common.values import ValueName
 from vent.alarm.alarm import Alarm
 from vent.alarm.rule import Alarm_Rule
+from vent.alarm.alarm_log import Alarm_Log
+from vent import prefs
 
 import typing
 
+
+def _synchronized(method):
+    """
+    Hold the :attr:`.Alarm_Manager.lock` while calling ``method``
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 ALARM_MANAGER_INSTANCE = None
 
 class Alarm_Manager(object):
     """
     Attributes:
         active_alarms (dict): {:class:`.AlarmType`: :class:`.Alarm`}
+        logged_alarms (:class:`collections.deque`): the most recent ``ALARM_LOG_SIZE`` alarms that have been deactivated
+        alarm_log (:class:`.Alarm_Log`): bounded, indexed history of every emitted alarm
         pending_clears (list): [:class:`.AlarmType`] list of alarms that have been requested to be cleared
         callbacks (list): list of callables that accept `Alarm` s when they are raised/altered.
         cleared_alarms (list): of :class:`.AlarmType` s, alarms that have been cleared but have not dropped back into the 'off' range to enable re-raising
         snoozed_alarms (dict): of :class:`.AlarmType` s : times, alarms that should not be raised because they have been silenced for a period of time
+        rule_subsets (dict): {tuple(:class:`.ValueName`): [:class:`.Alarm_Rule`]} cache of the rules that depend on a set of values,
+            see :meth:`.update`
+        lock (:class:`threading.RLock`): held by the methods that check or change alarms, since the controller's loop
+            and the GUI may both use the manager from different threads in the same process
     """
     _instance = None
 
     # use class attributes because __init__ is called every time instantiated
 
     active_alarms: typing.Dict[AlarmType, Alarm] = {}
-    logged_alarms: typing.List[Alarm] = []
+    logged_alarms: typing.Deque[Alarm] = deque(maxlen=prefs.get_pref('ALARM_LOG_SIZE'))
+    alarm_log = Alarm_Log()
 
     # get our alarm rules
     dependencies = {}
@@ -34,6 +58,8 @@ class Alarm_Manager(object):
     snoozed_alarms = {}
     callbacks = []
     rules = {}
+    rule_subsets = {}
+    lock = threading.RLock()
 
     def __new__(cls):
         """
@@ -62,6 +88,8 @@ class Alarm_Manager(object):
 
     def load_rule(self, alarm_rule: Alarm_Rule):
         self.rules[alarm_rule.name] = alarm_rule
+        # rules changed, so cached subsets are stale
+        self.rule_subsets.clear()
 
         for severity, condition in alarm_rule.conditions:
 
@@ -73,12 +101,47 @@ class Alarm_Manager(object):
 
 
 
-    def update(self, sensor_values: SensorValues):
-        for alarm_name, rule in self.rules.items():
+    @_synchronized
+    def update(self, sensor_values: SensorValues, value_names: typing.Tuple[ValueName] = None):
+        """
+        Check alarm rules against a set of sensor values.
+
+        Args:
+            sensor_values (:class:`.SensorValues`): values to check
+            value_names (tuple): optional, only check the rules that depend on these :class:`.ValueName` s.
+                Used by the controller to check the rules that depend on quickly-changing values like
+                pressure every control loop, without re-checking the rules that only change once per breath.
+        """
+        if value_names is None:
+            rules = self.rules.values()
+        else:
+            rules = self.get_rules(value_names)
+
+        for rule in rules:
             self.check_rule(rule, sensor_values)
             # don't want to do alarm emission here because any _check_,
             # not any full update should trigger an alarm
 
+    def get_rules(self, value_names: typing.Tuple[ValueName]) -> typing.List[Alarm_Rule]:
+        """
+        Get the rules that depend on any of ``value_names`` , caching the result so that
+        repeated calls in the control loop don't have to walk each rule's conditions.
+
+        Args:
+            value_names (tuple): of :class:`.ValueName`
+
+        Returns:
+            list: of :class:`.Alarm_Rule`
+        """
+        value_names = tuple(value_names)
+        try:
+            return self.rule_subsets[value_names]
+        except KeyError:
+            rules = [rule for rule in self.rules.values()
+                     if not rule.value_names.isdisjoint(value_names)]
+            self.rule_subsets[value_names] = rules
+            return rules
+
     def check_rule(self, rule: Alarm_Rule, sensor_values: SensorValues):
         current_severity = rule.check(sensor_values)
 
@@ -129,6 +192,7 @@ class Alarm_Manager(object):
 
 
 
+    @_synchronized
     def emit_alarm(self, alarm_type: AlarmType, severity: AlarmSeverity):
         """
         Emit alarm (by calling all callbacks with it).
@@ -156,6 +220,8 @@ class Alarm_Manager(object):
                 persistent = self.rules[alarm_type].persistent
             )
 
+            self.alarm_log.append(new_alarm)
+
             for callback in self.callbacks:
                 callback(new_alarm)
 
@@ -166,6 +232,7 @@ class Alarm_Manager(object):
         else:
             raise ValueError('No  rule found for alarm type {}'.format(alarm_type))
 
+    @_synchronized
     def deactivate_alarm(self, alarm: (AlarmType, Alarm)):
         """
         Mark an alarm's internal active flags and remove from :attr:`.active_alarms`
@@ -203,6 +270,7 @@ class Alarm_Manager(object):
         else:
             return
 
+    @_synchronized
     def dismiss_alarm(self,
                       alarm_type: AlarmType,
                       duration: float = None,):
@@ -251,6 +319,7 @@ class Alarm_Manager(object):
             return AlarmSeverity.OFF
 
 
+    @_synchronized
     def register_alarm(self, alarm: Alarm):
         """
         Add alarm to registry.
@@ -294,6 +363,7 @@ class Alarm_Manager(object):
             self.dependencies[value_name].append(dependency)
 
 
+    @_synchronized
     def update_dependencies(self, control_setting: ControlSetting):
         """
         Update Condition objects that update their value according to some control parameter
@@ -323,16 +393,27 @@ class Alarm_Manager(object):
 
                 setattr(depend['condition'], depend['condition_attr'], new_value)
 
+    @_synchronized
     def add_callback(self, callback: typing.Callable):
         assert callable(callback)
         self.callbacks.append(callback)
 
+    @_synchronized
+    def remove_callback(self, callback: typing.Callable):
+        """
+        Stop calling ``callback`` , if it was added with :meth:`.add_callback`
+        """
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    @_synchronized
     def clear_all_alarms(self):
         # make separate list because dict will be cleared during iteration
         alarm_keys = list(self.active_alarms.keys())
         for alarm_type in alarm_keys:
             self.deactivate_alarm(alarm_type)
 
+    @_synchronized
     def reset(self):
         """
         reset all conditions, callbacks, and other stateful attributes and clear alarms
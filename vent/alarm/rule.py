@@ -45,6 +45,24 @@ class Alarm_Rule(object):
         self._severity = active_severity
         return active_severity
 
+    @property
+    def value_names(self):
+        """
+        :class:`.ValueName` s that any of this rule's conditions (or their added children) check.
+
+        Used by :meth:`.Alarm_Manager.update` to only evaluate the rules affected by a given set of values.
+
+        Returns:
+            set
+        """
+        value_names = set()
+        for _, condition in self.conditions:
+            while condition is not None:
+                if getattr(condition, 'value_name', None) is not None:
+                    value_names.add(condition.value_name)
+                condition = condition._child
+        return value_names
+
     @property
     def severity(self):
         """
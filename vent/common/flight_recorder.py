@@ -0,0 +1,386 @@
+"""
+Crash-safe ring buffer of the most recent control loop samples, control settings and alarm events.
+
+The :class:`.DataLogger` only writes to disk when it is flushed, every few breaths, so if the controller process dies
+the last seconds of data are lost with it. The :class:`.FlightRecorder` keeps the last few minutes in a fixed-size file
+mapped into memory: recording is a plain store into a numpy array backed by the map, with no system call per
+sample, and the operating system writes the pages back to the file. Everything stored survives the process
+crashing, and everything up to the last :meth:`.FlightRecorder.sync` survives a power loss.
+
+Each record carries a sequence number, written after the rest of the record, so :func:`.read_flight_recorder`
+can put the rings back in order and skip records that were being written when the process died. Records are
+sized to divide the disk sector size so they never straddle a sector.
+
+:meth:`.FlightRecorder.sync` only writes the pages recorded into since the last sync, and can write them from a
+background thread (the control loop does), so the loop doesn't wait for the disk.
+
+The controller records into ``DATA_DIR/flight_recorder.ring`` when logging. When it starts, it moves the file of the
+previous run to ``flight_recorder.prev.<time it was started>.ring`` , keeping the last few, so a crash isn't
+overwritten by the restarts that follow it. To read the last one::
+
+    data = read_flight_recorder(previous_recordings()[0])
+    data['samples']['pressure']
+"""
+
+import ctypes
+import glob
+import mmap
+import os
+import sys
+import threading
+import time
+import typing
+
+import numpy as np
+import numpy.lib.recfunctions as rfn
+
+from vent.common import prefs
+from vent.common.loggers import init_logger
+
+if typing.TYPE_CHECKING:
+    from vent.alarm import Alarm
+    from vent.common.message import ControlSetting
+
+
+MAGIC = b'VENTFDR1'
+
+HEADER_DTYPE = np.dtype([
+    ('magic',      'S8'),
+    ('version',    np.uint32),
+    ('n_samples',  np.uint64),
+    ('n_settings', np.uint64),
+    ('n_alarms',   np.uint64),
+    ('created',    np.float64)
+])
+
+HEADER_SIZE = mmap.PAGESIZE
+"""
+Bytes reserved for the header, so the rings start on a page boundary
+"""
+
+SAMPLE_DTYPE = np.dtype([
+    ('seq',          np.uint64),   # 1 + number of samples recorded before this one, 0 if never written
+    ('timestamp',    np.float64),
+    ('pressure',     np.float64),
+    ('flow_out',     np.float64),
+    ('control_in',   np.float64),
+    ('control_out',  np.float64),
+    ('oxygen',       np.float64),
+    ('cycle_number', np.uint32),
+    ('_pad',         'V4')
+])
+"""
+One control loop sample, same values as :class:`.ContinuousData` , 64 bytes
+"""
+
+SETTING_DTYPE = np.dtype([
+    ('seq',       np.uint64),
+    ('timestamp', np.float64),
+    ('name',      'S16'),
+    ('value',     np.float64),
+    ('min_value', np.float64),
+    ('max_value', np.float64),
+    ('_pad',      'V8')
+])
+"""
+One control setting, same values as :class:`.ControlCommand` , 64 bytes
+"""
+
+ALARM_DTYPE = np.dtype([
+    ('seq',        np.uint64),
+    ('timestamp',  np.float64),
+    ('alarm_type', 'S32'),
+    ('severity',   'S16'),
+    ('alarm_id',   np.uint32),
+    ('_pad0',      'V4'),
+    ('start_time', np.float64),
+    ('end_time',   np.float64),
+    ('value',      np.float64),
+    ('_pad1',      'V24')
+])
+"""
+One alarm event, same values as :class:`.AlarmEvent` , 128 bytes
+"""
+
+RINGS = (
+    ('samples',  'n_samples',  SAMPLE_DTYPE),
+    ('settings', 'n_settings', SETTING_DTYPE),
+    ('alarms',   'n_alarms',   ALARM_DTYPE)
+)
+
+MAX_LOOP_RATE = 1000
+"""
+Loops per second the sample ring is sized for by default
+"""
+
+
+_MS_SYNC = 4
+"""
+``MS_SYNC`` flag of ``msync`` on linux
+"""
+
+
+def _msync_linux():
+    """ libc's ``msync`` , which, called through :mod:`ctypes` , releases the GIL while it waits for the disk """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        msync = ctypes.CDLL(None, use_errno=True).msync
+    except (OSError, AttributeError):
+        return None
+    msync.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+    msync.restype = ctypes.c_int
+    return msync
+
+
+def previous_filename(filename: str, created: float) -> str:
+    """
+    Name a previous recording is kept under, see :class:`.FlightRecorder`
+
+    Args:
+        filename (str): the ring file
+        created (float): when the recording was started
+    """
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(created)) + '.{:03d}'.format(int(created % 1 * 1000))
+    return '{}.prev.{}.ring'.format(os.path.splitext(filename)[0], stamp)
+
+
+def previous_recordings(filename: str = None) -> typing.List[str]:
+    """
+    Recordings kept from previous runs, newest first
+
+    Args:
+        filename (str): the ring file, default ``DATA_DIR/flight_recorder.ring``
+    """
+    if filename is None:
+        filename = os.path.join(prefs.get_pref('DATA_DIR'), 'flight_recorder.ring')
+    return sorted(glob.glob(glob.escape(os.path.splitext(filename)[0]) + '.prev.*.ring'), reverse=True)
+
+
+def _layout(header: np.ndarray) -> typing.List[tuple]:
+    """ (name, offset, length, dtype) of each ring in a file with this header, each ring starts on a page """
+    layout = []
+    offset = HEADER_SIZE
+    for name, length_field, dtype in RINGS:
+        length = int(header[length_field])
+        layout.append((name, offset, length, dtype))
+        offset += -(-length * dtype.itemsize // HEADER_SIZE) * HEADER_SIZE
+    return layout
+
+
+class FlightRecorder(object):
+    """
+    Fixed-size memory-mapped ring file of samples, settings and alarm events, see the module documentation.
+
+    Recording is not locked: samples should only be recorded from one thread (the control loop), and settings and
+    alarms only from one thread each.
+    """
+
+    def __init__(self,
+                 filename: str = None,
+                 minutes: float = None,
+                 rate: float = MAX_LOOP_RATE,
+                 n_settings: int = 10000,
+                 n_alarms: int = 10000,
+                 keep_previous: int = 10):
+        """
+        Args:
+            filename (str): ring file, default ``DATA_DIR/flight_recorder.ring``
+            minutes (float): minutes of samples to keep at ``rate`` , default the ``FLIGHT_RECORDER_MINUTES`` pref
+            rate (float): loops per second to size the sample ring for
+            n_settings (int): number of control settings to keep
+            n_alarms (int): number of alarm events to keep
+            keep_previous (int): if the file exists, move it to ``<name>.prev.<time>.ring`` (see
+                :func:`.previous_filename` ) rather than overwriting it, and keep at most this many previous recordings.
+                0 to overwrite it
+        """
+        self.logger = init_logger(__name__)
+        if filename is None:
+            filename = os.path.join(prefs.get_pref('DATA_DIR'), 'flight_recorder.ring')
+        if minutes is None:
+            minutes = prefs.get_pref('FLIGHT_RECORDER_MINUTES')
+        self.filename = filename
+
+        if keep_previous and os.path.exists(filename):
+            self._keep_previous(keep_previous)
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)[0]
+        header['magic'] = MAGIC
+        header['version'] = 1
+        header['n_samples'] = max(int(minutes * 60 * rate), 1)
+        header['n_settings'] = n_settings
+        header['n_alarms'] = n_alarms
+        header['created'] = time.time()
+        layout = _layout(header)
+        name, offset, length, dtype = layout[-1]
+        size = offset + length * dtype.itemsize
+
+        # allocate the whole file up front, so recording never extends it
+        with open(filename, 'w+b') as ring_file:
+            ring_file.truncate(size)
+            self._mmap = mmap.mmap(ring_file.fileno(), size)
+        self._map = np.frombuffer(self._mmap, dtype=np.uint8)
+        self._map[:HEADER_DTYPE.itemsize] = np.frombuffer(header.tobytes(), dtype=np.uint8)
+
+        self._rings = {name: np.ndarray((length,), dtype=dtype, buffer=self._map, offset=offset)
+                       for name, offset, length, dtype in layout}
+        self._offsets = {name: offset for name, offset, length, dtype in layout}
+        self._samples = self._rings['samples']
+        self._settings = self._rings['settings']
+        self._alarms = self._rings['alarms']
+        self._seq = {name: 0 for name in self._rings}
+        self._synced = {name: 0 for name in self._rings}    # sequence number of each ring at the last sync
+        self._msync = _msync_linux()
+        self._syncing = None                                # thread writing pages to disk, see sync()
+        self._write_pages([(0, size)])
+        self.logger.info(f'Flight recorder keeping {minutes} minutes in {filename} ({size / 1e6:.1f} MB)')
+
+    def _keep_previous(self, keep: int):
+        """ Move the file of the previous run aside, and remove the oldest previous recordings beyond ``keep`` """
+        try:
+            with open(self.filename, 'rb') as ring_file:
+                header = np.frombuffer(ring_file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE, count=1)[0]
+            created = float(header['created']) if header['magic'] == MAGIC else os.path.getmtime(self.filename)
+        except (OSError, ValueError):
+            created = os.path.getmtime(self.filename)
+        previous = previous_filename(self.filename, created)
+        if os.path.exists(previous):
+            previous = previous_filename(self.filename, time.time())
+        os.replace(self.filename, previous)
+
+        for old in previous_recordings(self.filename)[keep:]:
+            try:
+                os.remove(old)
+            except OSError as e:
+                self.logger.warning(f'Could not remove old flight recording {old}: {e}')
+
+    def _store(self, name: str, ring: np.ndarray, row: tuple):
+        seq = self._seq[name] + 1
+        i = seq % len(ring)
+        # clear the sequence number first, so a record torn by a crash is never read as valid
+        ring['seq'][i] = 0
+        ring[i] = (0,) + row
+        ring['seq'][i] = seq
+        self._seq[name] = seq
+
+    def record_sample(self, timestamp: float, pressure: float, flow_out: float, control_in: float,
+                      control_out: float, oxygen: float, cycle_number: int):
+        """ Record one control loop sample """
+        self._store('samples', self._samples,
+                    (timestamp, pressure, flow_out, control_in, control_out, oxygen, cycle_number, b''))
+
+    def record_setting(self, control_setting: 'ControlSetting'):
+        """ Record a control setting """
+        self._store('settings', self._settings, (
+            control_setting.timestamp,
+            control_setting.name.name if hasattr(control_setting.name, 'name') else str(control_setting.name),
+            _float(control_setting.value),
+            _float(control_setting.min_value),
+            _float(control_setting.max_value),
+            b''
+        ))
+
+    def record_alarm(self, alarm: 'Alarm', timestamp: float = None):
+        """ Record an alarm event, at ``timestamp`` or the alarm's start time """
+        self._store('alarms', self._alarms, (
+            alarm.start_time if timestamp is None else timestamp,
+            alarm.alarm_type.name,
+            alarm.severity.name,
+            alarm.id,
+            b'',
+            alarm.start_time,
+            _float(alarm.alarm_end_time),
+            _float(alarm.value),
+            b''
+        ))
+
+    def _dirty_pages(self) -> typing.List[typing.Tuple[int, int]]:
+        """
+        (offset, length) of the pages of the map recorded into since the last call, page aligned
+        """
+        pages = []
+        for name, ring in self._rings.items():
+            seq, synced = self._seq[name], self._synced[name]
+            self._synced[name] = seq
+            if seq == synced:
+                continue
+            first, n = (synced + 1) % len(ring), min(seq - synced, len(ring))
+            spans = [(first, min(n, len(ring) - first))]
+            if first + n > len(ring):
+                spans.append((0, first + n - len(ring)))
+            for start, count in spans:
+                begin = self._offsets[name] + start * ring.itemsize
+                end = begin + count * ring.itemsize
+                begin -= begin % mmap.PAGESIZE
+                pages.append((begin, end - begin))
+        return pages
+
+    def _write_pages(self, pages: typing.List[typing.Tuple[int, int]]):
+        for offset, length in pages:
+            if self._msync is not None:
+                if self._msync(self._map.ctypes.data + offset, length, _MS_SYNC) != 0:
+                    error = ctypes.get_errno()
+                    self.logger.warning(f'Could not sync the flight recorder: {os.strerror(error)}')
+            else:
+                self._mmap.flush(offset, length)
+
+    def sync(self, wait: bool = True):
+        """
+        Write the pages recorded into since the last sync to disk (a system call, so call it periodically rather
+        than per sample)
+
+        Args:
+            wait (bool): wait until they are written. Otherwise a background thread writes them, and if it's still
+                writing the last ones, this returns without syncing, the next sync writes them
+        """
+        if self._map is None:
+            return
+        if self._syncing is not None and self._syncing.is_alive():
+            if not wait:
+                return
+            self._syncing.join()
+        pages = self._dirty_pages()
+        if wait:
+            self._write_pages(pages)
+        elif pages:
+            self._syncing = threading.Thread(target=self._write_pages, args=(pages,),
+                                             name='flight_recorder_sync', daemon=True)
+            self._syncing.start()
+
+    def close(self):
+        """ Sync the file and stop recording, the file is unmapped once nothing refers to the rings """
+        if self._map is not None:
+            self.sync()
+            self._rings = self._samples = self._settings = self._alarms = None
+            self._map = self._mmap = None
+
+
+def _float(value) -> float:
+    return float(value) if isinstance(value, (int, float)) else np.nan
+
+
+def read_flight_recorder(filename: str) -> typing.Dict[str, np.ndarray]:
+    """
+    Read a flight recorder file, eg. after a crash.
+
+    Args:
+        filename (str): the ring file
+
+    Returns:
+        dict: {'samples', 'settings', 'alarms': structured arrays of the valid records, oldest first, without the
+        padding fields}, and 'created': time the recording started
+    """
+    with open(filename, 'rb') as ring_file:
+        data = ring_file.read()
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError(f'{filename} is not a flight recorder file')
+
+    result = {'created': float(header['created'])}
+    for name, offset, length, dtype in _layout(header):
+        ring = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+        valid = ring[ring['seq'] > 0]
+        valid = valid[np.argsort(valid['seq'])]
+        fields = [field for field in dtype.names if not field.startswith('_')]
+        result[name] = rfn.repack_fields(valid[fields])
+    return result
@@ -0,0 +1,302 @@
+"""
+Batch conversion and summary of many :class:`~vent.common.loggers.DataLogger` files.
+
+Log files are read with :class:`~vent.common.loggers.LogReader` in a pool of processes, so no
+:class:`~vent.common.loggers.DataLogger` (and no new log file) is created. For each file, the waveforms are read in
+chunks and summarized per breath, and optionally the file is exported to csv and/or MATLAB. The summaries of all files
+are merged into two reports in the output directory:
+
+* ``files.csv`` : one row per log file, with its time span, breaths, rows and mean derived quantities
+* ``breaths.csv`` : one row per breath, with the min/max/mean of its waveforms and its derived quantities. Breaths
+  split across rotated files of the same session are merged.
+
+Run with eg.::
+
+    python -m vent.common.log_batch                      # all logs in DATA_DIR
+    python -m vent.common.log_batch ~/vent/logs/2020-05-* --export csv mat --processes 4 --out report
+
+With ``--index`` , the files are only indexed and their catalog entries updated (see
+:func:`~vent.common.loggers.index_closed_logfile` ), eg. files copied from another machine.
+"""
+
+import argparse
+import csv
+import glob
+import multiprocessing as mp
+import os
+import re
+import time
+import typing
+
+import numpy as np
+
+from vent.common import prefs
+from vent.common.loggers import LogReader, export_csv, export_mat, index_closed_logfile
+
+BREATH_FIELDS = ('pressure', 'flow_out', 'oxygen', 'control_in')
+"""
+Waveforms summarized per breath
+"""
+
+_PARTIAL_DTYPE = np.dtype(
+    [('cycle_number', np.uint32), ('start', np.float64), ('stop', np.float64), ('n_samples', np.uint32)] +
+    [(field + stat, np.float64) for field in BREATH_FIELDS for stat in ('_min', '_max', '_sum')]
+)
+
+DERIVED_FIELDS = ('pip', 'peep', 'vte', 'I_phase_duration')
+"""
+Derived quantities joined to each breath
+"""
+
+EXPORTERS = {
+    'csv': export_csv,
+    'mat': export_mat
+}
+
+
+def find_logs(paths: typing.Iterable[str] = None) -> typing.List[str]:
+    """
+    Log files in ``paths`` , which may be files, directories (searched for ``*_controller_log.*.h5`` ) or glob patterns
+
+    Args:
+        paths (iterable): default ``DATA_DIR``
+    """
+    if not paths:
+        paths = [prefs.get_pref('DATA_DIR')]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '*_controller_log.*.h5')))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def session_of(filename: str) -> str:
+    """ The session a log file belongs to: its filename without the rotation index, eg. ``..._controller_log`` """
+    return re.sub(r'\.\d+\.h5$', '', os.path.basename(filename))
+
+
+def _reduce_breaths(partial: np.ndarray) -> np.ndarray:
+    """ Combine consecutive rows of partial breath summaries that are from the same breath """
+    if len(partial) == 0:
+        return partial
+    starts = np.r_[0, np.flatnonzero(np.diff(partial['cycle_number'].astype(np.int64))) + 1]
+    ends = np.r_[starts[1:], len(partial)] - 1
+
+    reduced = np.zeros(len(starts), dtype=_PARTIAL_DTYPE)
+    reduced['cycle_number'] = partial['cycle_number'][starts]
+    reduced['start'] = partial['start'][starts]
+    reduced['stop'] = partial['stop'][ends]
+    reduced['n_samples'] = np.add.reduceat(partial['n_samples'], starts)
+    for field in BREATH_FIELDS:
+        reduced[field + '_min'] = np.minimum.reduceat(partial[field + '_min'], starts)
+        reduced[field + '_max'] = np.maximum.reduceat(partial[field + '_max'], starts)
+        reduced[field + '_sum'] = np.add.reduceat(partial[field + '_sum'], starts)
+    return reduced
+
+
+def _chunk_breaths(chunk: np.ndarray) -> np.ndarray:
+    """ Partial breath summaries of a chunk of waveforms, in the same form as :func:`._reduce_breaths` returns """
+    partial = np.zeros(len(chunk), dtype=_PARTIAL_DTYPE)
+    partial['cycle_number'] = chunk['cycle_number']
+    partial['start'] = chunk['timestamp']
+    partial['stop'] = chunk['timestamp']
+    partial['n_samples'] = 1
+    for field in BREATH_FIELDS:
+        for stat in ('_min', '_max', '_sum'):
+            partial[field + stat] = chunk[field]
+    return _reduce_breaths(partial)
+
+
+def summarize_file(filename: str,
+                   export: typing.Iterable[str] = (),
+                   chunk_size: int = 100000) -> typing.Tuple[dict, np.ndarray, np.ndarray]:
+    """
+    Summarize (and optionally export) one log file.
+
+    Args:
+        filename (str): the log file
+        export (iterable): formats in :data:`.EXPORTERS` to export the file to, next to the file
+        chunk_size (int): rows of waveforms read at once
+
+    Returns:
+        tuple: (file summary (dict), breath summaries and derived quantities (:class:`numpy.ndarray` s) to merge
+        with the other files of the session in :func:`.breath_report` )
+    """
+    start_time = time.perf_counter()
+    with LogReader(filename) as reader:
+        partials = [_chunk_breaths(chunk) for chunk in reader.iter_read('waveforms', chunk_size=chunk_size)]
+        breaths = _reduce_breaths(np.concatenate(partials)) if partials else np.zeros(0, dtype=_PARTIAL_DTYPE)
+        derived = reader.read('derived_quantities', fields=('cycle_number',) + DERIVED_FIELDS)
+        n_controls = len(reader.read('controls'))
+        n_alarms = len(reader.read('alarms'))
+        first, last = reader.time_range()
+
+    for fmt in export:
+        EXPORTERS[fmt](filename, chunk_size=chunk_size)
+
+    n_samples = int(breaths['n_samples'].sum())
+    summary = {
+        'file':        filename,
+        'session':     session_of(filename),
+        'size_mb':     os.path.getsize(filename) / 1e6,
+        'start':       first,
+        'stop':        last,
+        'duration':    last - first if first is not None else 0,
+        'first_cycle': int(breaths['cycle_number'][0]) if len(breaths) else None,
+        'last_cycle':  int(breaths['cycle_number'][-1]) if len(breaths) else None,
+        'breaths':     len(breaths),
+        'samples':     n_samples,
+        'controls':    n_controls,
+        'alarms':      n_alarms,
+        'pressure_mean': breaths['pressure_sum'].sum() / n_samples if n_samples else np.nan,
+        'pressure_max':  breaths['pressure_max'].max() if n_samples else np.nan
+    }
+    for field in DERIVED_FIELDS:
+        summary[field + '_mean'] = derived[field].mean() if len(derived) else np.nan
+    summary['seconds'] = time.perf_counter() - start_time
+    return summary, breaths, derived
+
+
+def breath_report(sessions: typing.Dict[str, typing.List[tuple]]) -> typing.List[dict]:
+    """
+    Merge the partial breath summaries of the files of each session into one row per breath.
+
+    Args:
+        sessions (dict): {session: [(breaths, derived quantities), ...]} from :func:`.summarize_file`
+
+    Returns:
+        list: of dicts, one per breath
+    """
+    rows = []
+    for session, parts in sessions.items():
+        partial = np.concatenate([breaths for breaths, _ in parts])
+        partial = _reduce_breaths(partial[np.argsort(partial['start'], kind='stable')])
+        derived = np.concatenate([derived for _, derived in parts])
+        derived = derived[np.argsort(derived['cycle_number'], kind='stable')]
+        derived_index = np.searchsorted(derived['cycle_number'], partial['cycle_number'])
+
+        for breath, i in zip(partial, derived_index):
+            row = {
+                'session':      session,
+                'cycle_number': int(breath['cycle_number']),
+                'start':        breath['start'],
+                'stop':         breath['stop'],
+                'n_samples':    int(breath['n_samples'])
+            }
+            for field in BREATH_FIELDS:
+                row[field + '_min'] = breath[field + '_min']
+                row[field + '_max'] = breath[field + '_max']
+                row[field + '_mean'] = breath[field + '_sum'] / breath['n_samples']
+            has_derived = i < len(derived) and derived['cycle_number'][i] == breath['cycle_number']
+            for field in DERIVED_FIELDS:
+                row[field] = derived[field][i] if has_derived else np.nan
+            rows.append(row)
+    return rows
+
+
+def _summarize(args: tuple) -> tuple:
+    filename, export, chunk_size = args
+    try:
+        return (filename,) + summarize_file(filename, export, chunk_size) + (None,)
+    except Exception as e:
+        return filename, None, None, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def _write_csv(filename: str, rows: typing.List[dict]):
+    if not rows:
+        return
+    with open(filename, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_batch(files: typing.List[str],
+              out_dir: str,
+              export: typing.Iterable[str] = (),
+              processes: int = None,
+              chunk_size: int = 100000,
+              verbose: bool = True) -> dict:
+    """
+    Summarize (and optionally export) log files in a process pool, and write the merged reports to ``out_dir``
+
+    Args:
+        files (list): log files
+        out_dir (str): directory for ``files.csv`` and ``breaths.csv``
+        export (iterable): formats in :data:`.EXPORTERS` to export each file to
+        processes (int): number of worker processes, default one per cpu
+        chunk_size (int): rows of waveforms read at once
+        verbose (bool): print progress
+
+    Returns:
+        dict: with the ``files`` and ``breaths`` report rows, the ``errors`` as {file: message},
+        and the total ``seconds`` and ``mb_per_s``
+    """
+    for fmt in export:
+        if fmt not in EXPORTERS:
+            raise ValueError('export formats must be in {}, got {}'.format(tuple(EXPORTERS.keys()), fmt))
+    os.makedirs(out_dir, exist_ok=True)
+
+    start_time = time.perf_counter()
+    total_mb = sum(os.path.getsize(f) for f in files) / 1e6
+    done_mb = 0
+    summaries, sessions, errors = [], {}, {}
+
+    with mp.Pool(processes) as pool:
+        jobs = [(filename, tuple(export), chunk_size) for filename in files]
+        for n, (filename, summary, breaths, derived, error) in enumerate(pool.imap_unordered(_summarize, jobs), 1):
+            elapsed = time.perf_counter() - start_time
+            if error is not None:
+                errors[filename] = error
+                status = 'failed, ' + error
+            else:
+                summaries.append(summary)
+                sessions.setdefault(summary['session'], []).append((breaths, derived))
+                done_mb += summary['size_mb']
+                status = '{:.1f} MB in {:.1f} s'.format(summary['size_mb'], summary['seconds'])
+            if verbose:
+                print('[{}/{}] {} {} -- {:.1f}/{:.1f} MB, {:.1f} MB/s'.format(
+                    n, len(files), os.path.basename(filename), status, done_mb, total_mb, done_mb / elapsed))
+
+    summaries.sort(key=lambda summary: (summary['session'], summary['start'] if summary['start'] is not None else 0))
+    breaths = breath_report(sessions)
+
+    _write_csv(os.path.join(out_dir, 'files.csv'), summaries)
+    _write_csv(os.path.join(out_dir, 'breaths.csv'), breaths)
+
+    seconds = time.perf_counter() - start_time
+    if verbose:
+        print('Summarized {} files ({:.1f} MB, {} breaths) in {:.1f} s, {:.1f} MB/s, {} errors. Reports in {}'.format(
+            len(summaries), done_mb, len(breaths), seconds, done_mb / seconds, len(errors), out_dir))
+    return {'files': summaries, 'breaths': breaths, 'errors': errors,
+            'seconds': seconds, 'mb_per_s': done_mb / seconds}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('paths', nargs='*', help='log files, directories or glob patterns, default DATA_DIR')
+    parser.add_argument('--out', type=str, default='log_report', help='directory to write the reports to')
+    parser.add_argument('--export', type=str, nargs='*', default=[], choices=list(EXPORTERS.keys()),
+                        help='also export each file to these formats')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, default one per cpu')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows read at once')
+    parser.add_argument('--index', action='store_true',
+                        help='only index the files and update the log catalog, without writing reports')
+    args = parser.parse_args(argv)
+
+    files = find_logs(args.paths)
+    if not files:
+        parser.error('No log files found in {}'.format(args.paths or prefs.get_pref('DATA_DIR')))
+    if args.index:
+        for filename in files:
+            index_closed_logfile(filename)
+        return files
+    return run_batch(files, args.out, args.export, args.processes, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Catalog of the :class:`~vent.common.loggers.DataLogger` files in ``DATA_DIR`` .
+
+The catalog is a small SQLite database, ``DATA_DIR/log_catalog.sqlite`` , with one row per log file recording its
+session, rotation index, size, time span, breath range and number of rows in each table. The
+:class:`~vent.common.loggers.DataLogger` updates it when it closes or rotates a file, so checking the storage quota
+doesn't list and stat the log directory, and finding the files that cover a time or breath is an indexed query
+rather than opening every file::
+
+    catalog = LogCatalog()
+    catalog.total_size()
+    catalog.find(time=t)                  # files with waveforms at time t
+    LogReader(catalog.find(start=t0, stop=t1))
+
+If the database is missing (eg. on first run) it is rebuilt from the files in the directory, and if it lists a
+different number of files than the directory holds (eg. files were deleted or moved by hand) it is reconciled with
+the directory, see :meth:`.LogCatalog.reconcile` .
+"""
+
+import contextlib
+import os
+import re
+import sqlite3
+import time
+import typing
+
+import tables as pytb
+
+from vent.common import prefs
+
+CATALOG_FILE = 'log_catalog.sqlite'
+
+_TABLES = ('waveforms', 'derived_quantities', 'controls', 'alarms')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path            TEXT PRIMARY KEY,   -- absolute path of the log file
+    session         TEXT,               -- path without the rotation index, shared by the rotations of a session
+    rotation        INTEGER,            -- rotation index, 0 for the file being written, higher is older
+    size            INTEGER,            -- bytes
+    start           REAL,               -- first waveform timestamp
+    stop            REAL,               -- last waveform timestamp
+    first_cycle     INTEGER,
+    last_cycle      INTEGER,
+    n_waveforms     INTEGER,
+    n_derived       INTEGER,
+    n_controls      INTEGER,
+    n_alarms        INTEGER,
+    updated         REAL                -- time the entry was last updated
+);
+CREATE INDEX IF NOT EXISTS files_start ON files (start);
+CREATE INDEX IF NOT EXISTS files_stop ON files (stop);
+CREATE INDEX IF NOT EXISTS files_session ON files (session, rotation);
+"""
+
+_ROTATION = re.compile(r'^(.*)\.(\d+)\.h5$')
+
+
+def split_rotation(path: str) -> typing.Tuple[str, int]:
+    """ (session, rotation index) of a log file path, eg. ``('.../..._controller_log', 0)`` """
+    match = _ROTATION.match(path)
+    if match is None:
+        return os.path.splitext(path)[0], 0
+    return match.group(1), int(match.group(2))
+
+
+def file_stats(h5file: pytb.File) -> dict:
+    """
+    Time span, breath range and row counts of an open log file
+
+    Args:
+        h5file (:class:`tables.File`): log file, open for reading or writing
+    """
+    stats = {'start': None, 'stop': None, 'first_cycle': None, 'last_cycle': None}
+    for table, column in zip(_TABLES, ('n_waveforms', 'n_derived', 'n_controls', 'n_alarms')):
+        node = '/' + table + '/readout'
+        stats[column] = int(h5file.get_node(node).nrows) if node in h5file else 0
+
+    if stats['n_waveforms'] > 0:
+        waveforms = h5file.get_node('/waveforms/readout')
+        first, last = waveforms[0], waveforms[-1]
+        stats.update(start=float(first['timestamp']), stop=float(last['timestamp']),
+                     first_cycle=int(first['cycle_number']), last_cycle=int(last['cycle_number']))
+    return stats
+
+
+def _abspath(path: typing.Optional[str]) -> typing.Optional[str]:
+    return None if path is None else os.path.abspath(path)
+
+
+class LogCatalog(object):
+    """
+    SQLite catalog of log files, see the module documentation.
+
+    A connection is opened for each operation, so a catalog can be used from any thread or process.
+    """
+
+    def __init__(self, log_dir: str = None):
+        """
+        Args:
+            log_dir (str): directory of the log files and catalog, default ``DATA_DIR``
+        """
+        if log_dir is None:
+            log_dir = prefs.get_pref('DATA_DIR')
+        self.log_dir = log_dir
+        self.db_file = os.path.join(log_dir, CATALOG_FILE)
+
+        rebuild = not os.path.exists(self.db_file)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        if rebuild:
+            self.rebuild()
+        elif self.count() != len(self._log_files()):
+            self.reconcile()
+
+    @contextlib.contextmanager
+    def _connect(self) -> typing.Iterator[sqlite3.Connection]:
+        """ A connection that commits when the block exits without an exception, and is then closed """
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def update(self, path: str, h5file: pytb.File = None):
+        """
+        Add or update the entry of a log file.
+
+        Args:
+            path (str): the log file
+            h5file (:class:`tables.File`): the file, if it is already open
+        """
+        path = os.path.abspath(path)
+        if h5file is not None and h5file.isopen:
+            stats = file_stats(h5file)
+        else:
+            with pytb.open_file(path, mode='r') as h5file:
+                stats = file_stats(h5file)
+
+        session, rotation = split_rotation(path)
+        stats.update(path=path, session=session, rotation=rotation, size=os.path.getsize(path), updated=time.time())
+        columns = ', '.join(stats.keys())
+        with self._connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO files ({columns}) VALUES ({", ".join("?" * len(stats))})',
+                         tuple(stats.values()))
+
+    def remove(self, path: str):
+        """ Remove the entry of a log file """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files WHERE path = ?', (os.path.abspath(path),))
+
+    def rotate(self, path: str, max_files: int):
+        """
+        Record that the rotations of ``path`` were each renamed to the next index by
+        :meth:`.DataLogger.rotation_newfile` , and that the file renamed to ``max_files`` overwrote any file there.
+
+        Args:
+            path (str): the file being written, index 0
+            max_files (int): highest index a file can be renamed to
+        """
+        session, _ = split_rotation(os.path.abspath(path))
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files WHERE session = ? AND rotation >= ?', (session, max_files))
+            rows = conn.execute('SELECT rotation FROM files WHERE session = ? ORDER BY rotation DESC',
+                                (session,)).fetchall()
+            for rotation, in rows:
+                conn.execute('UPDATE files SET rotation = ?, path = ? WHERE session = ? AND rotation = ?',
+                             (rotation + 1, f'{session}.{rotation + 1}.h5', session, rotation))
+
+        # the file that was being written is only indexed and updated later, count its size now
+        rotated = f'{session}.1.h5'
+        if os.path.exists(rotated):
+            self._add_size(rotated)
+
+    def _log_files(self) -> typing.List[str]:
+        """ Absolute paths of the log files in the directory, without following symbolic links """
+        paths = []
+        for filename in sorted(os.listdir(self.log_dir)):
+            path = os.path.abspath(os.path.join(self.log_dir, filename))
+            if filename.endswith('.h5') and not os.path.islink(path):
+                paths.append(path)
+        return paths
+
+    def _add_size(self, path: str):
+        """
+        Set the size of a file's entry, adding an entry with only its path and size if it has none.
+
+        For files that can't be read (not log files, or ones that were never closed), which still count towards the
+        quota.
+        """
+        session, rotation = split_rotation(path)
+        size = os.path.getsize(path)
+        with self._connect() as conn:
+            if conn.execute('UPDATE files SET size = ?, updated = ? WHERE path = ?',
+                            (size, time.time(), path)).rowcount == 0:
+                conn.execute('INSERT INTO files (path, session, rotation, size, updated) VALUES (?, ?, ?, ?, ?)',
+                             (path, session, rotation, size, time.time()))
+
+    def _add(self, path: str):
+        """ Add or update the entry of a file in the directory, with only its size if it can't be read """
+        try:
+            self.update(path)
+        except Exception:
+            self._add_size(path)
+
+    def rebuild(self):
+        """
+        Replace the catalog with entries for the log files in the directory, and drop entries of files that are gone.
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files')
+        for path in self._log_files():
+            self._add(path)
+
+    def reconcile(self):
+        """
+        Bring the catalog in line with the directory without reading the files that are already cataloged:
+        drop entries of files that are gone, add files that aren't cataloged, and refresh sizes that changed.
+
+        Only lists and stats the directory, so it is cheap enough to run when the quota looks exceeded.
+        """
+        paths = self._log_files()
+        with self._connect() as conn:
+            sizes = dict(conn.execute('SELECT path, size FROM files').fetchall())
+            conn.executemany('DELETE FROM files WHERE path = ?',
+                             [(path,) for path in sizes.keys() - set(paths)])
+        for path in paths:
+            if path not in sizes:
+                self._add(path)
+            elif os.path.getsize(path) != sizes[path]:
+                self._add_size(path)
+
+    def total_size(self, exclude: str = None) -> int:
+        """
+        Bytes used by the cataloged log files
+
+        Args:
+            exclude (str): a file not to count, eg. the file being written, whose entry is out of date
+        """
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM files WHERE path IS NOT ?',
+                                (_abspath(exclude),)).fetchone()[0]
+
+    def count(self, exclude: str = None) -> int:
+        """
+        Number of cataloged log files
+
+        Args:
+            exclude (str): a file not to count
+        """
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM files WHERE path IS NOT ?', (_abspath(exclude),)).fetchone()[0]
+
+    def find(self,
+             time: float = None,
+             start: float = None,
+             stop: float = None,
+             cycle: int = None,
+             session: str = None) -> typing.List[str]:
+        """
+        Log files with waveforms at ``time`` , overlapping ``start <= t < stop`` , and/or with breath ``cycle`` ,
+        oldest first.
+
+        Args:
+            time (float): a time the file covers
+            start (float): start of a time window the file overlaps
+            stop (float): end of the time window
+            cycle (int): a breath cycle in the file. Breath numbers restart each session, so usually used with ``session``
+            session (str): only files of this session, see :func:`.split_rotation`
+        """
+        terms, args = [], []
+        if time is not None:
+            terms.append('start <= ? AND stop >= ?')
+            args += [time, time]
+        if start is not None:
+            terms.append('stop >= ?')
+            args.append(start)
+        if stop is not None:
+            terms.append('start < ?')
+            args.append(stop)
+        if cycle is not None:
+            terms.append('first_cycle <= ? AND last_cycle >= ?')
+            args += [cycle, cycle]
+        if session is not None:
+            terms.append('session = ?')
+            args.append(session)
+        where = ' WHERE ' + ' AND '.join(terms) if terms else ''
+        with self._connect() as conn:
+            rows = conn.execute('SELECT path FROM files' + where + ' ORDER BY start', args).fetchall()
+        return [path for path, in rows]
+
+    def entries(self) -> typing.List[dict]:
+        """ All entries, as dicts of the catalog's columns, oldest first """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute('SELECT * FROM files ORDER BY start')]
@@ -7,8 +7,12 @@ and a :mod:`tables` - based :class:`.DataLogger` class to store continuously mea
 """
 import typing
 import shutil
+import subprocess
+import sys
 import traceback
 import os
+import glob
+import math
 import logging
 from datetime import datetime
 from logging import handlers
@@ -16,17 +20,20 @@ import scipy.io as sio
 
 
 import numpy as np
+import numpy.lib.recfunctions as rfn
 import tables as pytb
 
 if typing.TYPE_CHECKING:
     # from vent.common.message import SensorValues, ControlValues, ControlSetting
     from vent.common.message import SensorValues, ControlValues, DerivedValues, ControlSetting
+    from vent.alarm.alarm import Alarm
 
 
 # some global stack param
 MAX_STACK_DEPTH = 20
 
 from vent.common import prefs
+from vent.common.log_catalog import LogCatalog
 
 _LOGGERS = []
 """
@@ -133,6 +140,41 @@ class ContinuousData(pytb.IsDescription):
     oxygen       = pytb.Float64Col()
     cycle_number = pytb.UInt32Col()     # Max is 2147483647 Breath Cycles (~78 years)
 
+class CompactContinuousData(pytb.IsDescription):
+    """
+    Compact structure for the hdf5-table for continuous waveform data, used by a ``compact`` :class:`.DataLogger` .
+
+    Waveforms are quantized to 16 bits in blocks of rows, with the scale and offset of each block in a
+    :class:`.QuantizationBlock` table (see :func:`.quantize_block` ). :class:`.LogReader` restores them to
+    :class:`.ContinuousData` rows. Timestamps and cycle numbers are stored as they are, so they are queried and indexed
+    the same way.
+    """
+    timestamp    = pytb.Float64Col()
+    pressure     = pytb.UInt16Col()
+    flow_out     = pytb.UInt16Col()
+    control_in   = pytb.UInt16Col()
+    control_out  = pytb.UInt16Col()
+    oxygen       = pytb.UInt16Col()
+    cycle_number = pytb.UInt32Col()
+
+class QuantizationBlock(pytb.IsDescription):
+    """
+    Structure for the hdf5-table of the scale and offset of each block of :class:`.CompactContinuousData` rows:
+    ``value = offset + scale * stored value``
+    """
+    start_row          = pytb.UInt64Col()    # first row of the block in the waveform table
+    n_rows             = pytb.UInt32Col()
+    pressure_offset    = pytb.Float64Col()
+    pressure_scale     = pytb.Float64Col()
+    flow_out_offset    = pytb.Float64Col()
+    flow_out_scale     = pytb.Float64Col()
+    control_in_offset  = pytb.Float64Col()
+    control_in_scale   = pytb.Float64Col()
+    control_out_offset = pytb.Float64Col()
+    control_out_scale  = pytb.Float64Col()
+    oxygen_offset      = pytb.Float64Col()
+    oxygen_scale       = pytb.Float64Col()
+
 
 class ControlCommand(pytb.IsDescription):
     """
@@ -158,6 +200,282 @@ class CycleData(pytb.IsDescription):
     peep             =  pytb.Float64Col()    # estimated peep pressure
     vte              =  pytb.Float64Col()    # estimated End-Tidal Volume
 
+class AlarmEvent(pytb.IsDescription):
+    """
+    Structure for the hdf5-table to store alarm events. Appended whenever an alarm is emitted, including when it is cleared.
+    """
+    timestamp  = pytb.Float64Col()    # time the event was logged
+    alarm_type = pytb.StringCol(32)   # AlarmType name
+    severity   = pytb.StringCol(16)   # AlarmSeverity name
+    alarm_id   = pytb.UInt32Col()     # Alarm.id
+    start_time = pytb.Float64Col()
+    end_time   = pytb.Float64Col()    # nan if the alarm has not ended
+    value      = pytb.Float64Col()    # nan if the alarm has no value
+
+class WaveformSummary(pytb.IsDescription):
+    """
+    Structure for the hdf5-tables of decimated waveforms, one row per bin of a :data:`.SUMMARY_LEVELS` period.
+    """
+    timestamp        = pytb.Float64Col()    # start time of the bin
+    n_samples        = pytb.UInt32Col()     # number of waveform samples in the bin
+    cycle_number     = pytb.UInt32Col()     # breath cycle of the first sample in the bin
+    pressure_min     = pytb.Float64Col()
+    pressure_max     = pytb.Float64Col()
+    pressure_mean    = pytb.Float64Col()
+    flow_out_min     = pytb.Float64Col()
+    flow_out_max     = pytb.Float64Col()
+    flow_out_mean    = pytb.Float64Col()
+    control_in_min   = pytb.Float64Col()
+    control_in_max   = pytb.Float64Col()
+    control_in_mean  = pytb.Float64Col()
+    control_out_min  = pytb.Float64Col()
+    control_out_max  = pytb.Float64Col()
+    control_out_mean = pytb.Float64Col()
+    oxygen_min       = pytb.Float64Col()
+    oxygen_max       = pytb.Float64Col()
+    oxygen_mean      = pytb.Float64Col()
+
+SUMMARY_FIELDS = ('pressure', 'flow_out', 'control_in', 'control_out', 'oxygen')
+"""
+Waveform columns summarized in :class:`.WaveformSummary`
+"""
+
+SUMMARY_LEVELS = {
+    'level_100ms': 0.1,
+    'level_1s':    1,
+    'level_1min':  60
+}
+"""
+Tables of decimated waveforms in the ``/waveform_summary`` group of a :class:`.DataLogger` file, {name: bin period (s)},
+finest first
+"""
+
+
+class WaveformPyramid:
+    """
+    Incrementally decimates waveform samples into min/max/mean bins at each of a set of periods.
+
+    Samples are binned at the finest period, and each completed bin is merged into the bin of the next coarser period,
+    so adding a sample costs the same however many levels there are. Bins are aligned to multiples of their period,
+    and periods should be multiples of each other so each bin falls in one coarser bin.
+    """
+
+    def __init__(self, periods: typing.Iterable[float] = tuple(SUMMARY_LEVELS.values())):
+        """
+        Args:
+            periods (iterable): bin periods (s), finest first
+        """
+        self.periods = tuple(periods)
+        self._bins = [None] * len(self.periods)
+
+    def add(self, timestamp: float, cycle_number: int, values: typing.Sequence[float]) -> typing.List[tuple]:
+        """
+        Add a sample.
+
+        Args:
+            timestamp (float): time of the sample
+            cycle_number (int): breath cycle of the sample
+            values (sequence): values of :data:`.SUMMARY_FIELDS` , in order
+
+        Returns:
+            list: of ``(level, bin)`` for each bin that the sample completed, see :meth:`.row`
+        """
+        key = math.floor(timestamp / self.periods[0])
+        return self._add(0, [key, 1, cycle_number, list(values), list(values), list(values)])
+
+    def _add(self, level: int, new: list) -> typing.List[tuple]:
+        # a bin is [index of the bin since t=0, n_samples, cycle_number, mins, maxs, sums]
+        current = self._bins[level]
+        if current is not None and current[0] == new[0]:
+            current[1] += new[1]
+            current[3] = [min(a, b) for a, b in zip(current[3], new[3])]
+            current[4] = [max(a, b) for a, b in zip(current[4], new[4])]
+            current[5] = [a + b for a, b in zip(current[5], new[5])]
+            return []
+
+        self._bins[level] = new
+        if current is None:
+            return []
+        return self._complete(level, current)
+
+    def _complete(self, level: int, done: list) -> typing.List[tuple]:
+        # completed bins are returned with their start time rather than their index
+        completed = [(level, [done[0] * self.periods[level]] + done[1:])]
+        if level + 1 < len(self.periods):
+            # the coarser bin holding the middle of this one, robust to rounding of the bin edges
+            key = math.floor((done[0] + 0.5) * self.periods[level] / self.periods[level + 1])
+            completed.extend(self._add(level + 1, [key] + done[1:]))
+        return completed
+
+    def flush(self) -> typing.List[tuple]:
+        """
+        Complete the partially filled bins, eg. when the file is closed, and start over.
+
+        Returns:
+            list: of ``(level, bin)`` , see :meth:`.add`
+        """
+        completed = []
+        # finest first, so each partial bin is merged into its coarser bin before that one is completed
+        for level in range(len(self.periods)):
+            current, self._bins[level] = self._bins[level], None
+            if current is not None:
+                completed.extend(self._complete(level, current))
+        return completed
+
+    @staticmethod
+    def row(summary_bin: list, row):
+        """
+        Fill a :class:`.WaveformSummary` row from a completed bin
+
+        Args:
+            summary_bin (list): a bin returned by :meth:`.add` or :meth:`.flush`
+            row: ``table.row`` of a table of :class:`.WaveformSummary`
+        """
+        start, n_samples, cycle_number, mins, maxs, sums = summary_bin
+        row['timestamp']    = start
+        row['n_samples']    = n_samples
+        row['cycle_number'] = cycle_number
+        for field, min_value, max_value, sum_value in zip(SUMMARY_FIELDS, mins, maxs, sums):
+            row[field + '_min']  = min_value
+            row[field + '_max']  = max_value
+            row[field + '_mean'] = sum_value / n_samples
+
+
+LOG_TABLES = {
+    'waveforms':          ContinuousData,
+    'controls':           ControlCommand,
+    'derived_quantities': CycleData,
+    'alarms':             AlarmEvent
+}
+"""
+Tables in a :class:`.DataLogger` file, {group name: row description}. Each group has one table, ``readout``
+"""
+
+INDEXED_COLUMNS = {
+    'waveforms':          ('timestamp', 'cycle_number'),
+    'controls':           ('timestamp',),
+    'derived_quantities': ('timestamp', 'cycle_number'),
+    'alarms':             ('timestamp',)
+}
+"""
+Columns of each table that are indexed by :func:`.index_logfile` , so :class:`.LogReader` queries on them
+don't have to scan the whole table.
+"""
+
+
+COMPACT_FIELDS = ('pressure', 'flow_out', 'control_in', 'control_out', 'oxygen')
+"""
+Waveform columns quantized in :class:`.CompactContinuousData`
+"""
+
+COMPACT_BLOCK_ROWS = 1000
+"""
+Rows of waveforms quantized with the same scale and offset by a ``compact`` :class:`.DataLogger`
+"""
+
+_QUANTIZED_MAX = np.iinfo(np.uint16).max
+_QUANTIZED_NONFINITE = _QUANTIZED_MAX   # code of NaN and inf values, finite values are stored below it
+
+
+def quantize_block(rows: np.ndarray, start_row: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize a block of waveforms to 16 bits.
+
+    The stored integers span the range of each waveform's finite values in the block, so values are restored to within
+    1/131068 of that range -- finer than the 16 bit ADC they were measured with. Non-finite values (NaN and inf) are
+    stored as a reserved code, restored as NaN by :func:`.dequantize` .
+
+    Args:
+        rows (:class:`numpy.ndarray`): :class:`.ContinuousData` rows
+        start_row (int): row of the waveform table the block starts at
+
+    Returns:
+        tuple: (:class:`.CompactContinuousData` rows, :class:`.QuantizationBlock` row) as structured arrays
+    """
+    compact = np.zeros(len(rows), dtype=pytb.description.dtype_from_descr(CompactContinuousData))
+    block = np.zeros(1, dtype=pytb.description.dtype_from_descr(QuantizationBlock))
+    compact['timestamp'] = rows['timestamp']
+    compact['cycle_number'] = rows['cycle_number']
+    block['start_row'] = start_row
+    block['n_rows'] = len(rows)
+
+    for field in COMPACT_FIELDS:
+        values = rows[field]
+        is_finite = np.isfinite(values)
+        finite = values[is_finite]
+        low, high = (finite.min(), finite.max()) if len(finite) else (0., 0.)
+        scale = (high - low) / (_QUANTIZED_NONFINITE - 1) if high > low else 1.
+        codes = np.full(len(values), _QUANTIZED_NONFINITE, dtype=compact.dtype[field])
+        codes[is_finite] = np.clip(np.rint((finite - low) / scale), 0, _QUANTIZED_NONFINITE - 1)
+        compact[field] = codes
+        block[field + '_offset'] = low
+        block[field + '_scale'] = scale
+    return compact, block
+
+
+def dequantize(rows: np.ndarray, coords: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+    """
+    Restore :class:`.CompactContinuousData` rows to :class:`.ContinuousData` rows in physical units, with
+    non-finite values as NaN (see :func:`.quantize_block` )
+
+    Args:
+        rows (:class:`numpy.ndarray`): rows read from a compact waveform table
+        coords (:class:`numpy.ndarray`): the row number of each row in the table
+        blocks (:class:`numpy.ndarray`): all the :class:`.QuantizationBlock` rows of the table
+    """
+    restored = np.zeros(len(rows), dtype=pytb.description.dtype_from_descr(ContinuousData))
+    restored['timestamp'] = rows['timestamp']
+    restored['cycle_number'] = rows['cycle_number']
+    block = np.searchsorted(blocks['start_row'], coords, side='right') - 1
+    for field in COMPACT_FIELDS:
+        restored[field] = np.where(rows[field] == _QUANTIZED_NONFINITE, np.nan,
+                                   blocks[field + '_offset'][block] + rows[field] * blocks[field + '_scale'][block])
+    return restored
+
+
+def index_logfile(h5file: pytb.File):
+    """
+    Create the PyTables indexes in :data:`.INDEXED_COLUMNS` in a log file, or bring them up to date.
+
+    Indexes are not updated as rows are appended (``autoindex`` is turned off) so the control loop never pays for
+    them -- they are marked dirty instead, and updated the next time this is called, eg. when the
+    :class:`.DataLogger` closes or rotates the file.
+
+    Args:
+        h5file (:class:`tables.File`): log file, opened for writing
+    """
+    for group, columns in INDEXED_COLUMNS.items():
+        if '/' + group not in h5file:
+            continue
+        table = h5file.get_node('/' + group, 'readout')
+        for column in columns:
+            if not table.colinstances[column].is_indexed:
+                table.colinstances[column].create_index()
+        table.autoindex = False
+        table.reindex_dirty()
+        table.flush()
+
+
+def index_closed_logfile(filename: str):
+    """
+    Index a log file that is no longer being written (see :func:`.index_logfile` ), and update its entry in the
+    :class:`.LogCatalog` of its directory.
+
+    Indexing a full file takes seconds, so the :class:`.DataLogger` runs this in a separate process on the files it
+    rotates (see :meth:`.DataLogger.rotation_newfile` ). Any files can be indexed with
+    ``python -m vent.common.log_batch --index`` .
+
+    Args:
+        filename (str): the log file
+    """
+    with pytb.open_file(filename, mode='a') as h5file:
+        index_logfile(h5file)
+    LogCatalog(os.path.dirname(os.path.abspath(filename))).update(filename)
+
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
 class DataLogger:
     """
     Class for logging numerical respiration data and control settings.
@@ -165,6 +483,7 @@ class DataLogger:
         / root
         |--- waveforms (group)
         |    |--- time | pressure_data | flow_out | control_signal_in | control_signal_out | FiO2 | Cycle No.
+        |    |--- (compact files only) quantization: (first row, n rows, scale & offset of each waveform)
         |
         |--- controls (group)
         |    |--- (time, controllsignal)
@@ -172,17 +491,32 @@ class DataLogger:
         |--- derived_quantities (group)
         |    |--- (time, Cycle No, I_PHASE_DURATION, PIP_TIME, PEEP_time, PIP, PIP_PLATEAU, PEEP, VTE )
         |
+        |--- alarms (group)
+        |    |--- (time, alarm type, severity, alarm id, start time, end time, value)
+        |
+        |--- waveform_summary (group)
+        |    |--- level_100ms, level_1s, level_1min: (bin start, n samples, Cycle No., min/max/mean of each waveform)
         |
 
+    When the file is closed, the timestamp and cycle_number columns are indexed (see :func:`.index_logfile`), and
+    :class:`.LogReader` can query time windows or breath ranges without reading whole tables. A file that is rotated
+    (from the control loop, see :meth:`.rotation_newfile` ) is indexed in a separate process instead, so the loop
+    doesn't wait for it. Waveforms are also decimated as they are stored (see :class:`.WaveformPyramid` ), so
+    :meth:`.LogReader.read_overview` can draw long spans from a few thousand summary rows.
+
+    If ``compact`` (default the ``COMPACT_LOGS`` pref), waveforms are buffered into blocks of
+    :data:`.COMPACT_BLOCK_ROWS` and stored quantized to 16 bits (see :class:`.CompactContinuousData` ), which
+    :class:`.LogReader` converts back to physical units.
+
     Public Methods:
-        close_logfile():                      Flushes, and closes the logfile.
+        close_logfile():                      Flushes, indexes, and closes the logfile.
         store_waveform_data(SensorValues):    Takes data from SensorValues, but DOES NOT FLUSH
         store_controls():                     Store controls in the same file? TODO: Discuss
         flush_logfile():                      Flush the data into the file
 
     """
 
-    def __init__(self, compression_level : int = 9):
+    def __init__(self, compression_level : int = 9, compact : bool = None):
 
         # Logging the start of the DataLogger
         self.logger = init_logger(__name__)
@@ -208,11 +542,30 @@ class DataLogger:
             self.file = os.path.join(self.log_dir, date_string + '-' + str(c) + "_controller_log.0.h5")
             c = c + 1
 
+        # Catalog of the logfiles in the folder, so checking space doesn't scan it
+        try:
+            self.catalog = LogCatalog(self.log_dir)
+        except Exception as e:
+            self.logger.exception(f'Could not open the log catalog, scanning {self.log_dir} instead. Got exception\n    {e}')
+            self.catalog = None
+
         self.storage_used = self.check_files()  # Make sure there is space. Sum of all logfiles in bytes
 
         ## For data storage ##
         self.h5file = pytb.open_file(self.file, mode = "a")      # Open logfile
         self.compression_level = compression_level # From 1 to 9, see tables documentation
+        self._pyramid = WaveformPyramid()          # Decimates waveforms into /waveform_summary
+        self.summary_tables = []
+
+        # Compact files buffer waveforms into blocks to quantize
+        if compact is None:
+            compact = prefs.get_pref('COMPACT_LOGS')
+        self.compact = compact
+        self.quantization_table = None
+        self._block = np.zeros(COMPACT_BLOCK_ROWS, dtype=pytb.description.dtype_from_descr(ContinuousData))
+        self._block_rows = 0
+
+        self._indexers = []     # processes indexing rotated files, see rotation_newfile
 
     def __del__(self):
         self.close_logfile()
@@ -228,14 +581,33 @@ class DataLogger:
         if "/waveforms" not in self.h5file:
             self.logger.info('Generating /waveform table in: ' + self.file )
             group = self.h5file.create_group("/", 'waveforms', 'Respiration waveforms')
-            self.data_table = self.h5file.create_table(group, 'readout', ContinuousData, "Breath Cycles",
-                                                       filters = pytb.Filters(
-                                                           complevel=self.compression_level,
-                                                           complib='zlib'),
-                                                       expectedrows=1000000)
+            if self.compact:
+                # shuffle groups the bytes of the 16 bit values, so their slowly changing high bytes compress well
+                self.data_table = self.h5file.create_table(group, 'readout', CompactContinuousData, "Breath Cycles",
+                                                           filters = pytb.Filters(
+                                                               complevel=self.compression_level,
+                                                               complib='zlib',
+                                                               shuffle=True),
+                                                           expectedrows=1000000)
+                self.h5file.create_table(group, 'quantization', QuantizationBlock, "Waveform scales and offsets",
+                                         filters = pytb.Filters(
+                                             complevel=self.compression_level,
+                                             complib='zlib'),
+                                         expectedrows=1000)
+            else:
+                self.data_table = self.h5file.create_table(group, 'readout', ContinuousData, "Breath Cycles",
+                                                           filters = pytb.Filters(
+                                                               complevel=self.compression_level,
+                                                               complib='zlib'),
+                                                           expectedrows=1000000)
         else:
             self.data_table = self.h5file.root.waveforms.readout
 
+        if "/waveforms/quantization" in self.h5file:
+            self.quantization_table = self.h5file.root.waveforms.quantization
+        else:
+            self.quantization_table = None
+
         if "/controls" not in self.h5file:
             self.logger.info('Generating /controls table in: ' + self.file )
             group = self.h5file.create_group("/", 'controls', 'Control signal history')
@@ -258,13 +630,62 @@ class DataLogger:
         else:
             self.derived_table = self.h5file.root.derived_quantities.readout
 
-    def close_logfile(self):
+        if "/alarms" not in self.h5file:
+            self.logger.info('Generating /alarms table in: ' + self.file )
+            group = self.h5file.create_group("/", 'alarms', 'Alarm events')
+            self.alarm_table = self.h5file.create_table(group, 'readout', AlarmEvent, "Alarm Events",
+                                                        filters = pytb.Filters(
+                                                            complevel=self.compression_level,
+                                                            complib='zlib')
+                                                        )
+        else:
+            self.alarm_table = self.h5file.root.alarms.readout
+
+        if "/waveform_summary" not in self.h5file:
+            self.logger.info('Generating /waveform_summary tables in: ' + self.file )
+            group = self.h5file.create_group("/", 'waveform_summary', 'Decimated respiration waveforms')
+            for name, period in SUMMARY_LEVELS.items():
+                self.h5file.create_table(group, name, WaveformSummary, f"Waveforms min/max/mean every {period}s",
+                                         filters = pytb.Filters(
+                                             complevel=self.compression_level,
+                                             complib='zlib')
+                                         )
+        self.summary_tables = [self.h5file.get_node('/waveform_summary', name) for name in SUMMARY_LEVELS]
+
+    def close_logfile(self, index: bool = True, background: bool = False):
         """
-        Flushes & closes the open hdf file.
+        Flushes, indexes & closes the open hdf file.
+
+        Args:
+            index (bool): if ``False`` , don't index the file or update the catalog, eg. because the file will be
+                indexed in the background with :func:`.index_closed_logfile`
+            background (bool): index the file and update the catalog in a separate process once it is closed (see
+                :meth:`.wait_indexed` ), so closing doesn't wait for it, eg. when the controller stops
         """
         print("Saving in..." + self.file)
+        was_open = self.h5file.isopen
+        index_now = index and not background
+        if self.h5file.isopen and self.h5file.mode != 'r':
+            try:
+                self._store_block()
+                self._store_summaries(self._pyramid.flush())
+                for table in self.summary_tables:
+                    table.flush()
+                if index_now:
+                    index_logfile(self.h5file)
+            except Exception as e:
+                # unindexed logs can still be read, just more slowly
+                self.logger.exception(f'Could not summarize and index {self.file}, got exception\n    {e}')
         self.h5file.close() # Also flushes the remaining buffers
 
+        if was_open and index_now and self.catalog is not None:
+            try:
+                self.catalog.update(self.file)
+            except Exception as e:
+                self.logger.exception(f'Could not update the log catalog for {self.file}, got exception\n    {e}')
+        elif was_open and index and background:
+            self._index_in_background(self.file)
+
     def store_waveform_data(self, sensor_values: 'SensorValues', control_values: 'ControlValues'):
         """
         Appends a datapoint to the file.
@@ -272,15 +693,63 @@ class DataLogger:
         """
         if self._data_save_allowed:
             self._open_logfile()
-            datapoint                 = self.data_table.row
-            datapoint['timestamp']    = sensor_values.timestamp
-            datapoint['pressure']     = sensor_values.PRESSURE
-            datapoint['flow_out']     = sensor_values.FLOWOUT
-            datapoint['control_in']   = control_values.control_signal_in
-            datapoint['control_out']  = control_values.control_signal_out
-            datapoint['oxygen']       = sensor_values.FIO2
-            datapoint['cycle_number'] = sensor_values.breath_count
-            datapoint.append()
+            if self.quantization_table is not None:
+                self._buffer_waveform_data(sensor_values, control_values)
+            else:
+                datapoint                 = self.data_table.row
+                datapoint['timestamp']    = sensor_values.timestamp
+                datapoint['pressure']     = sensor_values.PRESSURE
+                datapoint['flow_out']     = sensor_values.FLOWOUT
+                datapoint['control_in']   = control_values.control_signal_in
+                datapoint['control_out']  = control_values.control_signal_out
+                datapoint['oxygen']       = sensor_values.FIO2
+                datapoint['cycle_number'] = sensor_values.breath_count
+                datapoint.append()
+
+            self._store_summaries(self._pyramid.add(
+                sensor_values.timestamp,
+                sensor_values.breath_count,
+                (sensor_values.PRESSURE, sensor_values.FLOWOUT, control_values.control_signal_in,
+                 control_values.control_signal_out, sensor_values.FIO2)
+            ))
+
+    def _buffer_waveform_data(self, sensor_values: 'SensorValues', control_values: 'ControlValues'):
+        """
+        Adds a datapoint to the block of waveforms of a compact file, and stores the block when it is full.
+        """
+        datapoint                 = self._block[self._block_rows]
+        datapoint['timestamp']    = sensor_values.timestamp
+        datapoint['pressure']     = sensor_values.PRESSURE
+        datapoint['flow_out']     = sensor_values.FLOWOUT
+        datapoint['control_in']   = control_values.control_signal_in
+        datapoint['control_out']  = control_values.control_signal_out
+        datapoint['oxygen']       = sensor_values.FIO2
+        datapoint['cycle_number'] = sensor_values.breath_count
+        self._block_rows += 1
+        if self._block_rows == len(self._block):
+            self._store_block()
+
+    def _store_block(self):
+        """
+        Quantizes the buffered waveforms of a compact file and appends them to the /waveforms tables.
+        """
+        if self._block_rows == 0:
+            return
+        compact, block = quantize_block(self._block[:self._block_rows], self.data_table.nrows)
+        self.data_table.append(compact)
+        self.quantization_table.append(block)
+        self._block_rows = 0
+
+    def _store_summaries(self, completed: typing.List[tuple]):
+        """
+        Appends completed :class:`.WaveformPyramid` bins to the /waveform_summary tables.
+        """
+        if completed:
+            self._open_logfile()
+        for level, summary_bin in completed:
+            row = self.summary_tables[level].row
+            WaveformPyramid.row(summary_bin, row)
+            row.append()
 
     def store_control_command(self, control_setting: 'ControlSetting'):
         """
@@ -316,32 +785,62 @@ class DataLogger:
             datapoint['vte']               = derived_values.vte
             datapoint.append()
 
+    def store_alarm_event(self, alarm: 'Alarm', timestamp: float = None):
+        """
+        Appends an alarm event to the hdf5 file.
+        NOTE: Also not flushed yet.
+
+        Args:
+            alarm (:class:`.Alarm`): emitted alarm
+            timestamp (float): time of the event, if ``None`` , the alarm's start time
+        """
+        if self._data_save_allowed:
+            self._open_logfile()
+            datapoint                = self.alarm_table.row
+            datapoint['timestamp']   = alarm.start_time if timestamp is None else timestamp
+            datapoint['alarm_type']  = alarm.alarm_type.name
+            datapoint['severity']    = alarm.severity.name
+            datapoint['alarm_id']    = alarm.id
+            datapoint['start_time']  = alarm.start_time
+            datapoint['end_time']    = alarm.alarm_end_time if alarm.alarm_end_time is not None else np.nan
+            datapoint['value']       = alarm.value if isinstance(alarm.value, (int, float)) else np.nan
+            datapoint.append()
+
     def flush_logfile(self):
         """
         This flushes the datapoints to the file.
         To be executed every other second, e.g. at the end of breath cycle.
         """
         if self._data_save_allowed:
+            self._store_block()
             self.data_table.flush()
+            if self.quantization_table is not None:
+                self.quantization_table.flush()
             self.control_table.flush()
+            self.alarm_table.flush()
+            for table in self.summary_tables:
+                table.flush()
 
     def check_files(self):
         """
         make sure that the file's are not getting too large.
-        """
-        total_size = 0
-        for filenames in os.listdir(self.log_dir):
-            fp = os.path.join(self.log_dir, filenames)
-            # skip if it is symbolic link
-            if (not os.path.islink(fp)) and fp.endswith('.h5'):
-                total_size += os.path.getsize(fp)
 
-        #Check file system
+        Sizes and the number of files come from the :class:`.LogCatalog` , rather than scanning the folder, plus the
+        size of the file being written, which is only cataloged when it is closed. If that looks over the limits, the
+        catalog is first reconciled with the folder (see :meth:`.LogCatalog.reconcile` ), so files that were deleted
+        or moved to free space don't keep logging off.
+        """
+        max_files = 1000
         total_space_hd, used, free = shutil.disk_usage('/')
         max_size = np.min([total_space_hd*0.2, 1e10])      # Limit to whatever is smaller, 20% of the file system or 10 GB
 
-        if len(os.listdir(self.log_dir)) > 1000:
-            message = f'Too many logfiles in {self.log_dir} (>1000 files). There are ' + str(len(os.listdir(self.log_dir))) + ' files. Delete some.'
+        total_size, n_files = self._storage()
+        if self.catalog is not None and (n_files > max_files or total_size > max_size):
+            self.catalog.reconcile()
+            total_size, n_files = self._storage()
+
+        if n_files > max_files:
+            message = f'Too many logfiles in {self.log_dir} (>{max_files} files). There are ' + str(n_files) + ' files. Delete some.'
             print(message)
             # self.logger.exception(message)  # Log a warning
             self._data_save_allowed = False # Stop data saving
@@ -354,11 +853,31 @@ class DataLogger:
             self._data_save_allowed = True  # Allow data saving
             return total_size  # size in bytes
 
+    def _storage(self) -> typing.Tuple[int, int]:
+        """ (bytes used by, number of) log files, see :meth:`.check_files` """
+        if self.catalog is not None:
+            active = os.path.exists(self.file)
+            total_size = self.catalog.total_size(exclude=self.file) + (os.path.getsize(self.file) if active else 0)
+            n_files = self.catalog.count(exclude=self.file) + active
+        else:
+            total_size = 0
+            for filenames in os.listdir(self.log_dir):
+                fp = os.path.join(self.log_dir, filenames)
+                # skip if it is symbolic link
+                if (not os.path.islink(fp)) and fp.endswith('.h5'):
+                    total_size += os.path.getsize(fp)
+            n_files = len(os.listdir(self.log_dir))
+        return total_size, n_files
+
     def rotation_newfile(self):
+        if not self._data_save_allowed:                                 # Logging is off: see whether space was freed
+            self.storage_used = self.check_files()
+            return
+
         logfile_size = os.path.getsize(self.file)                       # Measure active logfile "..._log.0.h5"
 
         if logfile_size > self._MAX_FILE_SIZE:                          # If too big:
-            self.close_logfile()                                        # Close current logfile
+            self.close_logfile(index = False)                           # Close current logfile, indexed below
 
             parts = self.file.split(".0.")                              # Go through all logfiles, and increase idx;  "..._log.0.h5" -> "..._log.1.h5" etc
             for file_idx in range(self._MAX_NUM_LOGFILES-1, -1, -1):    # Have to start at index of last allowed file
@@ -366,12 +885,53 @@ class DataLogger:
                 new_filename = parts[0] + '.' + str(file_idx + 1) + '.' + parts[1]
                 if os.path.exists(old_filename):                        # On only if logfile already exists
                     os.rename(old_filename, new_filename)
+            if self.catalog is not None:                                # Rename them in the catalog too
+                self.catalog.rotate(self.file, self._MAX_NUM_LOGFILES)
+            self._index_in_background(parts[0] + '.1.' + parts[1])      # Indexing takes seconds, not in the control loop
 
             self.h5file.close()                                         # Generate new file with right file structure
             self.h5file = pytb.open_file(self.file, mode = "w")
             self._open_logfile()
+            self.storage_used = self.check_files()                      # The rotated file now counts towards the limits
             self.logger.info('DataLogger: rotated to new file.')
 
+    def _index_in_background(self, filename: str):
+        """
+        Index a closed file and update its catalog entry with :func:`.index_closed_logfile` in a new process.
+
+        A process rather than a thread, since PyTables isn't thread-safe and holds the GIL, and not a
+        :class:`multiprocessing.Process` , which can't be started from a daemonic process like the
+        :mod:`~vent.coordinator.control_process` .
+        """
+        self._indexers = [indexer for indexer in self._indexers if indexer.poll() is None]
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [_PACKAGE_ROOT, env.get('PYTHONPATH')]))
+        try:
+            self._indexers.append(subprocess.Popen([sys.executable, '-m', 'vent.common.log_batch', '--index', filename],
+                                                   stdout=subprocess.DEVNULL, env=env))
+        except Exception as e:
+            # unindexed logs can still be read, just more slowly
+            self.logger.exception(f'Could not start indexing {filename}, got exception\n    {e}')
+
+    def wait_indexed(self, timeout: float = None) -> bool:
+        """
+        Wait for files indexed in the background to be indexed, see :meth:`.rotation_newfile` and
+        :meth:`.close_logfile`
+
+        Args:
+            timeout (float): seconds to wait for each file, default no limit
+
+        Returns:
+            bool: whether they all were indexed successfully
+        """
+        success = True
+        for indexer in self._indexers:
+            try:
+                success = indexer.wait(timeout) == 0 and success
+            except subprocess.TimeoutExpired:
+                success = False
+        return success
+
     def load_file(self, filename = None):
         """
         This loads a hdf5 file, and returns data to the user as a dictionary with two keys: waveform_data and control_data
@@ -387,6 +947,9 @@ class DataLogger:
 
             table = file.root.waveforms.readout
             waveform_data = table.read()
+            if "/waveforms/quantization" in file:
+                waveform_data = dequantize(waveform_data, np.arange(len(waveform_data)),
+                                           file.root.waveforms.quantization.read())
 
             table = file.root.controls.readout
             control_data = table.read()
@@ -394,72 +957,448 @@ class DataLogger:
             table = file.root.derived_quantities.readout
             derived_data = table.read()
 
-        data_dict = {"waveform_data": waveform_data, "control_data": control_data, "derived_data": derived_data}
+            # files from before alarm events were logged don't have an alarm table
+            if "/alarms" in file:
+                alarm_data = file.root.alarms.readout.read()
+            else:
+                alarm_data = np.zeros(0, dtype=pytb.description.dtype_from_descr(AlarmEvent))
+
+        data_dict = {"waveform_data": waveform_data, "control_data": control_data, "derived_data": derived_data,
+                     "alarm_data": alarm_data}
         return data_dict
 
-    def log2mat(self, filename = None):
+    def log2mat(self, filename = None, chunk_size: int = 100000):
         """
-        Translates the compressed hdf5 into a matlab file containing a matlab struct. This struct has the same structure as the hdf5 file, but is not compressed.
+        Translates the compressed hdf5 into a MATLAB v7.3 file containing a struct for each table (see
+        :func:`.export_mat` ). The file is written in chunks, so the log is never loaded into memory at once.
         Use for any file:
             dl = DataLogger()
             dl.log2mat(filename)
         """
         if filename == None:
             filename = self.file
+            self.close_logfile()
 
-        new_file = filename.split('h5')
-        new_filename = new_file[0] + '.mat'
-        # try:
-        dff = self.load_file(filename)
-        ls_wv = dff['waveform_data']
-        ls_dv = dff['derived_data']
-        ls_ct = dff['control_data']
-        matlab_data = {'waveforms': ls_wv, 'derived_quantities': ls_dv, 'control_commands': ls_ct}
-        sio.savemat(new_filename, matlab_data)
-        # except:
-            # print(filename + " not found.")
+        return export_mat(filename, chunk_size=chunk_size)
 
-
-    def log2csv(self, filename = None):
+    def log2csv(self, filename = None, chunk_size: int = 100000):
         """
         Translates the compressed hdf5 into three csv files containing:
             - waveform_data (measurement once per cycle)
             - derived_quantities (PEEP, PIP etc.)
             - control_commands (control commands sent to the controller)
 
-        This is the best proxy for the structure contained in the hdf5 file.
+        This is the best proxy for the structure contained in the hdf5 file. The files are written in chunks,
+        see :func:`.export_csv` .
 
         Use for any file:
             dl = DataLogger()
             dl.log2csv(filename)
         """
-        
         if filename == None:
             filename = self.file
-        new_file = filename.split('h5')
+            self.close_logfile()
 
         try:
-            dff = self.load_file(filename)
-            ls_wv = dff['waveform_data']
-            ls_dv = dff['derived_data']
-            ls_ct = dff['control_data']
-
-            # Waveform_data
-            new_filename = new_file[0] + "waveforms"+'.csv'
-            title = str(ls_wv.dtype.names)[1:-1]
-            title.replace("'",'')
-            np.savetxt(new_filename, ls_wv, delimiter=',', header=title, comments="")
-
-            # Derived quantities
-            new_filename = new_file[0] + "derived_quantities"+'.csv'
-            title = str(ls_dv.dtype.names)[1:-1]
-            title.replace("'",'')
-            np.savetxt(new_filename, ls_dv, delimiter=',', header=title, comments="")
-
-            # Control Commands
-            new_filename = new_file[0] + "control_commands"+'.csv'
-            title = str(ls_ct.dtype.names)[1:-1]
-            title.replace("'",'')
-            np.savetxt(new_filename, ls_ct, delimiter=',', header=title, fmt = ('%.18e,%.18e,%s,%.18e,%.18e'))
-        except:
+            return export_csv(filename, chunk_size=chunk_size)
+        except FileNotFoundError:
             print(filename + " not found.")
+
+
+class LogReader:
+    """
+    Reads time windows or breath ranges from a set of :class:`.DataLogger` files without loading whole tables.
+
+    Queries are run in-kernel by PyTables (:meth:`tables.Table.read_where` ), using the indexes created by
+    :func:`.index_logfile` where a file has them, and files whose waveforms or derived quantities don't overlap the
+    queried range are skipped without being searched. :meth:`.read` returns all matching rows at once,
+    :meth:`.iter_read` yields them in chunks so memory use stays bounded however large the result is. Waveforms of
+    compact files are returned in physical units, like those of other files.
+
+    Use eg. for all the rotated files of a session::
+
+        with LogReader.session(dl.file) as reader:
+            breaths = reader.read('derived_quantities', first_cycle=100, last_cycle=200)
+            for chunk in reader.iter_read('waveforms', start=t0, stop=t0+60):
+                ...
+    """
+
+    _ORDERED_TABLES = ('waveforms', 'derived_quantities')
+    """
+    Tables written in time order by the controller, so their first and last rows bound their timestamps and cycles
+    """
+
+    def __init__(self, files: typing.Union[str, typing.List[str]]):
+        """
+        Args:
+            files (str, list): a log file, a directory of log files, a glob pattern, or a list of log files
+        """
+        if isinstance(files, str):
+            if os.path.isdir(files):
+                files = glob.glob(os.path.join(files, '*.h5'))
+            elif not os.path.isfile(files):
+                files = glob.glob(files)
+            else:
+                files = [files]
+        if len(files) == 0:
+            raise FileNotFoundError('No log files found')
+
+        self.logger = init_logger(__name__)
+        self._h5files = [pytb.open_file(f, mode='r') for f in files]
+        self._quantization = {}  # quantization blocks of compact files, read once per file
+        # oldest first, files without waveforms at the end
+        self._h5files.sort(key=lambda h5file: self._range(h5file, 'waveforms', 'timestamp')[0])
+
+    @classmethod
+    def session(cls, filename: str) -> 'LogReader':
+        """
+        Read a log file and all the files it was rotated into by :meth:`.DataLogger.rotation_newfile`
+
+        Args:
+            filename (str): the active log file of the session, ``..._controller_log.0.h5``
+        """
+        parts = filename.split('.0.')
+        return cls(glob.glob(parts[0] + '.[0-9]*.' + parts[1]))
+
+    @property
+    def files(self) -> typing.List[str]:
+        """ The log files being read, oldest first """
+        return [h5file.filename for h5file in self._h5files]
+
+    @staticmethod
+    def _range(h5file: pytb.File, table: str, column: str) -> tuple:
+        """ First and last value of `column` in `table` , or (inf, inf) if the table is missing or empty """
+        node = '/' + table + '/readout'
+        if node not in h5file or h5file.get_node(node).nrows == 0:
+            return np.inf, np.inf
+        readout = h5file.get_node(node)
+        return readout[0][column], readout[-1][column]
+
+    def _tables(self, table: str, start: float, stop: float, first_cycle: int, last_cycle: int):
+        """ Yield the `table` s of the files that may have rows in the queried range """
+        if table not in LOG_TABLES:
+            raise ValueError(f'table must be one of {tuple(LOG_TABLES.keys())}, got {table}')
+
+        for h5file in self._h5files:
+            if '/' + table not in h5file:
+                continue
+            if table in self._ORDERED_TABLES:
+                first_time, last_time = self._range(h5file, table, 'timestamp')
+                if (start is not None and last_time < start) or (stop is not None and first_time >= stop):
+                    continue
+                first, last = self._range(h5file, table, 'cycle_number')
+                if (first_cycle is not None and last < first_cycle) or (last_cycle is not None and first > last_cycle):
+                    continue
+            yield h5file.get_node('/' + table, 'readout')
+
+    @staticmethod
+    def _condition(table: str, start: float, stop: float, first_cycle: int, last_cycle: int,
+                   bin_period: float = None) -> tuple:
+        """
+        PyTables condition string and its variables for the queried range, condition is None for all rows
+
+        With ``bin_period`` , rows are bins stamped with their start time (see :class:`.WaveformPyramid` ), and the bin
+        ``start`` falls in is included
+        """
+        terms, condvars = [], {}
+        if start is not None:
+            terms.append('(timestamp >= start)')
+            condvars['start'] = float(start)
+            if bin_period is not None:
+                # half a bin before the start of start's bin, robust to rounding of the bin edges
+                condvars['start'] = math.floor(start / bin_period) * bin_period - bin_period / 2
+        if stop is not None:
+            terms.append('(timestamp < stop)')
+            condvars['stop'] = float(stop)
+        if first_cycle is not None or last_cycle is not None:
+            if 'cycle_number' not in INDEXED_COLUMNS[table]:
+                raise ValueError(f'Table {table} has no cycle_number, query it by time')
+            if first_cycle is not None:
+                terms.append('(cycle_number >= first_cycle)')
+                condvars['first_cycle'] = int(first_cycle)
+            if last_cycle is not None:
+                terms.append('(cycle_number <= last_cycle)')
+                condvars['last_cycle'] = int(last_cycle)
+        if not terms:
+            return None, condvars
+        return ' & '.join(terms), condvars
+
+    def _decode(self, readout: pytb.Table, rows: np.ndarray, coords: np.ndarray = None) -> np.ndarray:
+        """
+        Restore rows of a compact waveform table (see :class:`.CompactContinuousData` ) to physical units,
+        rows of other tables are returned as they are.
+
+        Args:
+            readout (:class:`tables.Table`): the table the rows were read from
+            rows (:class:`numpy.ndarray`): the rows
+            coords (:class:`numpy.ndarray`): row number of each row, default the table's first ``len(rows)`` rows
+        """
+        if 'quantization' not in readout._v_parent:
+            return rows
+        filename = readout._v_file.filename
+        if filename not in self._quantization:
+            self._quantization[filename] = readout._v_parent.quantization.read()
+        if coords is None:
+            coords = np.arange(len(rows))
+        return dequantize(rows, coords, self._quantization[filename])
+
+    def _read_rows(self, readout: pytb.Table, condition: typing.Optional[str], condvars: dict) -> np.ndarray:
+        """ All rows of a table matching a condition from :meth:`._condition` , in physical units """
+        if condition is None:
+            return self._decode(readout, readout.read())
+        if 'quantization' in readout._v_parent:
+            # compact rows are decoded by their row number
+            coords = readout.get_where_list(condition, condvars, sort=True)
+            return self._decode(readout, readout.read_coordinates(coords), coords)
+        return readout.read_where(condition, condvars)
+
+    @staticmethod
+    def _fields(rows: np.ndarray, fields: typing.Optional[typing.List[str]]) -> np.ndarray:
+        if fields is None:
+            return rows
+        return rfn.repack_fields(rows[list(fields)])
+
+    def iter_read(self,
+                  table: str = 'waveforms',
+                  start: float = None,
+                  stop: float = None,
+                  first_cycle: int = None,
+                  last_cycle: int = None,
+                  fields: typing.List[str] = None,
+                  chunk_size: int = 100000) -> typing.Iterator[np.ndarray]:
+        """
+        Yield the rows of a table in the time window ``start <= timestamp < stop`` and the breath range
+        ``first_cycle <= cycle_number <= last_cycle`` , oldest first, in chunks of at most ``chunk_size`` rows.
+
+        Args:
+            table (str): one of the tables in :data:`.LOG_TABLES` , eg. ``'waveforms'``
+            start (float): earliest timestamp, or ``None`` for no limit
+            stop (float): timestamp to stop before, or ``None`` for no limit
+            first_cycle (int): first breath cycle, or ``None`` for no limit.
+                Only for tables with a ``cycle_number`` column.
+            last_cycle (int): last breath cycle (inclusive), or ``None`` for no limit
+            fields (list): names of the columns to return, default all
+            chunk_size (int): maximum number of rows in each chunk
+
+        Yields:
+            :class:`numpy.ndarray` : structured array of rows
+        """
+        condition, condvars = self._condition(table, start, stop, first_cycle, last_cycle)
+        for readout in self._tables(table, start, stop, first_cycle, last_cycle):
+            if condition is None:
+                for i in range(0, readout.nrows, chunk_size):
+                    rows = readout.read(i, i + chunk_size)
+                    yield self._fields(self._decode(readout, rows, np.arange(i, i + len(rows))), fields)
+                continue
+
+            coords = readout.get_where_list(condition, condvars, sort=True)
+            for i in range(0, len(coords), chunk_size):
+                rows = readout.read_coordinates(coords[i:i + chunk_size])
+                yield self._fields(self._decode(readout, rows, coords[i:i + chunk_size]), fields)
+
+    def read(self,
+             table: str = 'waveforms',
+             start: float = None,
+             stop: float = None,
+             first_cycle: int = None,
+             last_cycle: int = None,
+             fields: typing.List[str] = None) -> np.ndarray:
+        """
+        Read all the rows of a table in a time window and breath range, see :meth:`.iter_read` for the arguments.
+
+        Returns:
+            :class:`numpy.ndarray` : structured array of rows, oldest first
+        """
+        condition, condvars = self._condition(table, start, stop, first_cycle, last_cycle)
+        results = []
+        for readout in self._tables(table, start, stop, first_cycle, last_cycle):
+            results.append(self._fields(self._read_rows(readout, condition, condvars), fields))
+
+        if not results:
+            empty = np.zeros(0, dtype=pytb.description.dtype_from_descr(LOG_TABLES[table]))
+            return self._fields(empty, fields)
+        return np.concatenate(results)
+
+    def time_range(self) -> tuple:
+        """ First and last waveform timestamps in the log files, or (None, None) if there are no waveforms """
+        ranges = [self._range(h5file, 'waveforms', 'timestamp') for h5file in self._h5files]
+        ranges = [r for r in ranges if np.isfinite(r[0])]
+        if not ranges:
+            return None, None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def read_overview(self, start: float = None, stop: float = None, width: int = 1000) -> np.ndarray:
+        """
+        Read min/max/mean waveforms at a resolution fit to draw ``start`` to ``stop`` ``width`` pixels wide.
+
+        Uses the coarsest level in :data:`.SUMMARY_LEVELS` that still has at least ``width`` bins in the span. Spans
+        too short for any level, and files written before waveforms were summarized, are read from the raw waveforms,
+        with one sample per row (``n_samples == 1`` and min, max and mean equal).
+
+        Args:
+            start (float): earliest timestamp, or ``None`` for the start of the logs
+            stop (float): timestamp to stop before, or ``None`` for the end of the logs
+            width (int): width of the plot, in pixels
+
+        Returns:
+            :class:`numpy.ndarray` : structured array of :class:`.WaveformSummary` rows, oldest first.
+            Rows of bins that straddle ``start`` are included.
+        """
+        first, last = self.time_range()
+        if first is None:
+            return np.zeros(0, dtype=pytb.description.dtype_from_descr(WaveformSummary))
+        span = (last if stop is None else stop) - (first if start is None else start)
+
+        level, period = None, 0
+        for name, level_period in SUMMARY_LEVELS.items():
+            if span / level_period >= width:
+                level, period = name, level_period
+
+        condition, condvars = self._condition('waveforms', start, stop, None, None)
+        if level is not None:
+            bin_condition, bin_condvars = self._condition('waveforms', start, stop, None, None, bin_period=period)
+
+        results = []
+        for readout in self._tables('waveforms', start, stop, None, None):
+            h5file = readout._v_file
+            if level is not None and '/waveform_summary/' + level in h5file:
+                summary = h5file.get_node('/waveform_summary', level)
+                if bin_condition is None:
+                    results.append(summary.read())
+                else:
+                    results.append(summary.read_where(bin_condition, bin_condvars))
+            else:
+                results.append(self._as_summary(self._read_rows(readout, condition, condvars)))
+
+        if not results:
+            return np.zeros(0, dtype=pytb.description.dtype_from_descr(WaveformSummary))
+        return np.concatenate(results)
+
+    @staticmethod
+    def _as_summary(rows: np.ndarray) -> np.ndarray:
+        """ Raw waveform rows as one-sample :class:`.WaveformSummary` rows """
+        summary = np.zeros(len(rows), dtype=pytb.description.dtype_from_descr(WaveformSummary))
+        summary['timestamp'] = rows['timestamp']
+        summary['n_samples'] = 1
+        summary['cycle_number'] = rows['cycle_number']
+        for field in SUMMARY_FIELDS:
+            for stat in ('min', 'max', 'mean'):
+                summary[field + '_' + stat] = rows[field]
+        return summary
+
+    def close(self):
+        """ Close all the log files """
+        for h5file in self._h5files:
+            h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+EXPORT_TABLES = {
+    'waveforms':          'waveforms',
+    'derived_quantities': 'derived_quantities',
+    'controls':           'control_commands'
+}
+"""
+Tables written by :func:`.export_csv` and :func:`.export_mat` , {table: name of the exported csv file / MATLAB variable}
+"""
+
+_MAT_CLASSES = {
+    'float64': 'double',
+    'float32': 'single'
+}
+
+
+def export_csv(filename: str, chunk_size: int = 100000) -> typing.List[str]:
+    """
+    Write the tables of a log file to csv files, ``<filename without h5><table>.csv`` , one chunk of rows at a time so
+    memory use doesn't grow with the size of the log.
+
+    Args:
+        filename (str): the log file
+        chunk_size (int): rows to read and format at once
+
+    Returns:
+        list: the csv files written
+    """
+    new_file = filename.split('h5')
+    written = []
+    with LogReader(filename) as reader:
+        for table, name in EXPORT_TABLES.items():
+            new_filename = new_file[0] + name + '.csv'
+            dtype = pytb.description.dtype_from_descr(LOG_TABLES[table])
+            fmt = ['%s' if dtype[field].kind == 'S' else '%.18e' for field in dtype.names]
+            with open(new_filename, 'w') as csv_file:
+                csv_file.write(','.join(dtype.names) + '\n')
+                for chunk in reader.iter_read(table, chunk_size=chunk_size):
+                    np.savetxt(csv_file, chunk, delimiter=',', fmt=fmt)
+            written.append(new_filename)
+    return written
+
+
+def export_mat(filename: str, chunk_size: int = 100000) -> str:
+    """
+    Write the tables of a log file to a MATLAB v7.3 (HDF5-based) mat file, ``<filename without h5>.mat`` , one chunk of
+    rows at a time so memory use doesn't grow with the size of the log.
+
+    Each table in :data:`.EXPORT_TABLES` is a struct of column vectors, eg. ``waveforms.pressure`` . String columns
+    are char matrices with one row per entry.
+
+    Args:
+        filename (str): the log file
+        chunk_size (int): rows to read and write at once
+
+    Returns:
+        str: the mat file written
+    """
+    new_filename = filename.split('h5')[0] + '.mat'
+
+    # MATLAB reads HDF5 files with a 512 byte user block holding its header,
+    # without the attributes PyTables adds to each node
+    with LogReader(filename) as reader, \
+            pytb.open_file(new_filename, mode='w', user_block_size=512, pytables_sys_attrs=False) as mat_file:
+        for table, name in EXPORT_TABLES.items():
+            group = mat_file.create_group('/', name)
+            group._v_attrs.MATLAB_class = np.bytes_('struct')
+            dtype = pytb.description.dtype_from_descr(LOG_TABLES[table])
+            n_rows = sum(readout.nrows for readout in reader._tables(table, None, None, None, None))
+
+            columns = {}
+            for field in dtype.names:
+                # MATLAB reverses the dimensions of HDF5 datasets, so (1, n) is an n x 1 column
+                if dtype[field].kind == 'S':
+                    atom, shape = pytb.UInt16Atom(), (dtype[field].itemsize, 0)
+                    mat_class = 'char'
+                else:
+                    atom, shape = pytb.Atom.from_dtype(dtype[field]), (1, 0)
+                    mat_class = _MAT_CLASSES.get(dtype[field].name, dtype[field].name)
+                columns[field] = mat_file.create_earray(group, field, atom, shape, expectedrows=max(n_rows, 1))
+                columns[field]._v_attrs.MATLAB_class = np.bytes_(mat_class)
+
+            for chunk in reader.iter_read(table, chunk_size=chunk_size):
+                for field, column in columns.items():
+                    if dtype[field].kind == 'S':
+                        chars = np.ascontiguousarray(chunk[field]).view(np.uint8).reshape(len(chunk), -1)
+                        column.append(chars.T.astype(np.uint16))
+                    else:
+                        column.append(chunk[field].reshape(1, -1))
+
+            if n_rows == 0:
+                for column in columns.values():
+                    column._v_attrs.MATLAB_empty = np.uint8(1)
+
+    _write_mat_header(new_filename)
+    return new_filename
+
+
+def _write_mat_header(filename: str):
+    """ Write the MATLAB v7.3 header into the user block of an HDF5 file """
+    text = 'MATLAB 7.3 MAT-file, Platform: {}, Created on: {} HDF5 schema 1.00 .'.format(
+        os.name, datetime.now().strftime('%a %b %d %H:%M:%S %Y'))
+    header = text.encode('ascii').ljust(116, b' ') + b' ' * 8 + b'\x00\x02' + b'IM'
+    with open(filename, 'r+b') as mat_file:
+        mat_file.write(header)
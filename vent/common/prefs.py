@@ -46,7 +46,20 @@ _DEFAULTS = {
     'CONTROLLER_LOOP_UPDATE_TIME': 0.0,
     'CONTROLLER_LOOPS_UNTIL_UPDATE': 1, # update copied values like get_sensor every n loops,
     'CONTROLLER_RINGBUFFER_SIZE': 100,
-    'COUGH_DURATION': 0.1
+    'COUGH_DURATION': 0.1,
+    'CONTROLLER_ALARMS': False, # run the alarm manager on every control loop sample in the controller process
+    'CONTROLLER_ALARM_EVENTS': 1000, # max number of alarm events queued in the controller until the coordinator collects them
+    'ALARM_LOG_SIZE': 10000, # number of alarm events kept in memory by the alarm manager
+    'FLIGHT_RECORDER': True, # keep the last minutes of controller data in a crash-safe ring file when saving logs
+    'FLIGHT_RECORDER_MINUTES': 10,
+    'COMPACT_LOGS': False, # store waveforms quantized to 16 bits rather than as 64 bit floats
+    'GUI_FPS': 20, # frames per second the GUI repaints at
+    'COORDINATOR_TIMEOUT': 1.0, # seconds the GUI waits for a reply from the controller before abandoning a request
+    'WATCHDOG_INTERVAL': 0.05, # seconds between checks of the controller's heartbeat by the process manager's watchdog
+    'WATCHDOG_TIMEOUT': 0.5, # seconds without a heartbeat before the watchdog restarts the controller
+    'WATCHDOG_BUSY_TIMEOUT': 30, # seconds without a heartbeat before the watchdog restarts a controller in a known long operation
+    'ISOLATE_CONTROL_LOOP': False, # run the control loop in its own process, apart from the RPC server
+    'CONTROL_LOOP_CPUS': None # list of CPUs to pin the isolated control loop process to, None for any
 }
 """
 Declare all available parameters and set default values. If no default, set as None. 
@@ -57,6 +70,16 @@ Declare all available parameters and set default values. If no default, set as N
 * ``DATA_DIR``: ~/vent/data - for storage of waveform data
 * ``LOGGING_MAX_BYTES`` : the **total** storage space for all loggers -- each logger gets ``LOGGING_MAX_BYTES/len(loggers)`` space
 * ``LOGGING_MAX_FILES`` : number of files to split each logger's logs across
+* ``CONTROLLER_ALARMS`` : if ``True`` , the controller checks alarm rules every control loop rather than leaving it to the GUI's polled values
+* ``CONTROLLER_ALARM_EVENTS`` : size of the queue of alarm transitions the controller keeps for the coordinator
+* ``ALARM_LOG_SIZE`` : number of alarm events kept in the alarm manager's history, older events are only kept in the data log
+* ``FLIGHT_RECORDER`` : if ``True`` , a controller that saves logs also records to a :class:`.FlightRecorder` in ``DATA_DIR``
+* ``FLIGHT_RECORDER_MINUTES`` : minutes of control loop samples kept by the flight recorder
+* ``COMPACT_LOGS`` : if ``True`` , the :class:`.DataLogger` stores waveforms as :class:`.CompactContinuousData`
+* ``GUI_FPS`` : frames per second of the GUI's :class:`~vent.gui.render.RenderClock` , independent of how often it fetches data
+* ``COORDINATOR_TIMEOUT`` : deadline of the GUI's requests to the controller, see :class:`~vent.coordinator.async_coordinator.AsyncCoordinator`
+* ``WATCHDOG_INTERVAL`` , ``WATCHDOG_TIMEOUT`` : how often the :class:`.ProcessManager` checks the controller's heartbeat, and how long it may stall before it is restarted. ``WATCHDOG_BUSY_TIMEOUT`` : how long it may stall in a known long operation, like rotating the log file (see :meth:`.ControlModuleBase.get_busy` )
+* ``ISOLATE_CONTROL_LOOP`` , ``CONTROL_LOOP_CPUS`` : if ``True`` , the controller process runs the control loop in a separate process, optionally pinned to ``CONTROL_LOOP_CPUS`` , see :mod:`~vent.coordinator.control_process`
 """
 
 def set_pref(key: str, val):
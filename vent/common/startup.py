@@ -0,0 +1,51 @@
+"""
+Timeline of starting the ventilator.
+
+Steps of startup are marked with :func:`.mark` , which logs the time since :mod:`vent` was first imported, so the
+time to the first waveform on screen (and what it was spent on) can be read from the logs::
+
+    startup: controller spawned at 0.412 s
+    startup: gui shown at 1.350 s
+    startup: controller ready at 1.581 s
+    startup: first waveform at 1.702 s
+
+:func:`.timeline` returns the marks of this process. A controller forked from this process
+(see :class:`.ProcessManager` ) shares the same start time, so its marks line up with the GUI's in the logs.
+"""
+
+import time
+import typing
+
+_START = time.perf_counter()
+
+_TIMELINE = []
+
+_LOGGER = None
+
+
+def mark(event: str) -> float:
+    """
+    Record and log that ``event`` happened now
+
+    Args:
+        event (str): what happened, eg. ``'gui shown'``
+
+    Returns:
+        float: seconds since startup
+    """
+    elapsed = time.perf_counter() - _START
+    _TIMELINE.append((event, elapsed))
+
+    if globals()['_LOGGER'] is None:
+        # import here, so this module can be imported before prefs are initialized
+        from vent.common.loggers import init_logger
+        globals()['_LOGGER'] = init_logger(__name__)
+    globals()['_LOGGER'].info(f'startup: {event} at {elapsed:.3f} s')
+    return elapsed
+
+
+def timeline() -> typing.List[typing.Tuple[str, float]]:
+    """
+    Events marked so far in this process, as (event, seconds since startup), in order
+    """
+    return list(_TIMELINE)
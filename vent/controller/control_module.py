@@ -1,3 +1,5 @@
+import contextlib
+import ctypes
 import time
 import typing
 from typing import List
@@ -9,12 +11,14 @@ import pdb
 from itertools import count
 
 import vent.io as io
+from vent.controller.scheduler import SensorScheduler, ScheduledSensor
 
 from vent.common.message import SensorValues, ControlValues, ControlSetting, DerivedValues
 from vent.common.loggers import init_logger, DataLogger
+from vent.common.flight_recorder import FlightRecorder
 from vent.common.values import CONTROL, ValueName
 from vent.common.utils import timeout
-from vent.alarm import ALARM_RULES, AlarmType, AlarmSeverity, Alarm
+from vent.alarm import ALARM_RULES, AlarmType, AlarmSeverity, Alarm, Alarm_Manager
 from vent import prefs
 
 
@@ -37,14 +41,21 @@ class ControlModuleBase:
     Public Methods:
         - get_sensors():                     Returns a copy of the current sensor values.
         - get_alarms():                      Returns a List of all alarms, active and logged
+        - get_alarm_events():                Returns alarm transitions since the last call, and clears them
         - get_control(ControlSetting):       Sets a controll-setting. Is updated at latest within self._NUMBER_CONTROLL_LOOPS_UNTIL_UPDATE
         - get_past_waveforms():              Returns a List of waveforms of pressure and volume during at the last N breath cycles, N<self. _RINGBUFFER_SIZE, AND clears this archive.
         - start():                           Starts the main-loop of the controller
         - stop():                            Stops the main-loop of the controller
+        - get_heartbeat(), get_busy():       The loop counter, and how long the loop has been in a known long operation
         - set_control():                     Set the control
 
     """
 
+    _ALARM_LOOP_VALUES = (ValueName.PRESSURE, ValueName.FLOWOUT, ValueName.FIO2)
+    """
+    Values that change every control loop -- alarm rules that depend on them are checked every loop, see :meth:`._update_alarms`
+    """
+
     def __init__(self, save_logs: bool = False, flush_every: int = 10):
         """
 
@@ -102,6 +113,17 @@ class ControlModuleBase:
 
         self.sensor_stuck_since = None
 
+        # Alarm transitions (HAPA, technical alerts, and Alarm_Manager emissions) queued for the coordinator
+        self._alarm_events = deque(maxlen = prefs.get_pref('CONTROLLER_ALARM_EVENTS'))
+        self._alarm_values = None           # SensorValues reused for each control loop sample
+
+        # Optionally run the Alarm_Manager rules on every control loop sample, see _update_alarms()
+        # The manager is shared by everything in the process, so the callback is only added while checking alarms
+        self._alarm_manager = None
+        self._alarm_callback_added = False
+        if prefs.get_pref('CONTROLLER_ALARMS'):
+            self._alarm_manager = Alarm_Manager()
+
         #########################  Data management  #########################
 
         # These are measurements from the last breath cycle.
@@ -146,6 +168,11 @@ class ControlModuleBase:
         ###########################  Threading init  #########################
         # Run the start() method as a thread
         self._loop_counter = 0
+        self._loop_times = deque(maxlen = 10000)     # Durations of the most recent main loop cycles
+        self._loop_times_count = 0                   # Cycles timed so far, see get_loop_times()
+        # When the main loop started a known long operation (time.time()), 0 if it isn't in one, see get_busy().
+        # A ctypes value, so the control_process can share it with the watchdog's process
+        self._busy_since = ctypes.c_double(0)
         self._running = threading.Event()
         self._running.clear()
         self._lock = threading.Lock()
@@ -166,6 +193,20 @@ class ControlModuleBase:
                 self.logger.exception(f'couldnt start data logger, not saving logs. Got exception\n    {e}')
                 self._save_logs = False
 
+        # Alarm events emitted in the control loop are stored along with the data
+        # (detached again when stopped, see _detach_data_logger)
+        if self._alarm_manager is not None and self.dl is not None:
+            with self._alarm_manager.lock:
+                self._alarm_manager.alarm_log.data_logger = self.dl
+
+        # Crash-safe ring of the last minutes of samples, settings and alarm events, survives the process dying
+        self._flight_recorder = None
+        if self._save_logs and prefs.get_pref('FLIGHT_RECORDER'):
+            try:
+                self._flight_recorder = FlightRecorder()
+            except OSError as e:
+                self.logger.exception(f'couldnt start flight recorder, not recording. Got exception\n    {e}')
+
         ####################### Internal health checks ###########################
         self._time_last_contact = time.time()
         self._critical_time     = prefs.get_pref('HEARTBEAT_TIMEOUT')           #If Controller has not received set/get within the last 200 ms, it gets nervous.
@@ -179,8 +220,12 @@ class ControlModuleBase:
         self._adaptivecontroller = PredictivePID(self._waveform)
 
     def __del__(self):
+        self._remove_alarm_callback()
+        self._detach_data_logger()
         if self._save_logs:
             self.dl.close_logfile()
+        if self._flight_recorder is not None:
+            self._flight_recorder.close()
 
     def _initialize_set_to_COPY(self):
         with self._lock:
@@ -304,37 +349,50 @@ class ControlModuleBase:
 
     def set_control(self, control_setting: ControlSetting):
         ''' Updates the entry of COPY contained in the control settings'''
+        self.set_controls([control_setting])
+
+    def set_controls(self, control_settings: typing.Iterable[ControlSetting]):
+        """
+        Update several control settings at once: the main loop sees either none or all of them.
+
+        Args:
+            control_settings (iterable): of :class:`.ControlSetting` , applied in order
+        """
+        with self._lock:
+            for control_setting in control_settings:
+                self._set_control(control_setting)
+
+        self._time_last_contact = time.time()
 
+    def _set_control(self, control_setting: ControlSetting):
+        ''' Updates the entry of COPY contained in the control settings, with the lock held'''
 
         if control_setting.value is not None:
-            with self._lock:
-                if control_setting.name == ValueName.PIP:
-                    self.COPY_SET_PIP = control_setting.value
-                elif control_setting.name == ValueName.PIP_TIME:
-                    self.COPY_SET_PIP_TIME = control_setting.value
-                elif control_setting.name == ValueName.PEEP:
-                    self.COPY_SET_PEEP = control_setting.value
-                elif control_setting.name == ValueName.BREATHS_PER_MINUTE:
-                    self.COPY_SET_BPM = control_setting.value
-                elif control_setting.name == ValueName.INSPIRATION_TIME_SEC:
-                    self.COPY_SET_I_PHASE = control_setting.value
-                elif control_setting.name == ValueName.PEEP_TIME:
-                    self.COPY_SET_PEEP_TIME = control_setting.value
-                else:
-                    self.logger.warning(f'Could not set control {control_setting.name}, no corresponding variable in controller')
-                    return
+            if control_setting.name == ValueName.PIP:
+                self.COPY_SET_PIP = control_setting.value
+            elif control_setting.name == ValueName.PIP_TIME:
+                self.COPY_SET_PIP_TIME = control_setting.value
+            elif control_setting.name == ValueName.PEEP:
+                self.COPY_SET_PEEP = control_setting.value
+            elif control_setting.name == ValueName.BREATHS_PER_MINUTE:
+                self.COPY_SET_BPM = control_setting.value
+            elif control_setting.name == ValueName.INSPIRATION_TIME_SEC:
+                self.COPY_SET_I_PHASE = control_setting.value
+            elif control_setting.name == ValueName.PEEP_TIME:
+                self.COPY_SET_PEEP_TIME = control_setting.value
+            else:
+                self.logger.warning(f'Could not set control {control_setting.name}, no corresponding variable in controller')
+                return
 
-                if self._save_logs:
-                    self.dl.store_control_command(control_setting)
+            if self._save_logs:
+                self.dl.store_control_command(control_setting)
+            if self._flight_recorder is not None:
+                self._flight_recorder.record_setting(control_setting)
 
         # PIP will pass the HAPA limit in the max_value parameter
         if control_setting.name == ValueName.PIP:
             if control_setting.max_value is not None:
-                with self._lock:
-                    self.limit_hapa = control_setting.max_value
-
-
-        self._time_last_contact = time.time()
+                self.limit_hapa = control_setting.max_value
 
 
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
@@ -429,6 +487,7 @@ class ControlModuleBase:
                                   AlarmSeverity.HIGH,
                                   time.time(),
                                   value=self._DATA_PRESSURE)
+                self._emit_alarm_event(self.HAPA)
             if time.time() - self.HAPA.start_time > self.cough_duration:       # 100 ms active to avoid being triggered by coughs
                 self.__SET_PIP = 30                 # Default: PIP to 30
                 for i in range(5):                   # Make sure to send this command for 100ms -> release pressure immediately
@@ -439,7 +498,8 @@ class ControlModuleBase:
                 self.logger.warning(f'Triggered HAPA at ' + str(self._DATA_PRESSURE))
             else:
                 print("Transient high pressure; probably a cough.")
-        else:
+        elif self.HAPA is not None:
+            self._emit_alarm_cleared(self.HAPA)
             self.HAPA = None
 
         #### Second: Check for Technical Alerts via data plausibility:
@@ -465,8 +525,10 @@ class ControlModuleBase:
                         AlarmType.SENSORS_STUCK,
                         AlarmSeverity.TECHNICAL,
                     ))
+                    self._emit_alarm_event(self.TECHA[-1])
         else:
             self.sensor_stuck_since = None                           # If ok, reset sensor_stuck
+            self._clear_technical_alert(AlarmType.SENSORS_STUCK)
 
 
         data_implausible = (self.COPY_DATA_OXYGEN < 0 or self.COPY_DATA_OXYGEN > 100) or \
@@ -478,6 +540,9 @@ class ControlModuleBase:
                     AlarmType.BAD_SENSOR_READINGS,
                     AlarmSeverity.TECHNICAL,
                 ))
+                self._emit_alarm_event(self.TECHA[-1])
+        else:
+            self._clear_technical_alert(AlarmType.BAD_SENSOR_READINGS)
 
         #### Third: Make sure that updates are coming in in a regular basis
         #
@@ -489,9 +554,244 @@ class ControlModuleBase:
                     AlarmSeverity.TECHNICAL,
                     message=f"Controller has not heard from coordinator in {last_contact}"
                 ))
+                self._emit_alarm_event(self.TECHA[-1])
+        else:
+            self._clear_technical_alert(AlarmType.MISSED_HEARTBEAT)
 
         #self.TECHA = time.time()  # Technical alert, but continue running hoping for the best
 
+    def _emit_alarm_event(self, alarm: Alarm):
+        """
+        Queue an alarm transition for :meth:`.get_alarm_events` , and record it in the flight recorder.
+        """
+        self._alarm_events.append(alarm)
+        if self._flight_recorder is not None:
+            self._flight_recorder.record_alarm(alarm)
+
+    def _remove_alarm_callback(self):
+        if self._alarm_callback_added:
+            self._alarm_manager.remove_callback(self._emit_alarm_event)
+            self._alarm_callback_added = False
+
+    def _detach_data_logger(self):
+        """
+        Stop storing alarm events in our :class:`.DataLogger` , whose file is closed when we stop. The
+        :class:`.Alarm_Manager` and its log are shared, so only if a later controller hasn't attached its own.
+        """
+        if self._alarm_manager is not None and self.dl is not None:
+            with self._alarm_manager.lock:
+                if self._alarm_manager.alarm_log.data_logger is self.dl:
+                    self._alarm_manager.alarm_log.data_logger = None
+
+    def _emit_alarm_cleared(self, alarm: Alarm):
+        """
+        Queue the end of an alarm raised by the controller itself, as a copy with :attr:`.AlarmSeverity.OFF`
+        """
+        self._emit_alarm_event(Alarm(alarm.alarm_type,
+                                     AlarmSeverity.OFF,
+                                     time.time(),
+                                     value=alarm.value,
+                                     message=alarm.message))
+
+    def _clear_technical_alert(self, alarm_type: AlarmType):
+        """
+        Remove a technical alert from :attr:`.TECHA` , if it's there, and queue its end
+        """
+        cleared = [a for a in self.TECHA if a.alarm_type == alarm_type]
+        if cleared:
+            # rebind rather than mutate, get_alarms() may be reading the list
+            self.TECHA = [a for a in self.TECHA if a.alarm_type != alarm_type]
+            for alarm in cleared:
+                self._emit_alarm_cleared(alarm)
+
+    def _update_alarms(self, new_breath: bool = False):
+        """
+        Check the :class:`.Alarm_Manager` rules against the current control loop sample.
+
+        To keep the cost per loop bounded, only the rules that depend on per-sample values
+        (:attr:`._ALARM_LOOP_VALUES`) are checked every loop, and a single :class:`.SensorValues`
+        is updated in place rather than instantiated. All rules are checked once per breath,
+        when the derived values (PIP, PEEP, VTE, ...) change. Alarm transitions are queued
+        by the manager's callback and returned by :meth:`.get_alarm_events`.
+
+        The callback is added to the manager on the first call, and removed by :meth:`.stop` .
+
+        Args:
+            new_breath (bool): if a new breath cycle has just started, check all rules.
+        """
+        if self._alarm_values is None:
+            self._alarm_values = SensorValues(vals={
+                ValueName.PIP.name                  : self._DATA_PIP,
+                ValueName.PEEP.name                 : self._DATA_PEEP,
+                ValueName.FIO2.name                 : self.COPY_DATA_OXYGEN,
+                ValueName.PRESSURE.name             : self._DATA_PRESSURE,
+                ValueName.VTE.name                  : self._DATA_VTE,
+                ValueName.BREATHS_PER_MINUTE.name   : self._DATA_BPM,
+                ValueName.INSPIRATION_TIME_SEC.name : self._DATA_I_PHASE,
+                ValueName.FLOWOUT.name              : self._DATA_Qout,
+                'timestamp'                         : time.time(),
+                'loop_counter'                      : self._loop_counter,
+                'breath_count'                      : self._DATA_BREATH_COUNT
+            })
+
+        if not self._alarm_callback_added:
+            self._alarm_manager.add_callback(self._emit_alarm_event)
+            self._alarm_callback_added = True
+
+        values = self._alarm_values
+        values.PRESSURE     = self._DATA_PRESSURE
+        values.FLOWOUT      = self._DATA_Qout
+        values.FIO2         = self.COPY_DATA_OXYGEN
+        values.timestamp    = time.time()
+        values.loop_counter = self._loop_counter
+        values.breath_count = self._DATA_BREATH_COUNT
+
+        try:
+            # derived values are None until the first waveform has been analyzed
+            if new_breath and self._DATA_VTE is not None:
+                values.PIP                  = self._DATA_PIP
+                values.PEEP                 = self._DATA_PEEP
+                values.VTE                  = self._DATA_VTE
+                values.BREATHS_PER_MINUTE   = self._DATA_BPM
+                values.INSPIRATION_TIME_SEC = self._DATA_I_PHASE
+                self._alarm_manager.update(values)
+            else:
+                self._alarm_manager.update(values, self._ALARM_LOOP_VALUES)
+        except Exception as e:
+            # never let an alarm rule stop the control loop
+            self.logger.exception(f'Error checking alarm rules, got exception:\n    {e}')
+
+    def get_controls(self) -> typing.Dict[ValueName, ControlSetting]:
+        """
+        Gets values of the COPY of all control settings at once, see :meth:`.get_control`
+        """
+        with self._lock:
+            controls = {
+                ValueName.PIP                  : self.COPY_SET_PIP,
+                ValueName.PIP_TIME             : self.COPY_SET_PIP_TIME,
+                ValueName.PEEP                 : self.COPY_SET_PEEP,
+                ValueName.BREATHS_PER_MINUTE   : self.COPY_SET_BPM,
+                ValueName.INSPIRATION_TIME_SEC : self.COPY_SET_I_PHASE,
+                ValueName.PEEP_TIME            : self.COPY_SET_PEEP_TIME
+            }
+        self._time_last_contact = time.time()
+        return {name: ControlSetting(name, value) for name, value in controls.items()}
+
+    def get_active_alarms(self) -> typing.Dict[AlarmType, Alarm]:
+        """
+        Alarms currently active in the controller's :class:`.Alarm_Manager` , empty if it isn't checking alarms
+        (see the ``CONTROLLER_ALARMS`` pref)
+        """
+        if self._alarm_manager is None:
+            return {}
+        with self._alarm_manager.lock:
+            return dict(self._alarm_manager.active_alarms)
+
+    def get_state(self, control_settings: typing.Iterable[ControlSetting] = (), loop_since: int = None) -> dict:
+        """
+        Set any number of controls and get everything the UI polls for, in one call, so a remote UI needs one round
+        trip rather than one per value.
+
+        Args:
+            control_settings (iterable): of :class:`.ControlSetting` to set first, together, see :meth:`.set_controls`
+            loop_since (int): the ``'count'`` of earlier ``'loop_stats'`` , see :meth:`.get_loop_stats`
+
+        Returns:
+            dict: ``'sensors'`` from :meth:`.get_sensors` , ``'controls'`` from :meth:`.get_controls` ,
+            ``'active_alarms'`` from :meth:`.get_active_alarms` and ``'loop_stats'`` from :meth:`.get_loop_stats`
+            (the cycles after ``loop_since`` , or the most recent ones)
+        """
+        if control_settings:
+            self.set_controls(control_settings)
+        return {
+            'sensors'       : self.get_sensors(),
+            'controls'      : self.get_controls(),
+            'active_alarms' : self.get_active_alarms(),
+            'loop_stats'    : self.get_loop_stats(loop_since)
+        }
+
+    def get_checkpoint(self) -> dict:
+        """
+        State to restore a restarted controller to with :meth:`.restore_checkpoint`
+
+        Returns:
+            dict: ``'controls'`` from :meth:`.get_controls` , ``'limit_hapa'`` , the HAPA limit set with the PIP's
+            ``max_value`` , and ``'running'`` , whether the main loop is running
+        """
+        return {
+            'controls'   : self.get_controls(),
+            'limit_hapa' : self.limit_hapa,
+            'running'    : self._running.is_set()
+        }
+
+    def restore_checkpoint(self, checkpoint: dict):
+        """
+        Set the controls from a :meth:`.get_checkpoint` of another controller, and start the main loop if it was running
+
+        Args:
+            checkpoint (dict): from :meth:`.get_checkpoint`
+        """
+        self.set_controls(checkpoint['controls'].values())
+        if checkpoint.get('limit_hapa') is not None:
+            with self._lock:
+                self.limit_hapa = checkpoint['limit_hapa']
+        if checkpoint['running']:
+            self.start()
+
+    def get_alarm_events(self) -> typing.List[Alarm]:
+        """
+        Returns the alarm transitions detected in the control loop since the last call, oldest first, and clears them.
+
+        Cleared alarms are returned with :attr:`.AlarmSeverity.OFF` .
+        The queue holds at most ``CONTROLLER_ALARM_EVENTS`` events, older events are dropped if it is not polled.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self._alarm_events.popleft())
+            except IndexError:
+                break
+        self._time_last_contact = time.time()
+        return events
+
+    def get_loop_times(self, since: int = None) -> typing.Tuple[typing.List[float], int]:
+        """
+        Durations of the main loop cycles (s) after the first ``since`` (at most the last 10000 cycles).
+
+        They aren't cleared, so several callers can each keep their own position: pass the returned count as
+        ``since`` next time to get only the cycles after this call.
+
+        Args:
+            since (int): number of cycles to skip, a count returned by an earlier call. Default the last 10000 cycles
+
+        Returns:
+            tuple: list of durations, oldest first, and the number of cycles timed so far
+        """
+        # the count first, so a cycle finished in between is returned again next time rather than skipped
+        count = self._loop_times_count
+        times = list(self._loop_times)
+        times = times[len(times) - min(count - since, len(times)):] if since is not None else times
+        return times, count
+
+    def get_loop_stats(self, since: int = None) -> dict:
+        """
+        Timing of the main loop cycles after the first ``since`` (at most the last 10000 cycles), see
+        :meth:`.get_loop_times`
+
+        Args:
+            since (int): the ``'count'`` of earlier stats, to summarize only the cycles after them. Default the last
+                10000 cycles
+
+        Returns:
+            dict: see :func:`.loop_stats` , with ``'count'`` , the number of cycles timed so far, if any cycles were
+            summarized
+        """
+        times, count = self.get_loop_times(since)
+        stats = loop_stats(times)
+        if stats:
+            stats['count'] = count
+        return stats
+
     def __start_new_breathcycle(self):
         """
         This has to be executed when the next breath cycles starts
@@ -504,8 +804,22 @@ class ControlModuleBase:
         self._sensor_to_COPY()            # Get the fit values from the last waveform directly into sensor values
 
         if self._save_logs and self._DATA_BREATH_COUNT % self._FLUSH_EVERY == 0:
-            self.dl.flush_logfile()        # If we kept records, flush the data from the previous breath cycle
-            self.dl.rotation_newfile()     # And Check whether we run out of space for the logger
+            with self._busy():                 # Can take longer than the watchdog allows a loop cycle
+                self.dl.flush_logfile()        # If we kept records, flush the data from the previous breath cycle
+                self.dl.rotation_newfile()     # And Check whether we run out of space for the logger
+                if self._flight_recorder is not None:
+                    self._flight_recorder.sync(wait = False)   # Also write the flight recorder to disk, in case of power loss
+
+    @contextlib.contextmanager
+    def _busy(self):
+        """
+        Mark a known long operation in the main loop, like rotating the log file, see :meth:`.get_busy`
+        """
+        self._busy_since.value = time.time()
+        try:
+            yield
+        finally:
+            self._busy_since.value = 0
 
     def _PID_update(self, dt):
         ''' 
@@ -588,6 +902,8 @@ class ControlModuleBase:
             self.__start_new_breathcycle()
         else:
             self.__cycle_waveform = np.append(self.__cycle_waveform, [[cycle_phase, self._DATA_PRESSURE, self._DATA_VOLUME]], axis=0)
+        if self._alarm_manager is not None:
+            self._update_alarms(new_breath = next_cycle)
         if self._save_logs:
             self.__save_values()
 
@@ -632,6 +948,8 @@ class ControlModuleBase:
             self.__start_new_breathcycle()
         else:
             self.__cycle_waveform = np.append(self.__cycle_waveform, [[cycle_phase, self._DATA_PRESSURE, self._DATA_VOLUME]], axis=0)
+        if self._alarm_manager is not None:
+            self._update_alarms(new_breath = next_cycle)
         if self._save_logs:
             self.__save_values()
 
@@ -639,6 +957,16 @@ class ControlModuleBase:
         """
             Small helper function to store key parameters in the main PID control loop
         """
+        now = time.time()
+        if self._flight_recorder is not None:
+            self._flight_recorder.record_sample(now,
+                                                self._DATA_PRESSURE,
+                                                self._DATA_Qout,
+                                                self.__control_signal_in,
+                                                self.__control_signal_out,
+                                                self.COPY_DATA_OXYGEN,
+                                                self._DATA_BREATH_COUNT)
+
         # Make the sensor value instance
         sensor_values =  SensorValues(vals={
         ValueName.PIP.name                  : self._DATA_PIP,
@@ -649,7 +977,7 @@ class ControlModuleBase:
         ValueName.BREATHS_PER_MINUTE.name   : self._DATA_BPM,
         ValueName.INSPIRATION_TIME_SEC.name : self._DATA_I_PHASE,
         ValueName.FLOWOUT.name              : self._DATA_Qout,
-        'timestamp'                         : time.time(),
+        'timestamp'                         : now,
         'loop_counter'                      : self._loop_counter,
         'breath_count'                      : self._DATA_BREATH_COUNT
         })
@@ -694,11 +1022,17 @@ class ControlModuleBase:
         self._time_last_contact = time.time()
         if self.__thread is not None and self.__thread.is_alive():
             self._running.clear()
+            if self._alarm_manager is not None and self.__thread is not threading.current_thread():
+                # let the last loop finish, so it doesn't add the callback again
+                self.__thread.join(1)
         else:
             print("Main Loop is not running.")
 
-        if self._save_logs:               # If we kept records, flush the data
-            self.dl.close_logfile()
+        self._remove_alarm_callback()
+        self._detach_data_logger()
+
+        if self._save_logs:               # If we kept records, flush the data, and index them without waiting
+            self.dl.close_logfile(background = True)
 
     def interrupt(self):
         """
@@ -739,18 +1073,49 @@ class ControlModuleBase:
         self._time_last_contact = time.time()
         return self._loop_counter
 
+    def get_busy(self) -> float:
+        """
+        Seconds the main loop has been in a known long operation, like rotating the log file, 0 if it isn't in one.
+
+        The :class:`.ProcessManager` 's watchdog doesn't restart a controller whose heartbeat stops while it is busy,
+        up to ``WATCHDOG_BUSY_TIMEOUT`` s.
+        """
+        since = self._busy_since.value
+        return time.time() - since if since else 0.
+
 class ControlModuleDevice(ControlModuleBase): 
     """
     Controlling Hardware.
     """
+    # Sensors read by the SensorScheduler in _get_HAL
+    #                   HAL property, period (s),  phase,         max age (s)
+    _SENSOR_SCHEDULE = (('pressure',  0,           None,          0.05),   # every loop
+                        ('flow_ex',   0,           'expiration',  None),   # every loop during expiration
+                        ('oxygen',    5,           'expiration',  None))   # slow, every 5 sec during expiration
+    _MAX_SLOW_READS_PER_LOOP = 1                                     # Periodic reads beyond this are deferred to the next loop
+    _SENSOR_TICK_BUDGET = 0.002                                      # and none are started once a loop has spent this long (s) reading
+    # The budget is checked before each periodic read, and a read that was started can't be cut short: a loop can still
+    # stall for the every-loop reads plus one periodic read. For the oxygen sensor that is a single-shot ADC conversion,
+    # 1/DR s (0.3 ms for the ADS1015 at 3300 SPS, 1.2 ms for an ADS1115 at 860 SPS), plus its I2C transfers -- or
+    # longer if the bus hangs, until the read raises.
+
     # Implement ControlModuleBase functions
-    def __init__(self, save_logs = True, flush_every = 10, config_file = None):
+    def __init__(self, save_logs = True, flush_every = 10, config_file = None, pig = None):
         """
         Args:
             config_file (string): Path to device config file, e.g. 'vent/io/config/dinky-devices.ini'
+            pig (PigpioConnection): optional, pigpiod connection for the :class:`.Hal` , e.g. a
+                :class:`~vent.io.devices.sim_pigpio.SimPigpio` to benchmark the loop without hardware
         """
         ControlModuleBase.__init__(self, save_logs, flush_every)
-        self.HAL = io.Hal(config_file)
+        self.HAL = io.Hal(config_file, pig = pig)
+        self._scheduler = SensorScheduler(
+            [ScheduledSensor(name, self.__hal_reader(name), period = period, phase = phase, max_age = max_age)
+             for name, period, phase, max_age in self._SENSOR_SCHEDULE],
+            max_reads_per_tick = self._MAX_SLOW_READS_PER_LOOP,
+            tick_budget = self._SENSOR_TICK_BUDGET
+        )
+        self._pressure_stale = False        # PID is suspended and valves in stand-by while pressure is too old
         self._sensor_to_COPY()
 
         # Current settings of the valves to avoid unneccesary hardware queries
@@ -793,34 +1158,78 @@ class ControlModuleDevice(ControlModuleBase):
             self.current_setting_ex = valve_open_out
             self.HAL.setpoint_ex =  valve_open_out
 
+    def __hal_reader(self, name):
+        # Reads the HAL property `name`
+        return lambda: getattr(self.HAL, name)
+
+    def get_sensor_ages(self) -> typing.Dict[str, float]:
+        """
+        Returns the seconds since each HAL sensor was last read by the control loop (``None`` if never).
+        """
+        self._time_last_contact = time.time()
+        return self._scheduler.ages()
+
     # @timeout
     def _get_HAL(self):
         """
         Get sensor values from HAL, decorated with timeout.
+        Which sensors are read in this loop is decided by the SensorScheduler, see _SENSOR_SCHEDULE.
         Only during expiration is the flow-sensor queried!
         """
+        now = time.time()
+        inspiration_phase = (now - self._cycle_start) < self.COPY_SET_I_PHASE
+        values = self._scheduler.update(phase = 'inspiration' if inspiration_phase else 'expiration', now = now)
 
-        inspiration_phase = (time.time() - self._cycle_start) < self.COPY_SET_I_PHASE
+        if 'pressure' in values:
+            self._DATA_PRESSURE = values['pressure']                 # Get pressure reading
+            self._DATA_PRESSURE_LIST.append(self._DATA_PRESSURE)     # And append it to list -> is averaged over a couple values
+            if len(self._DATA_PRESSURE_LIST) > 5:
+                self._DATA_PRESSURE_LIST.pop(0)
+
+        if 'oxygen' in values:                                       # If the time has come, get an oxygen value.
+            self._DATA_OXYGEN = values['oxygen']
+            self._OXYGEN_LAST_READ = now
 
-        self._DATA_PRESSURE = self.HAL.pressure                      # Get pressure reading
-        self._DATA_PRESSURE_LIST.append(self._DATA_PRESSURE)         # And append it to list -> is averaged over a couple values
-        if len(self._DATA_PRESSURE_LIST) > 5:
-            self._DATA_PRESSURE_LIST.pop(0)
-                
         if inspiration_phase:
             self._DATA_Qout         = 0                                  # Flow out and oxygen are not measured
             self.COPY_DATA_OXYGEN   = self._DATA_OXYGEN
-        else:
-            if time.time() - self._OXYGEN_LAST_READ > 5:                 # If the time has come, get an oxygen value.
-                self._DATA_OXYGEN = self.HAL.oxygen
-                self._OXYGEN_LAST_READ = time.time()
-
-            pq = self.HAL.flow_ex/60                                     # Get a flow reading in l/sec
+        elif 'flow_ex' in values:
+            pq = values['flow_ex']/60                                    # Get a flow reading in l/sec
             self._flow_list.append(pq)
             Qbaseline = np.percentile(self._flow_list, 5 )               # stimate the baseline flow during expiration with a rankfilter (baseline of air that bypasses patient)
 
             self._DATA_Qout = pq - Qbaseline                             # This has to be subtracted from flow_ex to integrate VTE
 
+    def _check_pressure_age(self, now: float) -> bool:
+        """
+        The PID can't run on a stale pressure: if the pressure sensor hasn't been read within its max age, raise a
+        :attr:`.AlarmType.STALE_SENSOR` technical alert and put the valves in stand-by until it is read again.
+
+        Returns:
+            bool: whether the pressure is fresh enough to control with
+        """
+        pressure = self._scheduler.sensors['pressure']
+        age = pressure.age(now)
+        stale = age is None or age > pressure.max_age
+
+        if stale and not self._pressure_stale:
+            self._pressure_stale = True
+            self.logger.error(f'Pressure not read for {age} s, valves to stand-by until it is')
+            self.set_valves_standby()
+            if not any([a.alarm_type == AlarmType.STALE_SENSOR for a in self.TECHA]):
+                self.TECHA.append(Alarm(
+                    AlarmType.STALE_SENSOR,
+                    AlarmSeverity.TECHNICAL,
+                    message=f"Pressure sensor not read for {age} s"
+                ))
+                self._emit_alarm_event(self.TECHA[-1])
+        elif not stale and self._pressure_stale:
+            self._pressure_stale = False
+            self.logger.info('Pressure read again, resuming control')
+            self._clear_technical_alert(AlarmType.STALE_SENSOR)
+
+        return not stale
+
 
     def set_valves_standby(self):
         """
@@ -841,6 +1250,8 @@ class ControlModuleDevice(ControlModuleBase):
             self._loop_counter += 1
             now = time.time()
             dt = now - self._last_update                            # Time sincle last cycle of main-loop
+            self._loop_times.append(dt)
+            self._loop_times_count += 1
 
             if dt > CONTROL[ValueName.BREATHS_PER_MINUTE].default / 4:                                                      # TODO: RAISE HARDWARE ALARM, no update should be so long
                 self.logger.warning("MainLoop: Update too long: " + str(dt))
@@ -849,12 +1260,13 @@ class ControlModuleDevice(ControlModuleBase):
                 dt = self._LOOP_UPDATE_TIME
             
             self._get_HAL()                                          # Update pressure and flow measurement
-            # self._PID_update(dt = dt)                              # With that, calculate controls
-            self._Predictive_PID_update(dt = dt)                     # With that, calculate controls
+            if self._check_pressure_age(now):                        # Valves stay in stand-by while pressure is stale
+                # self._PID_update(dt = dt)                          # With that, calculate controls
+                self._Predictive_PID_update(dt = dt)                 # With that, calculate controls
 
-            valve_open_in  = self._get_control_signal_in()           #    -> Inspiratory side: get control signal for PropValve
-            valve_open_out = self._get_control_signal_out()          #    -> Expiratory side: get control signal for Solenoid
-            self._set_HAL(valve_open_in, valve_open_out)             # And set values.
+                valve_open_in  = self._get_control_signal_in()       #    -> Inspiratory side: get control signal for PropValve
+                valve_open_out = self._get_control_signal_out()      #    -> Expiratory side: get control signal for Solenoid
+                self._set_HAL(valve_open_in, valve_open_out)         # And set values.
 
             self._last_update = now
 
@@ -1051,6 +1463,8 @@ class ControlModuleSimulator(ControlModuleBase):
             # time.sleep(self._LOOP_UPDATE_TIME)
             self._loop_counter += 1
             now = time.time()
+            self._loop_times.append(now - self._last_update)
+            self._loop_times_count += 1
             if self.simulator_dt:
                 dt = self.simulator_dt
             else:
@@ -1080,6 +1494,7 @@ class ControlModuleSimulator(ControlModuleBase):
             self.Balloon.set_flow_out(Qout, dt = dt)
 
             self._DATA_Qout = self.Balloon.Qout                     # Tell controller the expiratory flow rate, _DATA_Qout                    --- SENSOR 2
+            self.COPY_DATA_OXYGEN = self.Balloon.fio2               # And the oxygen concentration                                            --- SENSOR 3
             self._last_update = now
 
             if update_copies == 0:
@@ -1096,6 +1511,32 @@ class ControlModuleSimulator(ControlModuleBase):
 
 
 
+def loop_stats(times: typing.Sequence[float]) -> dict:
+    """
+    Summarize durations of main loop cycles
+
+    Args:
+        times (list): cycle durations in seconds
+
+    Returns:
+        dict: with keys ``'n'`` (number of cycles), ``'rate'`` (cycles per second), and ``'mean'`` , ``'std'`` ,
+        ``'min'`` , ``'p99'`` and ``'max'`` of the cycle durations in seconds. Empty if no cycles have run.
+    """
+    if len(times) == 0:
+        return {}
+
+    times = np.array(times)
+    return {
+        'n'    : len(times),
+        'rate' : 1 / np.mean(times),
+        'mean' : np.mean(times),
+        'std'  : np.std(times),
+        'min'  : np.min(times),
+        'p99'  : np.percentile(times, 99),
+        'max'  : np.max(times)
+    }
+
+
 def get_control_module(sim_mode=False, simulator_dt = None):
     """
     Generates control module.
@@ -0,0 +1,242 @@
+"""
+Multi-rate acquisition of sensor values for the control loop.
+
+Not every sensor needs to be read every control loop, and some (eg. an oxygen sensor behind a slow ADC conversion)
+are expensive to read. The :class:`.SensorScheduler` decides which sensors are read on each tick of the loop from a
+declarative list of :class:`.ScheduledSensor` s, each with
+
+* a ``period`` : ``0`` to read every tick, otherwise read once every ``period`` seconds,
+* a ``phase`` constraint: only read during ``'inspiration'`` or ``'expiration'`` , or ``None`` for any phase,
+* an ``offset`` : when in its period to read the sensor. If not given, sensors with the same period are spread evenly
+  across it so they don't all land on the same tick and collide on the bus.
+
+Periodic reads are budgeted: at most ``max_reads_per_tick`` periodic sensors are read on one tick (most overdue first),
+and none once a tick has spent ``tick_budget`` seconds reading, so the remaining reads are deferred to the next tick
+rather than stalling this one. The time each value was last read is kept so the age of stale values can be checked.
+A sensor that keeps failing is only logged with a traceback on its first failure, then at most every ``log_interval``
+seconds, so a broken sensor doesn't flood the logs at the rate of the loop.
+"""
+
+import time
+import typing
+
+from vent.common.loggers import init_logger
+
+
+class ScheduledSensor(object):
+    """
+    A sensor read by the :class:`.SensorScheduler`
+
+    Attributes:
+        value: the last value read, or ``None`` if never read
+        last_read (float): time of the last successful read, or ``None``
+        next_due (float): time the next periodic read is due
+        failures (int): number of failed reads since the last successful one
+    """
+
+    PHASES = (None, 'inspiration', 'expiration')
+
+    def __init__(self,
+                 name: str,
+                 read: typing.Callable[[], float],
+                 period: float = 0,
+                 phase: str = None,
+                 offset: float = None,
+                 max_age: float = None):
+        """
+        Args:
+            name (str): name of the sensor, eg. ``'pressure'``
+            read (callable): called with no arguments to read the sensor, eg. ``lambda: hal.pressure``
+            period (float): seconds between reads, or ``0`` to read every tick
+            phase (str): one of :attr:`.PHASES` , only read the sensor during this phase of the breath cycle
+            offset (float): seconds into each period to read the sensor, if ``None`` assigned by the scheduler
+            max_age (float): a value older than this is reported by :meth:`.SensorScheduler.stale` .
+                If ``None`` , twice the period (or never, for sensors read every tick or only in one phase)
+        """
+        if period < 0:
+            raise ValueError('period must be nonnegative, got {}'.format(period))
+        if phase not in self.PHASES:
+            raise ValueError('phase must be one of {}, got {}'.format(self.PHASES, phase))
+
+        self.name = name
+        self.read = read
+        self.period = period
+        self.phase = phase
+        self.offset = offset
+        if max_age is None and period > 0 and phase is None:
+            max_age = 2 * period
+        self.max_age = max_age
+
+        self.value = None
+        self.last_read = None
+        self.next_due = 0
+        self.failures = 0
+        self._last_logged = None
+
+    def due(self, now: float, phase: str) -> bool:
+        """ Whether the sensor should be read at time ``now`` in breath phase ``phase`` """
+        if self.phase is not None and phase != self.phase:
+            return False
+        return self.period == 0 or now >= self.next_due
+
+    def age(self, now: float = None) -> float:
+        """ Seconds since the value was read, or ``None`` if it never has been """
+        if self.last_read is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - self.last_read
+
+    def __repr__(self):
+        return 'ScheduledSensor(name={}, period={}, phase={}, offset={})'.format(
+            self.name, self.period, self.phase, self.offset)
+
+
+class SensorScheduler(object):
+    """
+    Reads :class:`.ScheduledSensor` s at their own rates from the control loop, see the module documentation.
+    """
+
+    def __init__(self,
+                 sensors: typing.List[ScheduledSensor],
+                 max_reads_per_tick: int = 1,
+                 tick_budget: float = None,
+                 start: float = None,
+                 log_interval: float = 10):
+        """
+        Args:
+            sensors (list): of :class:`.ScheduledSensor`
+            max_reads_per_tick (int): maximum number of periodic sensors read in one tick.
+                Sensors read every tick are always read.
+            tick_budget (float): if not ``None`` , no periodic sensors are read once a tick has spent this many
+                seconds reading sensors.
+            start (float): time the schedule starts from, default now
+            log_interval (float): seconds between log messages about a sensor that keeps failing
+        """
+        if len(set(sensor.name for sensor in sensors)) != len(sensors):
+            raise ValueError('sensor names must be unique')
+        if max_reads_per_tick < 1:
+            raise ValueError('max_reads_per_tick must be at least 1')
+
+        self.logger = init_logger(__name__)
+        self.sensors = {sensor.name: sensor for sensor in sensors}
+        self.max_reads_per_tick = max_reads_per_tick
+        self.tick_budget = tick_budget
+        self.deferred = 0  # number of due reads that were deferred to a later tick because of the budget
+        self.log_interval = log_interval
+
+        self._every_tick = [sensor for sensor in sensors if sensor.period == 0]
+        self._periodic = [sensor for sensor in sensors if sensor.period > 0]
+        self.reset(start)
+
+    def reset(self, start: float = None):
+        """
+        Restart the schedule from ``start`` (default now), assigning offsets to sensors that don't have one so that
+        sensors with the same period are spread evenly across it.
+        """
+        if start is None:
+            start = time.time()
+
+        by_period = {}
+        for sensor in self._periodic:
+            by_period.setdefault(sensor.period, []).append(sensor)
+
+        for period, sensors in by_period.items():
+            for i, sensor in enumerate(sensors):
+                offset = sensor.offset if sensor.offset is not None else period * i / len(sensors)
+                sensor.next_due = start + offset
+
+    def update(self, phase: str = None, now: float = None) -> typing.Dict[str, float]:
+        """
+        Read the sensors that are due in this tick.
+
+        A sensor that raises an exception when read keeps its last value (and its age keeps growing).
+        A failed periodic sensor is retried in its next period rather than on the next tick,
+        so a broken sensor can't use up the budget of the others.
+
+        Args:
+            phase (str): current phase of the breath cycle, ``'inspiration'`` or ``'expiration'``
+            now (float): current time, default :func:`time.time`
+
+        Returns:
+            dict: {name: value} of the sensors read in this tick
+        """
+        if now is None:
+            now = time.time()
+        tick_start = time.perf_counter()
+        values = {}
+
+        for sensor in self._every_tick:
+            if sensor.due(now, phase):
+                self._read(sensor, now, values)
+
+        due = [sensor for sensor in self._periodic if sensor.due(now, phase)]
+        if due:
+            due.sort(key=lambda sensor: sensor.next_due)
+            n_read = 0
+            for sensor in due:
+                if n_read >= self.max_reads_per_tick or \
+                        (self.tick_budget is not None and time.perf_counter() - tick_start > self.tick_budget):
+                    self.deferred += 1
+                    continue
+                n_read += 1
+                self._read(sensor, now, values)
+                # keep the sensor on its own grid unless it has fallen a full period behind
+                next_due = sensor.next_due + sensor.period
+                sensor.next_due = next_due if next_due > now else now + sensor.period
+
+        return values
+
+    def _read(self, sensor: ScheduledSensor, now: float, values: dict) -> bool:
+        try:
+            value = sensor.read()
+        except Exception as e:
+            sensor.failures += 1
+            if sensor.failures == 1:
+                self.logger.exception('Error reading sensor {}, keeping value from {} s ago:\n    {}'.format(
+                    sensor.name, sensor.age(now), e))
+                sensor._last_logged = now
+            elif now - sensor._last_logged >= self.log_interval:
+                self.logger.error('Sensor {} still failing, {} failed reads, keeping value from {} s ago: {}'.format(
+                    sensor.name, sensor.failures, sensor.age(now), e))
+                sensor._last_logged = now
+            return False
+        if sensor.failures:
+            self.logger.info('Sensor {} read again after {} failed reads'.format(sensor.name, sensor.failures))
+            sensor.failures = 0
+        sensor.value = value
+        sensor.last_read = now
+        values[sensor.name] = value
+        return True
+
+    def value(self, name: str) -> float:
+        """ The last value read from sensor ``name`` """
+        return self.sensors[name].value
+
+    def age(self, name: str, now: float = None) -> float:
+        """ Seconds since sensor ``name`` was last read, or ``None`` if it never has been """
+        return self.sensors[name].age(now)
+
+    def ages(self, now: float = None) -> typing.Dict[str, float]:
+        """ {name: age} for all sensors, see :meth:`.age` """
+        if now is None:
+            now = time.time()
+        return {name: sensor.age(now) for name, sensor in self.sensors.items()}
+
+    def stale(self, now: float = None) -> typing.List[str]:
+        """ Names of the sensors whose value is older than their ``max_age`` , or that haven't been read within
+        ``max_age`` of the schedule starting """
+        if now is None:
+            now = time.time()
+        stale = []
+        for name, sensor in self.sensors.items():
+            if sensor.max_age is None:
+                continue
+            age = sensor.age(now)
+            if age is None:
+                # never read, stale once it's a full max_age past when it was first due
+                if now - sensor.next_due > sensor.max_age:
+                    stale.append(name)
+            elif age > sensor.max_age:
+                stale.append(name)
+        return stale
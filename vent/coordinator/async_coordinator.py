@@ -0,0 +1,160 @@
+"""
+Calling the coordinator without waiting for the controller.
+
+Calls to a :class:`~vent.coordinator.coordinator.CoordinatorRemote` block until the controller replies, which, if the
+controller is busy or stalled, can take up to the RPC socket timeout. :class:`.AsyncCoordinator` makes the same calls
+from a pool of worker threads driven by an :mod:`asyncio` event loop in its own thread, so the caller (eg. the GUI's
+event loop) never waits:
+
+* :meth:`.AsyncCoordinator.call` is a coroutine, for code running in the client's :attr:`~.AsyncCoordinator.loop`
+* :meth:`.AsyncCoordinator.submit` can be called from any thread, and returns a :class:`concurrent.futures.Future`
+
+Each call has a deadline, after which it fails with :class:`asyncio.TimeoutError` , and can be cancelled with the
+future's ``cancel()`` . Several calls can be in flight at once, each on its own connection to the controller
+(see :class:`~vent.coordinator.rpc.RPCClient` )::
+
+    client = AsyncCoordinator(coordinator, timeout=1)
+    future = client.submit('get_sensors')
+    future.add_done_callback(lambda f: print(f.result()))
+
+A call that times out or is cancelled keeps its worker thread until the controller replies (or the socket times out),
+since a blocking call can't be interrupted, but its result is discarded. If every worker is stuck, new calls wait for
+one to be free, and time out themselves, so the caller still doesn't block.
+
+Calls made with ``ordered=True`` , like changing settings or starting and stopping the controller, have a worker of
+their own instead: they run one at a time, in the order they were submitted, so a setting can't overtake an earlier
+one. One that times out while still waiting for its turn is never made. :meth:`.AsyncCoordinator.close` lets the
+ordered calls already submitted finish first::
+
+    client.submit('set_control', setting, ordered=True).add_done_callback(report_failure)
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import typing
+
+from vent.common import prefs
+from vent.common.loggers import init_logger
+
+
+class AsyncCoordinator(object):
+    """
+    Make calls to a coordinator in the background, see the module documentation.
+    """
+
+    def __init__(self, coordinator, timeout: float = None, max_in_flight: int = 4):
+        """
+        Args:
+            coordinator (:class:`~vent.coordinator.coordinator.CoordinatorBase`): coordinator to call
+            timeout (float): default deadline of each call (s), default the ``COORDINATOR_TIMEOUT`` pref
+            max_in_flight (int): number of calls that can be waiting on the controller at once
+
+        Attributes:
+            loop (:class:`asyncio.AbstractEventLoop`): event loop the calls are made from, running in its own thread
+        """
+        self.logger = init_logger(__name__)
+        self.coordinator = coordinator
+        self.timeout = prefs.get_pref('COORDINATOR_TIMEOUT') if timeout is None else timeout
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight,
+                                                               thread_name_prefix='coordinator_call')
+        self._ordered_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                       thread_name_prefix='coordinator_ordered_call')
+        self._ordered_tasks = set()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._closing = False
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='coordinator_loop', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self._executor.shutdown(wait=False)
+        self._ordered_executor.shutdown(wait=False)
+        self.loop.close()
+
+    @property
+    def in_flight(self) -> int:
+        """ Number of calls that haven't finished, timed out or been cancelled """
+        with self._lock:
+            return self._in_flight
+
+    async def call(self, method: str, *args, timeout: float = None, ordered: bool = False):
+        """
+        Call ``method`` of the coordinator with ``args`` in a worker thread. Must be awaited in :attr:`.loop`
+
+        Args:
+            method (str): name of the method, eg. ``'get_sensors'``
+            timeout (float): seconds to wait for the result, default :attr:`.timeout`
+            ordered (bool): run after the ordered calls made before it, see the module documentation
+
+        Returns:
+            the result of the method
+
+        Raises:
+            asyncio.TimeoutError: if there's no result before the deadline
+        """
+        func = functools.partial(getattr(self.coordinator, method), *args)
+        task = asyncio.current_task(self.loop)
+        if ordered:
+            self._ordered_tasks.add(task)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # handed to the executor before the first await, so ordered calls queue in the order they were made
+            result = self.loop.run_in_executor(self._ordered_executor if ordered else self._executor, func)
+            return await asyncio.wait_for(result, self.timeout if timeout is None else timeout)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._ordered_tasks.discard(task)
+
+    def submit(self, method: str, *args, timeout: float = None, ordered: bool = False) -> concurrent.futures.Future:
+        """
+        Start a :meth:`.call` from any thread, without waiting for it
+
+        Args:
+            method (str): name of the method, eg. ``'get_sensors'``
+            timeout (float): seconds to wait for the result, default :attr:`.timeout`
+            ordered (bool): run after the ordered calls submitted before it, see the module documentation
+
+        Returns:
+            :class:`concurrent.futures.Future`: of the result. Its done callbacks are called from the client's thread.
+            ``cancel()`` abandons the call.
+        """
+        return asyncio.run_coroutine_threadsafe(self.call(method, *args, timeout=timeout, ordered=ordered),
+                                                self.loop)
+
+    async def _shutdown(self):
+        # ordered calls change the controller, let them finish (each has a deadline), abandon the rest
+        await asyncio.gather(*self._ordered_tasks, return_exceptions=True)
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not asyncio.current_task(self.loop)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def close(self, wait: bool = True):
+        """
+        Stop the event loop once the ordered calls already submitted have finished, abandoning any other calls in
+        flight
+
+        Args:
+            wait (bool): wait until it has stopped. Otherwise it stops in the background, eg. so a closing GUI doesn't
+                wait for the controller
+        """
+        with self._lock:
+            if self._closing or self.loop.is_closed():
+                return
+            self._closing = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        except RuntimeError:
+            return
+        if wait:
+            self._thread.join(self.timeout + 1)
@@ -0,0 +1,470 @@
+"""
+Running the control loop in a process of its own.
+
+Normally :func:`~vent.coordinator.rpc.rpc_server_main` runs the controller in the same process as the threads that
+handle RPC requests, so unpickling arguments and parsing XML compete with the control loop for the GIL. With the
+``ISOLATE_CONTROL_LOOP`` pref, it instead starts the controller in a separate process with :func:`.start_control_loop` ,
+optionally pinned to the ``CONTROL_LOOP_CPUS`` , and serves a :class:`.SharedController` in its place. The RPC
+process then lowers its own priority, so that where the two share a CPU, the scheduler runs the control loop first.
+The two processes only communicate through :class:`.SharedMemory` :
+
+* sensor values, published by the control loop process
+* control settings, written by the RPC process
+* whether the control loop should be running, and whether it is
+* the loop counter (the heartbeat), and the durations of loop cycles
+* alarm events and active alarms, pickled, only written when there are new alarm events
+
+In the control loop process, a :class:`.Bridge` copies between the shared memory and the controller every
+:data:`.BRIDGE_PERIOD` seconds, which only costs the control loop a few copies of numbers. It stops the controller
+and exits if the RPC process dies.
+
+Numbers are shared with :class:`.SharedArray` , like the :class:`~vent.coordinator.process_manager.Checkpoint` :
+readers take no lock, so a process killed while writing can't leave anything locked.
+"""
+
+import ctypes
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import typing
+
+from vent.alarm import Alarm
+from vent.common import prefs, values
+from vent.common.loggers import init_logger
+from vent.common.message import ControlSetting, SensorValues
+from vent.common.values import ValueName
+from vent.coordinator.process_manager import Checkpoint
+
+_PR_SET_PDEATHSIG = 1
+
+BRIDGE_PERIOD = 0.005
+"""
+Seconds between copies of the :class:`.Bridge`
+"""
+
+SENSOR_FIELDS = tuple(value.name for value in values.SENSOR.keys()) + SensorValues.additional_values
+"""
+Order of the fields of :attr:`.SharedMemory.sensors`
+"""
+
+CONTROLS = tuple(values.CONTROL.keys())
+"""
+Order of the controls in :attr:`.SharedMemory.controls` , each has :data:`.CONTROL_FIELDS`
+"""
+
+CONTROL_FIELDS = ('value', 'min_value', 'max_value', 'timestamp', 'sequence')
+"""
+Fields of each control in :attr:`.SharedMemory.controls` . ``sequence`` counts how many times it has been set
+"""
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value: float):
+    return None if math.isnan(value) else value
+
+
+class SharedArray(object):
+    """
+    Fixed length array of floats in shared memory, written by one thread at a time and read by any process.
+
+    Like the :class:`~vent.coordinator.process_manager.Checkpoint` , there are two slots, written in turn, and a
+    version published after each write, so readers don't take a lock.
+    """
+
+    def __init__(self, length: int):
+        self.length = length
+        self._slots = multiprocessing.RawArray(ctypes.c_double, 2 * length)
+        self._version = multiprocessing.RawValue(ctypes.c_uint64, 0)
+
+    @property
+    def version(self) -> int:
+        """ Number of writes so far """
+        return self._version.value
+
+    def write(self, array: typing.Sequence[float]):
+        version = self._version.value + 1
+        offset = (version % 2) * self.length
+        self._slots[offset:offset + self.length] = array
+        self._version.value = version
+
+    def read(self) -> typing.List[float]:
+        """
+        Returns:
+            list: the last array written, zeros if none has been
+        """
+        while True:
+            version = self._version.value
+            offset = (version % 2) * self.length
+            array = self._slots[offset:offset + self.length]
+            if self._version.value == version:
+                return array
+
+
+class SharedMemory(object):
+    """
+    Everything the control loop process and the RPC process share, see the module documentation
+
+    Attributes:
+        sensors (:class:`.SharedArray`): of :data:`.SENSOR_FIELDS` , written by the control loop process
+        controls (:class:`.SharedArray`): :data:`.CONTROL_FIELDS` of each of the :data:`.CONTROLS` , written by the
+            RPC process
+        running_request (:class:`multiprocessing.RawValue`): whether the control loop should be running
+        running (:class:`multiprocessing.RawValue`): whether it is
+        heartbeat (:class:`multiprocessing.RawValue`): the loop counter
+        busy_since (:class:`multiprocessing.RawValue`): when the control loop started a known long operation, written by
+            it directly, see :meth:`.ControlModuleBase.get_busy`
+        last_contact (:class:`multiprocessing.RawValue`): when the RPC process last got a request, see
+            :meth:`.ControlModuleBase.get_heartbeat`
+        loop_times (:class:`multiprocessing.RawArray`): ring buffer of loop cycle durations
+        loop_times_count (:class:`multiprocessing.RawValue`): number of durations written to it
+        alarms (:class:`~vent.coordinator.process_manager.Checkpoint`): recent alarm events and the active alarms
+        ready (:class:`multiprocessing.RawValue`): set by the control loop process once it has published its initial
+            state
+    """
+
+    def __init__(self, n_loop_times: int = 10000):
+        self.sensors = SharedArray(len(SENSOR_FIELDS))
+        self.controls = SharedArray(len(CONTROLS) * len(CONTROL_FIELDS))
+        self.running_request = multiprocessing.RawValue(ctypes.c_bool, False)
+        self.running = multiprocessing.RawValue(ctypes.c_bool, False)
+        self.heartbeat = multiprocessing.RawValue(ctypes.c_int64, 0)
+        self.busy_since = multiprocessing.RawValue(ctypes.c_double, 0)
+        self.last_contact = multiprocessing.RawValue(ctypes.c_double, time.time())
+        self.loop_times = multiprocessing.RawArray(ctypes.c_double, n_loop_times)
+        self.loop_times_count = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self.alarms = Checkpoint()
+        self.ready = multiprocessing.RawValue(ctypes.c_bool, False)
+
+
+class Bridge(object):
+    """
+    Copies between a controller and :class:`.SharedMemory` , in the control loop process
+    """
+
+    def __init__(self, controller, shared: SharedMemory):
+        """
+        Args:
+            controller (:class:`.ControlModuleBase`): controller in this process
+            shared (:class:`.SharedMemory`): memory shared with the RPC process
+        """
+        self.controller = controller
+        self.shared = shared
+        self._controls_version = None
+        self._sequences = [0.] * len(CONTROLS)
+        self._sensors_counter = None
+        self._alarm_events = []
+        self._alarm_event_count = 0
+        self._loop_times_read = 0
+
+    def publish_controls(self):
+        """
+        Write the controller's current control settings, before the RPC process starts writing them
+        """
+        controls = self.controller.get_controls()
+        table = []
+        for name in CONTROLS:
+            table.extend([_to_float(controls[name].value), math.nan, math.nan, time.time(), 0.])
+        self.shared.controls.write(table)
+        self._controls_version = self.shared.controls.version
+
+    def step(self):
+        """
+        Apply new control settings and start or stop the control loop as requested, then publish the controller's state
+        """
+        shared = self.shared
+        controller = self.controller
+
+        if shared.controls.version != self._controls_version:
+            self._controls_version = shared.controls.version
+            table = shared.controls.read()
+            changed = []
+            for i, name in enumerate(CONTROLS):
+                value, min_value, max_value, timestamp, sequence = \
+                    table[i * len(CONTROL_FIELDS):(i + 1) * len(CONTROL_FIELDS)]
+                if sequence != self._sequences[i]:
+                    self._sequences[i] = sequence
+                    changed.append(ControlSetting(name, _from_float(value), _from_float(min_value),
+                                                  _from_float(max_value), _from_float(timestamp)))
+            if changed:
+                controller.set_controls(changed)
+
+        if shared.running_request.value != controller._running.is_set():
+            if shared.running_request.value:
+                controller.start()
+            else:
+                controller.stop()
+        shared.running.value = controller._running.is_set()
+
+        sensors = controller.get_sensors()
+        if sensors is not None and sensors.loop_counter != self._sensors_counter:
+            self._sensors_counter = sensors.loop_counter
+            shared.sensors.write([_to_float(getattr(sensors, field)) for field in SENSOR_FIELDS])
+        shared.heartbeat.value = controller.get_heartbeat()
+
+        times, self._loop_times_read = controller.get_loop_times(self._loop_times_read)
+        if times:
+            count = shared.loop_times_count.value
+            size = len(shared.loop_times)
+            for duration in times[-size:]:
+                shared.loop_times[count % size] = duration
+                count += 1
+            shared.loop_times_count.value = count
+
+        events = controller.get_alarm_events()
+        if events:
+            self._alarm_events = (self._alarm_events + events)[-prefs.get_pref('CONTROLLER_ALARM_EVENTS'):]
+            self._alarm_event_count += len(events)
+            shared.alarms.save({
+                'events'        : self._alarm_events,
+                'count'         : self._alarm_event_count,
+                'active_alarms' : controller.get_active_alarms()
+            })
+
+        # the bridge isn't the GUI, it shouldn't count as contact with it
+        controller._time_last_contact = shared.last_contact.value
+
+    def run(self, parent_pid: int):
+        """
+        :meth:`.step` every :data:`.BRIDGE_PERIOD` until the process ``parent_pid`` exits, then stop the controller
+        """
+        while os.getppid() == parent_pid:
+            start = time.perf_counter()
+            self.step()
+            time.sleep(max(BRIDGE_PERIOD - (time.perf_counter() - start), 0))
+
+        if self.controller._running.is_set():
+            self.controller.stop()
+
+
+def control_loop_main(sim_mode: bool, shared: SharedMemory, parent_pid: int, cpus: typing.Iterable[int] = None):
+    """
+    Run a controller, and a :class:`.Bridge` to it, until the process ``parent_pid`` exits
+
+    Args:
+        sim_mode (bool): simulate the hardware
+        shared (:class:`.SharedMemory`): memory shared with the RPC process
+        parent_pid (int): the RPC process
+        cpus (list): CPUs to run on, default any
+    """
+    logger = init_logger(__name__)
+    if sys.platform.startswith('linux'):
+        # killed with the RPC process even if this one is stopped, otherwise Bridge.run notices it exited
+        ctypes.CDLL(None).prctl(_PR_SET_PDEATHSIG, signal.SIGKILL)
+    if cpus:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+            logger.info(f'control loop pinned to cpus {sorted(os.sched_getaffinity(0))}')
+        else:
+            logger.warning('CPU affinity is not supported on this platform, not pinning the control loop')
+
+    # import here, the RPC process doesn't need a controller
+    from vent.controller.control_module import get_control_module
+    controller = get_control_module(sim_mode)
+    # written by the control loop itself, the bridge might be waiting on the same operation
+    controller._busy_since = shared.busy_since
+    bridge = Bridge(controller, shared)
+    bridge.publish_controls()
+    bridge.step()
+    shared.ready.value = True
+    logger.info('control loop process ready')
+    bridge.run(parent_pid)
+
+
+def start_control_loop(sim_mode: bool, cpus: typing.Iterable[int] = None, timeout: float = 5) -> 'SharedController':
+    """
+    Start a control loop process (see :func:`.control_loop_main` ) and wait until it's ready
+
+    Args:
+        sim_mode (bool): simulate the hardware
+        cpus (list): CPUs to run the control loop on, default any
+        timeout (float): seconds to wait for it to be ready
+
+    Returns:
+        :class:`.SharedController`: that controls it
+
+    Raises:
+        RuntimeError: if it isn't ready before the timeout
+    """
+    shared = SharedMemory()
+    process = multiprocessing.Process(target=control_loop_main, args=(sim_mode, shared, os.getpid(), cpus),
+                                      name='control_loop', daemon=True)
+    process.start()
+    start = time.time()
+    while not shared.ready.value:
+        if not process.is_alive() or time.time() - start > timeout:
+            process.kill()
+            raise RuntimeError(f'control loop process did not start within {timeout} s')
+        time.sleep(0.001)
+    return SharedController(shared, process)
+
+
+class SharedController(object):
+    """
+    Stands in for a :class:`.ControlModuleBase` running in another process (see :func:`.start_control_loop` ), with
+    the methods that :mod:`~vent.coordinator.rpc` serves. Thread-safe.
+
+    Control settings are returned as they were last set, they're applied by the control loop within
+    :data:`.BRIDGE_PERIOD` . :meth:`.start` and :meth:`.stop` wait for the control loop to start or stop.
+    """
+
+    def __init__(self, shared: SharedMemory, process: multiprocessing.Process = None):
+        """
+        Args:
+            shared (:class:`.SharedMemory`): memory shared with the control loop process
+            process (:class:`multiprocessing.Process`): the control loop process
+        """
+        self.logger = init_logger(__name__)
+        self.shared = shared
+        self.process = process
+        self._lock = threading.Lock()
+        self._alarm_events_read = 0
+
+    def _contact(self):
+        self.shared.last_contact.value = time.time()
+
+    def get_sensors(self) -> SensorValues:
+        self._contact()
+        fields = dict(zip(SENSOR_FIELDS, self.shared.sensors.read()))
+        for field in ('loop_counter', 'breath_count'):
+            fields[field] = int(fields[field]) if not math.isnan(fields[field]) else None
+        return SensorValues(vals={field: _from_float(value) if isinstance(value, float) else value
+                                  for field, value in fields.items()})
+
+    def set_control(self, control_setting: ControlSetting):
+        self.set_controls([control_setting])
+
+    def set_controls(self, control_settings: typing.Iterable[ControlSetting]):
+        """
+        Set several controls at once, the control loop sees either none or all of them
+        """
+        self._contact()
+        with self._lock:
+            table = self.shared.controls.read()
+            for control_setting in control_settings:
+                if control_setting.name not in CONTROLS:
+                    self.logger.warning(f'Could not set control {control_setting.name}, no corresponding variable in controller')
+                    continue
+                i = CONTROLS.index(control_setting.name) * len(CONTROL_FIELDS)
+                value = _to_float(control_setting.value) if control_setting.value is not None else table[i]
+                table[i:i + len(CONTROL_FIELDS)] = [value,
+                                                    _to_float(control_setting.min_value),
+                                                    _to_float(control_setting.max_value),
+                                                    _to_float(control_setting.timestamp),
+                                                    table[i + len(CONTROL_FIELDS) - 1] + 1]
+            self.shared.controls.write(table)
+
+    def get_controls(self) -> typing.Dict[ValueName, ControlSetting]:
+        self._contact()
+        table = self.shared.controls.read()
+        return {name: ControlSetting(name, _from_float(table[i * len(CONTROL_FIELDS)]))
+                for i, name in enumerate(CONTROLS)}
+
+    def get_control(self, control_setting_name: ValueName) -> ControlSetting:
+        return self.get_controls().get(control_setting_name)
+
+    def get_active_alarms(self) -> dict:
+        alarms = self.shared.alarms.load()
+        return {} if alarms is None else alarms['active_alarms']
+
+    def get_alarm_events(self) -> typing.List[Alarm]:
+        """
+        Alarm events since the last call, see :meth:`.ControlModuleBase.get_alarm_events`
+        """
+        self._contact()
+        alarms = self.shared.alarms.load()
+        if alarms is None:
+            return []
+        with self._lock:
+            new = alarms['count'] - self._alarm_events_read
+            self._alarm_events_read = alarms['count']
+        return alarms['events'][-new:] if new > 0 else []
+
+    def get_loop_stats(self, since: int = None) -> dict:
+        """
+        Timing of the main loop cycles after the first ``since`` , see :meth:`.ControlModuleBase.get_loop_stats`
+        """
+        # import here, the RPC process doesn't need a controller
+        from vent.controller.control_module import loop_stats
+        count = self.shared.loop_times_count.value
+        size = len(self.shared.loop_times)
+        start = count - size if since is None else since
+        times = [self.shared.loop_times[i % size] for i in range(max(start, count - size, 0), count)]
+        stats = loop_stats(times)
+        if stats:
+            stats['count'] = count
+        return stats
+
+    def get_state(self, control_settings: typing.Iterable[ControlSetting] = (), loop_since: int = None) -> dict:
+        """
+        See :meth:`.ControlModuleBase.get_state`
+        """
+        if control_settings:
+            self.set_controls(control_settings)
+        return {
+            'sensors'       : self.get_sensors(),
+            'controls'      : self.get_controls(),
+            'active_alarms' : self.get_active_alarms(),
+            'loop_stats'    : self.get_loop_stats(loop_since)
+        }
+
+    def get_checkpoint(self) -> dict:
+        table = self.shared.controls.read()
+        return {
+            'controls'   : self.get_controls(),
+            'limit_hapa' : _from_float(table[CONTROLS.index(ValueName.PIP) * len(CONTROL_FIELDS) + CONTROL_FIELDS.index('max_value')]),
+            'running'    : bool(self.shared.running_request.value)
+        }
+
+    def restore_checkpoint(self, checkpoint: dict):
+        controls = list(checkpoint['controls'].values())
+        if checkpoint.get('limit_hapa') is not None:
+            # the control loop sets its HAPA limit from the PIP's max_value
+            controls.append(ControlSetting(ValueName.PIP, max_value=checkpoint['limit_hapa']))
+        self.set_controls(controls)
+        if checkpoint['running']:
+            self.start()
+
+    def _wait_running(self, running: bool, timeout: float = 1):
+        start = time.time()
+        while self.shared.running.value != running:
+            if time.time() - start > timeout:
+                self.logger.warning(f'control loop did not {"start" if running else "stop"} within {timeout} s')
+                return
+            time.sleep(BRIDGE_PERIOD / 5)
+
+    def start(self):
+        self._contact()
+        self.shared.running_request.value = True
+        self._wait_running(True)
+
+    def stop(self):
+        self._contact()
+        self.shared.running_request.value = False
+        self._wait_running(False)
+
+    def is_running(self) -> bool:
+        self._contact()
+        return bool(self.shared.running.value)
+
+    def get_heartbeat(self) -> int:
+        self._contact()
+        return self.shared.heartbeat.value
+
+    def get_busy(self) -> float:
+        since = self.shared.busy_since.value
+        return time.time() - since if since else 0.
+
+    def close(self):
+        """
+        Stop the control loop process
+        """
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join()
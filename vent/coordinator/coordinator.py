@@ -1,6 +1,6 @@
 import pickle
 import threading
-from typing import List, Dict
+from typing import Iterable, List, Dict
 
 import vent
 import vent.controller.control_module
@@ -32,6 +32,18 @@ class CoordinatorBase:
     def get_sensors(self) -> SensorValues:
         pass
 
+    def is_ready(self) -> bool:
+        """
+        Whether the controller can be reached. Only ``False`` while a separate controller process is starting
+        """
+        return True
+
+    def get_alarm_events(self) -> List[Alarm]:
+        """
+        Alarm transitions detected by the controller since the last call, oldest first.
+        """
+        pass
+
     # def get_active_alarms(self) -> Dict[str, Alarm]:
     #     pass
     #
@@ -47,6 +59,26 @@ class CoordinatorBase:
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
         pass
 
+    def set_controls(self, control_settings: Iterable[ControlSetting]):
+        """
+        Set several controls at once, the controller sees either none or all of them
+        """
+        pass
+
+    def get_state(self, control_settings: Iterable[ControlSetting] = (), loop_since: int = None) -> dict:
+        """
+        Set any number of controls, then get the sensor values, all control settings, active alarms and control loop
+        timing, in one request to the controller
+
+        Args:
+            control_settings (iterable): of :class:`.ControlSetting` , set together first like :meth:`.set_controls`
+            loop_since (int): only time the loop cycles after the ``'count'`` of earlier ``'loop_stats'``
+
+        Returns:
+            dict: see :meth:`.ControlModuleBase.get_state`
+        """
+        pass
+
     def start(self):
         pass
 
@@ -76,6 +108,9 @@ class CoordinatorLocal(CoordinatorBase):
         # return res
         return self.control_module.get_sensors()
 
+    def get_alarm_events(self) -> List[Alarm]:
+        return self.control_module.get_alarm_events()
+
     # def get_active_alarms(self) -> Dict[str, Alarm]:
     #     return self.control_module.get_active_alarms()
 
@@ -92,6 +127,12 @@ class CoordinatorLocal(CoordinatorBase):
     def get_control(self, control_setting_name: ValueName) -> ControlSetting:
         return self.control_module.get_control(control_setting_name)
 
+    def set_controls(self, control_settings: Iterable[ControlSetting]):
+        self.control_module.set_controls(control_settings)
+
+    def get_state(self, control_settings: Iterable[ControlSetting] = (), loop_since: int = None) -> dict:
+        return self.control_module.get_state(control_settings, loop_since)
+
     def start(self):
         """
         Start the coordinator.
@@ -114,17 +155,48 @@ class CoordinatorLocal(CoordinatorBase):
 
 
 class CoordinatorRemote(CoordinatorBase):
-    def __init__(self, sim_mode=False):
+    def __init__(self, sim_mode=False, wait=True, watchdog=False, standby=False):
+        """
+
+        Args:
+            sim_mode:
+            wait (bool): if ``True`` , block until the controller process is serving. Otherwise return as soon as it
+                is started, so it starts up while eg. the GUI is being built. Calls to the controller then wait for it
+                to be ready, or check first with :meth:`.is_ready`
+            watchdog (bool): restart the controller process, with its settings, if it stalls, see
+                :class:`.ProcessManager`
+            standby (bool): keep a standby controller process ready to take over, see :class:`.ProcessManager`
+
+        Calls can be made from any thread, each thread uses its own persistent connection to the controller (see
+        :class:`~vent.coordinator.rpc.RPCClient` )
+        """
         super().__init__(sim_mode=sim_mode)
         # TODO: according to documentation, pass max_heartbeat_interval?
-        self.process_manager = ProcessManager(sim_mode)
-        self.rpc_client = get_rpc_client()
-        # TODO: make sure the ipc connection is setup. There should be a clever method
+        self.process_manager = ProcessManager(sim_mode, wait=wait, watchdog=watchdog, standby=standby)
+        self._rpc_client = get_rpc_client()
+        self._ready = wait
+
+    @property
+    def rpc_client(self):
+        """
+        Proxy of the controller's RPC server, waiting for it to start serving the first time it's used
+        """
+        if not self._ready:
+            self.process_manager.wait_ready()
+            self._ready = True
+        return self._rpc_client
+
+    def is_ready(self) -> bool:
+        return self._ready or self.process_manager.is_ready()
 
     def get_sensors(self) -> SensorValues:
         sensor_values = pickle.loads(self.rpc_client.get_sensors().data)
         return sensor_values
 
+    def get_alarm_events(self) -> List[Alarm]:
+        pickled_res = self.rpc_client.get_alarm_events().data
+        return pickle.loads(pickled_res)
+
     # def get_active_alarms(self) -> Dict[str, Alarm]:
     #     pickled_res = self.rpc_client.get_active_alarms().data
     #     return pickle.loads(pickled_res)
@@ -146,6 +218,18 @@ class CoordinatorRemote(CoordinatorBase):
         pickled_res = self.rpc_client.get_control(pickled_args).data
         return pickle.loads(pickled_res)
 
+    def set_controls(self, control_settings: Iterable[ControlSetting]):
+        pickled_args = pickle.dumps(list(control_settings))
+        self.rpc_client.set_controls(pickled_args)
+
+    def get_state(self, control_settings: Iterable[ControlSetting] = (), loop_since: int = None) -> dict:
+        pickled_args = pickle.dumps(list(control_settings))
+        if loop_since is None:
+            pickled_res = self.rpc_client.get_state(pickled_args).data
+        else:
+            pickled_res = self.rpc_client.get_state(pickled_args, pickle.dumps(loop_since)).data
+        return pickle.loads(pickled_res)
+
     def start(self):
         """
         Start the coordinator.
@@ -174,8 +258,16 @@ class CoordinatorRemote(CoordinatorBase):
         self.stop()
 
 
-def get_coordinator(single_process=False, sim_mode=False) -> CoordinatorBase:
+def get_coordinator(single_process=False, sim_mode=False, wait=True, watchdog=False, standby=False) -> CoordinatorBase:
+    """
+    Args:
+        single_process (bool): run the controller in this process, rather than a separate process
+        sim_mode (bool): simulate the hardware
+        wait (bool): wait for a separate controller process to start serving, see :class:`.CoordinatorRemote`
+        watchdog (bool): restart a separate controller process if it stalls, see :class:`.ProcessManager`
+        standby (bool): keep a standby controller process ready to take over, see :class:`.ProcessManager`
+    """
     if single_process:
         return CoordinatorLocal(sim_mode)
     else:
-        return CoordinatorRemote(sim_mode)
+        return CoordinatorRemote(sim_mode, wait=wait, watchdog=watchdog, standby=standby)
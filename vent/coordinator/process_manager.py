@@ -1,63 +1,434 @@
+import ctypes
 import multiprocessing
+import os
+import pickle
+import signal
+import threading
 import time
+import typing
 
+from vent.common import prefs
+from vent.common.loggers import init_logger
 from vent.coordinator import rpc
 
 
+class Checkpoint(object):
+    """
+    State of the controller (see :meth:`.ControlModuleBase.get_checkpoint` ), kept in shared memory so a restarted
+    controller process can take over with the same settings.
+
+    The controller process saves its state whenever it changes, and a new one loads it when it starts.
+    There are two slots, written in turn, and a version number published after each write. Readers don't take a lock,
+    so a controller killed while saving can't leave it locked: they read the slot of the current version and check the
+    version didn't change while they read it, and a write that was cut off never becomes the current version.
+    """
+
+    def __init__(self, size: int = 2 ** 16):
+        """
+        Args:
+            size (int): maximum bytes of a pickled state
+        """
+        self.size = size
+        self._slots = multiprocessing.RawArray(ctypes.c_char, 2 * size)
+        self._lengths = multiprocessing.RawArray(ctypes.c_uint32, 2)
+        self._version = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        # only guards writers within one process, see above
+        self._write_lock = threading.Lock()
+
+    def save(self, state: typing.Optional[dict]):
+        """
+        Args:
+            state (dict): picklable state, or ``None`` to clear the checkpoint
+        """
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.size:
+            raise ValueError(f'checkpoint of {len(data)} bytes is larger than the {self.size} bytes allocated')
+        with self._write_lock:
+            version = self._version.value + 1
+            offset = (version % 2) * self.size
+            self._slots[offset:offset + len(data)] = data
+            self._lengths[version % 2] = len(data)
+            self._version.value = version
+
+    def load(self) -> typing.Optional[dict]:
+        """
+        Returns:
+            dict: the last saved state, ``None`` if nothing has been saved or it was cleared
+        """
+        while True:
+            version = self._version.value
+            if version == 0:
+                return None
+            offset = (version % 2) * self.size
+            data = self._slots[offset:offset + self._lengths[version % 2]]
+            if self._version.value == version:
+                return pickle.loads(data)
+
+    def clear(self):
+        self.save(None)
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Whether a process that may not be our child is running: it exists and isn't a zombie waiting for its parent
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+class _ProcessHandle(object):
+    """
+    A standby process, which is forked by a controller process rather than ours (see :class:`.Standby` ), with the
+    parts of the :class:`multiprocessing.Process` interface used by the :class:`.ProcessManager`
+    """
+    exitcode = None
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def is_alive(self) -> bool:
+        return pid_alive(self.pid)
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def join(self, timeout: float = None):
+        start = time.time()
+        while self.is_alive() and (timeout is None or time.time() - start < timeout):
+            time.sleep(0.001)
+
+
+class Standby(object):
+    """
+    Hands the controller over to a standby process, see :class:`.ProcessManager` .
+
+    Each controller process forks the next standby as soon as it starts (see :func:`.rpc.rpc_server_main` ), before it
+    builds the controller or starts any threads -- rather than the manager's process forking it, which once the GUI is
+    loaded is large and runs Qt's and the watchdog's threads, whose locks a forked child would inherit held.
+    The standby waits, until it is promoted or the manager's process exits. Since it isn't the manager's child, it is
+    tracked by its pid, published here in shared memory.
+    """
+
+    def __init__(self):
+        self.manager_pid = os.getpid()
+        self._pid = multiprocessing.RawValue(ctypes.c_int, 0)       # standby waiting to be promoted, 0 if none
+        self._promoted = multiprocessing.RawValue(ctypes.c_int, 0)  # pid of the standby to promote
+        self._promote = multiprocessing.Semaphore(0)
+
+    @property
+    def process(self) -> typing.Optional[_ProcessHandle]:
+        """
+        The standby process, ``None`` if none has been forked since the last was promoted or killed
+        """
+        pid = self._pid.value
+        return _ProcessHandle(pid) if pid else None
+
+    def start_next(self, **kwargs):
+        """
+        Called in a controller process: fork the next standby
+
+        Args:
+            **kwargs: passed on to :func:`.rpc.rpc_server_main`
+        """
+        process = multiprocessing.Process(target=rpc.rpc_server_main, name='controller_standby',
+                                          kwargs=dict(kwargs, standby=self, waiting=True))
+        process.start()
+        self._pid.value = process.pid
+
+    def wait_promoted(self) -> bool:
+        """
+        Called in a standby process: wait until it is promoted
+
+        Returns:
+            bool: ``True`` if promoted, ``False`` if the manager's process exited first
+        """
+        pid = os.getpid()
+        while pid_alive(self.manager_pid):
+            # a stale release, for a standby that died before it was promoted, is dropped
+            if self._promote.acquire(timeout=1) and self._promoted.value == pid:
+                return True
+        return False
+
+    def promote(self) -> typing.Optional[_ProcessHandle]:
+        """
+        Returns:
+            the promoted standby process, ``None`` if there was none ready
+        """
+        process = self.process
+        if process is None or not process.is_alive():
+            return None
+        self._pid.value = 0
+        self._promoted.value = process.pid
+        self._promote.release()
+        return process
+
+    def kill(self):
+        process = self.process
+        self._pid.value = 0
+        if process is not None:
+            process.kill()
+            process.join(1)
+
+
 class ProcessManager:
+    """
+    Runs the controller (see :func:`.rpc.rpc_server_main` ) in a separate process.
+
+    With ``watchdog`` , a thread checks the controller's :meth:`~.ControlModuleBase.get_heartbeat` every
+    ``WATCHDOG_INTERVAL`` s. If the controller process dies, doesn't answer, or its main loop should be running but the
+    heartbeat hasn't changed within ``WATCHDOG_TIMEOUT`` s, it is restarted warm (see :meth:`.restart_process` ): the
+    new process restores the control settings, and whether the main loop was running, from the shared
+    :attr:`.checkpoint` . While the main loop is in a known long operation, like rotating the log file (see
+    :meth:`~.ControlModuleBase.get_busy` ), it may stall for up to ``WATCHDOG_BUSY_TIMEOUT`` s instead: killing it
+    then would leave the log file unclosed.
+
+    With ``standby`` , a second controller process is forked ahead of time and waits, without building a controller
+    or serving, until it is promoted. Starting the controller then promotes the standby instead of forking a new
+    process from this one (which, once the GUI is loaded, is large and multi-threaded). The standbys are forked by
+    the controller processes, see :class:`.Standby` . If there is no standby ready, eg. when restarting again before
+    the promoted one forked the next, the controller process is forked from this one as without ``standby`` .
+
+    Attributes:
+        checkpoint (:class:`.Checkpoint`): state the controller saves whenever it changes
+        restarts (list): of dicts, for each restart: ``'time'`` (:func:`time.time` ), ``'reason'`` , and
+            ``'latency'`` , seconds from killing the old process to the new one serving
+    """
     # Functions:
-    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None):
+    def __init__(self, sim_mode, startCommandLine=None, maxHeartbeatInterval=None, wait=True, watchdog=False,
+                 standby=False):
+        """
+        Args:
+            sim_mode (bool): simulate the hardware
+            maxHeartbeatInterval (float): seconds without a heartbeat before the watchdog restarts the controller,
+                default the ``WATCHDOG_TIMEOUT`` pref
+            wait (bool): wait for the controller to be serving, see :meth:`.start_process`
+            watchdog (bool): restart the controller if it stalls
+            standby (bool): keep a standby controller process ready to take over
+        """
+        self.logger = init_logger(__name__)
         self.sim_mode = sim_mode
         self.command_line = None  # TODO: what is this?
-        self.max_heartbeat_interval = None
+        self.max_heartbeat_interval = prefs.get_pref('WATCHDOG_TIMEOUT') \
+            if maxHeartbeatInterval is None else maxHeartbeatInterval
+        self.watchdog_interval = prefs.get_pref('WATCHDOG_INTERVAL')
+        self.max_busy_interval = prefs.get_pref('WATCHDOG_BUSY_TIMEOUT')
         self.previous_timestamp = None
         self.child_process = None
+        self.child_pid = None
         self.serve_event = multiprocessing.Event()
         self.serve_event.clear()
         self.timeout = 5
+        self.checkpoint = Checkpoint()
+        self.restarts = []
+
+        self.standby = standby
+        self._standby = Standby() if standby else None
+
+        self.watchdog = watchdog
+        self._watchdog = None
+        self._watchdog_stop = threading.Event()
+        self._lock = threading.RLock()
         # TODO: if child process exists, need to reconnect it
-        self.start_process()
+        self.start_process(wait=wait)
         #time.sleep(1)
 
-    def __del__(self):
-        self.try_stop_process()
+    def start_process(self, wait=True, warm=False):
+        """
+        Start the controller process
 
-    def start_process(self):
-        if self.child_process is not None:
-            # Child process already started
-            return
-        self.serve_event.clear()
-        self.child_process = multiprocessing.Process(target=rpc.rpc_server_main,
-                                                     kwargs=
-                                                     {
-                                                         'sim_mode':self.sim_mode,
-                                                         'serve_event':self.serve_event
-                                                     })
-        # self.child_process.daemon = True
-        self.child_process.start()
-        self.child_pid = self.child_process.pid
-        self.serve_event.wait(self.timeout)
+        Args:
+            wait (bool): if ``True`` , block until the controller is serving (or :attr:`.timeout` ). Otherwise return
+                as soon as the process is started, and check with :meth:`.is_ready` or :meth:`.wait_ready`
+            warm (bool): if ``True`` , restore the controller from the :attr:`.checkpoint` . Otherwise clear it and
+                start with the default settings
+        """
+        with self._lock:
+            if self.child_process is not None:
+                # Child process already started
+                return
+            if not warm:
+                self.checkpoint.clear()
+            self.serve_event.clear()
+            self.child_process = self._standby.promote() if self._standby is not None else None
+            if self.child_process is None:
+                self.child_process = self._make_process()
+                self.child_process.start()
+            self.child_pid = self.child_process.pid
+            self._started_at = time.time()
+            self.previous_timestamp = None
 
-    def try_stop_process(self):
+            if self.watchdog:
+                self.start_watchdog()
+        if wait:
+            self.wait_ready()
+
+    def _make_process(self) -> multiprocessing.Process:
+        return multiprocessing.Process(target=rpc.rpc_server_main,
+                                       kwargs=
+                                       {
+                                           'sim_mode':self.sim_mode,
+                                           'serve_event':self.serve_event,
+                                           'checkpoint':self.checkpoint,
+                                           'standby':self._standby
+                                       })
+
+    @property
+    def standby_process(self) -> typing.Optional[_ProcessHandle]:
+        """
+        The standby controller process waiting to be promoted, if any
+        """
+        return self._standby.process if self._standby is not None else None
+
+    def is_ready(self) -> bool:
+        """
+        Whether the controller process is serving
+        """
+        return self.serve_event.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        """
+        Block until the controller process is serving
+
+        Args:
+            timeout (float): seconds to wait, default :attr:`.timeout`
+
+        Returns:
+            bool: whether it is serving
+        """
+        return self.serve_event.wait(self.timeout if timeout is None else timeout)
+
+    def _kill_process(self):
         if self.child_process is not None:
             # print(f'kill process {self.child_pid}')
             self.child_process.kill()
-            while self.child_process.is_alive():
-                time.sleep(0.01)
+            self.child_process.join()
             self.child_process = None
             self.child_pid = None
+            self.serve_event.clear()
 
-    def restart_process(self):
-        self.try_stop_process()
-        self.start_process()
+    def try_stop_process(self):
+        """
+        Stop the watchdog, the controller process and any standby
+        """
+        self.stop_watchdog()
+        with self._lock:
+            self._kill_process()
+            if self._standby is not None:
+                self._standby.kill()
+
+    def restart_process(self, warm=True, reason='restart requested'):
+        """
+        Kill the controller process and start a new one, waiting until it is serving
+
+        Args:
+            warm (bool): restore the new controller from the :attr:`.checkpoint` , see :meth:`.start_process`
+            reason (str): logged, and kept in :attr:`.restarts`
+
+        Returns:
+            float: seconds from killing the old process to the new one serving
+        """
+        with self._lock:
+            start = time.perf_counter()
+            self._kill_process()
+            self.start_process(wait=True, warm=warm)
+            latency = time.perf_counter() - start
+        self.restarts.append({'time': time.time(), 'reason': reason, 'latency': latency})
+        self.logger.warning(f'controller restarted ({"warm" if warm else "cold"}) in {latency * 1000:.1f} ms: {reason}')
+        return latency
 
     def heartbeat(self, timestamp):
-        # TODO: if no heartbeat in maxInterval restart
-        pass
+        """
+        Record that the controller was alive at ``timestamp`` (:func:`time.time` )
+        """
+        self.previous_timestamp = timestamp
+
+    def start_watchdog(self):
+        """
+        Start checking the controller's heartbeat, see :class:`.ProcessManager`
+        """
+        if self._watchdog is not None and self._watchdog.is_alive():
+            return
+        self._watchdog_stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='controller_watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop_watchdog(self):
+        self._watchdog_stop.set()
+        if self._watchdog is not None and self._watchdog is not threading.current_thread():
+            self._watchdog.join()
+        self._watchdog = None
+
+    def _watch(self):
+        client = rpc.RPCClient(timeout=self.max_heartbeat_interval)
+        count = None
+        while not self._watchdog_stop.wait(self.watchdog_interval):
+            count, reason = self._check(client, count)
+            if reason is not None:
+                with self._lock:
+                    if self._watchdog_stop.is_set():
+                        break
+                    self.restart_process(warm=True, reason=reason)
+                count = None
+        client.close()
+
+    def _check(self, client, last_count) -> typing.Tuple[typing.Optional[int], typing.Optional[str]]:
+        """
+        Check the controller once
+
+        Args:
+            client (:class:`.rpc.RPCClient`): to call the controller with
+            last_count (int): heartbeat from the last check
+
+        Returns:
+            tuple: the heartbeat, and ``None`` if the controller is alive, otherwise why it should be restarted
+        """
+        with self._lock:
+            if self.child_process is None:
+                return last_count, None
+            if not self.child_process.is_alive():
+                return last_count, f'controller process exited with code {self.child_process.exitcode}'
+            if not self.is_ready():
+                if time.time() - self._started_at > self.timeout:
+                    return last_count, f'controller not serving after {self.timeout} s'
+                return last_count, None
+        if self.previous_timestamp is None:
+            self.heartbeat(time.time())
+
+        try:
+            count = client.get_heartbeat()
+        except Exception as e:
+            if time.time() - self.previous_timestamp > self.max_heartbeat_interval:
+                return last_count, f'controller not answering: {e}'
+            return last_count, None
+
+        now = time.time()
+        state = self.checkpoint.load()
+        if count != last_count or state is None or not state['running']:
+            self.heartbeat(now)
+        elif now - self.previous_timestamp > self.max_heartbeat_interval:
+            try:
+                busy = client.get_busy()
+            except Exception:
+                busy = 0
+            if 0 < busy < self.max_busy_interval:
+                return count, None
+            return count, f'no heartbeat from the control loop for {now - self.previous_timestamp:.3f} s'
+        return count, None
 
     def __del__(self):
         try:
-            self.stop_process()
+            self.try_stop_process()
         except AttributeError:
             pass
-
@@ -1,10 +1,14 @@
 import logging
+import os
 import pickle
+import queue
 import socket
+import socketserver
 import xmlrpc.client
-from xmlrpc.server import SimpleXMLRPCServer
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 
 import vent.controller.control_module
+from vent.common import prefs, startup
 from vent.common.loggers import init_logger
 
 default_addr = 'localhost'
@@ -14,6 +18,17 @@ socket.setdefaulttimeout(default_timeout)
 
 remote_controller = None
 
+checkpoint = None
+"""
+:class:`~vent.coordinator.process_manager.Checkpoint` the state of :data:`.remote_controller` is saved to whenever it
+changes, so a restarted controller can take over where it stopped
+"""
+
+
+def save_checkpoint():
+    if checkpoint is not None:
+        checkpoint.save(remote_controller.get_checkpoint())
+
 
 def get_sensors():
     # left as example of how to get loggers within these callbacks
@@ -23,6 +38,11 @@ def get_sensors():
     return pickle.dumps(res)
 
 
+def get_alarm_events():
+    res = remote_controller.get_alarm_events()
+    return pickle.dumps(res)
+
+
 # def get_active_alarms():
 #     res = remote_controller.get_active_alarms()
 #     return pickle.dumps(res)
@@ -36,6 +56,7 @@ def get_sensors():
 def set_control(control_setting):
     args = pickle.loads(control_setting.data)
     remote_controller.set_control(args)
+    save_checkpoint()
 
 
 def get_control(control_setting_name):
@@ -44,35 +65,208 @@ def get_control(control_setting_name):
     return pickle.dumps(res)
 
 
-def rpc_server_main(sim_mode, serve_event, addr=default_addr, port=default_port):
+def set_controls(control_settings):
+    args = pickle.loads(control_settings.data)
+    remote_controller.set_controls(args)
+    save_checkpoint()
+
+
+def get_state(control_settings, loop_since=None):
+    args = pickle.loads(control_settings.data)
+    # pickled, the count of loop cycles can outgrow an XML-RPC int
+    res = remote_controller.get_state(args, pickle.loads(loop_since.data) if loop_since is not None else None)
+    if args:
+        save_checkpoint()
+    return pickle.dumps(res)
+
+
+def start():
+    remote_controller.start()
+    save_checkpoint()
+
+
+def stop():
+    remote_controller.stop()
+    save_checkpoint()
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Keeps the connection open between requests (HTTP/1.1), and sends responses without waiting to fill a packet
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+
+class RPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    XML-RPC server with persistent connections, serving each connection in its own thread so one client keeping its
+    connection open doesn't block the others. The controller's methods are thread-safe.
+    """
+    daemon_threads = True
+
+    def __init__(self, addr):
+        super(RPCServer, self).__init__(addr, requestHandler=KeepAliveRequestHandler,
+                                        allow_none=True, logRequests=False)
+
+
+def make_server(addr=default_addr, port=default_port) -> RPCServer:
+    """
+    Make a server for :data:`.remote_controller`
+
+    Args:
+        addr (str): address to listen on
+        port (int): port to listen on
+    """
+    server = RPCServer((addr, port))
+    server.register_function(get_sensors, "get_sensors")
+    server.register_function(get_alarm_events, "get_alarm_events")
+    # server.register_function(get_active_alarms, "get_active_alarms")
+    # server.register_function(get_logged_alarms, "get_logged_alarms")
+    server.register_function(set_control, "set_control")
+    server.register_function(get_control, "get_control")
+    server.register_function(set_controls, "set_controls")
+    server.register_function(get_state, "get_state")
+    server.register_function(start, "start")
+    server.register_function(remote_controller.is_running, "is_running")
+    server.register_function(stop, "stop")
+    server.register_function(remote_controller.get_heartbeat, "get_heartbeat")
+    server.register_function(remote_controller.get_busy, "get_busy")
+    return server
+
+
+def rpc_server_main(sim_mode, serve_event, addr=default_addr, port=default_port, checkpoint=None, standby=None,
+                    waiting=False):
+    """
+    Run a controller and serve it
+
+    Args:
+        sim_mode (bool): simulate the hardware
+        serve_event (:class:`multiprocessing.Event`): set once serving
+        checkpoint (:class:`~vent.coordinator.process_manager.Checkpoint`): if given, restore the controller to the
+            state saved in it, and keep saving its state there
+        standby (:class:`~vent.coordinator.process_manager.Standby`): if given, fork the next standby process first
+        waiting (bool): this is a standby process: wait until it is promoted before starting the controller. Returns
+            if the manager's process exits first.
+
+    With the ``ISOLATE_CONTROL_LOOP`` pref, the controller runs in a process of its own and this one only serves it,
+    see :mod:`~vent.coordinator.control_process` .
+    """
     logger = init_logger(__name__)
+    if standby is not None:
+        if waiting:
+            if not standby.wait_promoted():
+                return
+            logger.info('standby controller promoted')
+        # while this process has a single thread, see Standby
+        standby.start_next(sim_mode=sim_mode, serve_event=serve_event, addr=addr, port=port, checkpoint=checkpoint)
     logger.info('controller process init')
     global remote_controller
     if addr != default_addr:
         raise NotImplementedError
     if port != default_port:
         raise NotImplementedError
-    remote_controller = vent.controller.control_module.get_control_module(sim_mode)
-    server = SimpleXMLRPCServer((addr, port), allow_none=True, logRequests=False)
-    server.register_function(get_sensors, "get_sensors")
-    # server.register_function(get_active_alarms, "get_active_alarms")
-    # server.register_function(get_logged_alarms, "get_logged_alarms")
-    server.register_function(set_control, "set_control")
-    server.register_function(get_control, "get_control")
-    server.register_function(remote_controller.start, "start")
-    server.register_function(remote_controller.is_running, "is_running")
-    server.register_function(remote_controller.stop, "stop")
+    if prefs.get_pref('ISOLATE_CONTROL_LOOP'):
+        # import here, control_process imports process_manager, which imports this module
+        from vent.coordinator.control_process import start_control_loop
+        remote_controller = start_control_loop(sim_mode, prefs.get_pref('CONTROL_LOOP_CPUS'))
+        logger.info(f'control loop running in its own process {remote_controller.process.pid}')
+        # serving yields to the control loop when they share a CPU
+        os.nice(10)
+    else:
+        remote_controller = vent.controller.control_module.get_control_module(sim_mode)
+    if checkpoint is not None:
+        state = checkpoint.load()
+        if state is not None:
+            remote_controller.restore_checkpoint(state)
+            logger.info(f'controller restored from checkpoint, running: {state["running"]}')
+    globals()['checkpoint'] = checkpoint
+    server = make_server(addr, port)
     serve_event.set()
+    startup.mark('controller serving')
     server.serve_forever()
 
 
+class KeepAliveTransport(xmlrpc.client.Transport):
+    """
+    Transport that sends requests without waiting to fill a packet.
+
+    :class:`xmlrpc.client.Transport` already reuses its connection while the server keeps it open (see
+    :class:`.KeepAliveRequestHandler` ), and reconnects if it was closed. On a reused connection, the request's headers
+    and body are sent in two writes, so Nagle's algorithm would hold the body until the server acknowledges the
+    headers.
+
+    Args:
+        timeout (float): seconds to wait for the server, default the socket default timeout
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        super(KeepAliveTransport, self).__init__(**kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super(KeepAliveTransport, self).make_connection(host)
+        if conn.sock is None:
+            if self.timeout is not None:
+                conn.timeout = self.timeout
+            conn.connect()
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+
+class RPCClient(object):
+    """
+    Thread-safe client of the controller's RPC server.
+
+    Each call takes a :class:`xmlrpc.client.ServerProxy` , with its own persistent connection, from a pool, and puts
+    it back after, so calls from different threads each have a connection and calls from the same thread reuse one.
+    A connection that fails is closed and dropped from the pool. Methods are called like those of a
+    :class:`xmlrpc.client.ServerProxy` , eg. ``client.get_sensors()`` .
+
+    Args:
+        timeout (float): seconds to wait for a reply before raising :class:`socket.timeout` , default
+            :data:`.default_timeout`
+    """
+
+    def __init__(self, addr=default_addr, port=default_port, timeout=None):
+        self.uri = f"http://{addr}:{port}/"
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+
+    def _call(self, name, *args):
+        try:
+            proxy = self._pool.get_nowait()
+        except queue.Empty:
+            proxy = xmlrpc.client.ServerProxy(self.uri, transport=KeepAliveTransport(self.timeout),
+                                              allow_none=True)
+
+        try:
+            result = getattr(proxy, name)(*args)
+        except xmlrpc.client.Fault:
+            # the call failed in the server, the connection is fine
+            self._pool.put(proxy)
+            raise
+        except Exception:
+            proxy('close')()
+            raise
+        self._pool.put(proxy)
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args: self._call(name, *args)
+
+    def close(self):
+        """
+        Close the pooled connections
+        """
+        while True:
+            try:
+                self._pool.get_nowait()('close')()
+            except queue.Empty:
+                break
+
 
 def get_rpc_client():
-    # https://mail.python.org/pipermail/python-bugs-list/2015-January/260126.html
-    #transport = xmlrpc.client.Transport()
-    #con = transport.make_connection(f"http://{default_addr}:{default_port}/")
-    #con.timeout = 5
-    #
-    proxy = xmlrpc.client.ServerProxy(f"http://{default_addr}:{default_port}/")
-
-    return proxy
\ No newline at end of file
+    return RPCClient(default_addr, default_port)
\ No newline at end of file
@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import time
 import sys
 import threading
@@ -12,8 +14,10 @@ from vent.common import values
 from vent.common.values import ValueName
 from vent.common.message import ControlSetting
 from vent.common.loggers import init_logger
+from vent.common import startup
+from vent.coordinator.async_coordinator import AsyncCoordinator
 from vent import gui
-from vent.gui import widgets, set_gui_instance, get_gui_instance, styles, PLOTS
+from vent.gui import widgets, set_gui_instance, get_gui_instance, styles, render, PLOTS
 from vent.gui.alarm_manager import AlarmManager
 
 
@@ -26,6 +30,29 @@ class Vent_Gui(QtWidgets.QMainWindow):
     :class:`PySide2.QtCore.Signal` emitted when the GUI is closing.
     """
 
+    sensors_received = QtCore.Signal(object)
+    """
+    :class:`PySide2.QtCore.Signal` emitted when a request for sensor values made by :meth:`.update_gui` finishes.
+
+    Emitted from the :attr:`.async_coordinator` 's thread with the request's :class:`concurrent.futures.Future` ,
+    and handled by :meth:`.receive_sensors` in the GUI's thread.
+    """
+
+    control_sent = QtCore.Signal(object, str)
+    """
+    :class:`PySide2.QtCore.Signal` emitted when a change made by :meth:`.send_control` (a setting, or starting or
+    stopping the controller) finishes.
+
+    Emitted from the :attr:`.async_coordinator` 's thread with the request's :class:`concurrent.futures.Future` and
+    a description of the change, and handled by :meth:`.receive_control` in the GUI's thread.
+    """
+
+    control_failed = QtCore.Signal(str)
+    """
+    :class:`PySide2.QtCore.Signal` emitted with a message when a change made by :meth:`.send_control` failed or timed
+    out. The message is shown in the status bar.
+    """
+
     alarms_updated = QtCore.Signal(dict)
     """
     :class:`PySide2.QtCore.Signal` emitted whenever alarms are updated.
@@ -64,7 +91,12 @@ class Vent_Gui(QtWidgets.QMainWindow):
     computed from ``status_height+main_height``
     """
 
-    def __init__(self, coordinator, update_period = 0.1):
+    ready_timeout = 5
+    """
+    seconds to wait for the coordinator to be ready before starting anyway, see :meth:`.Vent_Gui.start_when_ready`
+    """
+
+    def __init__(self, coordinator, update_period = 0.1, fps = None):
         """
         The Main GUI window.
 
@@ -82,14 +114,18 @@ class Vent_Gui(QtWidgets.QMainWindow):
             plots (dict): Dictionary mapping :data:`.gui.PLOT` keys to :class:`.widgets.Plot` objects
             controls (dict): Dictionary mapping :data:`.values.CONTROL` keys to :class:`.widgets.Control` objects
             coordinator (:class:`vent.coordinator.coordinator.CoordinatorBase`): Some coordinator object that we use to communicate with the controller
+            async_coordinator (:class:`~vent.coordinator.async_coordinator.AsyncCoordinator`): polls the ``coordinator`` for values without blocking the GUI
             control_module (:class:`vent.controller.control_module.ControlModuleBase`): Reference to the control module, retrieved from coordinator
             start_time (float): Start time as returned by :func:`time.time`
-            update_period (float): The global delay between redraws of the GUI (seconds)
+            update_period (float): The global delay between fetching values from the coordinator (seconds)
+            render_clock (:class:`~.render.RenderClock`): repaints the plots and monitors at a fixed frame rate
+            ingest_stats (:class:`~.render.FrameStats`): durations of handing fetched values to the widgets, see :meth:`.render_stats`
             alarm_manager (:class:`~.AlarmManager`)
 
 
         Arguments:
-            update_period (float): The global delay between redraws of the GUI (seconds)
+            update_period (float): The global delay between fetching values from the coordinator (seconds)
+            fps (float): Frames per second the GUI is repainted at, default the ``GUI_FPS`` pref
             test (bool): Whether the monitored values and plots should be fed sine waves for visual testing.
 
 
@@ -124,17 +160,33 @@ class Vent_Gui(QtWidgets.QMainWindow):
         # stop QTimer when program closing
         self.gui_closing.connect(self.timer.stop)
 
+        # fetch values in the background, so a slow controller doesn't freeze the GUI
+        self.async_coordinator = AsyncCoordinator(self.coordinator)
+        self._sensor_request = None
+        self.sensors_received.connect(self.receive_sensors)
+        self.control_sent.connect(self.receive_control)
+        # changes still being sent are finished in the background
+        self.gui_closing.connect(functools.partial(self.async_coordinator.close, wait=False))
+
+        # widgets are repainted by the render clock, independently of fetching values
+        self.render_clock = render.get_render_clock()
+        if fps is not None:
+            self.render_clock.fps = fps
+        self.gui_closing.connect(self.render_clock.stop)
+        self.ingest_stats = render.FrameStats()
+
         # set update period (after timer is created!!)
         self._update_period = None
         self.update_period = update_period
 
-        # initialize controls to starting values
-        self.init_controls()
-
         self.init_ui()
         self.start_time = time.time()
+        startup.mark('gui shown')
 
-        self.update_gui()
+        self.render_clock.start()
+        self._first_values = False
+        self._ready_wait_start = time.perf_counter()
+        self.start_when_ready()
 
     @property
     def update_period(self):
@@ -152,13 +204,35 @@ class Vent_Gui(QtWidgets.QMainWindow):
             # store new value
             self._update_period = update_period
 
+    def start_when_ready(self):
+        """
+        Initialize the controls and start fetching values once the coordinator is ready.
+
+        While a separate controller process is starting (see :class:`~vent.coordinator.coordinator.CoordinatorRemote` )
+        check again shortly rather than blocking, so the window can be drawn in the meantime. After
+        :attr:`.ready_timeout` start anyway.
+        """
+        if not self.coordinator.is_ready():
+            if time.perf_counter() - self._ready_wait_start < self.ready_timeout:
+                QtCore.QTimer.singleShot(20, self.start_when_ready)
+                return
+            self.logger.warning(f'coordinator not ready after {self.ready_timeout} s, starting anyway')
+        else:
+            startup.mark('controller ready')
+
+        # initialize controls to starting values
+        self.init_controls()
+        self.update_gui()
+
     def init_controls(self):
         """
         on startup, set controls in coordinator to ensure init state is synchronized
         """
-
-        for control_name, control_params in self.CONTROL.items():
-            self.set_value(control_params.default, control_name)
+        # all in one request
+        self.send_control('set_controls',
+                          [self._control_setting(control_params.default, control_name.name)
+                           for control_name, control_params in self.CONTROL.items()],
+                          description='initialize the controls')
 
     def set_value(self, new_value, value_name=None):
         """
@@ -175,23 +249,100 @@ class Vent_Gui(QtWidgets.QMainWindow):
             # TODO: More explicitly check for enum
             value_name = value_name.name
 
+        self.send_control('set_control', self._control_setting(new_value, value_name),
+                          description=f'set {value_name} to {new_value}')
+
+    def send_control(self, method: str, *args, description: str = None):
+        """
+        Send a change to the controller without waiting for it, in order with the other changes (see
+        :meth:`.AsyncCoordinator.submit` with ``ordered=True`` ). If it fails, :attr:`.control_failed` is emitted.
+
+        Args:
+            method (str): coordinator method, eg. ``'set_control'``
+            *args: its arguments
+            description (str): what the change does, for the failure message, default the ``method``
+
+        Returns:
+            :class:`concurrent.futures.Future`: the request
+        """
+        if description is None:
+            description = method
+        request = self.async_coordinator.submit(method, *args, ordered=True)
+        request.add_done_callback(lambda done: self.control_sent.emit(done, description))
+        return request
+
+    def receive_control(self, request, description: str):
+        """
+        Report a change made by :meth:`.send_control` that failed
+
+        Args:
+            request (:class:`concurrent.futures.Future`): the request
+            description (str): what the change does
+        """
+        if request.cancelled():
+            return
+        try:
+            request.result()
+        except asyncio.TimeoutError:
+            message = f'Could not {description}: no reply from the controller after {self.async_coordinator.timeout} s'
+        except Exception as e:
+            message = f'Could not {description}: {e}'
+        else:
+            return
+        self.logger.warning(message)
+        self.control_failed.emit(message)
 
-        control_object = ControlSetting(name=getattr(ValueName, value_name),
-                                        value=new_value,
-                                        min_value = self.CONTROL[getattr(ValueName, value_name)]['safe_range'][0],
-                                        max_value = self.CONTROL[getattr(ValueName, value_name)]['safe_range'][1],
-                                        timestamp = time.time())
-        self.coordinator.set_control(control_object)
+    def _control_setting(self, new_value, value_name: str) -> ControlSetting:
+        return ControlSetting(name=getattr(ValueName, value_name),
+                              value=new_value,
+                              min_value = self.CONTROL[getattr(ValueName, value_name)]['safe_range'][0],
+                              max_value = self.CONTROL[getattr(ValueName, value_name)]['safe_range'][1],
+                              timestamp = time.time())
 
 
     def update_gui(self):
+        """
+        Request values from the coordinator without waiting for them. When they arrive, :meth:`.receive_sensors` gives
+        them to the plots and monitors, which display them on the next frame of the :attr:`.render_clock`
+
+        If the last request hasn't finished, another isn't made, so requests don't pile up behind a slow controller.
+        Each request is abandoned after the ``COORDINATOR_TIMEOUT`` pref.
+        """
+        try:
+            if self._sensor_request is None or self._sensor_request.done():
+                self._sensor_request = self.async_coordinator.submit('get_sensors')
+                self._sensor_request.add_done_callback(self.sensors_received.emit)
+        finally:
+            self.timer.start()
+
+    def receive_sensors(self, request):
+        """
+        Give the values from a finished request of :meth:`.update_gui` to the plots and monitors
+
+        Args:
+            request (:class:`concurrent.futures.Future`): the request
+        """
+        if request.cancelled():
+            return
+        try:
+            vals = request.result()
+        except asyncio.TimeoutError:
+            self.logger.warning(f'no sensor values from the controller after {self.async_coordinator.timeout} s')
+            return
+        except Exception as e:
+            self.logger.exception(f'error getting sensor values from the controller: {e}')
+            return
+
+        start = time.perf_counter()
         try:
             # get alarms
             #active_alarms = self.coordinator.get_active_alarms()
             #self.alarms_updated.emit(active_alarms)
 
-
-            vals = self.coordinator.get_sensors()
+            if not self._first_values and vals is not None:
+                self._first_values = True
+                startup.mark('first values')
+                self.render_clock.frame.connect(self._first_frame)
 
             for plot_key, plot_obj in self.plots.items():
                 if hasattr(vals, plot_key):
@@ -203,7 +354,26 @@ class Vent_Gui(QtWidgets.QMainWindow):
 
         #
         finally:
-            self.timer.start()
+            self.ingest_stats.add(start, time.perf_counter())
+
+    def _first_frame(self, this_time):
+        self.render_clock.frame.disconnect(self._first_frame)
+        startup.mark('first waveform')
+
+    def render_stats(self) -> dict:
+        """
+        Time spent rendering and fetching values, to check the GUI has CPU to spare
+
+        Returns:
+            dict: ``render`` and ``ingest`` :meth:`.FrameStats.stats` , and ``load`` , the fraction of time spent on both
+        """
+        render_stats = self.render_clock.stats()
+        ingest_stats = self.ingest_stats.stats(self.update_period)
+        return {
+            'render': render_stats,
+            'ingest': ingest_stats,
+            'load': render_stats.get('load', 0) + ingest_stats.get('load', 0)
+        }
 
 
 
@@ -396,7 +566,10 @@ class Vent_Gui(QtWidgets.QMainWindow):
         self.status_bar.status_message.message_cleared.connect(self.handle_cleared_alarm)
 
         # connect start button to coordinator start
-        self.status_bar.start_button.clicked.connect(self.coordinator.start)
+        self.status_bar.start_button.clicked.connect(self.start_controller)
+
+        # and show changes that didn't reach the controller
+        self.control_failed.connect(self.status_bar.status_message.show_error)
 
     @QtCore.Slot(Alarm)
     def handle_alarm(self, alarm):
@@ -443,16 +616,20 @@ class Vent_Gui(QtWidgets.QMainWindow):
         """
         #globals()['_GUI_INSTANCE'] = None
         set_gui_instance(None)
-        self.gui_closing.emit()
 
         if self.coordinator:
-            try:
-                self.coordinator.stop()
-            except:
-                raise Warning('had a thread object, but the thread object couldnt be stopped')
+            # after any changes still being sent, and before the async coordinator closes
+            self.send_control('stop', description='stop the controller')
+        self.gui_closing.emit()
 
         event.accept()
 
+    def start_controller(self):
+        """
+        Start the controller, without waiting for it, see :meth:`.send_control`
+        """
+        self.send_control('start', description='start the controller')
+
     def start(self):
         """
         Click the :meth:`~.gui.widgets.status_bar.Status_Bar.start` button
@@ -470,6 +647,7 @@ def launch_gui(coordinator):
     app.setStyle('Fusion')
     app.setStyleSheet(styles.DARK_THEME)
     app = styles.set_dark_palette(app)
+    startup.mark('qt app created')
     gui = Vent_Gui(coordinator)
 
     return app, gui
\ No newline at end of file
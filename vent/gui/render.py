@@ -0,0 +1,183 @@
+"""
+Fixed-rate rendering of the GUI.
+
+Data arrives at the rate :class:`~vent.gui.main.Vent_Gui` polls the coordinator, but the widgets only repaint on
+the ticks of a shared :class:`.RenderClock` , at ``GUI_FPS`` frames per second. Widgets take new data by storing it
+and setting their ``dirty`` flag, and the clock calls ``render(this_time)`` on each dirty widget (and on every
+``animated`` widget, like the sweeping :class:`~vent.gui.widgets.plot.Plot` s) once per frame, so however often data
+arrives a widget is painted at most once a frame.
+
+The time taken by each frame is kept in :class:`.FrameStats` , so the load of rendering (and, with
+:meth:`~vent.gui.main.Vent_Gui.render_stats` , of fetching data) can be checked against the frame period::
+
+    get_render_clock().stats()
+    {'n': 600, 'fps': 19.9, 'mean': 0.0041, 'p99': 0.0093, 'max': 0.0120, 'load': 0.082, 'late': 0}
+"""
+
+import time
+import typing
+import weakref
+
+import numpy as np
+from PySide2 import QtCore
+
+from vent.common import prefs
+
+
+class FrameStats(object):
+    """
+    Durations and start times of the most recent frames (or any other periodic work)
+    """
+
+    def __init__(self, n_frames: int = 600):
+        """
+        Args:
+            n_frames (int): number of frames to keep
+        """
+        self.n_frames = n_frames
+        self._starts = np.zeros(n_frames)
+        self._durations = np.zeros(n_frames)
+        self.count = 0
+
+    def add(self, start: float, stop: float):
+        """ Record a frame that ran from ``start`` to ``stop`` (:func:`time.perf_counter` ) """
+        i = self.count % self.n_frames
+        self._starts[i] = start
+        self._durations[i] = stop - start
+        self.count += 1
+
+    def stats(self, period: float = None) -> dict:
+        """
+        Statistics of the kept frames
+
+        Args:
+            period (float): intended time between frames (s), to count frames that started late
+
+        Returns:
+            dict: ``n`` frames, ``fps`` frames per second, ``mean`` , ``p99`` and ``max`` frame durations (s),
+            ``load`` the fraction of the time spent in frames, and ``late`` the number of frames that started more
+            than half a period late. Empty if no frames were recorded.
+        """
+        n = min(self.count, self.n_frames)
+        if n == 0:
+            return {}
+        # oldest first
+        order = np.argsort(self._starts[:n])
+        starts, durations = self._starts[:n][order], self._durations[:n][order]
+        stats = {
+            'n':    n,
+            'mean': float(durations.mean()),
+            'p99':  float(np.percentile(durations, 99)),
+            'max':  float(durations.max())
+        }
+        elapsed = starts[-1] + durations[-1] - starts[0]
+        stats['fps'] = (n - 1) / (starts[-1] - starts[0]) if n > 1 else 0.
+        stats['load'] = float(durations.sum() / elapsed) if elapsed > 0 else 0.
+        if period is not None and n > 1:
+            stats['late'] = int(np.sum(np.diff(starts) > period * 1.5))
+        return stats
+
+
+class RenderClock(QtCore.QObject):
+    """
+    Repaints registered widgets at a fixed frame rate, see the module documentation.
+
+    Widgets are held by weak reference, so they don't need to be removed when they are deleted.
+    The clock starts when the first widget is added, so widgets used on their own (outside
+    :class:`~vent.gui.main.Vent_Gui` ) are repainted too, unless it was stopped with :meth:`.stop` .
+    """
+
+    frame = QtCore.Signal(float)
+    """
+    :class:`PySide2.QtCore.Signal` emitted after each frame with the time the frame was rendered for
+    """
+
+    def __init__(self, fps: float = None, n_frames: int = 600):
+        """
+        Args:
+            fps (float): frames per second, default the ``GUI_FPS`` pref
+            n_frames (int): number of frames to keep the durations of
+        """
+        super(RenderClock, self).__init__()
+        self._items = weakref.WeakSet()
+        self.frames = FrameStats(n_frames)
+        self._stopped = False
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.render)
+
+        self._fps = None
+        self.fps = prefs.get_pref('GUI_FPS') if fps is None else fps
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @fps.setter
+    def fps(self, fps: float):
+        self._fps = fps
+        self.timer.setInterval(round(1000 / fps))
+
+    @property
+    def period(self) -> float:
+        """ Time between frames (s) """
+        return 1 / self._fps
+
+    def add(self, item):
+        """
+        Render ``item`` on each frame where it is ``dirty`` or ``animated`` , starting the clock if it isn't running
+
+        Args:
+            item: an object with a ``render(this_time)`` method, and optionally ``dirty`` and ``animated`` attributes
+        """
+        self._items.add(item)
+        if not self._stopped and not self.timer.isActive():
+            self.timer.start()
+
+    def remove(self, item):
+        self._items.discard(item)
+
+    def start(self):
+        self._stopped = False
+        self.timer.start()
+
+    def stop(self):
+        """ Stop rendering, until :meth:`.start` is called -- adding widgets doesn't restart it """
+        self._stopped = True
+        self.timer.stop()
+
+    def render(self):
+        """
+        Render a frame: call ``render(this_time)`` on each dirty or animated item, and record how long it took.
+        """
+        start = time.perf_counter()
+        this_time = time.time()
+        for item in list(self._items):
+            if getattr(item, 'animated', False) or getattr(item, 'dirty', False):
+                try:
+                    item.render(this_time)
+                except RuntimeError:
+                    # the Qt object was deleted before its python wrapper
+                    self._items.discard(item)
+        self.frames.add(start, time.perf_counter())
+        self.frame.emit(this_time)
+
+    def stats(self) -> dict:
+        """ :meth:`.FrameStats.stats` of the recent frames """
+        return self.frames.stats(self.period)
+
+
+_RENDER_CLOCK = None
+
+
+def get_render_clock() -> RenderClock:
+    """
+    Get the :class:`.RenderClock` shared by the GUI's widgets, creating it the first time.
+
+    Returns:
+        :class:`.RenderClock`
+    """
+    if globals()['_RENDER_CLOCK'] is None:
+        globals()['_RENDER_CLOCK'] = RenderClock()
+    return globals()['_RENDER_CLOCK']
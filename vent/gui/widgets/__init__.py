@@ -1,5 +1,15 @@
+import importlib
+
 from vent.gui.widgets.control import Control
 from vent.gui.widgets.monitor import Monitor
-from vent.gui.widgets.plot import Plot
 from vent.gui.widgets.status_bar import Status_Bar
-from vent.gui.widgets import components
\ No newline at end of file
+from vent.gui.widgets import components
+
+
+def __getattr__(name):
+    # pyqtgraph is slow to import, so the plot is only imported when it's first used
+    if name == 'plot':
+        return importlib.import_module(f'{__name__}.plot')
+    if name == 'Plot':
+        return importlib.import_module(f'{__name__}.plot').Plot
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
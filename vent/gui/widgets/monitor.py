@@ -2,7 +2,7 @@ import numpy as np
 import time
 from PySide2 import QtWidgets, QtCore
 
-from vent.gui import styles, mono_font
+from vent.gui import styles, mono_font, render
 from vent.gui.widgets.components import RangeSlider
 from vent.common import message
 
@@ -16,7 +16,12 @@ class Monitor(QtWidgets.QWidget):
 
         Args:
             value (:class:`~vent.values.Value`):
-            update_period (float): update period of monitor in s
+            update_period (float): minimum time between updates of the displayed value in s. The value is displayed
+                on a frame of the :class:`~vent.gui.render.RenderClock` after it changes.
+
+        Values are rounded to ``decimals`` when they arrive, and a value that is displayed the same as the last is
+        ignored. Every monitor with the same ``update_period`` displays its new value on the same frame, so Qt paints
+        all their labels in one pass.
         """
         super(Monitor, self).__init__()
 
@@ -29,13 +34,16 @@ class Monitor(QtWidgets.QWidget):
         self.enum_name = enum_name
 
         self.value = None
+        self.dirty = False         # a new value hasn't been displayed yet
+        self._last_period = None   # the update period the value was last displayed in
+        self._value_text = ''
 
         # whether we are currently styled as being in an alarm state
         self._alarm = False
 
         self.init_ui()
 
-        self.timed_update()
+        render.get_render_clock().add(self)
 
     def init_ui(self):
         self.layout = QtWidgets.QVBoxLayout()
@@ -171,15 +179,18 @@ class Monitor(QtWidgets.QWidget):
     @QtCore.Slot(float)
     def update_value(self, new_value):
 
-        # stash numerical value
+        # stash numerical value, as precise as it is displayed
         try:
-            new_value = np.clip(new_value, self.abs_range[0], self.abs_range[1])
+            new_value = round(float(np.clip(new_value, self.abs_range[0], self.abs_range[1])), self.decimals)
         except TypeError:
             # if given None, can't clip it.
             # just return
             # TODO: Should this raise an alarm?
             return
+        if new_value == self.value:
+            return
         self.value = new_value
+        self.dirty = True
         self.check_alarm()
 
     @QtCore.Slot(tuple)
@@ -188,13 +199,26 @@ class Monitor(QtWidgets.QWidget):
         self.range_slider.setHigh(new_limits[1])
         self.update_boxes(new_limits)
 
-    def timed_update(self):
-        # format value based on decimals
-        if self.value:
-            value_str = str(np.round(self.value, self.decimals))
-            self.value_label.setText(value_str)
+    def render(self, this_time: float):
+        """
+        Display the new value, at most once every ``update_period`` . Called by the
+        :class:`~vent.gui.render.RenderClock` when the monitor is ``dirty`` .
 
-        QtCore.QTimer.singleShot(round(self.update_period*1000), self.timed_update)
+        Periods are counted from the epoch rather than from the last update, so monitors that change at different
+        times still update their labels together.
+        """
+        period = this_time // self.update_period
+        if period == self._last_period:
+            return
+
+        # value is already rounded to decimals,
+        # but it may have changed back to what is displayed
+        value_str = str(self.value) if self.value is not None else ''
+        if value_str != self._value_text:
+            self.value_label.setText(value_str)
+            self._value_text = value_str
+        self._last_period = period
+        self.dirty = False
 
     def _limits_changed(self, val):
         # ignore value, just emit changes and check alarm
@@ -207,6 +231,9 @@ class Monitor(QtWidgets.QWidget):
 
     @alarm_state.setter
     def alarm_state(self, alarm):
+        # restyling is slow, skip if already styled
+        if alarm == self._alarm:
+            return
         if alarm == True:
             self.value_label.setStyleSheet(styles.DISPLAY_VALUE_ALARM)
             self.name_label.setStyleSheet(styles.DISPLAY_NAME_ALARM)
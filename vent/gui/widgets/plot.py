@@ -1,5 +1,6 @@
+import math
 import time
-from collections import deque
+import typing
 
 import numpy as np
 from PySide2 import QtCore
@@ -8,24 +9,199 @@ import pyqtgraph as pg
 
 
 from vent.gui import styles
-from vent.gui import mono_font
-from vent.gui import get_gui_instance
+from vent.gui import render
 
-PLOT_TIMER = None
-"""
-A :class:`~PySide2.QtCore.QTimer` that updates :class:`.TimedPlotCurveItem`s
-"""
 
-PLOT_FREQ = 5
-"""
-Update frequency of :class:`.Plot` s in Hz
-"""
+class PlotBuffer(object):
+    """
+    Fixed-size ring of plotted samples, preallocated as numpy arrays of timestamps, x positions and values.
+
+    Each sample is written twice, at ``i`` and ``i + size`` , so any run of the last ``size`` samples is one
+    contiguous slice of the arrays (see :meth:`.span` ) that can be plotted without copying or reordering, and
+    appending a sample is O(1).
+
+    Samples are referred to by their absolute number, counting from the first sample appended.
+    """
+
+    def __init__(self, size: int):
+        """
+        Args:
+            size (int): number of samples kept
+        """
+        self.size = size
+        self.times = np.zeros(size * 2)
+        self.x = np.zeros(size * 2)
+        self.values = np.zeros(size * 2)
+        self.count = 0  # number of samples ever appended, the number of the next sample
+
+    @property
+    def first(self) -> int:
+        """ Number of the oldest sample still in the buffer """
+        return max(self.count - self.size, 0)
+
+    def append(self, timestamp: float, x: float, value: float):
+        i = self.count % self.size
+        self.times[i] = self.times[i + self.size] = timestamp
+        self.x[i] = self.x[i + self.size] = x
+        self.values[i] = self.values[i + self.size] = value
+        self.count += 1
+
+    def span(self, start: int, stop: int = None) -> slice:
+        """
+        Slice of the arrays holding samples ``start`` to ``stop`` (exclusive, default the newest), limited to the
+        samples still in the buffer.
+        """
+        if stop is None:
+            stop = self.count
+        start = max(start, self.first)
+        if stop <= start:
+            return slice(0, 0)
+        end = (stop - 1) % self.size + self.size + 1
+        return slice(end - (stop - start), end)
+
+
+class SweepTrace(object):
+    """
+    Samples of a sweeping plot, in a :class:`.PlotBuffer` .
+
+    Sweeps are counted from ``start_time`` , and the number of the first sample of the current and previous sweeps is
+    kept as samples arrive, so the samples to draw are found without searching the whole history.
+    """
+
+    def __init__(self, size: int, duration: float, start_time: float):
+        """
+        Args:
+            size (int): number of samples kept
+            duration (float): duration of a sweep (s)
+            start_time (float): time the first sweep started
+        """
+        self.buffer = PlotBuffer(size)
+        self.duration = duration
+        self.start_time = start_time
+        self.sweep = None
+        self.sweep_start = 0
+        self.prev_sweep_start = 0
+
+    def _start_sweep(self, sweep: int):
+        """ Start a new sweep with the next sample if ``sweep`` isn't the current one """
+        if sweep != self.sweep:
+            # the sample wrapped around to the left edge
+            if self.sweep is not None and sweep == self.sweep + 1:
+                self.prev_sweep_start = self.sweep_start
+            else:
+                self.prev_sweep_start = self.buffer.count
+            self.sweep_start = self.buffer.count
+            self.sweep = sweep
+
+    def append(self, timestamp: float, value: float):
+        relative_time = timestamp - self.start_time
+        self._start_sweep(int(relative_time // self.duration))
+        self.buffer.append(timestamp, relative_time % self.duration, value)
+
+    def visible(self, start: int, stop: int, cutoff: float) -> tuple:
+        """ Numbers of the first and last+1 samples from ``start`` to ``stop`` that are newer than ``cutoff`` """
+        span = self.buffer.span(start, stop)
+        drawn_over = np.searchsorted(self.buffer.times[span], cutoff, side='right')
+        return stop - (span.stop - span.start) + int(drawn_over), stop
+
+    def spans(self, this_time: float) -> typing.Tuple[tuple, tuple]:
+        """
+        (first, last+1) sample numbers of what's left of the previous sweep and of the current sweep at ``this_time``,
+        samples older than ``duration`` have been drawn over.
+        """
+        cutoff = this_time - self.duration
+        return (self.visible(self.prev_sweep_start, self.sweep_start, cutoff),
+                self.visible(self.sweep_start, self.buffer.count, cutoff))
+
+    def set_duration(self, duration: float):
+        """ Recompute the positions and sweeps of the buffered samples for a new sweep duration """
+        self.duration = duration
+        buffer = self.buffer
+        relative = buffer.times - self.start_time
+        buffer.x[:] = np.mod(relative, duration)
+        self.sweep = None
+        self.sweep_start = self.prev_sweep_start = buffer.count
+        span = buffer.span(buffer.first)
+        if span.stop > span.start:
+            sweeps = np.floor_divide(relative[span], duration)
+            self.sweep = int(sweeps[-1])
+            self.sweep_start = buffer.first + int(np.searchsorted(sweeps, self.sweep))
+            self.prev_sweep_start = buffer.first + int(np.searchsorted(sweeps, self.sweep - 1))
+
+
+class MinMaxTrace(SweepTrace):
+    """
+    :class:`.SweepTrace` decimated to the minimum and maximum of each of ``n_bins`` bins across the plot.
+
+    Each bin is two points, its min and max in the order they occurred, so peaks are drawn however many samples fall
+    in a pixel. A sample updates the points of its bin in place, so a sweep is at most ``2 * n_bins`` points however
+    fast samples arrive, and adding one is O(1).
+    """
+
+    def __init__(self, n_bins: int, duration: float, start_time: float):
+        """
+        Args:
+            n_bins (int): bins per sweep, eg. the width of the plot in pixels
+            duration (float): duration of a sweep (s)
+            start_time (float): time the first sweep started
+        """
+        # two sweeps of two points per bin
+        super(MinMaxTrace, self).__init__(n_bins * 4, duration, start_time)
+        self.n_bins = n_bins
+        self._bin = None
+        self._min = None
+        self._max = None
+
+    def append(self, timestamp: float, value: float):
+        relative_time = timestamp - self.start_time
+        x = relative_time % self.duration
+        bin_index = math.floor(relative_time * self.n_bins / self.duration)
+        if bin_index == self._bin:
+            # replace the points of the open bin
+            self.buffer.count -= 2
+            if value < self._min[2]:
+                self._min = (timestamp, x, value)
+            if value > self._max[2]:
+                self._max = (timestamp, x, value)
+        else:
+            self._bin = bin_index
+            self._min = self._max = (timestamp, x, value)
+            self._start_sweep(bin_index // self.n_bins)
+
+        first, second = (self._min, self._max) if self._min[0] <= self._max[0] else (self._max, self._min)
+        self.buffer.append(*first)
+        self.buffer.append(*second)
 
 
 class Plot(pg.PlotWidget):
+    """
+    Sweeping plot of a value over the last ``plot_duration`` seconds.
+
+    Like a patient monitor, the newest sample is drawn at ``(time since start) % plot_duration`` , so each sweep draws
+    over the previous one from left to right. Samples are kept in a :class:`.SweepTrace` , so drawing takes slices of
+    its buffer rather than filtering and splitting the whole history, and curves are only given new data when their
+    part of the plot changed.
+
+    Samples are also decimated as they arrive into a :class:`.MinMaxTrace` with a bin per pixel of the plot. When
+    there are more than two samples per pixel in view, that is drawn instead, so the cost of drawing doesn't grow
+    with the sample rate.
+
+    New samples are only stored by :meth:`.update_value` . The plot is drawn on every frame of the
+    :class:`~vent.gui.render.RenderClock` , as the time marker moves even without new samples.
+    """
 
     limits_changed = QtCore.Signal(tuple)
 
+    MIN_BINS = 100
+    """
+    Fewest bins to decimate to, eg. before the plot is first shown and has no width
+    """
+
+    animated = True
+    """
+    Rendered on every frame of the :class:`~vent.gui.render.RenderClock`
+    """
+
     def __init__(self, name, buffer_size = 4092, plot_duration = 5, abs_range = None, safe_range = None, color=None, units='', **kwargs):
         #super(Plot, self).__init__(axisItems={'bottom':TimeAxis(orientation='bottom')})
         # construct title html string
@@ -36,8 +212,6 @@ class Plot(pg.PlotWidget):
 
         super(Plot, self).__init__(background=styles.BACKGROUND_COLOR,
                                    title=titlestr)
-        self.timestamps = deque(maxlen=buffer_size)
-        self.history = deque(maxlen=buffer_size)
         # TODO: Make @property to update buffer_size, preserving history
         self.plot_duration = plot_duration
 
@@ -48,6 +222,13 @@ class Plot(pg.PlotWidget):
         self._last_time = time.time()
         self._last_relative_time = 0
 
+        self.buffer_size = buffer_size
+        self.trace = None
+        self.decimated = None
+        # what the curves were last drawn with, so unchanged curves aren't redrawn
+        self._drawn_late = None
+        self._drawn_early = None
+
         self.abs_range = None
         if abs_range:
             self.abs_range = abs_range
@@ -61,6 +242,7 @@ class Plot(pg.PlotWidget):
         self.setXRange(0, plot_duration)
 
         # split plot curve into two so that the endpoint doesn't get connected to the start point
+        # early_curve is what's left of the previous sweep, late_curve the current sweep
         self.early_curve = self.plot(width=3)
         self.late_curve = self.plot(width=3)
         self.time_marker = self.plot()
@@ -77,53 +259,98 @@ class Plot(pg.PlotWidget):
             self.early_curve.setPen(color=color, width=3)
             self.late_curve.setPen(color=color, width=3)
 
+        self.reset(self._start_time)
+
+        render.get_render_clock().add(self)
+
+    def reset(self, start_time: float = None):
+        """
+        Clear the plot, and start sweeping from ``start_time`` (default now)
+        """
+        if start_time is None:
+            start_time = time.time()
+        self._start_time = start_time
+        self.trace = SweepTrace(self.buffer_size, self.plot_duration, start_time)
+        self.decimated = MinMaxTrace(self.MIN_BINS, self.plot_duration, start_time)
+        self._drawn_late = self._drawn_early = None
+        self.early_curve.clear()
+        self.late_curve.clear()
 
     def set_duration(self, dur):
         self.plot_duration = int(round(dur))
         self.setXRange(0, self.plot_duration)
 
+        self.trace.set_duration(self.plot_duration)
+        self._redecimate(self.decimated.n_bins)
+        self.redraw()
+
+    def _redecimate(self, n_bins: int):
+        """ Decimate the buffered samples again, eg. when the plot is resized """
+        self.decimated = MinMaxTrace(n_bins, self.plot_duration, self._start_time)
+        buffer = self.trace.buffer
+        span = buffer.span(buffer.first)
+        for timestamp, value in zip(buffer.times[span], buffer.values[span]):
+            self.decimated.append(timestamp, value)
+        self._drawn_late = self._drawn_early = None
 
     def update_value(self, new_value):
         """
         new_value: (timestamp from time.time(), value)
         """
         try:
-            this_time = time.time()
-            #time_diff = this_time-self._last_time
-            limits = self.getPlotItem().viewRange()
-            current_relative_time = (this_time-self._start_time) % self.plot_duration
-            self.time_marker.setData([current_relative_time, current_relative_time],
-                                     [limits[1][0], limits[1][1]])
-
-            self.timestamps.append(new_value[0])
-            self.history.append(new_value[1])
-
-            # filter values based on timestamps
-            ts_array = np.array(self.timestamps)
-            end_ind = len(self.history)
-            start_ind = np.where(ts_array > (this_time - self.plot_duration))[0][0]
-
-            # subtract start time and take modulus of duration to get wrapped timestamps
-            plot_timestamps = np.mod(ts_array[start_ind:end_ind]-self._start_time, self.plot_duration)
-            plot_values = np.array([self.history[i] for i in range(start_ind, end_ind)])
-
-            # find the point where the time resets
-            try:
-                reset_ind = np.where(np.diff(plot_timestamps)<0)[0][0]
-
-                # plot early and late
-                self.early_curve.setData(plot_timestamps[0:reset_ind+1],plot_values[0:reset_ind+1] )
-                self.late_curve.setData(plot_timestamps[reset_ind+1:], plot_values[reset_ind+1:])
-
-            except IndexError:
-                self.early_curve.setData(plot_timestamps, plot_values)
-                self.late_curve.clear()
+            self.trace.append(new_value[0], new_value[1])
+            self.decimated.append(new_value[0], new_value[1])
         except:
             # FIXME: Log this lol
             print('error plotting value: {}, timestamp: {}'.format(new_value[1], new_value[0]))
 
         #self._last_time = this_time
 
+    def render(self, this_time: float):
+        """
+        Draw a frame, called by the :class:`~vent.gui.render.RenderClock`
+        """
+        self.redraw(this_time)
+
+    def redraw(self, this_time: float = None):
+        """
+        Move the time marker to ``this_time`` (default now), and give the curves the samples of the current sweep
+        and the rest of the previous sweep if they changed.
+        """
+        if this_time is None:
+            this_time = time.time()
+        limits = self.getPlotItem().viewRange()
+        current_relative_time = (this_time-self._start_time) % self.plot_duration
+        self.time_marker.setData([current_relative_time, current_relative_time],
+                                 [limits[1][0], limits[1][1]])
+
+        n_bins = max(int(self.getPlotItem().getViewBox().width()), self.MIN_BINS)
+        if n_bins != self.decimated.n_bins:
+            self._redecimate(n_bins)
+
+        trace = self.trace
+        early, late = trace.spans(this_time)
+        if (early[1] - early[0]) + (late[1] - late[0]) > 2 * n_bins:
+            trace = self.decimated
+            early, late = trace.spans(this_time)
+
+        # the trace is part of what was drawn, so switching traces redraws
+        if (trace, late) != self._drawn_late:
+            self._set_curve(self.late_curve, trace.buffer, *late)
+            self._drawn_late = (trace, late)
+
+        if (trace, early) != self._drawn_early:
+            self._set_curve(self.early_curve, trace.buffer, *early)
+            self._drawn_early = (trace, early)
+
+    @staticmethod
+    def _set_curve(curve, buffer: PlotBuffer, start: int, stop: int):
+        if stop > start:
+            span = buffer.span(start, stop)
+            curve.setData(buffer.x[span], buffer.values[span])
+        else:
+            curve.clear()
+
     def _safe_limits_changed(self, val):
         # ignore input val, just emit the current value of the lines
         self.limits_changed.emit((self.min_safe.value(),
@@ -133,169 +360,3 @@ class Plot(pg.PlotWidget):
     def set_safe_limits(self, limits):
         self.max_safe.setPos(limits[1])
         self.min_safe.setPos(limits[0])
-    #
-    # def plot(self, *args, **kargs):
-    #     """
-    #     Override method :meth:`pyqtgraph.graphicsItems.PlotItem.plot` to return :class:`TimedPlotDataItem`
-    #
-    #     Add and return a new plot.
-    #     See :func:`PlotDataItem.__init__ <pyqtgraph.PlotDataItem.__init__>` for data arguments
-    #
-    #     Extra allowed arguments are:
-    #         clear    - clear all plots before displaying new data
-    #         params   - meta-parameters to associate with this data
-    #     """
-    #     clear = kargs.get('clear', False)
-    #     params = kargs.get('params', None)
-    #
-    #     if clear:
-    #         self.clear()
-    #
-    #     item = TimedPlotDataItem(*args, **kargs)
-    #
-    #     if params is None:
-    #         params = {}
-    #     self.addItem(item, params=params)
-    #
-    #     return item
-#
-# class TimedPlotDataItem(pg.PlotDataItem):
-#     """
-#     Subclass of :class:`pyqtgraph.PlotDataItem` that uses :class:`.TimedPlotCurveItem`
-#
-#     """
-#
-#     def __init__(self, *args, **kwargs):
-#         super(TimedPlotDataItem, self).__init__(*args, **kwargs)
-#
-#         # replace self.curve with timed version
-#         # mimic __init__ from parent
-#         # https://github.com/pyqtgraph/pyqtgraph/blob/a2053b13d0234e210561a73fa044625fd972e910/pyqtgraph/graphicsItems/PlotDataItem.py#L37
-#         self.curve = TimedPlotCurveItem()
-#         self.curve.setParentItem(self)
-#         self.curve.sigClicked.connect(self.curveClicked)
-#
-#         self.setData(*args, **kwargs)
-#
-# class TimedPlotCurveItem(pg.PlotCurveItem):
-#     """
-#     Subclass :class:`pyqtgraph.PlotCurveItem` to update with a fixed frequency instead of whenever new data pushed
-#
-#     Either creates or gets :data:`PLOT_TIMER` and connects it to :meth:`TimedPlotCurveItem.update`
-#     """
-#
-#
-#     def __init__(self, *args, **kwargs):
-#         super(TimedPlotCurveItem, self).__init__(*args, **kwargs)
-#
-#         if globals()['PLOT_TIMER'] is None:
-#             globals()['PLOT_TIMER'] = QtCore.QTimer()
-#
-#             get_gui_instance().gui_closing.connect(globals()['PLOT_TIMER'].stop)
-#
-#         self.timer = globals()['PLOT_TIMER']
-#         # stop timer, add ourselves, restart
-#         self.timer.timeout.connect(self.update)
-#
-#         try:
-#             self.fps = float(globals()['PLOT_FREQ'])
-#         except (ValueError, KeyError):
-#             self.fps = 15.
-#
-#         self.timer.start(1./self.fps)
-#
-#
-#
-#     def __del__(self):
-#         """
-#         On object deletion, remove from :data:`.PLOT_TIMER` 's signals
-#         """
-#         #self.timer.disconnect(self.update)
-#         #super(TimedPlotCurveItem, self).__del__()
-#
-#
-#     def updateData(self, *args, **kargs):
-#         """
-#         Override :meth:`pyqtgraph.PlotCurveItem.updateData` to omit call to :meth:`.update`
-#         which is done by :data:`.PLOT_TIMER`
-#
-#         """
-#         profiler = pg.debug.Profiler()
-#
-#         if 'compositionMode' in kargs:
-#             self.setCompositionMode(kargs['compositionMode'])
-#
-#         if len(args) == 1:
-#             kargs['y'] = args[0]
-#         elif len(args) == 2:
-#             kargs['x'] = args[0]
-#             kargs['y'] = args[1]
-#
-#         if 'y' not in kargs or kargs['y'] is None:
-#             kargs['y'] = np.array([])
-#         if 'x' not in kargs or kargs['x'] is None:
-#             kargs['x'] = np.arange(len(kargs['y']))
-#
-#         for k in ['x', 'y']:
-#             data = kargs[k]
-#             if isinstance(data, list):
-#                 data = np.array(data)
-#                 kargs[k] = data
-#             if not isinstance(data, np.ndarray) or data.ndim > 1:
-#                 raise Exception("Plot data must be 1D ndarray.")
-#             if data.dtype.kind == 'c':
-#                 raise Exception("Can not plot complex data types.")
-#
-#         profiler("data checks")
-#
-#         # self.setCacheMode(QtGui.QGraphicsItem.NoCache)  ## Disabling and re-enabling the cache works around a bug in Qt 4.6 causing the cached results to display incorrectly
-#         ##    Test this bug with test_PlotWidget and zoom in on the animated plot
-#         self.yData = kargs['y'].view(np.ndarray)
-#         self.xData = kargs['x'].view(np.ndarray)
-#
-#         self.invalidateBounds()
-#         self.prepareGeometryChange()
-#         self.informViewBoundsChanged()
-#
-#         profiler('copy')
-#
-#         if 'stepMode' in kargs:
-#             self.opts['stepMode'] = kargs['stepMode']
-#
-#         if self.opts['stepMode'] is True:
-#             if len(self.xData) != len(self.yData) + 1:  ## allow difference of 1 for step mode plots
-#                 raise Exception("len(X) must be len(Y)+1 since stepMode=True (got %s and %s)" % (
-#                 self.xData.shape, self.yData.shape))
-#         else:
-#             if self.xData.shape != self.yData.shape:  ## allow difference of 1 for step mode plots
-#                 raise Exception(
-#                     "X and Y arrays must be the same shape--got %s and %s." % (self.xData.shape, self.yData.shape))
-#
-#         self.path = None
-#         self.fillPath = None
-#         self._mouseShape = None
-#         # self.xDisp = self.yDisp = None
-#
-#         if 'name' in kargs:
-#             self.opts['name'] = kargs['name']
-#         if 'connect' in kargs:
-#             self.opts['connect'] = kargs['connect']
-#         if 'pen' in kargs:
-#             self.setPen(kargs['pen'])
-#         if 'shadowPen' in kargs:
-#             self.setShadowPen(kargs['shadowPen'])
-#         if 'fillLevel' in kargs:
-#             self.setFillLevel(kargs['fillLevel'])
-#         if 'fillOutline' in kargs:
-#             self.opts['fillOutline'] = kargs['fillOutline']
-#         if 'brush' in kargs:
-#             self.setBrush(kargs['brush'])
-#         if 'antialias' in kargs:
-#             self.opts['antialias'] = kargs['antialias']
-#
-#         profiler('set')
-#         #self.update()
-#         profiler('update')
-#         #self.sigPlotChanged.emit(self)
-#         profiler('emit')
-
@@ -181,8 +181,23 @@ class Message_Display(QtWidgets.QFrame):
                        (a_val.alarm_name != alarm.alarm_name) or
                        (a_val.id == alarm.id)}
 
+    @QtCore.Slot(str)
+    def show_error(self, message):
+        """
+        Show a message that isn't about an alarm, eg. that a setting didn't reach the controller, until it is cleared
+        or an alarm is shown
+
+        Arguments:
+            message (str)
+        """
+        if self.current_alarm:
+            return
+        self.draw_state(AlarmSeverity.MEDIUM)
+        self.message.setText(message)
+
     def clear_message(self):
         if not self.current_alarm:
+            self.update_message(None)
             return
 
         self.message_cleared.emit(self.current_alarm)
@@ -0,0 +1,214 @@
+""" Simulated devices backed by a physical model of a lung, so the :class:`~vent.io.hal.Hal` code path can be run
+without hardware but with sensors that respond to the valves.
+
+A :class:`SimLung` wraps the :class:`~vent.controller.control_module.Balloon_Simulator` used by
+:class:`~vent.controller.control_module.ControlModuleSimulator` . :class:`LungOnOffValve` and :class:`LungControlValve`
+attach to a lung by name and set its inspiratory and expiratory flows, and :class:`LungSensor` s read its pressure,
+flows and oxygen. Devices configured with the same ``lung`` name share one model. A ``[lung]`` section before the
+devices in the config file creates the model with non-default parameters, eg. in
+``vent/io/config/sim-lung-devices.ini`` ::
+
+    hal = Hal('vent/io/config/sim-lung-devices.ini', pig=SimPigpio())
+
+The model is advanced each time one of its sensors is read, either by the wall time since the last read
+(the default) or by a fixed ``dt`` .
+"""
+import threading
+import time
+
+import numpy as np
+
+from vent.io.devices.sensors import Sensor
+from vent.io.devices.valves import SimOnOffValve, SimControlValve
+
+
+class SimLung:
+    """ A lung model shared by the devices configured with the same name.
+
+    Creating a SimLung replaces any lung of the same name, use :meth:`SimLung.get` to get the lung of a name.
+    Valves attach themselves with :meth:`.attach` .
+
+    Attributes:
+        balloon (:class:`~vent.controller.control_module.Balloon_Simulator`): the physical model
+        valves (dict): {role: valve} for the roles ``'inlet'`` , ``'control'`` and ``'expiratory'``
+    """
+    ROLES = ('inlet', 'control', 'expiratory')
+    _MAX_STEP = 0.01   # longest single step of the model, longer updates are split
+    _LUNGS = {}
+
+    def __init__(self, name: str = 'default', peep_valve: float = 5, dt: float = None, pig=None):
+        """
+        Args:
+            name (str): name the devices use to find the lung
+            peep_valve (float): pressure of the PEEP valve on the expiratory side, in cmH2O
+            dt (float): if None, advance the model by the wall time between updates. Otherwise advance by ``dt``
+                seconds each update.
+            pig (PigpioConnection): Ignored, so the lung can be configured as a :class:`~vent.io.hal.Hal` device.
+        """
+        # imported here because the controller imports vent.io
+        from vent.controller.control_module import Balloon_Simulator
+
+        self.balloon = Balloon_Simulator(peep_valve=peep_valve)
+        self.dt = dt
+        self.valves = {}
+        self._last_update = None
+        self._lock = threading.Lock()
+        self.name = name
+        self._LUNGS[name] = self
+
+    @classmethod
+    def get(cls, name: str = 'default') -> 'SimLung':
+        """ Return the lung called `name` , creating one with default parameters if needed.
+
+        Args:
+            name (str): name of the lung
+        """
+        if name not in cls._LUNGS:
+            cls(name=name)
+        return cls._LUNGS[name]
+
+    def attach(self, role: str, valve):
+        """ Attach a valve that sets one of the lung's flows.
+
+        Args:
+            role (str): ``'inlet'`` (on/off valve before the control valve), ``'control'`` (proportional valve on the
+                inspiratory side) or ``'expiratory'`` (on/off valve on the expiratory side)
+            valve: the valve
+        """
+        if role not in self.ROLES:
+            raise ValueError('role must be one of {}, got {}'.format(self.ROLES, role))
+        self.valves[role] = valve
+
+    @staticmethod
+    def prop_valve_flow(setpoint: float) -> float:
+        """ Flow through the inspiratory proportional valve, in l/s, for a setpoint between 0 and 100.
+
+        Same eye-balled flow-current curve as :class:`~vent.controller.control_module.ControlModuleSimulator` .
+        """
+        if setpoint <= 0:
+            return 0
+        return np.tanh(0.12 * (0.5 * setpoint - 30)) + 1
+
+    def _flows(self) -> tuple:
+        """ Inspiratory and expiratory flows (l/s) set by the attached valves. Unattached valves count as open. """
+        inlet = self.valves.get('inlet')
+        control = self.valves.get('control')
+        expiratory = self.valves.get('expiratory')
+
+        q_in = 0
+        if control is not None and (inlet is None or inlet.is_open):
+            q_in = self.prop_valve_flow(control.setpoint)
+        q_out = 1 if expiratory is None or expiratory.is_open else 0
+        return q_in, q_out
+
+    def update(self):
+        """ Advance the model to now (or by :attr:`.dt` ) with the current valve settings. """
+        with self._lock:
+            now = time.time()
+            if self.dt is not None:
+                dt = self.dt
+            elif self._last_update is None:
+                dt = 0
+            else:
+                dt = now - self._last_update
+            self._last_update = now
+
+            if dt >= 1:
+                # like the simulator, long pauses restart the model
+                self.balloon._reset()
+                return
+
+            q_in, q_out = self._flows()
+            while dt > 0:
+                step = min(dt, self._MAX_STEP)
+                self.balloon.set_flow_in(q_in, dt=step)
+                self.balloon.set_flow_out(q_out, dt=step)
+                self.balloon.update(dt=step)
+                dt -= step
+
+    def reset(self):
+        """ Deflate the lung and restart its clock. """
+        with self._lock:
+            self.balloon._reset()
+            self._last_update = None
+
+
+class LungSensor(Sensor):
+    """ A sensor that reads a :class:`SimLung` """
+    _FIELDS = {
+        'pressure': lambda balloon: balloon.current_pressure,      # cmH2O
+        'flow_in':  lambda balloon: balloon.Qin * 60,              # l/min
+        'flow_ex':  lambda balloon: balloon.Qout * 60,             # l/min
+        'volume':   lambda balloon: balloon.current_volume,        # l
+        'oxygen':   lambda balloon: balloon.fio2                   # %
+    }
+
+    def __init__(self, field, lung='default', noise=0.0, pig=None):
+        """
+        Args:
+            field (str): what to read, one of ``'pressure'`` (cmH2O), ``'flow_in'`` and ``'flow_ex'`` (l/min, the units
+                of the flow sensors), ``'volume'`` (l) or ``'oxygen'`` (%)
+            lung (str): name of the :class:`SimLung`
+            noise (float): standard deviation of gaussian noise added to readings
+            pig (PigpioConnection): Ignored.
+        """
+        if field not in self._FIELDS:
+            raise ValueError('field must be one of {}, got {}'.format(tuple(self._FIELDS.keys()), field))
+        super().__init__()
+        self.lung = SimLung.get(lung)
+        self.field = field
+        self.noise = noise
+
+    def _verify(self, value) -> bool:
+        """ The model is always right. """
+        return True
+
+    def _convert(self, raw) -> float:
+        """ Adds measurement noise.
+
+        Args:
+            raw (float): The modelled value
+        """
+        if self.noise > 0:
+            raw += np.random.normal(0, self.noise)
+        return raw
+
+    def _raw_read(self) -> float:
+        """ Advances the lung and returns the field's value. """
+        self.lung.update()
+        return float(self._FIELDS[self.field](self.lung.balloon))
+
+
+class LungOnOffValve(SimOnOffValve):
+    """ A simulated on/off valve that opens or closes the inlet or expiratory side of a :class:`SimLung` """
+
+    def __init__(self, role, lung='default', pin=None, form='Normally Closed', pig=None):
+        """
+        Args:
+            role (str): ``'inlet'`` or ``'expiratory'`` , see :meth:`SimLung.attach`
+            lung (str): name of the :class:`SimLung`
+            pin (int): (unused for sim)
+            form (str): The form of the solenoid; can be either `Normally Open` or `Normally Closed`
+            pig (PigpioConnection): (unused for sim)
+        """
+        super().__init__(pin=pin, form=form, pig=pig)
+        self.lung = SimLung.get(lung)
+        self.lung.attach(role, self)
+
+
+class LungControlValve(SimControlValve):
+    """ A simulated proportional valve that sets the inspiratory flow into a :class:`SimLung` """
+
+    def __init__(self, lung='default', pin=None, form='Normally Closed', frequency=None, response=None, pig=None):
+        """
+        Args:
+            lung (str): name of the :class:`SimLung`
+            pin (int): (unused for sim)
+            form (str): The form of the solenoid, must be `Normally Closed`
+            frequency (float): (unused for sim)
+            response (str): (unused for sim)
+            pig (PigpioConnection): (unused for sim)
+        """
+        super().__init__(pin=pin, form=form, frequency=frequency, response=response, pig=pig)
+        self.lung = SimLung.get(lung)
+        self.lung.attach('control', self)
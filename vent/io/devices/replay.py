@@ -0,0 +1,255 @@
+""" Devices that replay recorded sensor data from a :class:`~vent.common.loggers.DataLogger` hdf5 file.
+
+A :class:`LogReplay` streams the ``/waveforms/readout`` table of a log file in chunks. :class:`ReplaySensor` s return
+one of its columns (``pressure``, ``flow_out``, ``oxygen`` ...), and :class:`ReplayOnOffValve` /
+:class:`ReplayControlValve` behave like their simulated counterparts but record every commanded setpoint along with
+the time in the log it was commanded at. Sensors and valves configured with the same file share the same replay, so
+the :class:`~vent.io.hal.Hal` can be used to run the controller against a recorded patient, eg. with
+``vent/io/config/replay-devices.ini`` .
+
+The replay either keeps the original timing of the log (``realtime=True``), or advances one row each time the
+"clock" sensor (by default the pressure sensor, which the controller reads every loop) is read.
+"""
+import os
+import time
+import typing
+
+import numpy as np
+import tables as pytb
+
+from vent.io.devices.sensors import Sensor
+from vent.io.devices.valves import SimOnOffValve, SimControlValve
+
+
+class LogReplay:
+    """ A cursor over the waveform table of a :class:`~vent.common.loggers.DataLogger` file, read in chunks so
+    arbitrarily large logs can be replayed in constant memory.
+
+    Use :meth:`LogReplay.get` to get the replay shared by the devices configured with a file.
+    """
+    _DEFAULT_CHUNK_SIZE = 4096
+    _REPLAYS = {}
+
+    def __init__(self, file: str, realtime: bool = True, loop: bool = False, chunk_size: int = _DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            file (str): path to a DataLogger hdf5 file
+            realtime (bool): if True, replay rows according to their timestamps. If False, advance one row each time
+                :meth:`.advance` is called.
+            loop (bool): if True, restart from the beginning of the log when it is finished. Otherwise keep returning
+                the last row.
+            chunk_size (int): number of rows to read from the file at a time
+        """
+        self.file = os.path.abspath(file)
+        self.realtime = realtime
+        self.loop = loop
+        self.chunk_size = chunk_size
+
+        self._h5file = pytb.open_file(self.file, mode='r')
+        self._table = self._h5file.root.waveforms.readout
+        self.nrows = self._table.nrows
+        if self.nrows == 0:
+            raise ValueError('No waveform data to replay in {}'.format(self.file))
+        self.fields = tuple(self._table.colnames)
+
+        self._chunk = None
+        self._chunk_start = 0
+        self.cursor = 0
+        self.finished = False
+        self._t0_log = None
+        self._t0_wall = None
+        self.reset()
+
+    @classmethod
+    def get(cls, file: str, realtime: bool = True, loop: bool = False) -> 'LogReplay':
+        """ Return the replay of `file` shared by all devices, creating it if needed.
+
+        Args:
+            file (str): path to a DataLogger hdf5 file
+            realtime (bool): see :class:`LogReplay`
+            loop (bool): see :class:`LogReplay`
+        """
+        key = (os.path.abspath(file), realtime, loop)
+        if key not in cls._REPLAYS or not cls._REPLAYS[key]._h5file.isopen:
+            cls._REPLAYS[key] = cls(file, realtime=realtime, loop=loop)
+        return cls._REPLAYS[key]
+
+    def reset(self):
+        """ Rewind to the first row. With realtime replay, the log's clock restarts at the next :meth:`.advance` """
+        self._load_chunk(0)
+        self.cursor = 0
+        self.finished = False
+        self._t0_log = self._chunk['timestamp'][0]
+        self._t0_wall = None
+
+    def close(self):
+        """ Close the log file. """
+        self._h5file.close()
+
+    def _load_chunk(self, start: int):
+        """ Read rows [start, start + chunk_size) from the table. """
+        self._chunk = self._table.read(start, min(start + self.chunk_size, self.nrows))
+        self._chunk_start = start
+
+    def _seek(self, row: int):
+        """ Move the cursor to `row`, loading its chunk if necessary. """
+        if not self._chunk_start <= row < self._chunk_start + len(self._chunk):
+            self._load_chunk(row)
+        self.cursor = row
+
+    def advance(self):
+        """ Advance the cursor: to the last row at or before the current replay time if realtime, otherwise by one
+        row. At the end of the log, either restart (if :attr:`.loop`) or stay on the last row.
+        """
+        if self.realtime:
+            now = time.time()
+            if self._t0_wall is None:
+                self._t0_wall = now
+            target = self._t0_log + (now - self._t0_wall)
+
+            # skip forward through chunks whose last row is still before the target time
+            row = self.cursor
+            while True:
+                times = self._chunk['timestamp']
+                idx = int(np.searchsorted(times, target, side='right')) - 1
+                row = max(self._chunk_start + idx, self.cursor)
+                if idx < len(times) - 1 or self._chunk_start + len(times) >= self.nrows:
+                    break
+                self._load_chunk(self._chunk_start + len(times))
+            end = row >= self.nrows - 1 and target > self._chunk['timestamp'][-1]
+        else:
+            row = self.cursor + 1
+            end = row >= self.nrows
+
+        if end:
+            if self.loop:
+                self.reset()
+                return
+            self.finished = True
+            row = self.nrows - 1
+        self._seek(row)
+
+    @property
+    def timestamp(self) -> float:
+        """ The logged timestamp of the current row. """
+        return float(self._chunk['timestamp'][self.cursor - self._chunk_start])
+
+    def value(self, field: str) -> float:
+        """ The value of `field` in the current row. """
+        return float(self._chunk[field][self.cursor - self._chunk_start])
+
+
+class ReplaySensor(Sensor):
+    """ A sensor that returns a column of a recorded log, see :class:`LogReplay` """
+
+    def __init__(self, file, field, realtime=True, loop=False, scale=1.0, default=None, clock=None, pig=None):
+        """
+        Args:
+            file (str): path to a DataLogger hdf5 file
+            field (str): column of ``/waveforms/readout`` to replay, eg. ``'pressure'``, ``'flow_out'`` or ``'oxygen'``
+            realtime (bool): keep the timing of the log, or advance a row per read of the clock sensor.
+            loop (bool): restart the log when it is finished
+            scale (float): multiply logged values by this to convert them to the units the HAL expects, eg. 60 to
+                convert logged ``flow_out`` in l/s to the l/min a flow sensor returns.
+            default (float): value to return if the log doesn't have `field` (older logs don't record oxygen).
+                If None, a missing field raises a ``ValueError``
+            clock (bool): whether reading this sensor advances the replay when not realtime. Defaults to True for
+                ``'pressure'`` , which is read every control loop.
+            pig (PigpioConnection): Ignored.
+        """
+        super().__init__()
+        self.replay = LogReplay.get(file, realtime=realtime, loop=loop)
+        if field not in self.replay.fields and default is None:
+            raise ValueError('{} has no field {}, fields are {}'.format(file, field, self.replay.fields))
+        self.field = field
+        self.scale = scale
+        self.default = default
+        self.clock = field == 'pressure' if clock is None else clock
+
+    def _verify(self, value) -> bool:
+        """ Recorded values were verified when they were logged. """
+        return True
+
+    def _convert(self, raw) -> float:
+        """ Scales the logged value.
+
+        Args:
+            raw (float): The logged value
+        """
+        return raw * self.scale
+
+    def _raw_read(self) -> float:
+        """ Returns the field's value at the current replay position, advancing the replay first if it is realtime or
+        this is the clock sensor."""
+        if self.replay.realtime or self.clock:
+            self.replay.advance()
+        if self.field not in self.replay.fields:
+            return self.default
+        return self.replay.value(self.field)
+
+
+class _SetpointRecorder:
+    """ Mixin for replay valves to record commanded setpoints with the replay's position in the log """
+
+    def _init_recorder(self, file, realtime, loop):
+        self.replay = LogReplay.get(file, realtime=realtime, loop=loop) if file is not None else None
+        self._commands = []
+
+    def _record(self, value):
+        log_time = self.replay.timestamp if self.replay is not None else np.nan
+        self._commands.append((time.time(), log_time, value))
+
+    @property
+    def commands(self) -> np.ndarray:
+        """ Commanded setpoints as an array of (time, log timestamp, setpoint) rows, oldest first. """
+        return np.array(self._commands, dtype=float).reshape(-1, 3)
+
+    def clear_commands(self):
+        self._commands = []
+
+
+class ReplayOnOffValve(SimOnOffValve, _SetpointRecorder):
+    """ A simulated on/off valve that records when it is opened (1) and closed (0). """
+
+    def __init__(self, file=None, realtime=True, loop=False, pin=None, form='Normally Closed', pig=None):
+        """
+        Args:
+            file (str): optional, DataLogger hdf5 file being replayed, to record log timestamps with commands
+            realtime (bool): see :class:`ReplaySensor`
+            loop (bool): see :class:`ReplaySensor`
+            pin (int): (unused for replay)
+            form (str): The form of the solenoid; can be either `Normally Open` or `Normally Closed`
+            pig (PigpioConnection): (unused for replay)
+        """
+        self._init_recorder(file, realtime, loop)
+        super().__init__(pin=pin, form=form, pig=pig)
+
+    def open(self):
+        super().open()
+        self._record(1)
+
+    def close(self):
+        super().close()
+        self._record(0)
+
+
+class ReplayControlValve(SimControlValve, _SetpointRecorder):
+    """ A simulated control valve that records each setpoint it is given. """
+
+    def __init__(self, file=None, realtime=True, loop=False, pin=None, form='Normally Closed', pig=None):
+        """
+        Args:
+            file (str): optional, DataLogger hdf5 file being replayed, to record log timestamps with commands
+            realtime (bool): see :class:`ReplaySensor`
+            loop (bool): see :class:`ReplaySensor`
+            pin (int): (unused for replay)
+            form (str): The form of the solenoid, must be `Normally Closed`
+            pig (PigpioConnection): (unused for replay)
+        """
+        self._init_recorder(file, realtime, loop)
+        super().__init__(pin=pin, form=form, pig=pig)
+
+    @SimControlValve.setpoint.setter
+    def setpoint(self, setpoint):
+        SimControlValve.setpoint.fset(self, setpoint)
+        self._record(setpoint)
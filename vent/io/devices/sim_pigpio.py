@@ -0,0 +1,436 @@
+""" A simulated pigpio daemon, for running the :class:`~vent.io.hal.Hal` and its devices without a Raspberry Pi.
+
+:class:`SimPigpio` implements the subset of :class:`pigpio.pi` used by ``vent.io.devices`` (I2C, GPIO and PWM) against
+in-memory devices and pins, and can be passed anywhere a :class:`~vent.io.devices.base.PigpioConnection` is expected,
+eg. ``Hal(config_file, pig=SimPigpio())`` .
+
+Unlike the monkeypatched fixtures in ``tests/pigpio_mocks.py`` , every transaction that would go over the socket to
+the pigpio daemon can be given a :class:`TransactionModel` with a latency, jitter and error rate, so the timing of the
+control loop can be measured under realistic bus conditions. The transactions are
+
+* ``'i2c_read'`` : ``i2c_read_device`` and ``i2c_read_i2c_block_data``
+* ``'i2c_write'`` : ``i2c_write_device`` and ``i2c_write_i2c_block_data``
+* ``'pwm'`` : ``hardware_PWM`` and getting/setting the PWM duty cycle, frequency and range
+* ``'gpio'`` : reading, writing and getting/setting the mode of a pin
+
+Latencies are simulated with :func:`time.sleep` , which releases the GIL like a blocking socket read does, and which
+on most systems oversleeps by some tens of microseconds -- so latencies below that aren't modelled accurately.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+import pigpio
+
+soft_frequencies = (8000, 4000, 2000, 1600, 1000, 800, 500, 400, 320, 250, 200, 160, 100, 80, 50, 40, 20, 10)
+""" PWM frequencies available to software PWM at the default pigpiod sample rate """
+
+
+class TransactionModel:
+    """ Timing and reliability of one kind of transaction with the pigpio daemon. """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        """
+        Args:
+            latency (float): mean duration of the transaction, in seconds
+            jitter (float): standard deviation of the duration, in seconds. Durations are clipped at zero.
+            error_rate (float): probability in [0, 1] that the transaction fails and raises a :class:`pigpio.error`
+        """
+        if latency < 0 or jitter < 0:
+            raise ValueError('latency and jitter must be nonnegative')
+        if not 0 <= error_rate <= 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def sample(self, rng: random.Random) -> tuple:
+        """ Draw the duration of a transaction, and whether it fails.
+
+        Args:
+            rng (random.Random): random number generator to use
+
+        Returns:
+            tuple: (duration (float), failed (bool))
+        """
+        duration = self.latency
+        if self.jitter > 0:
+            duration = max(0.0, rng.gauss(self.latency, self.jitter))
+        failed = self.error_rate > 0 and rng.random() < self.error_rate
+        return duration, failed
+
+    def __repr__(self):
+        return 'TransactionModel(latency={}, jitter={}, error_rate={})'.format(
+            self.latency, self.jitter, self.error_rate)
+
+
+class SimPigpio:
+    """ In-memory stand-in for a :class:`pigpio.pi` connection with configurable transaction timing.
+
+    I2C devices are added with :meth:`.add_i2c_device` ; any object with the methods of :class:`MockHardwareDevice`
+    can be used. All 54 GPIO pins exist and start as inputs pulled low.
+
+    Attributes:
+        models (dict): {transaction: :class:`TransactionModel`}
+        stats (dict): {transaction: {'count': int, 'errors': int, 'time': float}}, totals since the last
+            :meth:`.reset_stats`
+    """
+    TRANSACTIONS = ('i2c_read', 'i2c_write', 'pwm', 'gpio')
+    _ERRORS = {
+        'i2c_read':  pigpio.PI_I2C_READ_FAILED,
+        'i2c_write': pigpio.PI_I2C_WRITE_FAILED,
+        'pwm':       pigpio.PI_NOT_PWM_GPIO,
+        'gpio':      pigpio.PI_NOT_PERMITTED
+    }
+    _HARDWARE_PWM_PINS = (12, 13, 18, 19)
+    _HARDWARE_PWM_MODE = 4
+    _HARDWARE_PWM_RANGE = 1000000
+    _SOFT_PWM_RANGE = 255
+
+    def __init__(self, models: dict = None, seed=None):
+        """
+        Args:
+            models (dict): optional, {transaction: :class:`TransactionModel` }. Transactions that aren't given a model
+                are instantaneous and never fail.
+            seed: optional, seed for the random number generator that draws latencies and errors
+        """
+        self.connected = True
+        self.models = {transaction: TransactionModel() for transaction in self.TRANSACTIONS}
+        if models is not None:
+            for transaction, model in models.items():
+                self.set_model(transaction, model)
+        self._rng = random.Random(seed)
+        # pigpiod handles one command at a time per connection
+        self._lock = threading.Lock()
+
+        self.i2c_devices = {}       # {(i2c_bus, i2c_address): device}
+        self._handles = {}          # {handle: (i2c_bus, i2c_address)}
+        self._next_handle = 0
+
+        self.modes = [0] * 54
+        self.levels = [0] * 54
+        self.pwm_duty = [None] * 54
+        self.pwm_frequency = [800] * 54
+
+        self.stats = {}
+        self.reset_stats()
+
+    def set_model(self, transaction: str, model: TransactionModel = None, **kwargs):
+        """ Set the model for a kind of transaction.
+
+        Args:
+            transaction (str): one of :attr:`.TRANSACTIONS`
+            model (TransactionModel): the new model. If None, a model is made from ``kwargs``
+            **kwargs: ``latency``, ``jitter`` and ``error_rate`` , see :class:`TransactionModel`
+        """
+        if transaction not in self.TRANSACTIONS:
+            raise ValueError('transaction must be one of {}, got {}'.format(self.TRANSACTIONS, transaction))
+        self.models[transaction] = model if model is not None else TransactionModel(**kwargs)
+
+    def reset_stats(self):
+        """ Zero the transaction counts in :attr:`.stats` """
+        self.stats = {transaction: {'count': 0, 'errors': 0, 'time': 0.0} for transaction in self.TRANSACTIONS}
+
+    def stop(self):
+        """ Like :meth:`pigpio.pi.stop` , disconnects. """
+        self.connected = False
+
+    def _transact(self, transaction: str):
+        """ Spend the time a transaction takes, and raise a :class:`pigpio.error` if it fails. Must be called with
+        :attr:`._lock` held.
+        """
+        duration, failed = self.models[transaction].sample(self._rng)
+        stats = self.stats[transaction]
+        stats['count'] += 1
+        if duration > 0:
+            start = time.perf_counter()
+            time.sleep(duration)
+            stats['time'] += time.perf_counter() - start
+        if failed:
+            stats['errors'] += 1
+            raise pigpio.error(pigpio.error_text(self._ERRORS[transaction]))
+
+    ####################
+    # I2C
+
+    def add_i2c_device(self, device, i2c_address: int, i2c_bus: int = 1):
+        """ Attach a simulated device to an I2C bus.
+
+        Args:
+            device (:class:`MockHardwareDevice`): the device
+            i2c_address (int): its address, eg. ``0x48``
+            i2c_bus (int): the bus, usually 1
+        """
+        self.i2c_devices[(i2c_bus, i2c_address)] = device
+
+    def _device(self, handle):
+        if handle not in self._handles:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_HANDLE))
+        return self.i2c_devices[self._handles[handle]]
+
+    def i2c_open(self, i2c_bus, i2c_address, i2c_flags=0):
+        if (i2c_bus, i2c_address) not in self.i2c_devices:
+            raise pigpio.error(pigpio.error_text(pigpio.PI_I2C_OPEN_FAILED))
+        handle = self._next_handle
+        self._next_handle += 1
+        self._handles[handle] = (i2c_bus, i2c_address)
+        return handle
+
+    def i2c_close(self, handle):
+        self._device(handle)
+        del self._handles[handle]
+        return 0
+
+    def i2c_read_device(self, handle, count):
+        with self._lock:
+            device = self._device(handle)
+            self._transact('i2c_read')
+            data = bytearray(device.read_mock_hardware_device(count))
+        return len(data), data
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        with self._lock:
+            device = self._device(handle)
+            self._transact('i2c_read')
+            data = bytearray(device.read_mock_hardware_register(reg, count))
+        return len(data), data
+
+    def i2c_write_device(self, handle, data):
+        with self._lock:
+            device = self._device(handle)
+            self._transact('i2c_write')
+            device.write_mock_hardware_device(bytes(data))
+        return 0
+
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        with self._lock:
+            device = self._device(handle)
+            self._transact('i2c_write')
+            device.write_mock_hardware_register(reg, bytes(data))
+        return 0
+
+    ####################
+    # GPIO
+
+    @staticmethod
+    def _check_gpio(gpio, user=False):
+        if gpio not in range(32 if user else 54):
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_USER_GPIO if user else pigpio.PI_BAD_GPIO))
+
+    def get_mode(self, gpio):
+        self._check_gpio(gpio)
+        with self._lock:
+            self._transact('gpio')
+            return self.modes[gpio]
+
+    def set_mode(self, gpio, mode):
+        self._check_gpio(gpio)
+        if mode not in range(8):
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_MODE))
+        with self._lock:
+            self._transact('gpio')
+            self._set_mode(gpio, mode)
+        return 0
+
+    def _set_mode(self, gpio, mode):
+        """ Changing the mode of a pin stops any PWM on it """
+        if mode != self.modes[gpio]:
+            self.pwm_duty[gpio] = None
+        self.modes[gpio] = mode
+
+    def read(self, gpio):
+        self._check_gpio(gpio)
+        with self._lock:
+            self._transact('gpio')
+            return self.levels[gpio]
+
+    def write(self, gpio, level):
+        self._check_gpio(gpio)
+        if level not in (0, 1):
+            raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_LEVEL))
+        with self._lock:
+            self._transact('gpio')
+            self._set_mode(gpio, 1)
+            self.pwm_duty[gpio] = None
+            self.levels[gpio] = level
+        return 0
+
+    ####################
+    # PWM
+
+    def _pwm_range(self, gpio):
+        if self.modes[gpio] == self._HARDWARE_PWM_MODE:
+            return self._HARDWARE_PWM_RANGE
+        return self._SOFT_PWM_RANGE
+
+    def get_PWM_range(self, gpio):
+        self._check_gpio(gpio, user=True)
+        with self._lock:
+            self._transact('pwm')
+            return self._pwm_range(gpio)
+
+    def get_PWM_dutycycle(self, gpio):
+        self._check_gpio(gpio, user=True)
+        with self._lock:
+            self._transact('pwm')
+            if self.pwm_duty[gpio] is None:
+                raise pigpio.error(pigpio.error_text(pigpio.PI_NOT_PWM_GPIO))
+            return self.pwm_duty[gpio]
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        self._check_gpio(gpio, user=True)
+        with self._lock:
+            self._transact('pwm')
+            if dutycycle not in range(self._pwm_range(gpio) + 1):
+                raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_DUTYCYCLE))
+            self._set_mode(gpio, 1)
+            self.pwm_duty[gpio] = dutycycle
+        return 0
+
+    def get_PWM_frequency(self, gpio):
+        self._check_gpio(gpio, user=True)
+        with self._lock:
+            self._transact('pwm')
+            return self.pwm_frequency[gpio]
+
+    def set_PWM_frequency(self, gpio, frequency):
+        self._check_gpio(gpio, user=True)
+        with self._lock:
+            self._transact('pwm')
+            if self.modes[gpio] != self._HARDWARE_PWM_MODE:
+                frequency = min(soft_frequencies, key=lambda f: abs(f - frequency))
+            self.pwm_frequency[gpio] = frequency
+            return frequency
+
+    def hardware_PWM(self, gpio, PWMfreq, PWMduty):
+        self._check_gpio(gpio)
+        with self._lock:
+            self._transact('pwm')
+            if gpio not in self._HARDWARE_PWM_PINS:
+                raise pigpio.error(pigpio.error_text(pigpio.PI_NOT_HPWM_GPIO))
+            if not 0 <= PWMfreq <= 187500000:
+                raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_HPWM_FREQ))
+            if PWMduty not in range(self._HARDWARE_PWM_RANGE + 1):
+                raise pigpio.error(pigpio.error_text(pigpio.PI_BAD_HPWM_DUTY))
+            self._set_mode(gpio, self._HARDWARE_PWM_MODE)
+            self.pwm_frequency[gpio] = PWMfreq
+            self.pwm_duty[gpio] = PWMduty
+        return 0
+
+
+class MockHardwareDevice:
+    def __init__(self, *args):
+        """ A simple mock device with registers defined by kwargs. If only one register value is passed, device emulates
+        a single register device that responds to read_device commands (such as the SFM3200). Retains past register
+        values upon writing to a register for logging/assertion convenience.
+
+        Register values are stored as raw bytes. Reading and writing to/from the registers simulates network-endian
+            transactions by byteswapping.
+
+        Args:
+            *args: register_values of type bytes; one, per, register
+        """
+        self.last_register = None
+        self.registers = []
+        if args:
+            for arg in args:
+                if not isinstance(arg, bytes):
+                    raise TypeError("Unknown register value of type {}".format(type(arg)))
+                self.registers.append(deque())
+                self.registers[-1].append(arg)
+            if len(self.registers) == 1:
+                self.last_register = 0
+        else:
+            raise TypeError("MockHardwareDevice needs at least one register to initialize")
+
+    def read_mock_hardware_device(self, count=None):
+        """Alias for read_mock_hardware_register(reg_num=None, count)"""
+        return self.read_mock_hardware_register(reg_num=None, count=count)
+
+    def write_mock_hardware_device(self, value):
+        """ Alias for write_mock_hardware_register(reg_num=None, value)"""
+        self.write_mock_hardware_register(reg_num=None, value=value)
+
+    def read_mock_hardware_register(self, reg_num=None, count=None):
+        """ Reads count bytes from a specific register
+
+        Args:
+            reg_num: The index of the register to read
+            count (int): The number of bytes to read
+
+        Returns:
+            bytes: the register contents
+        """
+        if reg_num is None:
+            if self.last_register is not None:
+                reg_num = self.last_register
+            else:
+                raise RuntimeError("mock_i2c_device tried to access last register but none have been accessed yet")
+        else:
+            self.last_register = reg_num
+        result = self.registers[reg_num][-1]
+        return result if count is None else result[:count]
+
+    def write_mock_hardware_register(self, reg_num, value):
+        """ Writes value to register specified by reg_num
+
+        Args:
+            reg_num: The index of the register to write
+            value (bytes): The stuff to write to the register
+        """
+        if type(value) is not bytes:
+            raise TypeError("arg 'value' must be of type bytes")
+        if reg_num is None:
+            if self.last_register is not None:
+                reg_num = self.last_register
+            else:
+                raise RuntimeError("mock_i2c_device tried to access last register but none have been accessed yet")
+        else:
+            self.last_register = reg_num
+        self.last_register = reg_num
+        self.registers[reg_num].append(value)
+
+
+class SimADS1115(MockHardwareDevice):
+    """ A simulated ADS1115 (or ADS1015) analog to digital converter.
+
+    Writing the config register selects the channel (``MUX``) and gain (``PGA``), and reading the conversion register
+    returns the voltage of the selected channel. Only single-ended channels are simulated.
+    """
+    _POWER_UP_CONFIG = 0x8583
+    _PGA = (6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256)
+
+    def __init__(self, channels: dict = None, maxlen: int = 64):
+        """
+        Args:
+            channels (dict): {channel (int): voltage}, where channel is the single-ended input, 0-3 (``MUX`` 4-7), and
+                voltage is either a float or a callable that takes no arguments and returns a float. Unspecified
+                channels read 0 V.
+            maxlen (int): number of past values kept for each register
+        """
+        super().__init__(
+            (0).to_bytes(2, 'big'),
+            self._POWER_UP_CONFIG.to_bytes(2, 'big'),
+            (0).to_bytes(2, 'big'),
+            (0).to_bytes(2, 'big')
+        )
+        # don't keep every config written over a long run
+        self.registers = [deque(register, maxlen=maxlen) for register in self.registers]
+        self.channels = {} if channels is None else dict(channels)
+
+    def read_mock_hardware_register(self, reg_num=None, count=None):
+        """ Extends parent method to convert the voltage of the selected channel when reading the conversion
+        register (0).
+        """
+        if reg_num == 0 or (reg_num is None and self.last_register == 0):
+            cfg = int.from_bytes(self.registers[1][-1], 'big')
+            mux = (cfg >> 12) & 0b111
+            pga = self._PGA[(cfg >> 9) & 0b111]
+            voltage = 0.0
+            if mux >= 4 and mux - 4 in self.channels:
+                voltage = self.channels[mux - 4]
+                voltage = voltage() if callable(voltage) else voltage
+            raw = max(-32768, min(int(round(voltage / pga * 32767)), 32767))
+            self.registers[0].append(raw.to_bytes(2, 'big', signed=True))
+        return super().read_mock_hardware_register(reg_num, count)
@@ -2,6 +2,7 @@
 
 """
 
+import os
 from importlib import import_module
 from ast import literal_eval
 from .devices.sensors import Sensor
@@ -17,7 +18,7 @@ class Hal:
     on the ventilator (real or simulated) are specified in a configuration file.
     """
 
-    def __init__(self, config_file='vent/io/config/devices.ini'):
+    def __init__(self, config_file='vent/io/config/devices.ini', pig=None):
         """ Initializes HAL from config_file.
             For each section in config_file, imports the class <type> from module <module>, and sets attribute
             self.<section> = <type>(**opts), where opts is a dict containing all of the options in <section> that are
@@ -52,9 +53,12 @@ class Hal:
 
             Note: ast.literal_eval(opt) interprets integers, 0xFF, (a, b) etc. correctly. It does not interpret strings
             correctly, nor does it know 'adc' -> self._adc; therefore, these special cases are explicitly handled.
+            A relative path in a `file` option is relative to the directory of config_file.
         Args:
             config_file (str): Path to the configuration file containing the definitions of specific components on the
                 ventilator machine. (e.g., config_file = "vent/io/config/devices.ini")
+            pig (PigpioConnection): pigpiod connection to use for all devices; if not specified, a new one is
+                established. (e.g., a :class:`~vent.io.devices.sim_pigpio.SimPigpio` to run without a Raspberry Pi)
         """
         self._setpoint_in = 0.0  # setpoint for inspiratory side
         self._setpoint_ex = 0.0  # setpoint for expiratory side
@@ -66,7 +70,7 @@ class Hal:
         self._aux_pressure_sensor = object
         self._flow_sensor_in = object
         self._flow_sensor_ex = object
-        self._pig = PigpioConnection(show_errors=False)
+        self._pig = pig if pig is not None else PigpioConnection(show_errors=False)
         self.config = configparser.RawConfigParser()
         self.config.optionxform = lambda option: option
         self.config.read(config_file)
@@ -79,6 +83,9 @@ class Hal:
                     opts[key] = self._adc
                 else:
                     opts[key] = literal_eval(opts[key])
+                if key == 'file' and not os.path.isabs(opts[key]):
+                    # relative to the configuration file, not the working directory
+                    opts[key] = os.path.join(os.path.dirname(os.path.abspath(config_file)), opts[key])
             print("  [ {device_name:^19} ]  opts: {device_options}".format(
                 device_name=section,
                 device_options=opts
@@ -3,7 +3,7 @@ import argparse
 import sys
 import os
 from vent import prefs
-from vent.gui.main import launch_gui
+from vent.common import startup
 from vent.coordinator.coordinator import get_coordinator
 
 
@@ -21,7 +21,15 @@ def parse_cmd_args():
 
 def main():
     args = parse_cmd_args()
-    coordinator = get_coordinator(single_process=args.single_process, sim_mode=args.simulation)
+    # start the controller process first, so it starts up while the gui is built. It is forked here, before the gui
+    # (and Qt) is imported and before any threads are started; the standby controller processes are forked by the
+    # controller processes, not by the gui's (see process_manager.Standby)
+    coordinator = get_coordinator(single_process=args.single_process, sim_mode=args.simulation, wait=False,
+                                  watchdog=True, standby=True)
+    startup.mark('controller spawned')
+
+    from vent.gui.main import launch_gui
+    startup.mark('gui imported')
     app, gui = launch_gui(coordinator)
     sys.exit(app.exec_())
 